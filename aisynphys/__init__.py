@@ -1,2 +1,14 @@
 # import config to be sure that we get early access to some command line flags
-from . import config
\ No newline at end of file
+from . import config
+import importlib
+
+
+def __getattr__(name):
+    # subpackages and modules are imported on first access (e.g. aisynphys.database) so that
+    # `import aisynphys` does not pull in heavy dependencies that a caller may never use
+    try:
+        return importlib.import_module('.' + name, __name__)
+    except ModuleNotFoundError as exc:
+        if exc.name != __name__ + '.' + name:
+            raise
+        raise AttributeError("module %r has no attribute %r" % (__name__, name)) from None
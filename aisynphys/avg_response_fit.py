@@ -194,6 +194,31 @@ def sort_responses(pulse_responses):
     return sorted_responses
 
 
+def sort_response_frame(pr_frame):
+    """Columnar version of sort_responses() for a DataFrame of pulse responses (see
+    aisynphys.dynamics.experiment_pulse_response_frame).
+
+    Returns
+    -------
+    holding : ndarray
+        Holding potential category (-70 or -55) for each response, or NaN for responses outside
+        of both holding ranges
+    qc_pass : ndarray
+        Boolean array indicating whether each response passes QC for its holding category
+    """
+    ex_limits = [-80e-3, -60e-3]
+    in_limits = [-60e-3, -50e-3]
+
+    holding = pr_frame['baseline_potential'].to_numpy()
+    is_in = (holding >= in_limits[0]) & (holding < in_limits[1])
+    is_ex = (holding >= ex_limits[0]) & (holding < ex_limits[1])
+    category = np.where(is_in, -55., np.where(is_ex, -70., np.nan))
+
+    spike_ok = (pr_frame['n_spikes'] == 1).to_numpy() & pr_frame['first_spike_time'].notna().to_numpy()
+    qc_pass = spike_ok & np.where(is_in, pr_frame['in_qc_pass'].to_numpy(), pr_frame['ex_qc_pass'].to_numpy() & is_ex)
+    return category, qc_pass
+
+
 def check_fit_qc_pass(fit_result, expected_params, clamp_mode):
     """Return bool indicating whether a PSP fit result matches a previously accepted result, as well as
     a list of strings describing the reasons, if any.
@@ -250,15 +275,41 @@ def fit_avg_pulse_response(pulse_response_list, latency_window, sign, init_param
     pair = pulse_response_list[0].pair
     clamp_mode = pulse_response_list[0].recording.patch_clamp_recording.clamp_mode
 
-    # make a list of spike-aligned postsynaptic tseries
-    tsl = PulseResponseList(pulse_response_list).post_tseries(align='spike', bsub=True)
-    # prof('make tseries list')
+    # make a stack of spike-aligned postsynaptic tseries
+    stack = PulseResponseList(pulse_response_list).post_stack(align='spike', bsub=True)
+    # prof('make tseries stack')
     
-    if len(tsl) == 0:
+    if len(stack) == 0:
         return None, None
     
+    # decide whether to mask out crosstalk artifact
+    pre_id = int(pair.pre_cell.electrode.ext_id)
+    post_id = int(pair.post_cell.electrode.ext_id)
+    if abs(pre_id - post_id) < 3:
+        # nearby electrodes; mask out crosstalk
+        pass
+
+    return fit_avg_response_stack(stack, clamp_mode, latency_window, sign, init_params=init_params)
+
+
+def fit_avg_response_stack(stack, clamp_mode, latency_window, sign, init_params=None):
+    """Average and fit a TSeriesStack of spike-aligned, baseline-subtracted pulse responses.
+
+    This is the second half of fit_avg_pulse_response, for callers that build response stacks
+    directly from bulk-loaded data (see aisynphys.resting_state).
+
+    Returns
+    -------
+    fit : lmfit ModelResult
+        The resulting PSP fit (None if the stack is empty)
+    average : TSeries
+        The averaged pulse response data (None if the stack is empty)
+    """
+    if len(stack) == 0:
+        return None, None
+
     # average all together
-    average = tsl.mean()
+    average = stack.mean()
     # prof('average')
         
     # start with even weighting
@@ -268,13 +319,6 @@ def fit_avg_pulse_response(pulse_response_list, latency_window, sign, init_param
     onset_start_idx = average.index_at(latency_window[0])
     onset_stop_idx = average.index_at(latency_window[1] + 4e-3) 
     weight[onset_start_idx:onset_stop_idx] = 3.0
-    
-    # decide whether to mask out crosstalk artifact
-    pre_id = int(pair.pre_cell.electrode.ext_id)
-    post_id = int(pair.post_cell.electrode.ext_id)
-    if abs(pre_id - post_id) < 3:
-        # nearby electrodes; mask out crosstalk
-        pass
     # prof('weights')
 
     fit = fit_psp(average, search_window=latency_window, clamp_mode=clamp_mode, sign=sign, baseline_like_psp=True, init_params=init_params, fit_kws={'weights': weight})
@@ -419,6 +419,87 @@ def classify_pairs(pairs, cell_groups):
     return results
 
 
+def cell_class_key(cell_class):
+    """Return a hashable key identifying the criteria of *cell_class*.
+
+    CellClass compares equal by name only, but the same display name may be used with different criteria
+    (eg. target vs annotated layer), so memoized results are keyed on the criteria as well.
+    """
+    criteria = tuple(sorted((k, repr(v)) for k, v in cell_class.criteria.items()))
+    return (cell_class.name, criteria, tuple(str(ex) for ex in cell_class.exprs))
+
+
+class ClassificationCache(object):
+    """Memoized classify_cells() and classify_pairs() for one list of pairs.
+
+    Cells are classified once per distinct cell class (see cell_class_key) and pairs are grouped
+    once per (pre_class, post_class) element, so when the list of cell classes changes only the
+    new classes and matrix elements are computed.
+
+    Results contain the same members as classify_cells(cell_classes, pairs=pairs, missing_attr=...)
+    and classify_pairs(pairs, cell_groups), including the union of cells for classes that share
+    a name (CellClass is hashed by name). Cells in each group are returned as lists ordered by
+    their first appearance in *pairs*, so iterating over a group is deterministic.
+
+    Parameters
+    ----------
+    pairs : list of Pair instances
+        The pairs to classify
+    missing_attr : str
+        Passed to classify_cells()
+    """
+    def __init__(self, pairs, missing_attr='ignore'):
+        self.pairs = pairs
+        self.missing_attr = missing_attr
+        self.cells = list(OrderedDict.fromkeys([c for p in pairs for c in (p.pre_cell, p.post_cell)]))
+        self._class_cells = {}
+        self._element_pairs = {}
+
+    def class_cells(self, cell_class):
+        """Return the list of cells in *cell_class*.
+        """
+        key = cell_class_key(cell_class)
+        if key not in self._class_cells:
+            members = classify_cells([cell_class], cells=self.cells, missing_attr=self.missing_attr)[cell_class]
+            self._class_cells[key] = [c for c in self.cells if c in members]
+        return self._class_cells[key]
+
+    def cell_groups(self, cell_classes):
+        """Return an OrderedDict mapping {cell_class: [list of cells]}, as with classify_cells().
+        """
+        group_classes = OrderedDict()
+        for cell_class in cell_classes:
+            group_classes.setdefault(cell_class, []).append(cell_class)
+        cell_groups = OrderedDict()
+        for cell_class, same_name in group_classes.items():
+            if len(same_name) == 1:
+                cell_groups[cell_class] = self.class_cells(cell_class)
+            else:
+                members = set()
+                for cc in same_name:
+                    members.update(self.class_cells(cc))
+                cell_groups[cell_class] = [c for c in self.cells if c in members]
+        return cell_groups
+
+    def pair_groups(self, cell_groups):
+        """Return an OrderedDict mapping {(pre_class, post_class): [list of pairs]}, as with classify_pairs().
+        """
+        keys = OrderedDict([(cell_class, (cell_class_key(cell_class), tuple(id(c) for c in cells))) for cell_class, cells in cell_groups.items()])
+        sets = {}
+        pair_groups = OrderedDict()
+        for pre_class, pre_group in cell_groups.items():
+            for post_class, post_group in cell_groups.items():
+                key = (keys[pre_class], keys[post_class])
+                if key not in self._element_pairs:
+                    for cell_class, group in ((pre_class, pre_group), (post_class, post_group)):
+                        if cell_class not in sets:
+                            sets[cell_class] = set(group)
+                    pre_set, post_set = sets[pre_class], sets[post_class]
+                    self._element_pairs[key] = [p for p in self.pairs if p.pre_cell in pre_set and p.post_cell in post_set]
+                pair_groups[(pre_class, post_class)] = self._element_pairs[key]
+        return pair_groups
+
+
 def classify_pair_dataframe(cell_classes, df, col_names=('pre_class', 'post_class')):
     """Add two new columns to a pair dataframe giving the pre and post class
     names.
@@ -27,6 +27,9 @@ synphys_data = None  # location of data repo network storage
 synphys_db_host_rw = None  # rw access to postgres / sqlite DB
 synphys_db_readonly_user = "readonly"  # readonly postgres username assigned whrn creating db/tables
 lims_address = None
+lims_cache_ttl = 600  # seconds to keep results of batched LIMS lookups in memory
+lims_replay_file = None  # sqlite file used to record / replay LIMS query results
+lims_replay_mode = None  # 'record' or 'replay' (default)
 rig_name = None
 n_headstages = 8
 rig_data_paths = {}
@@ -37,6 +40,8 @@ configfile = os.path.join(os.path.dirname(__file__), '..', 'config.yml')
 
 stochastic_model_cache_path = None
 stochastic_model_spca_file = None
+layer_depth_cache_path = None
+synapse_type_cache_path = None
 
 # load values from ../config.yml (path relative to this python file)
 if os.path.isfile(configfile):
@@ -58,6 +63,10 @@ if stochastic_model_cache_path is None:
     stochastic_model_cache_path = os.path.join(cache_path, 'stochastic_model_results')
 if stochastic_model_spca_file is None:
     stochastic_model_spca_file = os.path.join(cache_path, 'sparse_pca_{run_type}.pkl')
+if layer_depth_cache_path is None:
+    layer_depth_cache_path = os.path.join(cache_path, 'layer_depth_fields')
+if synapse_type_cache_path is None:
+    synapse_type_cache_path = os.path.join(cache_path, 'synapse_type_embeddings')
 
 
 # intercept specific command line args
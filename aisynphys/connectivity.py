@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*- 
 import warnings
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import sqlalchemy
+from sqlalchemy.orm import aliased
 from statsmodels.stats.proportion import proportion_confint
 import scipy.optimize
+import scipy.stats
 from scipy.special import erf
 from .util import optional_import
 from aisynphys.database import default_db
@@ -39,38 +43,176 @@ def connectivity_profile(connected, distance, bin_edges):
         upper proportion confidence interval for each bin
 
     """
-    mask = np.isfinite(connected) & np.isfinite(distance)
-    connected = connected[mask]
-    distance = distance[mask]
+    n_probed, n_conn = binned_connection_counts(connected, distance, bin_edges)
+    prop, lower, upper = binned_connection_probability(n_conn, n_probed)
+    return bin_edges, prop, lower, upper
+
+
+def binned_connection_counts(connected, distance, bin_edges, groups=None, n_groups=None):
+    """Count probed and connected pairs in each distance bin, for many groups of pairs at once.
+
+    Parameters
+    ----------
+    connected : boolean array
+        Whether a synaptic connection was found for each probe
+    distance : array
+        Distance between cells for each probe
+    bin_edges : array
+        The distance values between which connections will be binned. Each bin includes its
+        lower edge and excludes its upper edge.
+    groups : int array | None
+        Index of the group (for example, a cell class matrix element) that each probe belongs to.
+        If None, then all probes belong to a single group and the group axis is omitted
+        from the output.
+    n_groups : int | None
+        Number of groups (default is ``groups.max() + 1``)
 
+    Returns
+    -------
+    n_probed : array
+        Number of probes in each bin; shape is (n_groups, n_bins), or (n_bins,) if *groups* is None
+    n_connected : array
+        Number of connections found in each bin
+    """
+    connected = np.asarray(connected, dtype=float)
+    distance = np.asarray(distance, dtype=float)
+    bin_edges = np.asarray(bin_edges)
     n_bins = len(bin_edges) - 1
-    upper = np.zeros(n_bins)
-    lower = np.zeros(n_bins)
-    prop = np.zeros(n_bins)
-    for i in range(n_bins):
-        minx = bin_edges[i]
-        maxx = bin_edges[i+1]
-
-        # select points inside this window
-        mask = (distance >= minx) & (distance < maxx)
-        pts_in_window = connected[mask]
-        # compute stats for window
-        n_probed = pts_in_window.shape[0]
-        n_conn = pts_in_window.sum()
-        if n_probed == 0:
-            prop[i] = np.nan
-            lower[i] = 0
-            upper[i] = 1
-        else:
-            prop[i] = n_conn / n_probed
-            ci = connection_probability_ci(n_conn, n_probed)
-            lower[i] = ci[0]
-            upper[i] = ci[1]
+    if groups is None:
+        group_ids = np.zeros(len(distance), dtype=int)
+        n_groups = 1
+    else:
+        group_ids = np.asarray(groups, dtype=int)
+        if n_groups is None:
+            n_groups = group_ids.max() + 1 if len(group_ids) > 0 else 0
+
+    bin_ids = _bin_index(distance, bin_edges)
+    mask = np.isfinite(connected) & (bin_ids >= 0)
+    flat = group_ids[mask] * n_bins + bin_ids[mask]
+    size = n_groups * n_bins
+    n_probed = np.bincount(flat, minlength=size).reshape(n_groups, n_bins)
+    n_connected = np.bincount(flat, weights=connected[mask], minlength=size).reshape(n_groups, n_bins)
+    n_connected = np.round(n_connected).astype(int)
+    if groups is None:
+        return n_probed[0], n_connected[0]
+    return n_probed, n_connected
+
+
+def binned_connection_probability(n_connected, n_probed, alpha=0.05):
+    """Return connection probability and Clopper-Pearson confidence intervals for arrays of counts
+    (as returned by `binned_connection_counts`).
 
-    return bin_edges, prop, lower, upper
+    Returns
+    -------
+    prop : array
+        Connected proportion (NaN where nothing was probed)
+    lower : array
+        Lower confidence interval (0 where nothing was probed)
+    upper : array
+        Upper confidence interval (1 where nothing was probed)
+    """
+    n_connected = np.asarray(n_connected)
+    n_probed = np.asarray(n_probed)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prop = np.where(n_probed > 0, n_connected / np.maximum(n_probed, 1), np.nan)
+    lower, upper = connection_probability_ci_array(n_connected, n_probed, alpha=alpha)
+    return prop, lower, upper
+
+
+def bootstrap_connectivity_profile(connected, distance, bin_edges, groups=None, n_groups=None, n_samples=1000,
+                                   seed=None, chunk_size=100, n_threads=1):
+    """Bootstrap resample connection probability vs distance.
 
+    Probes are resampled with replacement within each group, and the binned connection
+    probability is computed for each resampled set. All groups and all samples in a chunk
+    are resampled and binned together in a few array operations.
+
+    Parameters
+    ----------
+    connected, distance, bin_edges, groups, n_groups :
+        See `binned_connection_counts`
+    n_samples : int
+        Number of bootstrap samples
+    seed : int | None
+        Random seed. Results for a given seed do not depend on *chunk_size* or *n_threads*.
+    chunk_size : int
+        Number of samples to generate at once; limits memory use to about
+        ``chunk_size * len(distance)`` elements per thread.
+    n_threads : int
+        Number of chunks to process in parallel
 
-def measure_distance(pair_groups, window):
+    Returns
+    -------
+    prop : array
+        Connected proportion for each sample; shape is (n_samples, n_groups, n_bins), or
+        (n_samples, n_bins) if *groups* is None. Bins with no resampled probes are NaN, so
+        confidence bands can be computed with ``np.nanpercentile(prop, [2.5, 97.5], axis=0)``.
+    """
+    connected = np.asarray(connected, dtype=float)
+    distance = np.asarray(distance, dtype=float)
+    bin_edges = np.asarray(bin_edges)
+    n_bins = len(bin_edges) - 1
+    if groups is None:
+        group_ids = np.zeros(len(distance), dtype=int)
+        n_groups = 1
+    else:
+        group_ids = np.asarray(groups, dtype=int)
+        if n_groups is None:
+            n_groups = group_ids.max() + 1 if len(group_ids) > 0 else 0
+
+    # discard probes outside all bins, then sort by group so that each group occupies
+    # a contiguous range of indices
+    bin_ids = _bin_index(distance, bin_edges)
+    valid = np.isfinite(connected) & (bin_ids >= 0)
+    order = np.argsort(group_ids[valid], kind='stable')
+    group_ids = group_ids[valid][order]
+    connected = connected[valid][order]
+    flat_bin = group_ids * n_bins + bin_ids[valid][order]
+    group_size = np.bincount(group_ids, minlength=n_groups)
+    group_start = np.concatenate([[0], np.cumsum(group_size)[:-1]]).astype(int)
+    # each resampled position draws from the probes in its own group
+    pos_start = group_start[group_ids]
+    pos_size = group_size[group_ids]
+
+    chunk_size = max(1, int(chunk_size))
+    chunks = [(i, min(chunk_size, n_samples - i)) for i in range(0, n_samples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    size = n_groups * n_bins
+
+    def run_chunk(args):
+        (start, n), chunk_seed = args
+        rng = np.random.default_rng(chunk_seed)
+        idx = pos_start + (rng.random((n, len(pos_start))) * pos_size).astype(int)
+        flat = (flat_bin[idx] + (np.arange(n) * size)[:, None]).ravel()
+        n_probed = np.bincount(flat, minlength=n * size)
+        n_conn = np.bincount(flat, weights=connected[idx].ravel(), minlength=n * size)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(n_probed > 0, n_conn / np.maximum(n_probed, 1), np.nan).reshape(n, n_groups, n_bins)
+
+    tasks = list(zip(chunks, seeds))
+    if n_threads > 1 and len(tasks) > 1:
+        with ThreadPoolExecutor(n_threads) as pool:
+            results = list(pool.map(run_chunk, tasks))
+    else:
+        results = [run_chunk(t) for t in tasks]
+
+    prop = np.concatenate(results, axis=0) if len(results) > 0 else np.empty((0, n_groups, n_bins))
+    if groups is None:
+        return prop[:, 0]
+    return prop
+
+
+def _bin_index(x, bin_edges):
+    """Return the index of the bin containing each value in *x*, or -1 for values outside all bins
+    (each bin includes its lower edge and excludes its upper edge).
+    """
+    bin_ids = np.searchsorted(bin_edges, x, side='right') - 1
+    outside = ~np.isfinite(x) | (bin_ids < 0) | (bin_ids >= len(bin_edges) - 1)
+    bin_ids[outside] = -1
+    return bin_ids
+
+
+def measure_distance(pair_groups, window, alpha=0.05, n_bootstrap=0, seed=None, n_threads=1):
     """Given a description of cell pairs grouped together by cell class,
     return a structure that describes connectivity as a function of distance between cell classes.
     
@@ -80,22 +222,50 @@ def measure_distance(pair_groups, window):
         Output of `cell_class.classify_pairs`
     window: float
         binning window for distance
+    alpha : float
+        Alpha value setting confidence interval width (default is 0.05)
+    n_bootstrap : int
+        If > 0, then also compute bootstrap confidence bands from this many resamplings of the
+        probed pairs in each group (see `bootstrap_connectivity_profile`); these are stored as
+        'bootstrap_lower_ci' and 'bootstrap_upper_ci'.
+    seed : int | None
+        Random seed for bootstrap resampling
+    n_threads : int
+        Number of threads used for bootstrap resampling
     """
+    bin_edges = np.arange(0, 500e-6, window)
+    keys = list(pair_groups.keys())
+    connected, distance, groups = [], [], []
+    for i, (pre_class, post_class) in enumerate(keys):
+        conn, dist = pair_distance(pair_groups[(pre_class, post_class)], pre_class)
+        connected.append(conn)
+        distance.append(dist)
+        groups.append(np.full(len(conn), i))
+    if len(keys) > 0:
+        connected, distance, groups = [np.concatenate(x) for x in (connected, distance, groups)]
+
+    # compute all matrix elements at once
+    n_probed, n_connected = binned_connection_counts(connected, distance, bin_edges, groups=groups, n_groups=len(keys))
+    cp, lower, upper = binned_connection_probability(n_connected, n_probed, alpha=alpha)
+    if n_bootstrap > 0:
+        samples = bootstrap_connectivity_profile(connected, distance, bin_edges, groups=groups, n_groups=len(keys),
+                                                 n_samples=n_bootstrap, seed=seed, n_threads=n_threads)
+        with warnings.catch_warnings():
+            # bins with no probes are all-NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            boot_lower, boot_upper = np.nanpercentile(samples, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
 
     results = OrderedDict()
-    for key, class_pairs in pair_groups.items():
-        pre_class, post_class = key
-
-        connected, distance = pair_distance(class_pairs, pre_class) 
-        bin_edges = np.arange(0, 500e-6, window)
-        xvals, cp, lower, upper = connectivity_profile(connected, distance, bin_edges)
-
-        results[(pre_class, post_class)] = {
+    for i, key in enumerate(keys):
+        results[key] = {
         'bin_edges': bin_edges,
-        'conn_prob': cp,
-        'lower_ci': lower,
-        'upper_ci': upper,
+        'conn_prob': cp[i],
+        'lower_ci': lower[i],
+        'upper_ci': upper[i],
         }
+        if n_bootstrap > 0:
+            results[key]['bootstrap_lower_ci'] = boot_lower[i]
+            results[key]['bootstrap_upper_ci'] = boot_upper[i]
 
     return results
 
@@ -221,9 +391,33 @@ def connection_probability_ci(n_connected, n_probed, alpha=0.05):
     return proportion_confint(n_connected, n_probed, alpha=alpha, method='beta')
 
 
+def connection_probability_ci_array(n_connected, n_probed, alpha=0.05):
+    """Vectorized version of `connection_probability_ci`.
+
+    Computes Clopper-Pearson intervals for arrays of counts in a single call. Elements
+    where *n_probed* is 0 have the interval (0, 1).
+
+    Returns
+    -------
+    lower : array
+        The lower confidence intervals
+    upper : array
+        The upper confidence intervals
+    """
+    n_connected = np.asarray(n_connected, dtype=float)
+    n_probed = np.asarray(n_probed, dtype=float)
+    assert np.all(n_connected <= n_probed), "n_connected must be <= n_probed"
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lower = scipy.stats.beta.ppf(alpha / 2, n_connected, n_probed - n_connected + 1)
+        upper = scipy.stats.beta.isf(alpha / 2, n_connected + 1, n_probed - n_connected)
+    lower = np.where(n_connected == 0, 0.0, lower)
+    upper = np.where(n_connected == n_probed, 1.0, upper)
+    return lower, upper
+
+
 probed_pair_test_spike_limit = 10
 
-def pair_was_probed(pair, synapse_type, test_spike_limit=None):
+def pair_was_probed(pair, synapse_type, test_spike_limit=None, clamp_mode=None):
     """Return boolean indicating whether a cell pair was "probed" for either 
     excitatory or inhibitory connectivity.
     
@@ -241,31 +435,136 @@ def pair_was_probed(pair, synapse_type, test_spike_limit=None):
         if it passes criteria for _both_ 'ex' and 'in'.
     test_spike_limit : int | None
         The number of test spikes required to consider a pair probed for connectivity.
+    clamp_mode : str | None
+        If 'ic' or 'vc', then only test spikes recorded in that clamp mode are counted.
+
+    See also
+    --------
+    probed_pair_clause : the equivalent SQL expression
     """
     global probed_pair_test_spike_limit
     if test_spike_limit is None:
         test_spike_limit = probed_pair_test_spike_limit
 
     assert synapse_type in ('ex', 'in', 'mixed', None), "synapse_type must be 'ex', 'in', 'mixed', or None"
+    suffix = '' if clamp_mode is None else '_' + clamp_mode
+    def n_spikes(syn_type):
+        return getattr(pair, 'n_%s_test_spikes%s' % (syn_type, suffix)) or 0
     if synapse_type in (None, 'mixed'):
-        return (pair.n_ex_test_spikes > test_spike_limit) and (pair.n_in_test_spikes > test_spike_limit)
+        return (n_spikes('ex') > test_spike_limit) and (n_spikes('in') > test_spike_limit)
     else:
-        qc_field = 'n_%s_test_spikes' % synapse_type
-        return getattr(pair, qc_field) > test_spike_limit
+        return n_spikes(synapse_type) > test_spike_limit
 
 
 def pair_probed_gj(pair):
     """Return boolean indicateing whether a cell pair was "probed" for a gap junction.
 
     Checks both the "pre" and "post" synaptic cells for long-pulse stimuli from which
-    gap junctions were identified and quantified.
+    gap junctions were identified and quantified. This uses `pair.gap_junction_probed` when it
+    was recorded by the dataset pipeline module, and otherwise falls back to checking the stimulus
+    names of all recordings made by both electrodes.
     """
-    
+    if pair.gap_junction_probed is not None:
+        return pair.gap_junction_probed
+
     pre_electrode = pair.pre_cell.electrode
     post_electrode = pair.post_cell.electrode
     pre_stims = set([rec.stim_name for rec in pre_electrode.recordings])
     post_stims = set([rec.stim_name for rec in post_electrode.recordings])
-    return any('TargetV' in s for s in pre_stims) and any('TargetV' in s for s in post_stims)
+    return any('TargetV' in s for s in pre_stims if s is not None) and any('TargetV' in s for s in post_stims if s is not None)
+
+
+def probed_pair_clause(pair, synapse_type, test_spike_limit=None, clamp_mode=None):
+    """Return an SQL expression that selects pairs that were probed for connectivity.
+
+    This is the query-level equivalent of `pair_was_probed`.
+
+    Parameters
+    ----------
+    pair : Pair
+        The Pair table (or an alias of it) to filter
+    synapse_type : str | None | column
+        'ex', 'in', 'mixed', or None as in `pair_was_probed`. May also be a column expression
+        (for example ``pre_cell.cell_class_nonsynaptic``), in which case the criteria are
+        selected per row: 'ex' and 'in' require only excitatory or inhibitory test spikes,
+        and any other value requires both.
+    test_spike_limit : int | None
+        The number of test spikes required to consider a pair probed for connectivity.
+    clamp_mode : str | None
+        If 'ic' or 'vc', then only test spikes recorded in that clamp mode are counted.
+    """
+    if test_spike_limit is None:
+        test_spike_limit = probed_pair_test_spike_limit
+    suffix = '' if clamp_mode is None else '_' + clamp_mode
+    ex_probed = getattr(pair, 'n_ex_test_spikes' + suffix) > test_spike_limit
+    in_probed = getattr(pair, 'n_in_test_spikes' + suffix) > test_spike_limit
+    both_probed = sqlalchemy.and_(ex_probed, in_probed)
+
+    if synapse_type is None or isinstance(synapse_type, str):
+        assert synapse_type in ('ex', 'in', 'mixed', None), "synapse_type must be 'ex', 'in', 'mixed', or None"
+        return {'ex': ex_probed, 'in': in_probed}.get(synapse_type, both_probed)
+
+    return sqlalchemy.or_(
+        sqlalchemy.and_(synapse_type == 'ex', ex_probed),
+        sqlalchemy.and_(synapse_type == 'in', in_probed),
+        both_probed,
+    )
+
+
+def connectivity_count_query(group_by=('cell_class_nonsynaptic',), test_spike_limit=None, session=None, database=None):
+    """Return a query that counts probed and connected pairs (for both chemical synapses
+    and gap junctions) in a single aggregate query.
+
+    Pairs are considered probed for chemical synapses according to the presynaptic
+    cell's `cell_class_nonsynaptic` (as in `get_cp_results`), and probed for gap junctions
+    according to `pair.gap_junction_probed`.
+
+    Parameters
+    ----------
+    group_by : list
+        Names of Cell columns; the counts are grouped by the value of each of these columns for
+        both the presynaptic and postsynaptic cells.
+    test_spike_limit : int | None
+        The number of test spikes required to consider a pair probed for connectivity.
+
+    Returns
+    -------
+    query : DBQuery
+        Query returning columns ``pre_<name>`` and ``post_<name>`` for each name in *group_by*, followed
+        by n_probed, n_connected, n_gaps_probed and n_gaps. The presynaptic and postsynaptic cell tables
+        are aliased as "pre_cell" and "post_cell" so that additional filters may be added (for
+        example ``query.join(db.Experiment).filter(db.Experiment.project_name==...)``).
+    """
+    database = database or default_db
+    session = session or database.default_session
+    Pair = database.Pair
+    pre_cell = aliased(database.Cell, name='pre_cell')
+    post_cell = aliased(database.Cell, name='post_cell')
+
+    probed = probed_pair_clause(Pair, pre_cell.cell_class_nonsynaptic, test_spike_limit=test_spike_limit)
+    gj_probed = Pair.gap_junction_probed == True
+
+    def count(expr):
+        return sqlalchemy.func.coalesce(sqlalchemy.func.sum(sqlalchemy.case([(expr, 1)], else_=0)), 0)
+
+    group_cols = []
+    for name in group_by:
+        group_cols.append(getattr(pre_cell, name).label('pre_' + name))
+        group_cols.append(getattr(post_cell, name).label('post_' + name))
+
+    query = session.query(
+        *group_cols,
+        count(probed).label('n_probed'),
+        count(sqlalchemy.and_(probed, Pair.has_synapse == True)).label('n_connected'),
+        count(gj_probed).label('n_gaps_probed'),
+        count(sqlalchemy.and_(gj_probed, Pair.has_electrical == True)).label('n_gaps'),
+    )
+    query = query.select_from(Pair)
+    query = query.join(pre_cell, pre_cell.id == Pair.pre_cell_id)
+    query = query.join(post_cell, post_cell.id == Pair.post_cell_id)
+    if len(group_cols) > 0:
+        query = query.group_by(*group_cols).order_by(*group_cols)
+    return query
 
 
 def distance_adjusted_connectivity(x_probed, connected, sigma, alpha=0.05):
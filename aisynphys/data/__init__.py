@@ -4,5 +4,5 @@ from .cell import Cell
 from .data import (
     MultiPatchDataset, MultiPatchProbe, MultiPatchMixedFreqTrain,
     MultiPatchSyncRecAnalyzer, 
-    PulseResponseList, PulseResponse, StimPulse,
+    PulseResponseList, PulseResponse, StimPulse, TSeriesStack,
 )
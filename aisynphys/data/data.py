@@ -1,5 +1,6 @@
 import sys
 import numpy as np
+import scipy.signal
 
 from neuroanalysis.miesnwb import MiesNwb, MiesSyncRecording, MiesRecording
 from neuroanalysis.stimuli import find_square_pulses
@@ -128,9 +129,12 @@ class MultiPatchSyncRecAnalyzer(Analyzer):
         self._attach(srec)
         self.srec = srec
 
-    def get_spike_responses(self, pre_rec, post_rec, align_to='pulse', pre_pad=10e-3, require_spike=True):
+    def get_spike_responses(self, pre_rec, post_rec, align_to='pulse', pre_pad=10e-3, require_spike=True, recording_qc=None):
         """Given a pre- and a postsynaptic recording, return a structure
         containing evoked responses.
+
+        If *recording_qc* is given, it is used as the (qc_pass, failures) result of
+        qc.recording_qc_pass(post_rec) rather than evaluating it again.
         
         Returns
         -------
@@ -152,6 +156,7 @@ class MultiPatchSyncRecAnalyzer(Analyzer):
 
         # Select ranges to extract from postsynaptic recording
         result = []
+        qc_args = []
         for i,pulse in enumerate(spikes):
             pulse = pulse.copy()
             if len(pulse['spikes']) == 0:
@@ -197,9 +202,16 @@ class MultiPatchSyncRecAnalyzer(Analyzer):
                 adj_pulse_times.append(prev_pulse - this_pulse)
             if next_pulse is not None:
                 adj_pulse_times.append(next_pulse - this_pulse)
-            pulse['ex_qc_pass'], pulse['in_qc_pass'], pulse['qc_failures'] = qc.pulse_response_qc_pass(post_rec=post_rec, window=pulse_window, n_spikes=n_spikes, adjacent_pulses=adj_pulse_times)
+            qc_args.append((pulse_window, n_spikes, adj_pulse_times))
 
             result.append(pulse)
+
+        # evaluate QC for all responses at once
+        if len(result) > 0:
+            windows, n_spikes, adj_pulse_times = zip(*qc_args)
+            pr_qc = qc.PulseResponseQCBatch(post_rec, windows, n_spikes, adj_pulse_times, recording_qc=recording_qc)
+            for i, pulse in enumerate(result):
+                pulse['ex_qc_pass'], pulse['in_qc_pass'], pulse['qc_failures'] = pr_qc.result(i)
         
         return result
 
@@ -281,6 +293,241 @@ class PulseResponse(object):
         return self.stim_pulse.stimulus_tseries
     
 
+def float_mode_rows(data, lengths=None):
+    """Vectorized float_mode: return the binned mode of each row in a 2D array.
+
+    Rows shorter than the array width are described by *lengths* (values beyond the
+    length of each row are ignored). Results match calling float_mode() on each row
+    individually (up to floating point rounding of the bin edges).
+    """
+    data = np.asarray(data, dtype=float)
+    n_rows, width = data.shape
+    if lengths is None:
+        lengths = np.full(n_rows, width, dtype=int)
+    modes = np.empty(n_rows)
+    # rows of equal length share a bin count, so process one group per length
+    for length in np.unique(lengths):
+        rows = np.argwhere(lengths == length)[:, 0]
+        if length == 0:
+            modes[rows] = np.nan
+            continue
+        d = data[rows, :length]
+        # same bin count as neuroanalysis.baseline.float_mode
+        bins = int(np.clip(int(length**0.5), 3, 500))
+        lo = d.min(axis=1)
+        hi = d.max(axis=1)
+        # np.histogram expands a zero-width range by 0.5 on either side
+        flat = lo == hi
+        lo = np.where(flat, lo - 0.5, lo)
+        hi = np.where(flat, hi + 0.5, hi)
+        width_ = (hi - lo) / bins
+        idx = np.floor((d - lo[:, None]) / width_[:, None]).astype(int)
+        idx = np.clip(idx, 0, bins - 1)
+        counts = np.zeros((len(rows), bins), dtype=int)
+        np.add.at(counts, (np.arange(len(rows))[:, None], idx), 1)
+        ind = np.argmax(counts, axis=1)
+        edges_lo = lo + ind * width_
+        edges_hi = lo + (ind + 1) * width_
+        modes[rows] = 0.5 * (edges_lo + edges_hi)
+    return modes
+
+
+class TSeriesStack(object):
+    """A set of time series stored as rows of a single 2D array.
+
+    Each row has its own start time (t0) and sample rate; rows shorter than the array are
+    padded with NaN. Baseline subtraction, alignment, resampling and averaging are
+    performed on all rows at once rather than by creating one TSeries per row.
+
+    Parameters
+    ----------
+    data : 2D array
+        Array of shape (n_rows, n_samples)
+    t0 : array
+        Start time of each row
+    sample_rate : float | array
+        Sample rate of all rows, or of each row
+    lengths : array | None
+        Number of valid samples in each row (default is the full width of *data*)
+    """
+    def __init__(self, data, t0, sample_rate, lengths=None):
+        self.data = np.asarray(data, dtype=float)
+        n = self.data.shape[0]
+        self.t0 = np.broadcast_to(np.asarray(t0, dtype=float), (n,)).copy()
+        self.sample_rate = np.broadcast_to(np.asarray(sample_rate, dtype=float), (n,)).copy()
+        if lengths is None:
+            lengths = np.full(n, self.data.shape[1], dtype=int)
+        self.lengths = np.asarray(lengths, dtype=int)
+
+    @classmethod
+    def from_arrays(cls, arrays, t0, sample_rate):
+        """Create a stack from a list of 1D arrays with per-array t0.
+        """
+        lengths = np.array([len(a) for a in arrays], dtype=int)
+        data = np.full((len(arrays), lengths.max() if len(arrays) > 0 else 0), np.nan)
+        for i, a in enumerate(arrays):
+            data[i, :len(a)] = a
+        return cls(data, t0, sample_rate, lengths)
+
+    @classmethod
+    def from_tseries(cls, tseries):
+        """Create a stack from a list of TSeries.
+        """
+        tseries = list(tseries)
+        return cls.from_arrays([ts.data for ts in tseries], [ts.t0 for ts in tseries], [ts.sample_rate for ts in tseries])
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.tseries(i)
+
+    def __getitem__(self, i):
+        return self.tseries(i)
+
+    def tseries(self, i):
+        """Return row *i* as a TSeries.
+        """
+        return TSeries(self.data[i, :self.lengths[i]].copy(), sample_rate=self.sample_rate[i], t0=self.t0[i])
+
+    def to_tserieslist(self):
+        return TSeriesList([self.tseries(i) for i in range(len(self))])
+
+    def _rows(self, rows):
+        return TSeriesStack(self.data[rows], self.t0[rows], self.sample_rate[rows], self.lengths[rows])
+
+    def index_at(self, t):
+        """Return the (rounded) index of time *t* in each row, clipped to the row length.
+
+        *t* may be a scalar or an array with one value per row.
+        """
+        idx = np.round((t - self.t0) * self.sample_rate).astype(int)
+        return np.clip(idx, 0, self.lengths)
+
+    @property
+    def t_end(self):
+        return self.t0 + self.lengths / self.sample_rate
+
+    def baseline_subtract(self, stop_time, window):
+        """Return a new stack with the float_mode of each row in the window [stop_time-window, stop_time] subtracted.
+
+        *stop_time* may be a scalar or an array with one value per row. Rows whose window is
+        empty are offset by their first sample instead.
+        """
+        stop_time = np.broadcast_to(np.asarray(stop_time, dtype=float), (len(self),))
+        start = self.index_at(np.maximum(self.t0, stop_time - window))
+        stop = self.index_at(stop_time)
+        n = np.maximum(stop - start, 0)
+        width = n.max() if len(n) > 0 else 0
+        cols = start[:, None] + np.arange(width)[None, :]
+        base_data = np.take_along_axis(self.data, np.clip(cols, 0, max(self.data.shape[1]-1, 0)), axis=1)
+        baseline = float_mode_rows(base_data, n)
+        empty = n == 0
+        baseline[empty] = self.data[empty, 0]
+        return TSeriesStack(self.data - baseline[:, None], self.t0, self.sample_rate, self.lengths)
+
+    def align(self, t):
+        """Return a new stack with each row's time values shifted so that *t* (one value per row) becomes 0.
+        """
+        return TSeriesStack(self.data, self.t0 - t, self.sample_rate, self.lengths)
+
+    def resample(self, sample_rate):
+        """Return a new stack with all rows resampled to *sample_rate*.
+
+        Matches TSeries.resample: rows that are not already at *sample_rate* are lowpass
+        filtered (2nd order bessel, cutoff=sample_rate) and then linearly interpolated, and
+        each output row ends at or before the last time value of its input row.
+        """
+        if np.all(self.sample_rate == sample_rate):
+            return self
+        step = 1.0 / sample_rate
+        lengths = self.lengths.copy()
+        resample = self.sample_rate != sample_rate
+        # output length of each row is len(np.arange(t[0], t[-1], step)), as in TSeries.resample
+        t_last = (np.maximum(self.lengths - 1, 0) * (1.0 / self.sample_rate)) + self.t0
+        lengths[resample] = np.ceil((t_last - self.t0)[resample] / step).astype(int)
+        data = np.full((len(self), max(lengths.max(), 0)), np.nan)
+        w = min(data.shape[1], self.data.shape[1])
+        data[~resample, :w] = self.data[~resample, :w]
+
+        # rows with the same sample rate and length are filtered together
+        groups = {}
+        for i in np.argwhere(resample)[:, 0]:
+            groups.setdefault((self.sample_rate[i], self.lengths[i]), []).append(i)
+        for (src_rate, n), rows in groups.items():
+            rows = np.array(rows)
+            b, a = scipy.signal.bessel(2, sample_rate * (1.0 / src_rate))
+            filt = _filter_rows(self.data[rows, :n], b, a)
+            width = lengths[rows].max()
+            src = np.arange(width) * step * src_rate
+            i0 = np.clip(np.floor(src).astype(int), 0, max(n - 1, 0))
+            i1 = np.clip(i0 + 1, 0, max(n - 1, 0))
+            frac = src - i0
+            interp = filt[:, i0] + (filt[:, i1] - filt[:, i0]) * frac[None, :]
+            interp[np.arange(width)[None, :] >= lengths[rows][:, None]] = np.nan
+            data[rows, :width] = interp
+        return TSeriesStack(data, self.t0, sample_rate, lengths)
+
+    def overlap(self):
+        """Return (data, t0, sample_rate) where *data* is a 2D array containing the time range
+        over which all rows overlap, sampled at the lowest sample rate in the stack.
+
+        Rows are clipped the same way as TSeriesList.mean: each row starts at the sample nearest
+        the latest t0 (which is also the t0 of the result), and all rows are truncated to the
+        shortest remaining length.
+        """
+        if len(self) == 0:
+            raise ValueError("Cannot average empty trace list.")
+        sample_rate = self.sample_rate.min()
+        stack = self.resample(sample_rate)
+        t0 = stack.t0.max()
+        start = np.minimum(stack.index_at(t0), np.maximum(stack.lengths - 1, 0))
+        n = max(int((stack.lengths - start).min()), 0)
+        cols = start[:, None] + np.arange(n)[None, :]
+        data = np.take_along_axis(stack.data, cols, axis=1)
+        return data, t0, sample_rate
+
+    def _reduce(self, func):
+        data, t0, sample_rate = self.overlap()
+        return TSeries(func(data, axis=0), sample_rate=sample_rate, t0=t0)
+
+    def mean(self):
+        """Return a TSeries averaged over all rows (see overlap()).
+
+        Like TSeriesList.mean, NaN samples are ignored and the number of averaged rows is
+        stored in meta['mean_of_n'].
+        """
+        if len(self) == 1:
+            ts = self.tseries(0)
+        else:
+            ts = self._reduce(np.nanmean)
+        ts.meta['mean_of_n'] = len(self)
+        return ts
+
+    def median(self):
+        """Return a TSeries with the NaN-ignoring median over all rows (see overlap()).
+        """
+        return self._reduce(np.nanmedian)
+
+    def std(self):
+        """Return a TSeries with the NaN-ignoring standard deviation over all rows (see overlap()).
+        """
+        return self._reduce(np.nanstd)
+
+
+def _filter_rows(data, b, a, padding=100):
+    """Apply a bidirectional linear filter to each row of a 2D array.
+
+    Same as neuroanalysis.filter.apply_filter, but operating on all rows at once.
+    """
+    pad1 = data[:, :padding][:, ::-1]
+    pad2 = data[:, -padding:][:, ::-1]
+    padded = np.hstack([pad1, data, pad2])
+    filtered = scipy.signal.lfilter(b, a, scipy.signal.lfilter(b, a, padded, axis=1)[:, ::-1], axis=1)[:, ::-1]
+    return filtered[:, pad1.shape[1]:padded.shape[1] - pad2.shape[1]]
+
+
 class PulseResponseList(object):
     """A list of pulse responses with methods for time-aligning and baseline
     subtracting recordings.
@@ -306,65 +553,75 @@ class PulseResponseList(object):
     def post_tseries(self, align=None, bsub=False, bsub_win=5e-3, alignment_failure_mode='ignore'):
         """Return a TSeriesList of all postsynaptic recordings.
         """
-        return self._get_tserieslist('post_tseries', align, bsub, bsub_win, alignment_failure_mode)
+        return self._get_tseries_stack('post_tseries', align, bsub, bsub_win, alignment_failure_mode).to_tserieslist()
 
     def pre_tseries(self, align=None, bsub=False, bsub_win=5e-3, alignment_failure_mode='ignore'):
         """Return a TSeriesList of all presynaptic recordings.
         """
-        return self._get_tserieslist('pre_tseries', align, bsub, bsub_win, alignment_failure_mode)
-
-    def _get_tserieslist(self, ts_name, align, bsub, bsub_win=5e-3, alignment_failure_mode='ignore'):
-        tsl = []
-        if align is not None and alignment_failure_mode == 'average':
-            if align == 'spike':
-                average_align_t = np.mean([p.stim_pulse.first_spike_time for p in self.prs if p.stim_pulse.first_spike_time is not None])
-            elif align == 'peak':
-                average_align_t = np.mean([p.stim_pulse.spikes[0].peak_time for p in self.prs if p.stim_pulse.n_spikes==1 and p.stim_pulse.spikes[0].peak_time is not None])
-            elif align == 'stim':
-                average_align_t = np.mean([p.stim_pulse.onset_time for p in self.prs if p.stim_pulse.onset_time is not None])
-            else:
-                raise ValueError("align must be None, 'spike', 'peak', or 'pulse'.")
-        
-        for pr in self.prs:   
-            ts = getattr(pr, ts_name)
-            stim_time = pr.stim_pulse.onset_time
-
-            if bsub is True:
-                start_time = max(ts.t0, stim_time-bsub_win)
-                baseline_data = ts.time_slice(start_time, stim_time).data
-                if len(baseline_data) == 0:
-                    baseline = ts.data[0]
-                else:
-                    baseline = float_mode(baseline_data)
-                ts = ts - baseline
-
-            if align is not None:
-                if align == 'spike':
-                # first_spike_time is the max dv/dt of the spike
-                    align_t = pr.stim_pulse.first_spike_time
-                elif align == 'pulse':
-                    align_t = stim_time
-                elif align == 'peak':
-                    # peak of the first spike
-                    align_t = pr.stim_pulse.spikes[0].peak_time if pr.stim_pulse.n_spikes==1 else None
-                else:
-                    raise ValueError("align must be None, 'spike', 'peak', or 'pulse'.")
-                
-                if align_t is None:
-                    if alignment_failure_mode == 'ignore':
-                        # ignore PRs with no known timing
-                        continue
-                    elif alignment_failure_mode == 'average':
-                        align_t = average_align_t
-                        if np.isnan(align_t):
-                            raise Exception("average %s time is None, try another mode" % align)
-                    elif alignment_failure_mode == 'raise':
-                        raise Exception("%s time is not available for pulse %s and can't be aligned" % (align, pr))
-                
-                ts = ts.copy(t0=ts.t0 - align_t)
-
-            tsl.append(ts)
-        return TSeriesList(tsl)
+        return self._get_tseries_stack('pre_tseries', align, bsub, bsub_win, alignment_failure_mode).to_tserieslist()
+
+    def post_stack(self, align=None, bsub=False, bsub_win=5e-3, alignment_failure_mode='ignore'):
+        """Return a TSeriesStack of all postsynaptic recordings.
+
+        This is equivalent to post_tseries(), but much faster when the result is only
+        needed for averaging.
+        """
+        return self._get_tseries_stack('post_tseries', align, bsub, bsub_win, alignment_failure_mode)
+
+    def pre_stack(self, align=None, bsub=False, bsub_win=5e-3, alignment_failure_mode='ignore'):
+        """Return a TSeriesStack of all presynaptic recordings.
+        """
+        return self._get_tseries_stack('pre_tseries', align, bsub, bsub_win, alignment_failure_mode)
+
+    def _align_times(self, align, alignment_failure_mode):
+        """Return an array of alignment times for each pulse response (NaN where unknown).
+        """
+        if align == 'spike':
+            # first_spike_time is the max dv/dt of the spike
+            align_t = [p.stim_pulse.first_spike_time for p in self.prs]
+        elif align == 'pulse':
+            align_t = [p.stim_pulse.onset_time for p in self.prs]
+        elif align == 'peak':
+            # peak of the first spike
+            align_t = [p.stim_pulse.spikes[0].peak_time if p.stim_pulse.n_spikes==1 else None for p in self.prs]
+        else:
+            raise ValueError("align must be None, 'spike', 'peak', or 'pulse'.")
+        align_t = np.array([np.nan if t is None else t for t in align_t], dtype=float)
+
+        missing = np.isnan(align_t)
+        if missing.any():
+            if alignment_failure_mode == 'average':
+                average_align_t = np.nanmean(align_t) if not missing.all() else np.nan
+                if np.isnan(average_align_t):
+                    raise Exception("average %s time is None, try another mode" % align)
+                align_t[missing] = average_align_t
+            elif alignment_failure_mode == 'raise':
+                pr = self.prs[np.argwhere(missing)[0, 0]]
+                raise Exception("%s time is not available for pulse %s and can't be aligned" % (align, pr))
+        return align_t
+
+    def _get_tseries_stack(self, ts_name, align, bsub, bsub_win=5e-3, alignment_failure_mode='ignore'):
+        if align is not None:
+            align_t = self._align_times(align, alignment_failure_mode)
+            # ignore PRs with no known timing
+            keep = ~np.isnan(align_t)
+        else:
+            keep = np.ones(len(self.prs), dtype=bool)
+        prs = [pr for pr, k in zip(self.prs, keep) if k]
+
+        tseries = [getattr(pr, ts_name) for pr in prs]
+        stack = TSeriesStack.from_tseries(tseries)
+        if len(stack) == 0:
+            return stack
+
+        if bsub is True:
+            stim_time = np.array([pr.stim_pulse.onset_time for pr in prs], dtype=float)
+            stack = stack.baseline_subtract(stim_time, bsub_win)
+
+        if align is not None:
+            stack = stack.align(align_t[keep])
+
+        return stack
 
 
 class StimPulse(object):
@@ -5,7 +5,7 @@ The actual schemas for database tables are implemented in other files in this su
 """
 from __future__ import division, print_function
 
-import os, sys, io, json, threading, gc, re, weakref
+import os, sys, io, json, threading, gc, re, weakref, sqlite3, pathlib
 from collections import OrderedDict, namedtuple
 import numpy as np
 try:
@@ -15,21 +15,20 @@ except ImportError:
 from inspect import isclass
 
 import sqlalchemy
-from distutils.version import LooseVersion
-if LooseVersion(sqlalchemy.__version__) < '1.2':
+if tuple(int(x) for x in re.findall(r'\d+', sqlalchemy.__version__)[:2]) < (1, 2):
     raise Exception('requires at least sqlalchemy 1.2')
 
-import sqlalchemy.inspection, sqlalchemy.pool
+import sqlalchemy.inspection, sqlalchemy.pool, sqlalchemy.event, sqlalchemy.exc
 from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Boolean, Float, Date, DateTime, LargeBinary, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, deferred, sessionmaker, reconstructor
 from sqlalchemy.types import TypeDecorator
-from sqlalchemy.sql.expression import func
+from sqlalchemy.sql.expression import func, type_coerce
 
 
 from .. import config
-from neuroanalysis.util.optional_import import optional_import
-pandas = optional_import('pandas')
+from ..util.lazy_import import lazy_import
+pandas = lazy_import('pandas')
 
 
 class NDArray(TypeDecorator):
@@ -56,6 +55,31 @@ class NDArray(TypeDecorator):
     def python_type(self):
         return np.ndarray
 
+def decode_ndarray(blob, headers):
+    """Decode the raw bytes of an NDArray column (as returned when the column is selected with
+    ``type_coerce(column, LargeBinary)``) without going through np.load for every value.
+
+    The .npy header is parsed only once for each distinct header; *headers* is a dict used to cache
+    (dtype, shape, fortran_order) between calls. The returned array is a read-only view of *blob*,
+    or None if *blob* is empty.
+    """
+    if blob is None or len(blob) == 0:
+        return None
+    blob = bytes(blob)
+    # .npy format: 6-byte magic string, 2-byte version, then a 2-byte (v1) or 4-byte (v2+) header length
+    len_size = 2 if blob[6] == 1 else 4
+    offset = 8 + len_size + int.from_bytes(blob[8:8+len_size], 'little')
+    header = blob[:offset]
+    info = headers.get(header)
+    if info is None:
+        arr = np.load(io.BytesIO(blob), allow_pickle=False)
+        info = (arr.dtype, arr.shape, arr.ndim > 1 and arr.flags.f_contiguous and not arr.flags.c_contiguous)
+        headers[header] = info
+    dtype, shape, fortran_order = info
+    count = int(np.prod(shape))
+    return np.frombuffer(blob, dtype=dtype, count=count, offset=offset).reshape(shape, order='F' if fortran_order else 'C')
+
+
 class CustomEncoder(json.JSONEncoder):
     """ For encoding nonserializable floats into json
     """
@@ -215,6 +239,23 @@ def make_table(ormbase, name, columns, base=None, **table_args):
     return new_table
 
 
+def _record_connection_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+def _check_connection_pid(dbapi_connection, connection_record, connection_proxy):
+    """Refuse to hand out pooled connections that were opened by another process.
+
+    See https://docs.sqlalchemy.org/en/13/core/pooling.html#using-connection-pools-with-multiprocessing
+    """
+    pid = os.getpid()
+    if connection_record.info.get('pid', pid) != pid:
+        # drop (without closing) the connection; the pool will open a new one
+        connection_record.connection = connection_proxy.connection = None
+        raise sqlalchemy.exc.DisconnectionError(
+            "Connection record belongs to pid %s, attempting to check out in pid %s" % (connection_record.info['pid'], pid))
+
+
 class Database(object):
     """Methods for doing relational database maintenance via sqlalchemy.
     
@@ -223,6 +264,7 @@ class Database(object):
     Features:
     
     * Automatically build/dispose ro and rw engines (especially after fork)
+    * Pooled, read-tuned connections for read-only access
     * Generate ro/rw sessions on demand
     * Methods for creating / dropping databases
     * Clone databases across backends
@@ -230,17 +272,37 @@ class Database(object):
     _all_dbs = weakref.WeakSet()
     default_app_name = (' '.join(sys.argv))[-63:]
 
+    # open sqlite files in immutable mode when no read-write engine is configured
+    sqlite_immutable = True
+
+    # PRAGMAs applied to every connection made by read-only sqlite engines
+    sqlite_ro_pragmas = OrderedDict([
+        ('query_only', 1),
+        ('mmap_size', 256 * 2**20),
+        ('cache_size', -64 * 2**10),  # negative values are in KiB
+    ])
+
     def __init__(self, ro_host, rw_host, db_name, ormbase):
         self.ormbase = ormbase
         self._mappings = {}
 
+        # engines inherited from a parent process; these are kept referenced (but never used) in child
+        # processes, because closing their connections would also close the parent's connections
+        self._inherited_engines = []
+
         # default options for creating DB engines
         self._engine_opts = {
             'postgresql': {
-                'ro': {'echo': False, 'poolclass': sqlalchemy.pool.NullPool, 'isolation_level': 'AUTOCOMMIT'}, # {'pool_size': 0, 'max_overflow': 40, }
+                # no limit on checked-out connections; only pool_size connections are kept idle
+                'ro': {'echo': False, 'pool_size': 2, 'max_overflow': -1, 'pool_pre_ping': True, 'isolation_level': 'AUTOCOMMIT'},
                 'rw': {'poolclass': sqlalchemy.pool.NullPool}, #{'pool_size': 0, 'max_overflow': 40},
                 'maint': {'poolclass': sqlalchemy.pool.NullPool},
-            }
+            },
+            'sqlite': {
+                # pooled connections are only ever used by one thread at a time; as with postgres,
+                # the number of checked-out connections is not limited
+                'ro': {'poolclass': sqlalchemy.pool.QueuePool, 'pool_size': 2, 'max_overflow': -1, 'connect_args': {'check_same_thread': False}},
+            },
         }
 
         self.ro_host = ro_host
@@ -324,16 +386,20 @@ class Database(object):
         """
         return Database(self.ro_host, self.rw_host, db_name, self.ormbase)
         
-    def dispose_engines(self):
+    def dispose_engines(self, close=True):
         """Dispose any existing DB engines. This is necessary when forking to avoid accessing the same DB
         connection simultaneously from two processes.
+
+        If *close* is False, then the engines are discarded without closing their pooled connections
+        (used in child processes, where those connections still belong to the parent).
         """
-        if self._ro_engine is not None:
-            self._ro_engine.dispose()
-        if self._rw_engine is not None:
-            self._rw_engine.dispose()
-        if self._maint_engine is not None:
-            self._maint_engine.dispose()
+        for engine in (self._ro_engine, self._rw_engine, self._maint_engine):
+            if engine is None:
+                continue
+            if close:
+                engine.dispose()
+            else:
+                self._inherited_engines.append(engine)
         self._ro_engine = None
         self._ro_sessionmaker = None
         self._rw_engine = None
@@ -364,7 +430,7 @@ class Database(object):
             # https://docs.sqlalchemy.org/en/latest/faq/connections.html#how-do-i-use-engines-connections-sessions-with-python-multiprocessing-or-os-fork
             if self._engine_pid is not None:
                 print("Making new session for subprocess %d != %d" % (os.getpid(), self._engine_pid))
-            self.dispose_engines()
+            self.dispose_engines(close=self._engine_pid is None)
 
     @property
     def ro_engine(self):
@@ -372,10 +438,38 @@ class Database(object):
         """
         self._check_engines()
         if self._ro_engine is None:
-            opts = self._engine_opts.get(self.backend, {}).get('ro', {})
+            opts = self._engine_opts.get(self.backend, {}).get('ro', {}).copy()
+            sqlite_file = self.sqlite_file
+            if self.backend == 'sqlite' and sqlite_file is None:
+                # in-memory databases use sqlalchemy's default (per-thread) pool
+                opts = {}
+            elif sqlite_file is not None and self.rw_address is None and self.sqlite_immutable:
+                # nothing will write to this file while it is open; let sqlite skip locking and change detection
+                uri = pathlib.Path(sqlite_file).absolute().as_uri() + '?mode=ro&immutable=1'
+                connect_args = opts.pop('connect_args', {})
+                opts['creator'] = lambda: sqlite3.connect(uri, uri=True, **connect_args)
             self._ro_engine = create_engine(self.ro_address, **opts)
+            if sqlite_file is not None:
+                sqlalchemy.event.listen(self._ro_engine, 'connect', self._set_sqlite_ro_pragmas)
+            if not isinstance(self._ro_engine.pool, sqlalchemy.pool.NullPool):
+                sqlalchemy.event.listen(self._ro_engine, 'connect', _record_connection_pid)
+                sqlalchemy.event.listen(self._ro_engine, 'checkout', _check_connection_pid)
             self._engine_pid = os.getpid()
         return self._ro_engine
+
+    @property
+    def sqlite_file(self):
+        """The sqlite file used by this database, or None if this is not a file-based sqlite database.
+        """
+        if self.backend != 'sqlite' or self.db_name in (None, '', ':memory:'):
+            return None
+        return self.db_name
+
+    def _set_sqlite_ro_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in self.sqlite_ro_pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
     
     @property
     def rw_engine(self):
@@ -607,6 +701,88 @@ class Database(object):
             last_size = size
             print("   sqlite file size:  %0.4fGB  (+%0.4fGB for %s)" % (size*1e-9, diff*1e-9, table))
 
+    def bake_sqlite_multi(self, destinations, tables=None, chunksize=1000):
+        """Dump copies of this database to several sqlite files while reading each source table only once.
+
+        Each destination may skip a different set of tables and columns (for example, the small,
+        medium and full releases). Rows are read from this database in a background thread and
+        written to all destination files in parallel, one writer thread per file. Indexes are
+        built and ANALYZE is run on each file after all rows have been written.
+
+        Parameters
+        ----------
+        destinations : dict
+            ``{sqlite_file: {'skip_tables': [...], 'skip_columns': {table_name: [...]}}}``.
+            Destination files must not already exist.
+        tables : list | None
+            Names of tables to copy (default is all tables)
+        """
+        for sqlite_file in destinations:
+            if os.path.exists(sqlite_file):
+                raise Exception("sqlite file %s already exists" % sqlite_file)
+
+        meta_tables = self.metadata_tables()
+        writers = [SqliteBakeWriter(sqlite_file, meta_tables, **opts) for sqlite_file, opts in destinations.items()]
+        try:
+            for table_name, table in meta_tables.items():
+                table_writers = [w for w in writers if w.copies_table(table_name)]
+                if len(table_writers) == 0 or (tables is not None and table_name not in tables):
+                    print("Skipping %s.." % table_name)
+                    continue
+                print("Baking %s.. (%d files)" % (table_name, len(table_writers)))
+
+                # read only the columns that are needed by at least one destination
+                needed = set()
+                for w in table_writers:
+                    needed.update(w.column_names(table))
+                skip_cols = [col.name for col in table.columns if col.name not in needed]
+                reader = TableReadThread(self, table, chunksize=chunksize, skip_columns=skip_cols, raw=True)
+                read_names = [col.name for col in reader.columns]
+
+                fanout = []
+                for w in table_writers:
+                    names = w.column_names(table)
+                    fanout.append((w, [(name, read_names.index(name)) for name in names]))
+                    w.put('begin', table_name, None)
+
+                n_rows = 0
+                for recs in reader.iter_chunks():
+                    if len(recs) == 0:
+                        continue
+                    for w, cols in fanout:
+                        w.put('rows', table_name, [{name: rec[i] for name, i in cols} for rec in recs])
+                    n_rows += len(recs)
+                    print("%d/%d   %0.2f%%\r" % (n_rows, reader.max_id, (100.0 * n_rows / max(reader.max_id, 1))), end="")
+                    sys.stdout.flush()
+
+                for w in table_writers:
+                    w.put('commit', table_name, None)
+                print("   queued %d rows..                    " % n_rows)
+
+            print("Building indexes..")
+            for w in writers:
+                w.finish()
+            print("All finished!")
+        except Exception:
+            # stop all writers and delete any files that were not completely written
+            for w in writers:
+                if w.is_alive():
+                    w.queue.put(('abort',))
+            for w in writers:
+                w.join()
+                w.engine.dispose()
+                if not w.complete and os.path.exists(w.sqlite_file):
+                    os.remove(w.sqlite_file)
+            raise
+
+    def export_snapshot(self, path, **kwds):
+        """Export a columnar (Parquet) snapshot of this database to the directory *path*.
+
+        See :func:`aisynphys.database.snapshot.export_snapshot` for arguments.
+        """
+        from .snapshot import export_snapshot
+        return export_snapshot(self, path, **kwds)
+
     def clone_database(self, dest_db_name=None, dest_db=None, overwrite=False, **kwds):
         """Copy this database to a new one.
         """
@@ -784,6 +960,22 @@ class DBQuery(sqlalchemy.orm.Query):
 
         return arr
 
+    def structured_array(self, dtype):
+        """Return the results of this query as a numpy structured array with the given *dtype*.
+
+        Unlike recarray(), rows are fetched directly from the cursor without constructing ORM results,
+        and each field is converted in a single step (see rows_to_structured_array). The query must
+        select individual columns; each field in *dtype* is filled from the result column with the
+        same name (use ``column.label(name)`` where needed).
+        """
+        result = self.session.execute(self.statement)
+        try:
+            keys = list(result.keys())
+            rows = result.fetchall()
+        finally:
+            result.close()
+        return rows_to_structured_array(rows, dtype, keys=keys)
+
     def _prepare_array(self, expand_tables):
         recs = self.all()
         row_types = (tuple,)
@@ -897,12 +1089,72 @@ class DBQuery(sqlalchemy.orm.Query):
         return column_expr.type.python_type
 
 
+def rows_to_structured_array(rows, dtype, keys=None):
+    """Convert a sequence of result rows to a numpy structured array.
+
+    Rows are transposed once and every field is converted column-wise according to its dtype kind.
+    NULL values become NaN in float fields, 0 in integer fields, and False in bool fields; object and
+    other fields receive values unchanged.
+
+    Parameters
+    ----------
+    rows : list
+        Sequence of tuples (or result rows)
+    dtype : numpy dtype or list
+        Structured dtype of the output array
+    keys : list | None
+        Column names of *rows*. If given, fields are matched to columns by name; otherwise the
+        fields of *dtype* must be in the same order as the columns of *rows*.
+    """
+    dtype = np.dtype(dtype)
+    arr = np.empty(len(rows), dtype=dtype)
+    if len(rows) == 0:
+        return arr
+    columns = list(zip(*rows))
+    for i, name in enumerate(dtype.names):
+        col = columns[i if keys is None else keys.index(name)]
+        field_type = dtype.fields[name][0]
+        if field_type.kind == 'f':
+            # float conversion maps None to NaN
+            arr[name] = np.array(col, dtype=float)
+        elif field_type.kind in 'iub':
+            values = np.array(col, dtype=object)
+            values[np.equal(values, None)] = 0
+            arr[name] = values.astype(field_type)
+        elif field_type.kind == 'O':
+            values = np.empty(len(col), dtype=object)
+            try:
+                values[:] = col
+            except ValueError:
+                # sequence values (eg. list columns) confuse numpy broadcasting
+                for j, v in enumerate(col):
+                    values[j] = v
+            arr[name] = values
+        else:
+            arr[name] = col
+    return arr
+
+
+def _raw_column_type(col_type):
+    """Return the storage type for NDArray / JSONObject columns (so that values can be copied
+    between databases without being decoded and re-encoded), or *col_type* for other columns.
+    """
+    if isinstance(col_type, NDArray):
+        return LargeBinary()
+    if isinstance(col_type, JSONObject):
+        return String()
+    return col_type
+
+
 class TableReadThread(threading.Thread):
     """Iterator that yields records (all columns) from a table.
     
     Records are queried chunkwise and queued in a background thread to enable more efficient streaming.
+
+    If *raw* is True, array and JSON columns are returned as their stored bytes / text rather
+    than being decoded.
     """
-    def __init__(self, db, table, chunksize=1000, skip_columns=()):
+    def __init__(self, db, table, chunksize=1000, skip_columns=(), raw=False):
         threading.Thread.__init__(self)
         self.daemon = True
         
@@ -910,6 +1162,8 @@ class TableReadThread(threading.Thread):
         self.table = table
         self.chunksize = chunksize
         self.skip_columns = skip_columns
+        self.raw = raw
+        self.columns = [col for col in table.columns if col.name not in skip_columns]
         self.queue = queue.Queue(maxsize=5)
         self.max_id = db.session().query(func.max(table.columns['id'])).all()[0][0] or 0
         self.start()
@@ -919,8 +1173,10 @@ class TableReadThread(threading.Thread):
             session = self.db.session()
             table = self.table
             chunksize = self.chunksize
-            all_columns = [col for col in table.columns if col.name not in self.skip_columns]
-            for i in range(0, self.max_id, chunksize):
+            all_columns = self.columns
+            if self.raw:
+                all_columns = [type_coerce(col, _raw_column_type(col.type)).label(col.name) for col in all_columns]
+            for i in range(0, self.max_id + 1, chunksize):
                 query = session.query(*all_columns).filter((table.columns['id'] >= i) & (table.columns['id'] < i+chunksize))
                 records = query.all()
                 self.queue.put(records)
@@ -932,12 +1188,107 @@ class TableReadThread(threading.Thread):
             self.queue.put(exc)
             raise
     
-    def __iter__(self):
+    def iter_chunks(self):
+        """Yield lists of records, one list per chunk.
+        """
         while True:
             recs = self.queue.get()
             if recs is None:
                 break
             if isinstance(recs, Exception):
                 raise recs
+            yield recs
+
+    def __iter__(self):
+        for recs in self.iter_chunks():
             for rec in recs:
                 yield rec
+
+
+class SqliteBakeWriter(threading.Thread):
+    """Writes tables to a new sqlite file in a background thread.
+
+    Used by Database.bake_sqlite_multi: rows that are read once from the source database are
+    passed to one writer per destination file, and each writer drops the tables and columns that
+    its destination skips. Tables are created without indexes; indexes are built and ANALYZE is run
+    after all rows have been written.
+    """
+    def __init__(self, sqlite_file, metadata_tables, skip_tables=(), skip_columns={}):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.sqlite_file = sqlite_file
+        self.metadata_tables = metadata_tables
+        self.skip_tables = set(skip_tables)
+        self.skip_columns = skip_columns
+        self.queue = queue.Queue(maxsize=5)
+        self.exc = None
+        # set after all rows, indexes, and ANALYZE have been written
+        self.complete = False
+        self.engine = create_engine('sqlite:///' + sqlite_file, poolclass=sqlalchemy.pool.NullPool)
+        self.start()
+
+    def copies_table(self, table_name):
+        return table_name not in self.skip_tables
+
+    def column_names(self, table):
+        """Names of the columns in *table* that are written to this destination.
+        """
+        skip = self.skip_columns.get(table.name, ())
+        return [col.name for col in table.columns if col.name not in skip]
+
+    def put(self, *msg):
+        if self.exc is not None:
+            raise Exception("Error writing to %s" % self.sqlite_file) from self.exc
+        self.queue.put(msg)
+
+    def finish(self):
+        """Wait for all queued rows, indexes, and ANALYZE to complete.
+        """
+        self.put(None)
+        self.join()
+        self.engine.dispose()
+        if self.exc is not None:
+            raise Exception("Error writing to %s" % self.sqlite_file) from self.exc
+
+    def run(self):
+        finished = False
+        try:
+            with self.engine.connect() as conn:
+                # the file is deleted by bake_sqlite_multi if baking fails, so durability is not needed while writing
+                conn.execute('PRAGMA journal_mode=OFF')
+                conn.execute('PRAGMA synchronous=OFF')
+                for table in self.metadata_tables.values():
+                    conn.execute(sqlalchemy.schema.CreateTable(table))
+
+                while True:
+                    msg = self.queue.get()
+                    if msg == (None,):
+                        finished = True
+                        break
+                    if msg == ('abort',):
+                        return
+                    cmd, table_name, rows = msg
+                    if cmd == 'begin':
+                        table = self.metadata_tables[table_name]
+                        names = self.column_names(table)
+                        raw_table = sqlalchemy.Table(table_name, sqlalchemy.MetaData(),
+                            *[Column(col.name, _raw_column_type(col.type)) for col in table.columns if col.name in names])
+                        insert = raw_table.insert()
+                        trans = conn.begin()
+                    elif cmd == 'rows':
+                        conn.execute(insert, rows)
+                    elif cmd == 'commit':
+                        trans.commit()
+
+                for table in self.metadata_tables.values():
+                    for index in table.indexes:
+                        index.create(bind=conn)
+                conn.execute('ANALYZE')
+            self.complete = True
+        except Exception as exc:
+            sys.excepthook(*sys.exc_info())
+            self.exc = exc
+            # keep consuming so that the reader is never blocked by a failed writer
+            while not finished and self.queue.get() not in [(None,), ('abort',)]:
+                pass
@@ -1,12 +1,15 @@
 from collections import OrderedDict
 import numpy as np
-from neuroanalysis.data import TSeries
-from neuroanalysis.stimuli import Stimulus
 from sqlalchemy.orm import relationship
+from ...util.lazy_import import lazy_import
 from . import make_table
 from .experiment import Experiment, Electrode, Pair, Cell
 from . import default_sample_rate, sample_rate_str
 
+# neuroanalysis pulls in scipy / numba; defer these until recorded data is actually accessed
+neuroanalysis_data = lazy_import('neuroanalysis.data')
+neuroanalysis_stimuli = lazy_import('neuroanalysis.stimuli')
+
 __all__ = ['SyncRec', 'Recording', 'PatchClampRecording', 'MultiPatchProbe', 'TestPulse', 'StimPulse', 'StimSpike', 'PulseResponse', 'Baseline']
 
 
@@ -37,7 +40,7 @@ class RecordingBase:
         """
         if self.stim_meta is None:
             return None
-        return Stimulus.load(self.stim_meta)
+        return neuroanalysis_stimuli.Stimulus.load(self.stim_meta)
 
 
 Recording = make_table(
@@ -130,7 +133,7 @@ class StimPulseBase(object):
     @property
     def recorded_tseries(self):
         if self._rec_tseries is None:
-            self._rec_tseries = TSeries(self.data, sample_rate=default_sample_rate, t0=self.data_start_time)
+            self._rec_tseries = neuroanalysis_data.TSeries(self.data, sample_rate=default_sample_rate, t0=self.data_start_time)
         return self._rec_tseries
 
     @property
@@ -199,7 +202,7 @@ class PulseResponseBase(object):
     @property
     def post_tseries(self):
         if self._post_tseries is None:
-            self._post_tseries = TSeries(self.data, sample_rate=default_sample_rate, t0=self.data_start_time)
+            self._post_tseries = neuroanalysis_data.TSeries(self.data, sample_rate=default_sample_rate, t0=self.data_start_time)
         return self._post_tseries
 
     @property
@@ -215,7 +218,7 @@ class PulseResponseBase(object):
         bl = self.baseline
         if bl is None:
             return None
-        return TSeries(bl.data, sample_rate=default_sample_rate, t0=bl.data_start_time)
+        return neuroanalysis_data.TSeries(bl.data, sample_rate=default_sample_rate, t0=bl.data_start_time)
 
     def get_tseries(self, ts_type, align_to):
         """Return the pre-, post-, or stimulus TSeries, time aligned to either the spike or the stimulus onset.
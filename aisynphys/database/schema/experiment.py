@@ -1,12 +1,24 @@
 import os
 from collections import OrderedDict
+import sqlalchemy.event
 from sqlalchemy.orm import relationship, deferred, sessionmaker, aliased
 from ... import config, constants, synphys_cache
 from . import make_table
 from .slice import Slice
 
 
-__all__ = ['Experiment', 'Electrode', 'Cell', 'Pair']
+__all__ = ['Experiment', 'Electrode', 'Cell', 'Pair', 'acq_timestamp_key']
+
+
+def acq_timestamp_key(ts):
+    """Return the integer lookup key for an acquisition timestamp (timestamp rounded to 10 ms).
+
+    Two timestamps that differ by less than 10 ms have keys that differ by at most 1.
+    *ts* may be a number or a string (such as an experiment ext_id / pipeline job ID).
+    """
+    if ts is None:
+        return None
+    return int(round(float(ts) * 100))
 
 
 class ExperimentBase(object):
@@ -89,9 +101,16 @@ Experiment = make_table(
         ('storage_path', 'str', 'Location of data within server or cache storage.'),
         ('ephys_file', 'str', 'Name of ephys NWB file relative to storage_path.'),
         ('acq_timestamp', 'float', 'Creation timestamp for site data acquisition folder.', {'unique': True, 'index': True}),
+        ('acq_timestamp_key', 'int', 'acq_timestamp rounded to 10 ms; used for tolerant timestamp lookups. '
+                                     'Set automatically when acq_timestamp is assigned.', {'index': True}),
     ]
 )
 
+
+@sqlalchemy.event.listens_for(Experiment.acq_timestamp, 'set')
+def _set_acq_timestamp_key(target, value, oldvalue, initiator):
+    target.acq_timestamp_key = acq_timestamp_key(value)
+
 Slice.experiments = relationship(Experiment, order_by=Experiment.id, back_populates="slice", cascade='save-update,merge,delete')
 Experiment.slice = relationship(Slice, back_populates="experiments")
 
@@ -226,6 +245,11 @@ Pair = make_table(
         ('crosstalk_artifact', 'float', 'Amplitude of crosstalk artifact measured in current clamp'),
         ('n_ex_test_spikes', 'int', 'Number of QC-passed spike-responses recorded for this pair at excitatory holding potential', {'index': True}),
         ('n_in_test_spikes', 'int', 'Number of QC-passed spike-responses recorded for this pair at inhibitory holding potential', {'index': True}),
+        ('n_ex_test_spikes_ic', 'int', 'Number of QC-passed current clamp spike-responses recorded for this pair at excitatory holding potential', {'index': True}),
+        ('n_ex_test_spikes_vc', 'int', 'Number of QC-passed voltage clamp spike-responses recorded for this pair at excitatory holding potential', {'index': True}),
+        ('n_in_test_spikes_ic', 'int', 'Number of QC-passed current clamp spike-responses recorded for this pair at inhibitory holding potential', {'index': True}),
+        ('n_in_test_spikes_vc', 'int', 'Number of QC-passed voltage clamp spike-responses recorded for this pair at inhibitory holding potential', {'index': True}),
+        ('gap_junction_probed', 'bool', 'Whether long-pulse (TargetV) stimuli were recorded on both cells, allowing gap junctions to be detected', {'index': True}),
         ('distance', 'float', 'Distance between somas (in m)'),
         ('lateral_distance', 'float', 'Distance between somas perpendicular to the pia-wm axis (in m)'),
         ('vertical_distance', 'float', 'Distance between somas along the pia-wm axis (in m)'),
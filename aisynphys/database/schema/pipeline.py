@@ -1,7 +1,7 @@
 from collections import OrderedDict
 from . import make_table
 
-__all__ = ['Pipeline']
+__all__ = ['Pipeline', 'PipelineJobMetrics', 'PipelineRunLedger']
 
 
 Pipeline = make_table(
@@ -13,5 +13,47 @@ Pipeline = make_table(
         ('finish_time', 'datetime', 'The date/time when this job completed processing'),
         ('success', 'bool', 'Whether the job completed successfully', {'index': True}),
         ('error', 'str', 'Error or warning messages generated during job processing'),
+        ('input_hash', 'str', 'Content fingerprint of the inputs consumed by this job (used to detect stale results)'),
+        ('output_hash', 'str', 'Content fingerprint of the records written by this job'),
+    ]
+)
+
+
+PipelineJobMetrics = make_table(
+    name='pipeline_job_metrics',
+    comment="Resource usage recorded for each pipeline job that was run. Unlike the pipeline table, records are kept for every run so that runs can be compared.",
+    columns=[
+        ('module_name', 'str', 'The name of the pipeline module that ran this job', {'index': True}),
+        ('job_id', 'str', 'Unique value identifying the job that was processed', {'index': True}),
+        ('run_id', 'str', 'Identifies the pipeline update that ran this job (all jobs from one update share the same run_id)', {'index': True}),
+        ('start_time', 'datetime', 'The date/time when this job started processing'),
+        ('success', 'bool', 'Whether the job completed successfully'),
+        ('wall_time', 'float', 'Elapsed wall-clock time (s)'),
+        ('cpu_time', 'float', 'CPU time used by the job process (s)'),
+        ('db_time', 'float', 'Time spent waiting on database statements (s)'),
+        ('peak_rss', 'int', 'Peak resident memory of the job process (bytes); note this is the peak over the lifetime of the worker process'),
+        ('rows_written', 'object', 'Number of rows inserted or updated per table: {table_name: n_rows}'),
+    ]
+)
+
+
+PipelineRunLedger = make_table(
+    name='pipeline_run_ledger',
+    comment="Tracks the state of each pipeline job across updates so that interrupted updates can be resumed and repeatedly failing jobs can be retried with backoff.",
+    columns=[
+        ('module_name', 'str', 'The name of the pipeline module that runs this job', {'index': True}),
+        ('job_id', 'str', 'Unique value identifying the job', {'index': True}),
+        ('run_id', 'str', 'Identifies the pipeline update that most recently planned this job', {'index': True}),
+        ('state', 'str', 'Job state: "planned", "running", "done", or "failed"', {'index': True}),
+        ('input_hash', 'str', 'Content fingerprint of the job inputs when it was planned'),
+        ('attempts', 'int', 'Number of times this job has been run with its current inputs'),
+        ('repeat_failures', 'int', 'Number of consecutive failures with the same error fingerprint'),
+        ('error_fingerprint', 'str', 'Identifies the class of the most recent error (see aisynphys.pipeline.ledger.error_fingerprint)', {'index': True}),
+        ('plan_time', 'datetime', 'The date/time when this job was last planned'),
+        ('start_time', 'datetime', 'The date/time when this job last started'),
+        ('host', 'str', 'Name of the host running this job (set when the job starts)'),
+        ('pid', 'int', 'ID of the process running this job (set when the job starts)'),
+        ('finish_time', 'datetime', 'The date/time when this job last finished'),
+        ('next_attempt_time', 'datetime', 'Failed jobs with unchanged inputs are not retried before this time'),
     ]
 )
@@ -0,0 +1,434 @@
+"""
+Columnar (Parquet) snapshots of a database.
+
+A snapshot is a directory written alongside an sqlite release that holds the same data in a
+form that is much faster to load for whole-dataset analyses:
+
+* one Parquet file per table containing all scalar columns (JSON object columns are stored as text)
+* one Parquet file per array / deferred column, holding (id, data) rows in chunks of
+  *blob_chunk_size* so that a subset of records can be read without touching the rest
+* pre-joined summary tables (for example pair_summary, which combines pair, cell, synapse,
+  experiment and slice columns) so that common analyses need no joins at all
+* a ``snapshot.json`` manifest recording the snapshot format and database schema versions
+
+Snapshots are read with :class:`Snapshot`, which supports column projection and predicate pushdown::
+
+    snap = db.load_snapshot()
+    pairs = snap.load('pair_summary', columns=['pre_cell_class', 'post_cell_class', 'has_synapse', 'distance'],
+                      filters=[('slice_species', '==', 'mouse')])
+
+Requires pyarrow.
+"""
+import os, io, json, shutil, datetime
+from collections import OrderedDict
+import numpy as np
+import sqlalchemy
+from sqlalchemy import LargeBinary, String
+from sqlalchemy.sql.expression import type_coerce
+from ..util.lazy_import import lazy_import
+from .database import NDArray, JSONObject, FloatType
+pd = lazy_import('pandas')
+pa = lazy_import('pyarrow')
+pq = lazy_import('pyarrow.parquet')
+
+
+# incremented whenever the on-disk layout of snapshots changes
+snapshot_format_version = 1
+manifest_file = 'snapshot.json'
+
+
+def default_snapshot_path(sqlite_file):
+    """Return the default location of the snapshot exported alongside *sqlite_file*.
+    """
+    return os.path.splitext(sqlite_file)[0] + '.snapshot'
+
+
+def _arrow_type(col_type):
+    """Return the arrow type used to store a scalar column, or None if the column is not scalar.
+    """
+    if isinstance(col_type, (NDArray, JSONObject)):
+        return None
+    if isinstance(col_type, FloatType):
+        return pa.float64()
+    for sa_type, arrow_type in [
+            (sqlalchemy.Boolean, pa.bool_),
+            (sqlalchemy.Integer, pa.int64),   # also covers BigInteger
+            (sqlalchemy.Float, pa.float64),
+            (sqlalchemy.DateTime, lambda: pa.timestamp('us')),
+            (sqlalchemy.Date, pa.date32),
+            (sqlalchemy.String, pa.string),
+        ]:
+        if isinstance(col_type, sa_type):
+            return arrow_type()
+    raise TypeError("Cannot store column type %r in a snapshot" % col_type)
+
+
+def _deferred_columns(db, table_name):
+    mapping = db.orm_tables().get(table_name)
+    if mapping is None:
+        return set()
+    return {attr.key for attr in sqlalchemy.inspect(mapping).column_attrs if attr.deferred}
+
+
+def _table_layout(db, table, skip_columns=()):
+    """Split the columns of *table* into scalar columns (stored in the table file) and
+    blob columns (stored in separate chunked files).
+
+    Returns (scalar, blobs) where scalar is a list of (column, arrow_type, kind) and blobs is a
+    list of (column, kind). *kind* is 'array', 'object', or None.
+    """
+    deferred = _deferred_columns(db, table.name)
+    scalar, blobs = [], []
+    for col in table.columns:
+        if col.name in skip_columns:
+            continue
+        if isinstance(col.type, NDArray):
+            blobs.append((col, 'array'))
+        elif isinstance(col.type, JSONObject):
+            if col.name in deferred:
+                blobs.append((col, 'object'))
+            else:
+                scalar.append((col, pa.string(), 'object'))
+        elif col.name in deferred:
+            blobs.append((col, None))
+        else:
+            scalar.append((col, _arrow_type(col.type), None))
+    return scalar, blobs
+
+
+def _select_raw(col, kind):
+    # read JSON / array columns without decoding them; they are written to the snapshot as stored
+    if kind == 'object':
+        return type_coerce(col, String).label(col.name)
+    if kind == 'array':
+        return type_coerce(col, LargeBinary).label(col.name)
+    return col
+
+
+def _iter_chunks(db, columns, id_column, chunk_size):
+    """Yield lists of rows selected from *columns*, ordered by *id_column*.
+    """
+    query = sqlalchemy.select(columns).order_by(id_column)
+    with db.ro_engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(query)
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if len(rows) == 0:
+                break
+            yield rows
+
+
+def _write_table_file(db, table, scalar, filename, chunk_size):
+    schema = pa.schema([pa.field(col.name, arrow_type) for col, arrow_type, kind in scalar])
+    columns = [_select_raw(col, kind) for col, arrow_type, kind in scalar]
+    n_rows = 0
+    with pq.ParquetWriter(filename, schema) as writer:
+        for rows in _iter_chunks(db, columns, table.columns['id'], chunk_size):
+            arrays = [pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            n_rows += len(rows)
+        if n_rows == 0:
+            writer.write_table(schema.empty_table())
+    return n_rows
+
+
+def _write_blob_file(db, table, col, kind, filename, chunk_size):
+    if kind == 'array':
+        data_type = pa.binary()
+    elif kind == 'object':
+        data_type = pa.string()
+    else:
+        data_type = _arrow_type(col.type)
+    schema = pa.schema([pa.field('id', pa.int64()), pa.field('data', data_type)])
+    columns = [table.columns['id'], _select_raw(col, kind)]
+    n_rows = 0
+    with pq.ParquetWriter(filename, schema) as writer:
+        for rows in _iter_chunks(db, columns, table.columns['id'], chunk_size):
+            # NDArray stores None as an empty string
+            rows = [row for row in rows if row[1] is not None and row[1] != b'']
+            if len(rows) == 0:
+                continue
+            ids = pa.array([row[0] for row in rows], type=pa.int64())
+            data = pa.array([row[1] for row in rows], type=data_type)
+            writer.write_table(pa.Table.from_arrays([ids, data], schema=schema))
+            n_rows += len(rows)
+        if n_rows == 0:
+            writer.write_table(schema.empty_table())
+    return n_rows
+
+
+def export_snapshot(db, path, tables=None, skip_tables=(), skip_columns={}, summaries=None,
+                    schema_version=None, overwrite=False, chunk_size=100000, blob_chunk_size=1000):
+    """Export the contents of *db* to a columnar snapshot directory at *path*.
+
+    Parameters
+    ----------
+    db : Database
+        The database to export
+    path : str
+        Directory to write. The snapshot is written to a temporary directory first and moved
+        into place when complete.
+    tables : list | None
+        Names of tables to export (default is all tables present in the database)
+    skip_tables : list
+        Names of tables to exclude
+    skip_columns : dict
+        {table_name: [column_names]} of columns to exclude
+    summaries : dict | None
+        {name: function} of pre-joined summary tables to write. Each function is called with
+        the partially written :class:`Snapshot` and must return a DataFrame (or None to skip).
+    schema_version : str | None
+        Database schema version recorded in the manifest
+    chunk_size : int
+        Number of rows read per query and written per Parquet row group in table files
+    blob_chunk_size : int
+        Number of records per row group in array / deferred column files
+    """
+    if os.path.exists(path):
+        if not overwrite:
+            raise Exception("Snapshot %s already exists" % path)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    manifest = OrderedDict([
+        ('format_version', snapshot_format_version),
+        ('schema_version', schema_version),
+        ('source', os.path.split(db.db_name)[-1]),
+        ('creation_date', datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+        ('tables', OrderedDict()),
+        ('blobs', OrderedDict()),
+        ('summaries', OrderedDict()),
+    ])
+
+    existing_tables = set(db.table_names())
+    for table_name, table in db.metadata_tables().items():
+        if table_name not in existing_tables or table_name in skip_tables:
+            continue
+        if tables is not None and table_name not in tables:
+            continue
+        print("Exporting %s.." % table_name)
+        scalar, blobs = _table_layout(db, table, skip_columns.get(table_name, ()))
+
+        filename = table_name + '.parquet'
+        n_rows = _write_table_file(db, table, scalar, os.path.join(tmp_path, filename), chunk_size)
+        manifest['tables'][table_name] = OrderedDict([
+            ('file', filename),
+            ('n_rows', n_rows),
+            ('object_columns', [col.name for col, arrow_type, kind in scalar if kind == 'object']),
+        ])
+
+        for col, kind in blobs:
+            key = table_name + '.' + col.name
+            filename = key + '.parquet'
+            n_rows = _write_blob_file(db, table, col, kind, os.path.join(tmp_path, filename), blob_chunk_size)
+            manifest['blobs'][key] = OrderedDict([('file', filename), ('kind', kind), ('n_rows', n_rows)])
+
+    # summaries are built from the table files that were just written
+    _write_manifest(tmp_path, manifest)
+    for name, fn in (summaries or {}).items():
+        frame = fn(Snapshot(tmp_path))
+        if frame is None:
+            continue
+        print("Writing summary %s.." % name)
+        filename = name + '.parquet'
+        frame.to_parquet(os.path.join(tmp_path, filename), index=False, row_group_size=chunk_size)
+        manifest['summaries'][name] = OrderedDict([('file', filename), ('n_rows', len(frame))])
+    _write_manifest(tmp_path, manifest)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    return Snapshot(path)
+
+
+def _write_manifest(path, manifest):
+    with open(os.path.join(path, manifest_file), 'w') as fh:
+        json.dump(manifest, fh, indent=2)
+
+
+class Snapshot(object):
+    """Read-only access to a columnar snapshot written by :func:`export_snapshot`.
+
+    Tables and summary tables are loaded with :meth:`load`; array and deferred columns are
+    loaded separately with :meth:`load_blobs`.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, manifest_file), 'r') as fh:
+            self.manifest = json.load(fh)
+        if self.manifest['format_version'] != snapshot_format_version:
+            raise Exception("Snapshot %s has unsupported format version %s (expected %s)" % (
+                path, self.manifest['format_version'], snapshot_format_version))
+
+    def __repr__(self):
+        return "<Snapshot %s (schema %s)>" % (self.path, self.schema_version)
+
+    @property
+    def schema_version(self):
+        return self.manifest['schema_version']
+
+    @property
+    def tables(self):
+        """Names of all tables and summary tables in this snapshot.
+        """
+        return list(self.manifest['tables'].keys()) + list(self.manifest['summaries'].keys())
+
+    def _table_info(self, table):
+        for group in ('tables', 'summaries'):
+            if table in self.manifest[group]:
+                return self.manifest[group][table]
+        raise KeyError("No table named %r in snapshot %s" % (table, self.path))
+
+    def __contains__(self, table):
+        return table in self.manifest['tables'] or table in self.manifest['summaries']
+
+    def columns(self, table):
+        """Return the names of the columns stored for *table* (excluding blob columns).
+        """
+        return pq.read_schema(os.path.join(self.path, self._table_info(table)['file'])).names
+
+    def blob_columns(self, table):
+        """Return the names of array / deferred columns stored separately for *table*.
+        """
+        prefix = table + '.'
+        return [key[len(prefix):] for key in self.manifest['blobs'] if key.startswith(prefix)]
+
+    def read(self, table, columns=None, filters=None):
+        """Read a table as a pyarrow Table.
+
+        Parameters
+        ----------
+        table : str
+            Name of a table or summary table
+        columns : list | None
+            Names of columns to read; other columns are never read from disk
+        filters : list | pyarrow.compute.Expression | None
+            Row filters in the format accepted by ``pyarrow.parquet.read_table``, for example
+            ``[('cell_class', '==', 'ex'), ('depth', '>', 50e-6)]``. Row groups that cannot
+            match are skipped using the statistics stored in the file.
+        """
+        filename = os.path.join(self.path, self._table_info(table)['file'])
+        return pq.read_table(filename, columns=columns, filters=filters)
+
+    def load(self, table, columns=None, filters=None, decode_objects=True):
+        """Load a table as a pandas DataFrame.
+
+        Accepts the same arguments as :meth:`read`. If *decode_objects* is True, JSON object
+        columns are decoded into python objects.
+        """
+        frame = self.read(table, columns=columns, filters=filters).to_pandas()
+        if decode_objects and table in self.manifest['tables']:
+            for col in self.manifest['tables'][table]['object_columns']:
+                if col in frame.columns:
+                    frame[col] = [None if v is None else json.loads(v) for v in frame[col]]
+        return frame
+
+    def load_blobs(self, table, column, ids=None):
+        """Load an array or deferred column.
+
+        Parameters
+        ----------
+        table : str
+            Name of the table
+        column : str
+            Name of the column (see :meth:`blob_columns`)
+        ids : list | None
+            Record ids to load (default loads all). Only chunks that contain the requested
+            ids are read.
+
+        Returns
+        -------
+        values : dict
+            {id: value} for all requested records that have a value
+        """
+        info = self.manifest['blobs'][table + '.' + column]
+        filters = None if ids is None else [('id', 'in', [int(i) for i in ids])]
+        data = pq.read_table(os.path.join(self.path, info['file']), filters=filters)
+        ids = data.column('id').to_pylist()
+        values = data.column('data').to_pylist()
+        if info['kind'] == 'array':
+            values = [np.load(io.BytesIO(v), allow_pickle=False) for v in values]
+        elif info['kind'] == 'object':
+            values = [json.loads(v) for v in values]
+        return dict(zip(ids, values))
+
+
+def _prefixed(frame, prefix, keep=()):
+    return frame.rename(columns={c: prefix + c for c in frame.columns if c not in keep})
+
+
+def _scalar_columns(snap, table, exclude=('meta',)):
+    return [c for c in snap.columns(table) if c not in exclude and c not in snap.manifest['tables'][table]['object_columns']]
+
+
+def _load_prefixed(snap, table, prefix, key):
+    """Load the scalar columns of *table*, prefixing all column names except *key*.
+    """
+    cols = _scalar_columns(snap, table)
+    frame = snap.load(table, columns=cols)
+    if key != 'id':
+        frame = frame.drop(columns=['id'])
+    return _prefixed(frame, prefix, keep=(key,))
+
+
+def cell_summary(snap):
+    """One row per cell, joined with its experiment, slice, and all per-cell result tables.
+    """
+    if 'cell' not in snap:
+        return None
+    cells = snap.load('cell', columns=_scalar_columns(snap, 'cell'))
+    if 'experiment' in snap:
+        expts = _load_prefixed(snap, 'experiment', 'experiment_', 'id').rename(columns={'id': 'experiment_id'})
+        cells = cells.merge(expts, on='experiment_id', how='left')
+        if 'slice' in snap:
+            slices = _load_prefixed(snap, 'slice', 'slice_', 'id').rename(columns={'id': 'experiment_slice_id'})
+            cells = cells.merge(slices, on='experiment_slice_id', how='left')
+    for table in ('intrinsic', 'morphology', 'cortical_cell_location', 'patch_seq'):
+        if table in snap:
+            cells = cells.merge(_load_prefixed(snap, table, table + '_', 'cell_id').rename(columns={'cell_id': 'id'}), on='id', how='left')
+    return cells
+
+
+def pair_summary(snap):
+    """One row per pair, joined with experiment and slice columns, pre_ / post_ cell columns,
+    and synapse_ columns.
+    """
+    if 'pair' not in snap or 'cell' not in snap:
+        return None
+    pairs = snap.load('pair', columns=_scalar_columns(snap, 'pair'))
+    cells = snap.load('cell', columns=_scalar_columns(snap, 'cell')).drop(columns=['experiment_id'])
+    for prefix in ('pre_', 'post_'):
+        pairs = pairs.merge(_prefixed(cells, prefix).rename(columns={prefix + 'id': prefix + 'cell_id'}), on=prefix + 'cell_id', how='left')
+    if 'experiment' in snap:
+        expts = _load_prefixed(snap, 'experiment', 'experiment_', 'id').rename(columns={'id': 'experiment_id'})
+        pairs = pairs.merge(expts, on='experiment_id', how='left')
+        if 'slice' in snap:
+            slices = _load_prefixed(snap, 'slice', 'slice_', 'id').rename(columns={'id': 'experiment_slice_id'})
+            pairs = pairs.merge(slices, on='experiment_slice_id', how='left')
+    if 'synapse' in snap:
+        synapses = _load_prefixed(snap, 'synapse', 'synapse_', 'pair_id').rename(columns={'pair_id': 'id'})
+        pairs = pairs.merge(synapses, on='id', how='left')
+    return pairs
+
+
+def synapse_summary(snap):
+    """One row per synapse, joined with pair, dynamics and synapse_model columns.
+    """
+    if 'synapse' not in snap or 'pair' not in snap:
+        return None
+    synapses = snap.load('synapse', columns=_scalar_columns(snap, 'synapse'))
+    pairs = _load_prefixed(snap, 'pair', 'pair_', 'id').rename(columns={'id': 'pair_id'})
+    synapses = synapses.merge(pairs, on='pair_id', how='left')
+    for table in ('dynamics', 'synapse_model'):
+        if table in snap:
+            synapses = synapses.merge(_load_prefixed(snap, table, table + '_', 'pair_id'), on='pair_id', how='left')
+    return synapses
+
+
+synphys_summaries = OrderedDict([
+    ('cell_summary', cell_summary),
+    ('pair_summary', pair_summary),
+    ('synapse_summary', synapse_summary),
+])
@@ -1,11 +1,12 @@
 import datetime
 import os.path
 from sqlalchemy.orm import aliased, contains_eager, selectinload
-import pandas as pd
 from collections import OrderedDict
 from .database import Database
 from .schema import schema_version, default_sample_rate
 from ..synphys_cache import get_db_path, list_db_versions
+from ..util.lazy_import import lazy_import
+pd = lazy_import('pandas')
 
 
 class SynphysDatabase(Database):
@@ -174,29 +175,16 @@ class SynphysDatabase(Database):
         return slices[0]
 
     def experiment_from_timestamp(self, ts, session=None):
-        session = session or self.default_session
-        expts = session.query(self.Experiment).filter(self.Experiment.acq_timestamp==ts).all()
-        if len(expts) == 0:
-            # For backward compatibility, check for timestamp truncated to 2 decimal places
-            for expt in session.query(self.Experiment).all():
-                if abs((expt.acq_timestamp - ts)) < 0.01:
-                    return expt
-            
-            raise KeyError("No experiment found for timestamp %0.3f" % ts)
-        elif len(expts) > 1:
-            raise RuntimeError("Multiple experiments found for timestamp %0.3f" % ts)
-        
-        return expts[0]
+        expts = self.experiments_from_timestamps([ts], session=session)
+        if ts not in expts:
+            raise KeyError("No experiment found for timestamp %0.3f" % float(ts))
+        return expts[ts]
 
     def experiment_from_ext_id(self, ext_id, session=None):
-        session = session or self.default_session
-        expts = session.query(self.Experiment).filter(self.Experiment.ext_id==ext_id).all()
-        if len(expts) == 0:
+        expts = self.experiments_from_ext_ids([ext_id], session=session)
+        if ext_id not in expts:
             raise KeyError('No experiment found for ext_id %s' %ext_id)
-        elif len(expts) > 1:
-            raise RuntimeError("Multiple experiments found for ext_id %s" %ext_id)
-
-        return expts[0]
+        return expts[ext_id]
 
     def slice_from_ext_id(self, ext_id, session=None):
         session = session or self.default_session
@@ -209,14 +197,141 @@ class SynphysDatabase(Database):
         return slices[0]
 
     def pair_from_ext_id(self, ext_id, session=None):
-        session = session or self.default_session
-        expt = self.experiment_from_ext_id(ext_id[0], session=session)
-        return expt.pairs[ext_id[1], ext_id[2]]
+        ext_id = tuple(ext_id)
+        pairs = self.pairs_from_ext_ids([ext_id], session=session)
+        if ext_id not in pairs:
+            raise KeyError("No pair found for ext_id %r" % (ext_id,))
+        return pairs[ext_id]
     
     def cell_from_ext_id(self, ext_id, session=None):
+        ext_id = tuple(ext_id)
+        cells = self.cells_from_ext_ids([ext_id], session=session)
+        if ext_id not in cells:
+            raise KeyError("No cell found for ext_id %r" % (ext_id,))
+        return cells[ext_id]
+
+    # maximum number of values passed to a single IN clause (sqlite allows 999 bound parameters per statement)
+    resolver_chunk_size = 300
+
+    def _chunks(self, items):
+        items = list(items)
+        for i in range(0, len(items), self.resolver_chunk_size):
+            yield items[i:i+self.resolver_chunk_size]
+
+    def experiments_from_timestamps(self, timestamps, session=None):
+        """Return a dict mapping each acquisition timestamp to its Experiment.
+
+        Timestamps with no exact match are matched to an experiment whose timestamp differs by
+        less than 10 ms (older records store timestamps truncated to 2 decimal places). Candidates
+        are selected using the indexed acq_timestamp_key column, so resolving many timestamps
+        requires only one query per chunk of ids. Timestamps with no match are omitted from the result.
+
+        Timestamps may be given as numbers or strings (such as pipeline job IDs); the returned dict is
+        keyed by the values exactly as given.
+        """
+        from .schema import acq_timestamp_key
         session = session or self.default_session
-        expt = self.experiment_from_ext_id(ext_id[0], session=session)
-        return expt.cells[ext_id[1]]
+        timestamps = list(OrderedDict.fromkeys(timestamps))
+        keys = set()
+        for ts in timestamps:
+            key = acq_timestamp_key(ts)
+            keys.update([key-1, key, key+1])
+
+        candidates = {}
+        for chunk in self._chunks(sorted(keys)):
+            for expt in session.query(self.Experiment).filter(self.Experiment.acq_timestamp_key.in_(chunk)):
+                candidates.setdefault(expt.acq_timestamp_key, []).append(expt)
+
+        expts = OrderedDict()
+        for ts in timestamps:
+            ts_val = float(ts)
+            key = acq_timestamp_key(ts_val)
+            nearby = [e for k in (key-1, key, key+1) for e in candidates.get(k, [])]
+            exact = [e for e in nearby if e.acq_timestamp == ts_val]
+            if len(exact) > 1:
+                raise RuntimeError("Multiple experiments found for timestamp %0.3f" % ts_val)
+            elif len(exact) == 1:
+                expts[ts] = exact[0]
+                continue
+            # For backward compatibility, check for timestamp truncated to 2 decimal places
+            close = [e for e in nearby if abs(e.acq_timestamp - ts_val) < 0.01]
+            if len(close) > 0:
+                expts[ts] = min(close, key=lambda e: abs(e.acq_timestamp - ts_val))
+        return expts
+
+    def experiments_from_ext_ids(self, ext_ids, session=None):
+        """Return a dict mapping each experiment ext_id to its Experiment.
+
+        Ext_ids with no match are omitted from the result.
+        """
+        session = session or self.default_session
+        expts = OrderedDict()
+        for chunk in self._chunks(OrderedDict.fromkeys(ext_ids)):
+            for expt in session.query(self.Experiment).filter(self.Experiment.ext_id.in_(chunk)):
+                expts[expt.ext_id] = expt
+        return expts
+
+    def pairs_from_ext_ids(self, ext_ids, session=None):
+        """Return a dict mapping (expt_ext_id, pre_cell_ext_id, post_cell_ext_id) tuples to Pairs.
+
+        Pairs are loaded together with their experiment and pre/post cells in one joined query per chunk
+        of experiment ids. Ids with no match are omitted from the result.
+        """
+        session = session or self.default_session
+        ext_ids = [tuple(ext_id) for ext_id in ext_ids]
+        wanted = set(ext_ids)
+        pre_cell = aliased(self.Cell, name='pre_cell')
+        post_cell = aliased(self.Cell, name='post_cell')
+
+        found = {}
+        for chunk in self._chunks(OrderedDict.fromkeys(ext_id[0] for ext_id in ext_ids)):
+            cell_ids = set(str(ext_id[i]) for ext_id in ext_ids if ext_id[0] in chunk for i in (1, 2))
+            q = (session.query(self.Pair)
+                .join(self.Experiment, self.Pair.experiment_id==self.Experiment.id)
+                .join(pre_cell, self.Pair.pre_cell_id==pre_cell.id)
+                .join(post_cell, self.Pair.post_cell_id==post_cell.id)
+                .options(contains_eager(self.Pair.experiment), contains_eager(self.Pair.pre_cell, alias=pre_cell), contains_eager(self.Pair.post_cell, alias=post_cell))
+                .filter(self.Experiment.ext_id.in_(chunk))
+                .filter(pre_cell.ext_id.in_(cell_ids))
+                .filter(post_cell.ext_id.in_(cell_ids))
+            )
+            for pair in q:
+                found[(pair.experiment.ext_id, pair.pre_cell.ext_id, pair.post_cell.ext_id)] = pair
+
+        pairs = OrderedDict()
+        for ext_id in ext_ids:
+            key = (ext_id[0], str(ext_id[1]), str(ext_id[2]))
+            if key in found:
+                pairs[ext_id] = found[key]
+        return pairs
+
+    def cells_from_ext_ids(self, ext_ids, session=None):
+        """Return a dict mapping (expt_ext_id, cell_ext_id) tuples to Cells.
+
+        Cells are loaded together with their experiment in one joined query per chunk of experiment ids.
+        Ids with no match are omitted from the result.
+        """
+        session = session or self.default_session
+        ext_ids = [tuple(ext_id) for ext_id in ext_ids]
+
+        found = {}
+        for chunk in self._chunks(OrderedDict.fromkeys(ext_id[0] for ext_id in ext_ids)):
+            cell_ids = set(str(ext_id[1]) for ext_id in ext_ids if ext_id[0] in chunk)
+            q = (session.query(self.Cell)
+                .join(self.Experiment, self.Cell.experiment_id==self.Experiment.id)
+                .options(contains_eager(self.Cell.experiment))
+                .filter(self.Experiment.ext_id.in_(chunk))
+                .filter(self.Cell.ext_id.in_(cell_ids))
+            )
+            for cell in q:
+                found[(cell.experiment.ext_id, cell.ext_id)] = cell
+
+        cells = OrderedDict()
+        for ext_id in ext_ids:
+            key = (ext_id[0], str(ext_id[1]))
+            if key in found:
+                cells[ext_id] = found[key]
+        return cells
 
     def list_experiments(self, session=None):
         session = session or self.default_session
@@ -228,7 +343,7 @@ class SynphysDatabase(Database):
             self._project_names = [rec[0] for rec in session.query(self.Experiment.project_name).distinct().all()]
         return self._project_names
 
-    def pair_query(self, pre_class=None, post_class=None, synapse=None, synapse_type=None, synapse_probed=None, electrical=None,
+    def pair_query(self, pre_class=None, post_class=None, synapse=None, synapse_type=None, synapse_probed=None, electrical=None, electrical_probed=None,
                    experiment_type=None, project_name=None, acsf=None, age=None, species=None, distance=None, internal=None,
                    preload=(), session=None, filter_exprs=None):
         """Generate a query for selecting pairs from the database.
@@ -248,6 +363,9 @@ class SynphysDatabase(Database):
             of whether a connectin was found)
         electrical : bool | None
             Include only pairs that are (or are not) connected by an electrical synapse (gap junction)
+        electrical_probed : bool | None
+            If True, include only pairs that were probed for an electrical synapse (see
+            :func:`aisynphys.connectivity.pair_probed_gj`)
         experiment_type : str | None
             Include only data from specific types of experiments
         project_name : str | list | None
@@ -330,16 +448,15 @@ class SynphysDatabase(Database):
             query = query.filter(self.Synapse.synapse_type==synapse_type)
 
         if synapse_probed is True:
-            from ..connectivity import probed_pair_test_spike_limit
-            query = query.filter(
-                ((pre_cell.cell_class == 'ex') & (self.Pair.n_ex_test_spikes > probed_pair_test_spike_limit)) |
-                ((pre_cell.cell_class == 'in') & (self.Pair.n_in_test_spikes > probed_pair_test_spike_limit)) |
-                ((self.Pair.n_ex_test_spikes > probed_pair_test_spike_limit) & (self.Pair.n_in_test_spikes > probed_pair_test_spike_limit))
-            )
+            from ..connectivity import probed_pair_clause
+            query = query.filter(probed_pair_clause(self.Pair, pre_cell.cell_class))
 
         if electrical is not None:
             query = query.filter(self.Pair.has_electrical==electrical)
 
+        if electrical_probed is True:
+            query = query.filter(self.Pair.gap_junction_probed==True)
+
         if project_name is not None:
             names = [project_name] if isinstance(project_name, str) else project_name
             for name in names:
@@ -486,6 +603,37 @@ class SynphysDatabase(Database):
         
         return pairs
 
+    def export_snapshot(self, path=None, **kwds):
+        """Export a columnar (Parquet) snapshot of this database, including the pre-joined
+        cell_summary, pair_summary, and synapse_summary tables.
+
+        By default, the snapshot is written alongside the sqlite file for this database.
+        See :func:`aisynphys.database.snapshot.export_snapshot` for other arguments.
+        """
+        from .snapshot import export_snapshot, default_snapshot_path, synphys_summaries
+        if path is None:
+            if self.sqlite_file is None:
+                raise ValueError("Snapshot path must be given for databases that are not sqlite files")
+            path = default_snapshot_path(self.sqlite_file)
+        kwds.setdefault('summaries', synphys_summaries)
+        kwds.setdefault('schema_version', self.schema_version)
+        return export_snapshot(self, path, **kwds)
+
+    def load_snapshot(self, path=None, check_schema=True):
+        """Return a :class:`~aisynphys.database.snapshot.Snapshot` for fast columnar access to this database.
+
+        By default, the snapshot is loaded from alongside the sqlite file for this database.
+        """
+        from .snapshot import Snapshot, default_snapshot_path
+        if path is None:
+            if self.sqlite_file is None:
+                raise ValueError("Snapshot path must be given for databases that are not sqlite files")
+            path = default_snapshot_path(self.sqlite_file)
+        snap = Snapshot(path)
+        if check_schema and snap.schema_version != self.schema_version:
+            raise Exception("Snapshot %s has unsupported schema version %s (expected %s)" % (path, snap.schema_version, self.schema_version))
+        return snap
+
     def __getstate__(self):
         """Allows DB to be pickled and passed to subprocesses.
         """
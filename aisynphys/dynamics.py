@@ -72,8 +72,112 @@ def pulse_response_query(pair, qc_pass=False, clamp_mode=None, data=False, spike
     return q
 
 
-def generate_pair_dynamics(pair, db, session, pr_recs=None):
+# columns in the frames returned by experiment_pulse_response_frame() and pulse_response_frame()
+pulse_response_frame_columns = [
+    'pair_id', 'pulse_response_id', 'recording_id', 'clamp_mode', 'baseline_potential',
+    'access_adj_baseline_potential', 'induction_frequency', 'recovery_delay', 'pulse_number',
+    'previous_pulse_dt', 'n_spikes', 'first_spike_time', 'ex_qc_pass', 'in_qc_pass', 'has_fit',
+    'fit_amp', 'dec_fit_reconv_amp', 'baseline_dec_fit_reconv_amp', 'has_probe',
+]
+
+
+def experiment_pulse_response_frame(expt, db, session, clamp_mode=None, pair_ids=None):
+    """Return a DataFrame describing all pulse responses in an experiment, loaded in a single query.
+
+    Each row is one pulse response, with its fit amplitudes, holding potential, stimulus parameters,
+    and QC flags. Rows are ordered by pair, then recording start time and pulse onset time (the same
+    order as pulse_response_query).
+
+    Responses without a fit or without a multipatch probe record are included; the boolean
+    ``has_fit`` and ``has_probe`` columns indicate whether these records exist.
+
+    Parameters
+    ----------
+    expt : Experiment
+        The experiment whose pulse responses should be loaded
+    clamp_mode : str | None
+        If given, only responses recorded in this clamp mode ('ic' or 'vc') are returned
+    pair_ids : list | None
+        If given, only responses from these pairs are returned
+    """
+    q = session.query(
+        db.PulseResponse.pair_id,
+        db.PulseResponse.id.label('pulse_response_id'),
+        db.PulseResponse.recording_id,
+        db.PatchClampRecording.clamp_mode,
+        db.PatchClampRecording.baseline_potential,
+        db.PatchClampRecording.access_adj_baseline_potential,
+        db.MultiPatchProbe.induction_frequency,
+        db.MultiPatchProbe.recovery_delay,
+        db.StimPulse.pulse_number,
+        db.StimPulse.previous_pulse_dt,
+        db.StimPulse.n_spikes,
+        db.StimPulse.first_spike_time,
+        db.PulseResponse.ex_qc_pass,
+        db.PulseResponse.in_qc_pass,
+        db.PulseResponseFit.id.label('fit_id'),
+        db.PulseResponseFit.fit_amp,
+        db.PulseResponseFit.dec_fit_reconv_amp,
+        db.PulseResponseFit.baseline_dec_fit_reconv_amp,
+        db.MultiPatchProbe.id.label('probe_id'),
+    )
+    q = q.join(db.Pair, db.PulseResponse.pair)
+    q = q.join(db.StimPulse, db.PulseResponse.stim_pulse)
+    q = q.join(db.Recording, db.PulseResponse.recording)
+    q = q.join(db.PatchClampRecording, db.PatchClampRecording.recording_id==db.Recording.id)
+    q = q.outerjoin(db.MultiPatchProbe, db.MultiPatchProbe.patch_clamp_recording_id==db.PatchClampRecording.id)
+    q = q.outerjoin(db.PulseResponseFit, db.PulseResponseFit.pulse_response_id==db.PulseResponse.id)
+    q = q.filter(db.Pair.experiment_id==expt.id)
+    if pair_ids is not None:
+        q = q.filter(db.PulseResponse.pair_id.in_(list(pair_ids)))
+    if clamp_mode is not None:
+        q = q.filter(db.PatchClampRecording.clamp_mode==clamp_mode)
+    q = q.order_by(db.PulseResponse.pair_id, db.Recording.start_time, db.StimPulse.onset_time)
+
+    columns = [c['name'] for c in q.column_descriptions]
+    df = pd.DataFrame.from_records(q.all(), columns=columns)
+    df['has_fit'] = df.pop('fit_id').notna()
+    df['has_probe'] = df.pop('probe_id').notna()
+    return _normalize_pulse_response_frame(df)
+
+
+def pulse_response_frame(pr_recs):
+    """Return a DataFrame (with the same columns as experiment_pulse_response_frame) built from
+    rows returned by pulse_response_query().
+    """
+    rows = []
+    for rec in pr_recs:
+        pr, fit, sp, pcr = rec.PulseResponse, rec.PulseResponseFit, rec.StimPulse, rec.PatchClampRecording
+        rows.append((
+            pr.pair_id, pr.id, rec.Recording.id, pcr.clamp_mode, pcr.baseline_potential,
+            pcr.access_adj_baseline_potential, rec.MultiPatchProbe.induction_frequency, 
+            rec.MultiPatchProbe.recovery_delay, sp.pulse_number, sp.previous_pulse_dt, sp.n_spikes,
+            sp.first_spike_time, pr.ex_qc_pass, pr.in_qc_pass, fit is not None,
+            getattr(fit, 'fit_amp', None), getattr(fit, 'dec_fit_reconv_amp', None),
+            getattr(fit, 'baseline_dec_fit_reconv_amp', None), True,
+        ))
+    df = pd.DataFrame.from_records(rows, columns=pulse_response_frame_columns)
+    return _normalize_pulse_response_frame(df)
+
+
+def _normalize_pulse_response_frame(df):
+    # null QC flags count as failures; null numeric values become NaN
+    df = df[pulse_response_frame_columns].copy()
+    for col in ['ex_qc_pass', 'in_qc_pass', 'has_fit', 'has_probe']:
+        df[col] = df[col].fillna(False).astype(bool)
+    for col in ['baseline_potential', 'access_adj_baseline_potential', 'induction_frequency', 'recovery_delay', 
+                'pulse_number', 'previous_pulse_dt', 'n_spikes', 'first_spike_time', 'fit_amp', 
+                'dec_fit_reconv_amp', 'baseline_dec_fit_reconv_amp']:
+        df[col] = df[col].astype(float)
+    return df
+
+
+def generate_pair_dynamics(pair, db, session, pr_recs=None, pr_frame=None):
     """Generate a Dynamics table entry for the given pair.
+
+    Pulse responses are taken from *pr_frame* (IC responses for this pair, as returned by
+    experiment_pulse_response_frame), or from *pr_recs* (rows returned by pulse_response_query).
+    If neither is given, the pair's responses are queried from the database.
     """
     logger = logging.getLogger(__name__)
     logger.info('generate dynamics for %s', pair)
@@ -94,16 +198,18 @@ def generate_pair_dynamics(pair, db, session, pr_recs=None):
     syn_type = pair.synapse.synapse_type
     
     # load all IC pulse response amplitudes to determine the maximum that will be used for normalization
-    if pr_recs is None:
-        pr_query = pulse_response_query(pair, qc_pass=False, clamp_mode='ic', session=session)
-        pr_recs = pr_query.all()
+    if pr_frame is None:
+        if pr_recs is None:
+            pr_query = pulse_response_query(pair, qc_pass=False, clamp_mode='ic', session=session, db=db)
+            pr_recs = pr_query.all()
+        pr_frame = pulse_response_frame(pr_recs)
     
     # cull out all PRs that didn't get a fit or failed qc
     qc_field = syn_type + '_qc_pass'
-    passed_pr_recs = [pr_rec for pr_rec in pr_recs if getattr(pr_rec.PulseResponse, qc_field) and getattr(pr_rec.PulseResponseFit, amp_field) is not None]
+    passed = pr_frame[pr_frame[qc_field].to_numpy() & pr_frame[amp_field].notna().to_numpy()]
     
     percentile = 90 if syn_type == 'ex' else 10
-    amps = [getattr(rec.PulseResponseFit, amp_field) for rec in passed_pr_recs]
+    amps = passed[amp_field].to_numpy()
     amp_90p = scipy.stats.scoreatpercentile(amps, percentile)
 
     # fail QC if there are not enough events (but continue anyway)
@@ -112,7 +218,7 @@ def generate_pair_dynamics(pair, db, session, pr_recs=None):
     dynamics.n_source_events = len(amps)
 
     # load all baseline amplitudes to determine the noise level
-    noise_amps = np.array([getattr(rec.PulseResponseFit, baseline_amp_field) for rec in passed_pr_recs if getattr(rec.PulseResponseFit, baseline_amp_field) is not None])
+    noise_amps = passed[baseline_amp_field].dropna().to_numpy()
     noise_std = noise_amps.std()
     noise_90p = scipy.stats.scoreatpercentile(noise_amps, percentile)
 
@@ -121,9 +227,9 @@ def generate_pair_dynamics(pair, db, session, pr_recs=None):
     dynamics.noise_amp_90th_percentile = noise_90p
     dynamics.noise_std = noise_std
 
-    # sort all PRs by recording and stimulus parameters
-    #   [(clamp_mode, ind_freq, recovery_delay)][recording][pulse_number]
-    sorted_prs = sorted_pulse_responses(passed_pr_recs)
+    # sort all PRs by stimulus parameters into arrays of [recording, pulse_number-1] amplitudes
+    #   [(clamp_mode, ind_freq, recovery_delay, amps), ...]
+    stim_groups = sorted_pulse_amplitudes(passed, amp_field)
 
     # calculate 50Hz paired pulse and induction metrics for their own column
     col_metrics = {
@@ -145,8 +251,7 @@ def generate_pair_dynamics(pair, db, session, pr_recs=None):
     all_metrics = []
     delays = [125e-3, 250e-3, 500e-3, 1000e-3, 2000e-3, 4000e-3]
     
-    for key,recs in sorted_prs.items():
-        clamp_mode, ind_freq, rec_delay = key
+    for clamp_mode, ind_freq, rec_delay, a in stim_groups:
         # check for a rec_delay and match it to closest known interval in delays
         if rec_delay is None:
             delay = None
@@ -157,59 +262,51 @@ def generate_pair_dynamics(pair, db, session, pr_recs=None):
             else:
                 delay = rec_delay
         meta = (clamp_mode, ind_freq, delay)
+
+        # present[i, j] is True if recording i has a response to pulse j+1
+        present = np.isfinite(a)
         
-        collect_initial = []
-        collect_induction = []
-        collect_recovery = []
-        collect_recovery_single = []
-        collect_pulse_amps = [[]] * 12
-
-        for recording, pulses in recs.items():
-            # get all pulse amps
-            amps = {k:getattr(r.PulseResponseFit, amp_field) for k,r in pulses.items()}
-
-            # calculate metrics if the proper conditions are met
-            if 1 in pulses:
-                if ind_freq == 50:
-                    col_metrics['pulse_amp_first_50hz'].append(amps[1])
-            if 1 in pulses and 2 in pulses:
-                initial = (amps[2] - amps[1]) / amp_90p
-                collect_initial.append(initial)
-                # we separate out 50Hz into its own column because the induction frequency spans
-                # multiple recovery delays
-                if ind_freq == 50:
-                    col_metrics['stp_initial_50hz'].append(initial)
-                    col_metrics['pulse_amp_stp_initial_50hz'].append(amps[2])
-                    if amps[1] != 0:
-                        paired_pulse_ratio.append(amps[2] / amps[1])
-            if all([k in pulses for k in [1,6,7,8]]):
-                induction_amp = np.median([amps[6], amps[7], amps[8]])
-                induction = (induction_amp - amps[1]) / amp_90p
-                collect_induction.append(induction)
-                if ind_freq == 50:
-                    col_metrics['stp_induction_50hz'].append(induction)
-                    col_metrics['pulse_amp_stp_induction_50hz'].append(induction_amp)
-            if delay is not None and all([k in pulses for k in range(1,13)]):
-                recovery_amp = np.median([amps[i] for i in range(9,13)])
-                r = [amps[i+8] - amps[i] for i in range(1,5)]
-                recovery = np.median(r) / amp_90p
-                collect_recovery.append(recovery)
-                if delay == 250e-3:
-                    col_metrics['stp_recovery_250ms'].append(recovery)
-                    col_metrics['pulse_amp_stp_recovery_250ms'].append(recovery_amp)
-            if delay is not None and all([k in pulses for k in range(1,10)]):
-                r = amps[9] - amps[1]
-                recovery = np.median(r) / amp_90p
-                collect_recovery_single.append(recovery)
-                if delay == 250e-3:
-                    col_metrics['stp_recovery_single_250ms'].append(recovery)
-                    col_metrics['pulse_amp_stp_recovery_single_250ms'].append(amps[9])
-
-            # collect individual pulse amplitudes
-            for i in range(1, 13):
-                if i not in pulses:
-                    break
-                collect_pulse_amps[i-1].append(amps[i])
+        # calculate metrics for all recordings where the proper conditions are met
+        if ind_freq == 50:
+            col_metrics['pulse_amp_first_50hz'].extend(a[present[:, 0], 0])
+
+        mask = present[:, 0] & present[:, 1]
+        collect_initial = (a[mask, 1] - a[mask, 0]) / amp_90p
+        # we separate out 50Hz into its own column because the induction frequency spans
+        # multiple recovery delays
+        if ind_freq == 50:
+            col_metrics['stp_initial_50hz'].extend(collect_initial)
+            col_metrics['pulse_amp_stp_initial_50hz'].extend(a[mask, 1])
+            nonzero = mask & (a[:, 0] != 0)
+            paired_pulse_ratio.extend(a[nonzero, 1] / a[nonzero, 0])
+
+        mask = present[:, [0, 5, 6, 7]].all(axis=1)
+        induction_amp = np.median(a[mask, 5:8], axis=1)
+        collect_induction = (induction_amp - a[mask, 0]) / amp_90p
+        if ind_freq == 50:
+            col_metrics['stp_induction_50hz'].extend(collect_induction)
+            col_metrics['pulse_amp_stp_induction_50hz'].extend(induction_amp)
+
+        if delay is not None:
+            mask = present[:, :12].all(axis=1)
+            recovery_amp = np.median(a[mask, 8:12], axis=1)
+            collect_recovery = np.median(a[mask, 8:12] - a[mask, 0:4], axis=1) / amp_90p
+
+            mask = present[:, :9].all(axis=1)
+            collect_recovery_single = (a[mask, 8] - a[mask, 0]) / amp_90p
+            if delay == 250e-3:
+                col_metrics['stp_recovery_250ms'].extend(collect_recovery)
+                col_metrics['pulse_amp_stp_recovery_250ms'].extend(recovery_amp)
+                col_metrics['stp_recovery_single_250ms'].extend(collect_recovery_single)
+                col_metrics['pulse_amp_stp_recovery_single_250ms'].extend(a[mask, 8])
+        else:
+            collect_recovery = []
+            collect_recovery_single = []
+
+        # collect individual pulse amplitudes from the unbroken sequence of pulses starting at 1.
+        # Note: amplitudes from all pulse numbers are pooled together and reported for every
+        # pulse number; this matches the records generated by earlier versions of this function.
+        pooled_amps = a[:, :12][np.cumprod(present[:, :12], axis=1).astype(bool)]
         
         stp_metrics = {
             'stp_initial': (np.median(collect_initial), np.std(collect_initial), len(collect_initial),) if len(collect_initial) > 1 else (float('nan'),)*3,
@@ -217,9 +314,8 @@ def generate_pair_dynamics(pair, db, session, pr_recs=None):
             'stp_recovery': (np.median(collect_recovery), np.std(collect_recovery), len(collect_recovery),) if len(collect_recovery) > 1 else (float('nan'),)*3,
             'stp_recovery_single': (np.median(collect_recovery_single), np.std(collect_recovery_single), len(collect_recovery_single),) if len(collect_recovery_single) > 1 else (float('nan'),)*3,
             'pulse_amplitudes': [
-                (np.median(pulses), np.std(pulses), len(pulses),) if len(pulses) > 1 else float('nan')
-                for i,pulses in enumerate(collect_pulse_amps)
-            ]
+                (np.median(pooled_amps), np.std(pooled_amps), len(pooled_amps),) if len(pooled_amps) > 1 else float('nan')
+            ] * 12,
         }
         all_metrics.append((meta, stp_metrics))
     
@@ -243,10 +339,8 @@ def generate_pair_dynamics(pair, db, session, pr_recs=None):
     #     sqrt(amp_stdev^2 - noise_stdev^2) / abs(amp_90th_percentile)
         
     # Variability at resting state:
-    resting_amps = []
-    for pr_rec in pr_recs:
-        if pr_rec.StimPulse.previous_pulse_dt > 8.0 and getattr(pr_rec.PulseResponse, qc_field):
-            resting_amps.append(getattr(pr_rec.PulseResponseFit, amp_field))
+    resting_mask = (pr_frame['previous_pulse_dt'] > 8.0).to_numpy() & pr_frame[qc_field].to_numpy()
+    resting_amps = pr_frame[amp_field].to_numpy()[resting_mask]
     
     if len(resting_amps) == 0:
         logger.info("%s: no resting amps; bail out", pair)
@@ -257,22 +351,19 @@ def generate_pair_dynamics(pair, db, session, pr_recs=None):
 
     dynamics.variability_resting_state = variability(resting_amps)
 
-    # Variability in STP-induced state (5th-8th pulses)
+    # Variability in STP-induced state (5th-8th pulses) and correlations between adjacent 
+    # events in 50Hz pulses, using only recordings with an unbroken sequence of pulses from 1
+    amps_50hz = [a for clamp_mode, ind_freq, rec_delay, a in stim_groups if ind_freq == 50]
+    amps_50hz = np.concatenate(amps_50hz, axis=0) if len(amps_50hz) > 0 else np.empty((0, 12))
+    present = np.isfinite(amps_50hz)
+    has_2 = present[:, :2].all(axis=1)
+    has_4 = present[:, :4].all(axis=1)
+    has_8 = present[:, :8].all(axis=1)
+
     pulse_amps = {
-        (2,3): [],
-        (5,9): [],
+        (2,3): amps_50hz[has_2, 1],
+        (5,9): amps_50hz[has_8, 4:8].ravel(),
     }
-    # collect pulse amplitudes in each category
-    for key,recs in sorted_prs.items():
-        clamp_mode, ind_freq, rec_delay = key
-        if ind_freq != 50:
-            continue
-        for recording, pulses in recs.items():
-            for pulse_n, amps in pulse_amps.items():
-                if any([k not in pulses for k in range(1,pulse_n[-1])]):
-                    continue
-                for n in range(*pulse_n):
-                    amps.append(getattr(pulses[n].PulseResponseFit, amp_field))
     
     # normalize
     pulse_var = {n:(variability(a) if len(a) > 0 else np.nan) for n,a in pulse_amps.items()}
@@ -284,31 +375,9 @@ def generate_pair_dynamics(pair, db, session, pr_recs=None):
     dynamics.variability_change_induction_50hz = pulse_var[5,9] - dynamics.variability_resting_state
     
     # Look for evidence of vesicle depletion -- correlations between adjacent events in 50Hz pulses 5-8.
-    amps_1_2 = ([], [])
-    amps_2_4 = ([], [])
-    amps_4_8 = ([], [])
-    pulse_amps = [[] for i in range(9)]
-    for key,recs in sorted_prs.items():
-        clamp_mode, ind_freq, rec_delay = key
-        if ind_freq != 50:
-            continue
-        for recording, pulses in recs.items():
-            for i in range(1,9):
-                if i not in pulses:
-                    break
-                if i == 2:
-                    amps_1_2[0].append(getattr(pulses[i-1].PulseResponseFit, amp_field))
-                    amps_1_2[1].append(getattr(pulses[i].PulseResponseFit, amp_field))
-                if i == 4:
-                    first = np.median([getattr(pulses[i].PulseResponseFit, amp_field) for i in range(1, 3)])
-                    second = np.median([getattr(pulses[i].PulseResponseFit, amp_field) for i in range(3, 5)])
-                    amps_2_4[0].append(np.median(first))
-                    amps_2_4[1].append(np.median(second))
-                if i == 8:
-                    first = np.median([getattr(pulses[i].PulseResponseFit, amp_field) for i in range(1, 5)])
-                    second = np.median([getattr(pulses[i].PulseResponseFit, amp_field) for i in range(5, 9)])
-                    amps_4_8[0].append(np.median(first))
-                    amps_4_8[1].append(np.median(second))
+    amps_1_2 = (amps_50hz[has_2, 0], amps_50hz[has_2, 1])
+    amps_2_4 = (np.median(amps_50hz[has_4, 0:2], axis=1), np.median(amps_50hz[has_4, 2:4], axis=1))
+    amps_4_8 = (np.median(amps_50hz[has_8, 0:4], axis=1), np.median(amps_50hz[has_8, 4:8], axis=1))
     
     if len(amps_1_2[0]) > 3:
         r,p = scipy.stats.pearsonr(amps_1_2[0], amps_1_2[1])
@@ -323,9 +392,35 @@ def generate_pair_dynamics(pair, db, session, pr_recs=None):
         dynamics.paired_event_correlation_4_8_r = r
         dynamics.paired_event_correlation_4_8_p = p
 
+    return dynamics
 
 
-    return dynamics
+def sorted_pulse_amplitudes(pr_frame, amp_field, n_pulses=12):
+    """Group pulse response amplitudes by stimulus parameters, then arrange each group into an
+    array indexed by [recording, pulse_number-1].
+
+    This is the columnar equivalent of sorted_pulse_responses(). Groups and recordings are returned
+    in the order they first appear in *pr_frame*; missing pulses are NaN, and if a recording contains
+    more than one response with the same pulse number, the last one is used.
+
+    Returns
+    -------
+    groups : list
+        List of (clamp_mode, ind_freq, recovery_delay, amps) tuples, where *amps* has shape
+        (n_recordings, n_pulses). Null stimulus parameters are given as None.
+    """
+    groups = []
+    keys = ['clamp_mode', 'induction_frequency', 'recovery_delay']
+    for key, grp in pr_frame.groupby(keys, sort=False, dropna=False):
+        clamp_mode, ind_freq, rec_delay = [None if (isinstance(v, float) and np.isnan(v)) else v for v in key]
+        rec_ids = pd.unique(grp['recording_id'])
+        grp = grp[(grp['pulse_number'] >= 1) & (grp['pulse_number'] <= n_pulses)]
+        grp = grp.drop_duplicates(['recording_id', 'pulse_number'], keep='last')
+        rows = pd.Index(rec_ids).get_indexer(grp['recording_id'])
+        amps = np.full((len(rec_ids), n_pulses), np.nan)
+        amps[rows, grp['pulse_number'].to_numpy().astype(int) - 1] = grp[amp_field].to_numpy()
+        groups.append((clamp_mode, ind_freq, rec_delay, amps))
+    return groups
 
 
 def stim_sorted_pulse_amp(pair, db=None):
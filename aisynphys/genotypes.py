@@ -1,5 +1,6 @@
 from __future__ import print_function
 import sys, itertools
+import numpy as np
 
 # ----------------- Genotype Handling ----------------------------
 # The purpose of the code below is to be able to ask, given a mouse genotype string, 
@@ -268,7 +269,7 @@ class Genotype(object):
             gt.expressed_reporters(['pvalb'])
             # returns: set(['tdTomato'])
         """
-        prods = self.model.forward_model(drivers)
+        prods = self._forward_model(drivers)
         reporters = set([p for p in prods if p in ALL_REPORTERS])
         return reporters
 
@@ -292,7 +293,7 @@ class Genotype(object):
             gt.expressed_colors(['pvalb'])
             # returns: set(['red'])
         """
-        prods = self.model.forward_model(drivers)
+        prods = self._forward_model(drivers)
         colors = set([p for p in prods if p in ALL_COLORS])
         return colors
 
@@ -330,6 +331,36 @@ class Genotype(object):
         """
         return self.model.reverse_model(unknown_factors=self.all_drivers, products=colors, starting_factors=starting_factors)
 
+    def predict_driver_expression_batch(self, colors, starting_factors=()):
+        """Vectorized version of predict_driver_expression() for many cells at once.
+
+        Parameters
+        ----------
+        colors : dict
+            Maps each observed color to an array (one value per cell) of True / 1 (expressed),
+            False / 0 (not expressed), or None / NaN (ambiguous).
+        starting_factors : list
+            Optional list of factors that are present in every cell (for example: dox)
+
+        Returns
+        -------
+        driver_expression : dict
+            Maps each driver in the genotype to an object array of True / False / None
+            with one value per cell, as described in predict_driver_expression().
+
+        Notes
+        -----
+
+        Example::
+
+            gt = Genotype('Tlx3-Cre_PL56/wt;Pvalb-2A-FlpO/wt;Ai65F/Ai65F;Ai140(TIT2L-GFP-ICL-tTA2)/wt')
+
+            gt.predict_driver_expression_batch({'red': [True, False, None], 'green': [True, True, False]})
+            # returns: {'tlx3': array([True, True, False]), 'pvalb': array([True, False, None])}
+        """
+        compiled = self.model.compile(self.all_drivers, starting_factors)
+        return compiled.reverse_batch(colors)
+
     def test_driver_combinations(self, colors, starting_factors=()):
         """Given information about fluorescent colors expressed in a cell,
         return predictions about whether each combination of drivers could
@@ -375,6 +406,14 @@ class Genotype(object):
         """
         return self.model.test_factor_combinations(unknown_factors=self.all_drivers, products=colors, starting_factors=starting_factors)
 
+    def _forward_model(self, factors):
+        """Forward-model a set of factors, using the compiled truth table of this genotype's drivers.
+        Factors that are not drivers (for example: dox) are treated as starting factors.
+        """
+        factors = set(factors)
+        starting_factors = factors - self.all_drivers
+        return self.model.compile(self.all_drivers, starting_factors).forward(factors & self.all_drivers)
+
     def _parse(self):
         """Extract driver/reporter lines from genotype string, generate a GeneticModel
         """
@@ -415,7 +454,7 @@ class Genotype(object):
 class GeneticModel:
     """Genetic modeling engine.
 
-    See add_rule(), forward_model(), and reverse_model().
+    See add_rule(), forward_model(), reverse_model(), and compile().
     """
 
     def __init__(self, ruleset=None):
@@ -424,6 +463,11 @@ class GeneticModel:
         #        inputs=('tTA',)   outputs=('tdTomato')
         self.ruleset = []
         self.all_products = set()
+        # compiled form of the ruleset: each factor is assigned a bit position, and each rule
+        # becomes a (positive deps, negative deps, products) tuple of bit masks
+        self.factor_bits = {}
+        self.rule_masks = []
+        self._compiled = {}
         if ruleset is not None:
             for dependencies, products in ruleset:
                 self.add_rule(dependencies, products)
@@ -455,9 +499,62 @@ class GeneticModel:
         pos_deps = set([d for d in dependencies if not d.startswith('~')])
         neg_deps = set([d[1:] for d in dependencies if d.startswith('~')])
         products = set(products)
+        if ((pos_deps, neg_deps), products) in self.ruleset:
+            # duplicate rules have no effect; keep the compiled truth tables
+            return
         self.ruleset.append(((pos_deps, neg_deps), products))
         self.all_products |= products
 
+        for factor in sorted(pos_deps | neg_deps | products):
+            if factor not in self.factor_bits:
+                self.factor_bits[factor] = len(self.factor_bits)
+        self.rule_masks.append((self._mask(pos_deps), self._mask(neg_deps), self._mask(products)))
+        # truth tables compiled from the previous ruleset are no longer valid
+        self._compiled.clear()
+
+    def _mask(self, factors):
+        """Return the bit mask representing a set of factors (factors unknown to the model are ignored).
+        """
+        mask = 0
+        for factor in factors:
+            bit = self.factor_bits.get(factor)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    def _factors(self, mask):
+        """Return the set of factors represented by a bit mask.
+        """
+        return set([f for f, bit in self.factor_bits.items() if mask & (1 << bit)])
+
+    def _forward_mask(self, mask):
+        """Forward-model a bit mask of starting factors; see forward_model().
+        """
+        new_expression = True
+        while new_expression:
+            new_expression = False
+            for pos_deps, neg_deps, products in self.rule_masks:
+                # are all positive dependencies present, no negative dependencies present,
+                # and will any new products be generated?
+                if mask & pos_deps == pos_deps and mask & neg_deps == 0 and products & ~mask:
+                    mask |= products
+                    new_expression = True
+        return mask
+
+    def compile(self, unknown_factors, starting_factors=()):
+        """Return a CompiledGeneticModel giving the forward-modeled products of every combination
+        of *unknown_factors* (in addition to *starting_factors*).
+
+        Compiled models are cached until the next call to add_rule().
+        """
+        starting_factors = frozenset(starting_factors or ())
+        key = (frozenset(unknown_factors), starting_factors)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = CompiledGeneticModel(self, unknown_factors, starting_factors)
+            self._compiled[key] = compiled
+        return compiled
+
     def forward_model(self, starting_factors):
         """Given a list of starting factors, predict the set of ending factors given the ruleset
         in this model.
@@ -477,23 +574,8 @@ class GeneticModel:
 
         """
         factors = set(starting_factors)
-        new_expression = False
-        for dependencies, products in self.ruleset:
-            pos_deps, neg_deps = dependencies
-
-            # are all positive dependencies present, and no negative dependencies present?
-            dependencies_met = pos_deps.issubset(factors) and len(factors & neg_deps) == 0
-
-            # If dependencies are met, will any new products be generated?
-            if dependencies_met and not products.issubset(factors):
-                # Something new was expressed; add it to the list and run again
-                factors |= products
-                new_expression = True
-        
-        if new_expression:
-            return self.forward_model(factors)
-        else:
-            return factors
+        mask = self._forward_mask(self._mask(factors))
+        return factors | self._factors(mask)
 
     def reverse_model(self, unknown_factors, products, starting_factors=()):
         """Given information about products expressed in a cell,
@@ -540,27 +622,7 @@ class GeneticModel:
             # returns: {'tlx3': True, 'pvalb': False}
 
         """
-        factor_combos = self.test_factor_combinations(unknown_factors, products, starting_factors)
-        true_combos = [factors for factors,prediction in factor_combos.items() if prediction is True]
-        factor_expression = {}
-        for factor in unknown_factors:
-            n_match_with_factor = len([d for d in true_combos if factor in d])
-            n_match_without_factor = len([d for d in true_combos if factor not in d])
-
-            if n_match_with_factor > 0 and n_match_without_factor == 0:
-                # If every possible factor combination that is consistent with observed products
-                # contains this factor, then we say it is definitely expressed.
-                factor_expression[factor] = True
-            elif n_match_with_factor == 0:
-                # If no possible combinations that contain this factor are consistent with observed
-                # products, then we say the factor is definitely not expressed.
-                # TODO: this can give incorrect results in cases where the factor is expressed, but silenced.
-                factor_expression[factor] = False
-            else:
-                # Otherwise, we can't say one way or another whether this factor is expressed.
-                factor_expression[factor] = None
-
-        return factor_expression
+        return self.compile(unknown_factors, starting_factors).reverse(products)
 
     def test_factor_combinations(self, unknown_factors, products, starting_factors=()):
         """Given information about products expressed in a cell,
@@ -625,29 +687,9 @@ class GeneticModel:
             # }
 
         """
-        starting_factors = set(starting_factors)
-        predictions = {}
-        # iterate over all combinations of unknown_factors
-        for factors in self._factor_combinations(unknown_factors):
-            # initial assumption is that this combination _will_ generate products that are
-            # consistent with the observed products
-            factor_combo_possible = True
-
-            # model the products geenrated by this combination of factors
-            predicted_products = self.forward_model(set(factors) | starting_factors)
-
-            # check over all products for any mismatch
-            for product in self.all_products:
-                product_observed = products.get(product, None)
-                if product_observed is None:
-                    continue
-                product_predicted = product in predicted_products
-                if product_predicted != product_observed:
-                    # prediction and observation do not match; mark this combination as impossible
-                    factor_combo_possible = False
-                    break
-            predictions[tuple(sorted(factors))] = factor_combo_possible
-        return predictions
+        compiled = self.compile(unknown_factors, starting_factors)
+        consistent = compiled.consistent_combinations(products)
+        return {combo: bool(ok) for combo, ok in zip(compiled.combinations, consistent)}
 
     def _factor_combinations(self, factors):
         """Return a list of all possible combinations of the given factors"""
@@ -666,12 +708,151 @@ class GeneticModel:
             Maps {(drivers,): [reporters]} to describe all of the reporters that would be expressed
             by each possible combination of drivers.
         """
-        product_map = {}
+        compiled = self.compile(starting_factors)
+        return {combo: compiled.forward(combo) for combo in compiled.combinations}
+
+
+
+class CompiledGeneticModel(object):
+    """Truth table of a GeneticModel over all combinations of a set of unknown factors.
+
+    Each row of the table corresponds to one combination of unknown factors (row *i* contains
+    unknown_factors[j] if bit *j* of *i* is set). The forward model is run once per row when the
+    table is built, so that reverse inference from a set of observed products is a scan over
+    the table rather than a new simulation of every combination.
+
+    Instances are created and cached by GeneticModel.compile().
+    """
+    def __init__(self, model, unknown_factors, starting_factors=()):
+        self.model = model
+        self.unknown_factors = sorted(set(unknown_factors))
+        self.starting_factors = frozenset(starting_factors)
+        self.products = sorted(model.all_products)
+
+        n_factors = len(self.unknown_factors)
+        rows = np.arange(2**n_factors)
+        # (n_combos, n_factors) table of the unknown factors present in each combination
+        self.factor_table = ((rows[:, None] >> np.arange(n_factors)[None, :]) & 1).astype(bool)
+        self.combinations = [tuple(f for f, present in zip(self.unknown_factors, row) if present) for row in self.factor_table]
+
+        start_mask = model._mask(self.starting_factors)
+        factor_masks = [model._mask([f]) for f in self.unknown_factors]
+        self.masks = []
+        for row in self.factor_table:
+            mask = start_mask
+            for factor_mask, present in zip(factor_masks, row):
+                if present:
+                    mask |= factor_mask
+            self.masks.append(model._forward_mask(mask))
+
+        # (n_combos, n_products) table of the products expressed by each combination
+        product_bits = [model.factor_bits[p] for p in self.products]
+        self.product_table = np.array([[bool((mask >> bit) & 1) for bit in product_bits] for mask in self.masks], dtype=bool)
+        self.product_table = self.product_table.reshape(len(rows), len(self.products))
+
+        self._reverse_cache = {}
+
+    def forward(self, factors):
+        """Return the set of factors generated by the given combination of unknown factors
+        (see GeneticModel.forward_model).
+        """
+        factors = set(factors)
+        row = 0
+        for j, factor in enumerate(self.unknown_factors):
+            if factor in factors:
+                row |= 1 << j
+        extra = factors - set(self.unknown_factors)
+        if len(extra) > 0:
+            return self.model.forward_model(factors | self.starting_factors)
+        return factors | self.starting_factors | self.model._factors(self.masks[row])
+
+    def _observation_codes(self, products):
+        """Encode a dict of observed products as an array with one value per product:
+        0 (not observed / ambiguous), 1 (not expressed), or 2 (expressed).
+        """
+        codes = np.zeros(len(self.products), dtype='int8')
+        for i, product in enumerate(self.products):
+            observed = products.get(product, None)
+            if observed is not None:
+                codes[i] = 2 if observed else 1
+        return codes
+
+    def _consistent(self, codes):
+        """Given an (n_observations, n_products) array of observation codes, return an
+        (n_observations, n_combos) boolean array indicating which factor combinations could
+        have generated each observation.
+        """
+        observed = codes[:, None, :] > 0
+        expressed = codes[:, None, :] == 2
+        match = ~observed | (self.product_table[None, :, :] == expressed)
+        return match.all(axis=2)
+
+    def _factor_expression(self, consistent):
+        """Given an (n_observations, n_combos) array of consistent combinations, return an
+        (n_observations, n_factors) object array of True / False / None for each unknown factor.
+        """
+        with_factor = (consistent[:, :, None] & self.factor_table[None, :, :]).any(axis=1)
+        without_factor = (consistent[:, :, None] & ~self.factor_table[None, :, :]).any(axis=1)
+        expression = np.full(with_factor.shape, None, dtype=object)
+        # If every possible factor combination that is consistent with observed products
+        # contains this factor, then we say it is definitely expressed.
+        expression[with_factor & ~without_factor] = True
+        # If no possible combinations that contain this factor are consistent with observed
+        # products, then we say the factor is definitely not expressed.
+        # TODO: this can give incorrect results in cases where the factor is expressed, but silenced.
+        expression[~with_factor] = False
+        # Otherwise, we can't say one way or another whether this factor is expressed.
+        return expression
+
+    def consistent_combinations(self, products):
+        """Return a boolean array (one value per item in self.combinations) indicating which
+        factor combinations are consistent with the observed *products*
+        (see GeneticModel.test_factor_combinations).
+        """
+        return self._consistent(self._observation_codes(products)[None, :])[0]
 
-        # Iterate over all combinations of starting factors
-        # predict which products would be expressed in each case
-        factor_combos = self._factor_combinations(starting_factors)
-        for factors in factor_combos:
-            product_map[tuple(sorted(factors))] = self.forward_model(factors)
+    def reverse(self, products):
+        """Return a dict indicating whether each unknown factor must be expressed (True), must not be
+        expressed (False), or cannot be determined (None) given the observed *products*
+        (see GeneticModel.reverse_model). Results are memoized per distinct observation.
+        """
+        codes = self._observation_codes(products)
+        key = codes.tobytes()
+        expression = self._reverse_cache.get(key)
+        if expression is None:
+            expression = self._factor_expression(self._consistent(codes[None, :]))[0]
+            self._reverse_cache[key] = expression
+        return dict(zip(self.unknown_factors, expression))
 
-        return product_map
+    def reverse_batch(self, products):
+        """Vectorized version of reverse() for many observations.
+
+        Parameters
+        ----------
+        products : dict
+            Maps each observed product to an array (one value per observation) of True / 1 (expressed),
+            False / 0 (not expressed), or None / NaN (ambiguous).
+
+        Returns
+        -------
+        factor_expression : dict
+            Maps each unknown factor to an object array of True / False / None (one value per observation).
+        """
+        columns = {}
+        for product, values in products.items():
+            values = np.asarray(values)
+            if values.dtype == object:
+                values = np.array([np.nan if v is None else v for v in values], dtype=float)
+            values = values.astype(float)
+            columns[product] = np.where(np.isnan(values), 0, np.where(values != 0, 2, 1)).astype('int8')
+        n_obs = len(next(iter(columns.values()))) if len(columns) > 0 else 0
+
+        codes = np.zeros((n_obs, len(self.products)), dtype='int8')
+        for i, product in enumerate(self.products):
+            if product in columns:
+                codes[:, i] = columns[product]
+
+        # only distinct observations need to be evaluated
+        unique_codes, inverse = np.unique(codes, axis=0, return_inverse=True)
+        expression = self._factor_expression(self._consistent(unique_codes))[inverse.reshape(-1)]
+        return {factor: expression[:, j] for j, factor in enumerate(self.unknown_factors)}
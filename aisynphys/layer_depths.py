@@ -1,19 +1,40 @@
+import os, hashlib, pickle
 import numpy as np
-from neuron_morphology.lims_apical_queries import get_data
-from neuron_morphology.transforms.pia_wm_streamlines.calculate_pia_wm_streamlines import generate_laplace_field
-from neuron_morphology.snap_polygons.__main__ import run_snap_polygons, Parser
-from neuron_morphology.snap_polygons.types import ensure_path, ensure_linestring, ensure_polygon
-from neuron_morphology.features.layer.reference_layer_depths import DEFAULT_HUMAN_MTG_REFERENCE_LAYER_DEPTHS, DEFAULT_MOUSE_REFERENCE_LAYER_DEPTHS
-import neuron_morphology.layered_point_depths.__main__ as ld 
-from shapely.geometry import Polygon, Point, LineString, LinearRing
-from scipy.interpolate import CloughTocher2DInterpolator, LinearNDInterpolator
+from . import config
+from .streamlines import streamline_distances
+from .util.lazy_import import lazy_import
 import logging
 logger = logging.getLogger(__name__)
 
-WELL_KNOWN_REFERENCE_LAYER_DEPTHS = {
-    "human": DEFAULT_HUMAN_MTG_REFERENCE_LAYER_DEPTHS,
-    "mouse": DEFAULT_MOUSE_REFERENCE_LAYER_DEPTHS,
-}
+# neuron_morphology, shapely and scipy are slow to import; defer them until first use
+lims_apical_queries = lazy_import('neuron_morphology.lims_apical_queries')
+pia_wm_streamlines = lazy_import('neuron_morphology.transforms.pia_wm_streamlines.calculate_pia_wm_streamlines')
+snap_polygons = lazy_import('neuron_morphology.snap_polygons.__main__')
+snap_polygon_types = lazy_import('neuron_morphology.snap_polygons.types')
+reference_layer_depths = lazy_import('neuron_morphology.features.layer.reference_layer_depths')
+ld = lazy_import('neuron_morphology.layered_point_depths.__main__')
+geometry = lazy_import('shapely.geometry')
+interpolate = lazy_import('scipy.interpolate')
+
+
+def well_known_reference_layer_depths():
+    return {
+        "human": reference_layer_depths.DEFAULT_HUMAN_MTG_REFERENCE_LAYER_DEPTHS,
+        "mouse": reference_layer_depths.DEFAULT_MOUSE_REFERENCE_LAYER_DEPTHS,
+    }
+
+
+def __getattr__(name):
+    if name == 'WELL_KNOWN_REFERENCE_LAYER_DEPTHS':
+        return well_known_reference_layer_depths()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def generate_laplace_field(*args, **kwds):
+    """Calls neuron_morphology's generate_laplace_field (imported on first use).
+    """
+    return pia_wm_streamlines.generate_laplace_field(*args, **kwds)
+
 class LayerDepthError(Exception):
     pass
 
@@ -40,7 +61,7 @@ def get_cell_soma_data(cell_specimen_ids):
             ORDER BY sp.id
             """
     # all results returned as 'invalid_data' with only soma coords and resolution
-    _, cell_data = get_data(query_for_soma)
+    _, cell_data = lims_apical_queries.get_data(query_for_soma)
     soma_centers = {k: cell_data[k]["soma_center"] for k in cell_specimen_ids
                    if cell_data[k]["soma_center"] is not None}
     resolution = cell_data[int(cell_specimen_ids[1])]["resolution"]
@@ -51,7 +72,7 @@ def layer_info_from_snap_polygons_output(output, resolution=1):
     pia_path = None
     wm_path = None
     for polygon in output["polygons"]:
-        layers[polygon['name']] = {'bounds': Polygon(resolution*np.array(polygon['path']))}
+        layers[polygon['name']] = {'bounds': geometry.Polygon(resolution*np.array(polygon['path']))}
     for surface in output["surfaces"]:
         name = surface['name']
         path = list(resolution*np.array(surface['path']))
@@ -60,13 +81,13 @@ def layer_info_from_snap_polygons_output(output, resolution=1):
         elif name=='wm':
             wm_path = path
         else:
-            path = LineString(path)
+            path = geometry.LineString(path)
             layer, side = name.split('_')
             layers[layer][f"{side}_surface"] = path
     return layers, pia_path, wm_path
 
 def get_missing_layer_info(layers, species):
-    ref_layer_depths = WELL_KNOWN_REFERENCE_LAYER_DEPTHS[species].copy()
+    ref_layer_depths = well_known_reference_layer_depths()[species].copy()
     # don't want to include wm as a layer!
     ref_layer_depths.pop('wm')
     all_layers_ordered = sorted(ref_layer_depths.keys())
@@ -88,12 +109,12 @@ def get_missing_layer_info(layers, species):
     wm_extra_dist = sum(ref_layer_depths[layer].thickness for layer in missing_below)
     return top_path, bottom_path, pia_extra_dist, wm_extra_dist
 
-def get_layer_depths(point, layer_polys, pia_path, wm_path, depth_interp, dx_interp, dy_interp, 
-                     step_size=1.0, max_iter=1000,
-                     pia_extra_dist=0, wm_extra_dist=0):
+def get_start_layer(point, layer_polys):
+    """Return the name of the layer containing *point*.
+    """
     in_layer = [
         layer for layer in layer_polys if
-        layer_polys[layer]['bounds'].intersects(Point(*point)) # checks for common boundary or interior
+        layer_polys[layer]['bounds'].intersects(geometry.Point(*point)) # checks for common boundary or interior
     ]
 
     if len(in_layer) == 0:
@@ -107,6 +128,16 @@ def get_layer_depths(point, layer_polys, pia_path, wm_path, depth_interp, dx_int
             if not layer=="Layer1":
                 start_layer = layer
         logger.warning(f"Overlapping layers: {in_layer}. Choosing {start_layer}")
+    return start_layer
+
+def get_layer_depths(point, layer_polys, pia_path, wm_path, depth_interp, dx_interp, dy_interp, 
+                     step_size=1.0, max_iter=1000,
+                     pia_extra_dist=0, wm_extra_dist=0):
+    """Measure the depth of one point by stepping along streamlines to each boundary.
+
+    See get_layer_depths_batch for a faster version that handles many points at once.
+    """
+    start_layer = get_start_layer(point, layer_polys)
     layer_poly = layer_polys[start_layer]
     
     pia_direction = np.array([dx_interp(point), dy_interp(point)])
@@ -124,12 +155,12 @@ def get_layer_depths(point, layer_polys, pia_path, wm_path, depth_interp, dx_int
         return dist
 
     if pia_path is not None:
-        pia_path = ensure_linestring(pia_path)
+        pia_path = snap_polygon_types.ensure_linestring(pia_path)
         pia_distance = dist_to_boundary(pia_path, 1)
     else:
         pia_distance = np.nan
     if wm_path is not None:
-        wm_path = ensure_linestring(wm_path)
+        wm_path = snap_polygon_types.ensure_linestring(wm_path)
         wm_distance = dist_to_boundary(wm_path, -1)
     else:
         wm_distance = np.nan
@@ -160,8 +191,143 @@ def get_layer_depths(point, layer_polys, pia_path, wm_path, depth_interp, dx_int
         }
     return out
 
+def get_layer_depths_batch(points, layer_polys, pia_path, wm_path, dx_interp, dy_interp,
+                           step_size=1.0, max_iter=1000,
+                           pia_extra_dist=0, wm_extra_dist=0):
+    """Measure depths for many points at once; equivalent to calling get_layer_depths for each point.
+
+    Streamlines from all points to all four boundaries (pia, wm, and the upper and lower surfaces
+    of each point's layer) are integrated together (see aisynphys.streamlines).
+
+    Parameters
+    ----------
+    points : dict
+        {name: (x, y)} positions to measure
+
+    Returns
+    -------
+    outputs : dict
+        {name: result} where each result is a dict as returned by get_layer_depths
+    errors : dict
+        {name: error_message} for points that could not be measured
+    """
+    outputs = {}
+    errors = {}
+    names = []
+    start_layers = []
+    for name, point in points.items():
+        try:
+            start_layers.append(get_start_layer(point, layer_polys))
+            names.append(name)
+        except LayerDepthError as exc:
+            errors[name] = str(exc)
+    if len(names) == 0:
+        return outputs, errors
+    positions = np.array([points[name] for name in names], dtype=float).reshape(-1, 2)
+
+    pia_path = None if pia_path is None else snap_polygon_types.ensure_linestring(pia_path)
+    wm_path = None if wm_path is None else snap_polygon_types.ensure_linestring(wm_path)
+
+    # one streamline for each (point, boundary) combination that has a surface to aim at
+    starts, surfaces, directions, slots = [], [], [], []
+    boundaries = {layer: layer_polys[layer]['bounds'].boundary for layer in set(start_layers)}
+    for i, layer in enumerate(start_layers):
+        layer_poly = layer_polys[layer]
+        targets = [
+            (pia_path, 1),
+            (wm_path, -1),
+            (layer_poly.get('pia_surface', boundaries[layer]), 1),
+            (layer_poly.get('wm_surface', boundaries[layer]), -1),
+        ]
+        for j, (surface, direction) in enumerate(targets):
+            if surface is None:
+                continue
+            starts.append(positions[i])
+            surfaces.append(surface)
+            directions.append(direction)
+            slots.append((i, j))
+    dists = np.full((len(names), 4), np.nan)
+    if len(starts) > 0:
+        result = streamline_distances(np.array(starts), surfaces, directions, dx_interp, dy_interp,
+                                      step_size=step_size, max_iter=max_iter)
+        for (i, j), d in zip(slots, result):
+            dists[i, j] = d
+
+    dx = np.broadcast_to(np.asarray(dx_interp(positions), dtype=float).reshape(-1), (len(names),))
+    dy = np.broadcast_to(np.asarray(dy_interp(positions), dtype=float).reshape(-1), (len(names),))
+    for i, name in enumerate(names):
+        pia_direction = np.array([[dx[i]], [dy[i]]])
+        pia_direction /= np.linalg.norm(pia_direction)
+
+        pia_distance, wm_distance, pia_side_dist, wm_side_dist = dists[i]
+        pia_distance += pia_extra_dist
+        wm_distance += wm_extra_dist
+        layer_thickness = wm_side_dist + pia_side_dist
+        cortex_thickness = pia_distance + wm_distance
+        outputs[name] = {
+            'position': positions[i],
+            'layer_depth': pia_side_dist,
+            'layer_thickness': layer_thickness,
+            'normalized_layer_depth': pia_side_dist/layer_thickness,
+            'normalized_depth': pia_distance/cortex_thickness,
+            'absolute_depth': pia_distance,
+            'cortex_thickness': cortex_thickness,
+            'wm_distance': wm_distance,
+            'layer': start_layers[i],
+            'pia_direction': pia_direction,
+        }
+    return outputs, errors
+
+def laplace_field_cache_key(top_path, bottom_path):
+    """Return a hash identifying the Laplace field generated between two boundary paths.
+    """
+    h = hashlib.sha1(b'laplace_field_v1')
+    for path in (top_path, bottom_path):
+        h.update(np.ascontiguousarray(path, dtype=float).tobytes())
+        h.update(b'|')
+    return h.hexdigest()
+
+def get_laplace_interpolators(top_path, bottom_path, cache_path=None):
+    """Return (depth_interp, dx_interp, dy_interp) for the Laplace field between two boundary paths.
+
+    The interpolators are expensive to generate, so they are cached on disk in *cache_path*
+    (default is config.layer_depth_cache_path), keyed by a hash of the boundary paths
+    (which are derived from the slice's layer polygons). Set cache_path=False to disable caching.
+    """
+    if cache_path is None:
+        cache_path = config.layer_depth_cache_path
+    cache_file = None
+    if cache_path:
+        cache_file = os.path.join(cache_path, 'laplace_%s.pkl' % laplace_field_cache_key(top_path, bottom_path))
+        if os.path.isfile(cache_file):
+            try:
+                with open(cache_file, 'rb') as fh:
+                    return pickle.load(fh)
+            except Exception:
+                logger.warning("Could not read layer depth cache file %s; regenerating", cache_file, exc_info=True)
+
+    (_, _, _, mesh_coords, mesh_values, mesh_gradients) = generate_laplace_field(
+            top_path,
+            bottom_path,
+            )
+    interp = interpolate.CloughTocher2DInterpolator
+    interps = (
+        interp(mesh_coords, mesh_values),
+        interp(mesh_coords, mesh_gradients[:,0]),
+        interp(mesh_coords, mesh_gradients[:,1]),
+    )
+
+    if cache_file is not None:
+        # write to a temporary file first so that concurrent jobs never read a partial file
+        os.makedirs(cache_path, exist_ok=True)
+        tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+        with open(tmp_file, 'wb') as fh:
+            pickle.dump(interps, fh)
+        os.replace(tmp_file, cache_file)
+    return interps
+
 def resample_line(coords, distance_delta=50):
-    line = LineString(coords)
+    line = geometry.LineString(coords)
     distances = np.arange(0, line.length, distance_delta)
     points = [line.interpolate(distance) for distance in distances] + [line.boundary[1]]
     line_coords = [point.coords[0] for point in points]
@@ -174,7 +340,7 @@ def get_depths_slice(focal_plane_image_series_id, soma_centers, species,
     # if resolution is not set, can run in pixel coordinates but some default scales may be off
     soma_centers = {cell: resolution*np.array(position) for cell, position in soma_centers.items()}
 
-    parser = Parser(args=[], input_data=dict(
+    parser = snap_polygons.Parser(args=[], input_data=dict(
         focal_plane_image_series_id=focal_plane_image_series_id))
     parser.args.pop('log_level')
     # fully ignore pia/wm, rarely present and often incomplete if present
@@ -186,14 +352,14 @@ def get_depths_slice(focal_plane_image_series_id, soma_centers, species,
     layer_names = [layer['name'] for layer in parser.args['layer_polygons']]
     if len(layer_names) != len(set(layer_names)):
         raise ValueError("Duplicate layer names.")
-    output = run_snap_polygons(**parser.args)
+    output = snap_polygons.run_snap_polygons(**parser.args)
 
     layers, pia_path, wm_path = layer_info_from_snap_polygons_output(output, resolution)
     return get_depths_from_processed_layers(layers, pia_path, wm_path, soma_centers, species,
                                             step_size=step_size, max_iter=max_iter)
 
 def get_depths_from_processed_layers(layers, pia_path, wm_path, soma_centers, species,
-                                     step_size=2.0, max_iter=1000):
+                                     step_size=2.0, max_iter=1000, cache_path=None):
     errors = []
     try:
         if (pia_path is None) or (wm_path is None):
@@ -207,14 +373,7 @@ def get_depths_from_processed_layers(layers, pia_path, wm_path, soma_centers, sp
         top_path = resample_line(top_path)
         bottom_path = resample_line(bottom_path)
 
-        (_, _, _, mesh_coords, mesh_values, mesh_gradients) = generate_laplace_field(
-                top_path,
-                bottom_path,
-                )
-        interp = CloughTocher2DInterpolator
-        depth_interp = interp(mesh_coords, mesh_values)
-        dx_interp = interp(mesh_coords, mesh_gradients[:,0])
-        dy_interp = interp(mesh_coords, mesh_gradients[:,1])
+        depth_interp, dx_interp, dy_interp = get_laplace_interpolators(top_path, bottom_path, cache_path=cache_path)
     except LayerDepthError as exc:
         top_path = bottom_path = None
         pia_extra_dist = wm_extra_dist = np.nan
@@ -222,19 +381,13 @@ def get_depths_from_processed_layers(layers, pia_path, wm_path, soma_centers, sp
         logger.error(exc)
         errors.append(str(exc))
 
-    outputs = {}
-    cell_errors = {}
-    for name, point in soma_centers.items():
-        try:
-            outputs[name] = get_layer_depths(
-                point, layers, top_path, bottom_path, depth_interp, dx_interp, dy_interp,
-                step_size=step_size, max_iter=max_iter,
-                pia_extra_dist=pia_extra_dist, wm_extra_dist=wm_extra_dist
-                )
-        except (LayerDepthError,) as exc:
-            error = f"Failure getting depth info for cell {name}: {exc}"
-            logger.error(error)
-            cell_errors[name] = str(exc)
+    outputs, cell_errors = get_layer_depths_batch(
+        soma_centers, layers, top_path, bottom_path, dx_interp, dy_interp,
+        step_size=step_size, max_iter=max_iter,
+        pia_extra_dist=pia_extra_dist, wm_extra_dist=wm_extra_dist
+        )
+    for name, exc in cell_errors.items():
+        logger.error(f"Failure getting depth info for cell {name}: {exc}")
     if ((len(layers) >= 3) | ((pia_path is not None) & (wm_path is not None))):
         if len(soma_centers) == len(cell_errors):
             raise ValueError(f"All cells in slice failed unexpectedly: {cell_errors}")
@@ -1,5 +1,6 @@
 from __future__ import print_function
-import os, re, json
+import os, re, json, time, pickle, sqlite3
+from collections import OrderedDict
 import six
 from . import config
 import sqlalchemy
@@ -22,11 +23,228 @@ def lims_engine():
     return _lims_engine
 
 
+class LimsRecord(tuple):
+    """A single row returned from LIMS.
+
+    Values may be accessed by column name (``rec['id']`` or ``rec.id``) or by
+    index (``rec[0]``), and ``dict(rec)`` works as for sqlalchemy rows. Unlike
+    sqlalchemy rows, records can be pickled, which allows them to be cached
+    and stored in a replay file.
+    """
+    def __new__(cls, keys, values):
+        rec = tuple.__new__(cls, values)
+        rec._keys = tuple(keys)
+        return rec
+
+    def __getnewargs__(self):
+        return (self._keys, tuple(self))
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                key = self._keys.index(key)
+            except ValueError:
+                raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def keys(self):
+        return list(self._keys)
+
+    def __repr__(self):
+        return "<LimsRecord %s>" % ", ".join("%s=%r" % kv for kv in zip(self._keys, self))
+
+
+class LimsReplayError(KeyError):
+    """Raised in replay mode when a query result was not recorded.
+    """
+
+
+class LimsReplayStore(object):
+    """Stores LIMS query results in a local sqlite file.
+
+    In "record" mode, every result fetched from LIMS is written to the file. In "replay"
+    mode, results are read only from the file and LIMS is never contacted; this allows
+    code that uses LIMS to run (and be tested) offline.
+    """
+    def __init__(self, path, mode='replay'):
+        assert mode in ('record', 'replay'), "mode must be 'record' or 'replay'"
+        self.path = path
+        self.mode = mode
+        self._conn = None
+        self._conn_pid = None
+
+    @property
+    def conn(self):
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            self._conn.execute("create table if not exists results (key text primary key, value blob)")
+            self._conn.commit()
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        row = self.conn.execute("select value from results where key=?", (repr(key),)).fetchone()
+        if row is None:
+            raise LimsReplayError(key)
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        self.conn.execute("insert or replace into results (key, value) values (?, ?)", (repr(key), pickle.dumps(value)))
+        self.conn.commit()
+
+
+class LimsResultCache(object):
+    """Cache of batched LIMS lookups (see _batch_query) that expire after *ttl* seconds.
+
+    Each caller receives its own copy of a cached result list, so modifying a result does
+    not affect other callers.
+
+    If a replay store is attached, results are written through to the store (record mode)
+    or read exclusively from the store (replay mode).
+    """
+    def __init__(self, ttl=600, store=None):
+        self.ttl = ttl
+        self.store = store
+        self._results = {}
+
+    def get(self, key):
+        """Return (found, value) for *key*.
+
+        In replay mode, raises LimsReplayError if *key* was never recorded.
+        """
+        if key in self._results:
+            t, value = self._results[key]
+            if self.ttl is None or time.time() - t < self.ttl:
+                return True, _copy_result(value)
+            del self._results[key]
+        if self.store is not None and self.store.mode == 'replay':
+            value = self.store.get(key)
+            self._results[key] = (time.time(), value)
+            return True, _copy_result(value)
+        return False, None
+
+    def set(self, key, value):
+        if self.ttl is None or self.ttl > 0:
+            self._results[key] = (time.time(), _copy_result(value))
+        if self.store is not None and self.store.mode == 'record':
+            self.store.set(key, value)
+
+    def clear(self):
+        self._results.clear()
+
+
+def _copy_result(value):
+    # records are immutable tuples; only the containing list needs to be copied
+    return list(value) if isinstance(value, list) else value
+
+
+_cache = None
+def result_cache():
+    """Return the LimsResultCache used for batched lookups in this module.
+
+    The cache is configured from config.lims_cache_ttl, config.lims_replay_file and
+    config.lims_replay_mode.
+    """
+    global _cache
+    if _cache is None:
+        store = None
+        if config.lims_replay_file is not None:
+            store = LimsReplayStore(config.lims_replay_file, mode=config.lims_replay_mode or 'replay')
+        _cache = LimsResultCache(ttl=config.lims_cache_ttl, store=store)
+    return _cache
+
+
+def set_replay_store(path, mode='replay'):
+    """Record LIMS results to (mode='record') or replay them from (mode='replay') a local sqlite file.
+
+    Pass path=None to return to normal operation.
+    """
+    store = None if path is None else LimsReplayStore(path, mode=mode)
+    result_cache().store = store
+    result_cache().clear()
+
+
+def clear_cache():
+    """Discard all cached LIMS results (the replay store, if any, is not affected).
+    """
+    result_cache().clear()
+
+
+def _execute(query_str):
+    with lims_engine().connect() as conn:
+        result = conn.execute(query_str)
+        keys = tuple(result.keys())
+        return [LimsRecord(keys, row) for row in result.fetchall()]
+
+
 def query(query_str):
     """Query LIMS database and return result.
+
+    Results are not cached, but string queries are recorded to / replayed from the
+    replay store if one is configured (see set_replay_store()).
     """
-    with lims_engine().connect() as conn:
-        return conn.execute(query_str).fetchall()
+    store = result_cache().store
+    if store is None or not isinstance(query_str, str):
+        return _execute(query_str)
+    key = ('query', query_str)
+    if store.mode == 'replay':
+        return store.get(key)
+    recs = _execute(query_str)
+    store.set(key, recs)
+    return recs
+
+
+# maximum number of values in a single IN (...) clause
+batch_size = 1000
+
+def _sql_list(values):
+    """Return a comma-separated SQL literal list for *values* (ints or strings).
+    """
+    items = []
+    for v in values:
+        if isinstance(v, six.integer_types):
+            items.append('%d' % v)
+        else:
+            items.append("'%s'" % str(v).replace("'", "''"))
+    return ', '.join(items)
+
+
+def _batch_query(name, keys, make_query, group_key):
+    """Run a query for many keys at once and return {key: [records]}.
+
+    *make_query* is called with an SQL list of keys to generate a query string, and
+    *group_key* returns the key that each resulting record belongs to. Results are cached
+    per key, so that a later request for any subset of the keys does not contact LIMS.
+    """
+    cache = result_cache()
+    results = {}
+    missing = set()
+    for key in keys:
+        found, recs = cache.get((name, key))
+        if found:
+            results[key] = recs
+        else:
+            missing.add(key)
+
+    missing = sorted(missing, key=repr)
+    for i in range(0, len(missing), batch_size):
+        chunk = missing[i:i+batch_size]
+        groups = OrderedDict([(key, []) for key in chunk])
+        for rec in _execute(make_query(_sql_list(chunk))):
+            groups.setdefault(group_key(rec), []).append(rec)
+        for key in chunk:
+            cache.set((name, key), groups[key])
+            results[key] = groups[key]
+
+    return OrderedDict([(key, results[key]) for key in keys])
 
 
 def specimen_info(specimen_name=None, specimen_id=None):
@@ -57,49 +275,65 @@ def specimen_info(specimen_name=None, specimen_id=None):
     section_number : indicates the order this slice was sectioned (1=first)
     """
     
-    # Query all interesting information about this specimen from LIMS
-    q = """
-        select 
-            organisms.name as organism, 
-            ages.days as age,
-            donors.date_of_birth as date_of_birth,
-            donors.full_genotype as genotype,
-            donors.weight as weight,
-            genders.name as sex,
-            structures.acronym as structure,
-            tissue_processings.section_thickness_um as thickness,
-            tissue_processings.instructions as section_instructions,
-            plane_of_sections.name as plane_of_section,
-            flipped_specimens.name as flipped,
-            specimens.histology_well_name as histology_well_name,
-            specimens.carousel_well_name as carousel_well_name,
-            specimens.parent_id as parent_id,
-            specimens.name as specimen_name,
-            specimens.id as specimen_id
-        from specimens
-            left join donors on specimens.donor_id=donors.id 
-            left join organisms on donors.organism_id=organisms.id
-            left join ages on donors.age_id=ages.id
-            left join genders on donors.gender_id=genders.id
-            left join structures on structures.id=specimens.structure_id
-            left join tissue_processings on specimens.tissue_processing_id=tissue_processings.id
-            left join plane_of_sections on tissue_processings.plane_of_section_id=plane_of_sections.id
-            left join flipped_specimens on flipped_specimens.id = specimens.flipped_specimen_id
-    """
     if specimen_name is not None:
         sid = specimen_name.strip()
-        q += "where specimens.name='%s';" % sid
+        r = specimen_info_batch(specimen_names=[sid])[sid]
     elif specimen_id is not None:
         sid = specimen_id
-        q += "where specimens.id='%d';" % sid
+        r = specimen_info_batch(specimen_ids=[sid])[sid]
     else:
         raise ValueError("Must specify specimen name or ID")
         
-    r = query(q)
     if len(r) != 1:
         raise Exception("LIMS lookup for specimen '%s' returned %d results (expected 1)" % (sid, len(r)))
-    rec = dict(r[0])
-    
+    return _parse_specimen_info(dict(r[0]))
+
+
+_specimen_info_query = """
+    select 
+        organisms.name as organism, 
+        ages.days as age,
+        donors.date_of_birth as date_of_birth,
+        donors.full_genotype as genotype,
+        donors.weight as weight,
+        genders.name as sex,
+        structures.acronym as structure,
+        tissue_processings.section_thickness_um as thickness,
+        tissue_processings.instructions as section_instructions,
+        plane_of_sections.name as plane_of_section,
+        flipped_specimens.name as flipped,
+        specimens.histology_well_name as histology_well_name,
+        specimens.carousel_well_name as carousel_well_name,
+        specimens.parent_id as parent_id,
+        specimens.name as specimen_name,
+        specimens.id as specimen_id
+    from specimens
+        left join donors on specimens.donor_id=donors.id 
+        left join organisms on donors.organism_id=organisms.id
+        left join ages on donors.age_id=ages.id
+        left join genders on donors.gender_id=genders.id
+        left join structures on structures.id=specimens.structure_id
+        left join tissue_processings on specimens.tissue_processing_id=tissue_processings.id
+        left join plane_of_sections on tissue_processings.plane_of_section_id=plane_of_sections.id
+        left join flipped_specimens on flipped_specimens.id = specimens.flipped_specimen_id
+"""
+
+
+def specimen_info_batch(specimen_names=(), specimen_ids=()):
+    """Query LIMS for the unparsed specimen_info records of many specimens at once.
+
+    Returns {specimen_name_or_id: [records]}; see specimen_info().
+    """
+    result = _batch_query('specimen_info_by_name', specimen_names,
+        lambda names: _specimen_info_query + "where specimens.name in (%s);" % names,
+        lambda rec: rec['specimen_name'])
+    result.update(_batch_query('specimen_info_by_id', specimen_ids,
+        lambda ids: _specimen_info_query + "where specimens.id in (%s);" % ids,
+        lambda rec: rec['specimen_id']))
+    return result
+
+
+def _parse_specimen_info(rec):
     # convert thickness to unscaled
     rec['thickness'] = None if rec['thickness'] is None else (rec['thickness'] * 1e-6)
     # convert organism to more easily searchable form
@@ -187,52 +421,70 @@ def specimen_images(specimen):
         Either the ID (int) or name (str) of the specimen.
     """
 
-    field = 'id' if isinstance(specimen, int) else 'name'
-    images = []
+    return specimen_images_batch([specimen])[specimen]
 
-    # First get a list of all image series for the specimen
-    q = """
-        select image_series.id, image_series.is_stack from specimens 
+
+def specimen_images_batch(specimens):
+    """Return {specimen: [image dicts]} for many specimens using two LIMS queries.
+
+    See specimen_images().
+    """
+    series_q = """
+        select specimens.id as specimen_id, specimens.name as specimen_name, 
+            image_series.id, image_series.is_stack from specimens 
         join image_series on image_series.specimen_id=specimens.id 
-        where specimens.%s='%s' and
-        image_series.type='FocalPlaneImageSeries';
-        """ % (field, specimen)
-
-    # for each image series, get all sub images and decide whether to treat them as 
-    # a stack or a set of images with different treatments
-    for image_series in query(q):
-        q = """
-            select distinct sub_images.id, images.jp2, scans.resolution, treatments.name, slides.storage_directory from image_series
-            join sub_images on sub_images.image_series_id=image_series.id
-            join images on images.id = sub_images.image_id
-            left join treatments on treatments.id = images.treatment_id
-            left join slides on slides.id=images.slide_id
-            left join scans on scans.slide_id=slides.id
-            where image_series.id=%d;
-            """ % image_series['id']
-        results = query(q)
-
-        if image_series['is_stack'] is True:
-            image_ids = {}
-            image_files = {}
-            # sift through stack and group images by treatment and resolution
-            for image in results:
-                key = (image['name'], image['resolution'])
-                image_ids.setdefault(key, []).append(image['id'])
-                image_files.setdefault(key, []).append(image['storage_directory'].rstrip('/') + '/' + image['jp2'])
-            for k in image_ids:
-                # not sure how to generate an image stack url
-                images.append({'id':image_ids[k], 'file': image_files[k], 'treatment': k[0], 'resolution': k[1], 'url': None, 'image_series': image_series['id']})
-        else:
-            for image in results:
-                if image['storage_directory'] is None:
-                    path = None
-                else:
-                    path = image['storage_directory'].rstrip('/') + '/' + image['jp2']
-                url = "http://lims2/siv?sub_image=%d" % image['id']
-                images.append({'id':image['id'], 'file': path, 'treatment': image['name'], 'resolution': image['resolution'], 'url': url, 'image_series': image_series['id']})
+        where specimens.%s in (%%s) and
+        image_series.type='FocalPlaneImageSeries'
+        order by image_series.id;
+        """
+    spec_ids = [s for s in specimens if isinstance(s, int)]
+    spec_names = [s for s in specimens if not isinstance(s, int)]
+    all_series = _batch_query('image_series_by_id', spec_ids, lambda ids: series_q % ('id', ids), lambda rec: rec['specimen_id'])
+    all_series.update(_batch_query('image_series_by_name', spec_names, lambda names: series_q % ('name', names), lambda rec: rec['specimen_name']))
+
+    # get all sub images for all image series
+    series_ids = [s['id'] for recs in all_series.values() for s in recs]
+    all_sub_images = _batch_query('sub_images', series_ids, lambda ids: """
+        select distinct image_series.id as image_series_id, sub_images.id, images.jp2, scans.resolution, treatments.name, slides.storage_directory from image_series
+        join sub_images on sub_images.image_series_id=image_series.id
+        join images on images.id = sub_images.image_id
+        left join treatments on treatments.id = images.treatment_id
+        left join slides on slides.id=images.slide_id
+        left join scans on scans.slide_id=slides.id
+        where image_series.id in (%s)
+        order by sub_images.id;
+        """ % ids, lambda rec: rec['image_series_id'])
+
+    result = OrderedDict()
+    for specimen in specimens:
+        images = []
+        # for each image series, decide whether to treat sub images as 
+        # a stack or a set of images with different treatments
+        for image_series in all_series[specimen]:
+            results = all_sub_images[image_series['id']]
+
+            if image_series['is_stack'] is True:
+                image_ids = {}
+                image_files = {}
+                # sift through stack and group images by treatment and resolution
+                for image in results:
+                    key = (image['name'], image['resolution'])
+                    image_ids.setdefault(key, []).append(image['id'])
+                    image_files.setdefault(key, []).append(image['storage_directory'].rstrip('/') + '/' + image['jp2'])
+                for k in image_ids:
+                    # not sure how to generate an image stack url
+                    images.append({'id':image_ids[k], 'file': image_files[k], 'treatment': k[0], 'resolution': k[1], 'url': None, 'image_series': image_series['id']})
+            else:
+                for image in results:
+                    if image['storage_directory'] is None:
+                        path = None
+                    else:
+                        path = image['storage_directory'].rstrip('/') + '/' + image['jp2']
+                    url = "http://lims2/siv?sub_image=%d" % image['id']
+                    images.append({'id':image['id'], 'file': path, 'treatment': image['name'], 'resolution': image['resolution'], 'url': url, 'image_series': image_series['id']})
+        result[specimen] = images
             
-    return images
+    return result
 
 
 def specimen_20x_image(specimen, treatment='Biocytin'):
@@ -288,10 +540,20 @@ def donor_medical_conditions(donor_id=None, specimen=None):
 def specimen_id_from_name(spec_name):
     """Return the LIMS ID of a specimen give its name.
     """
-    recs = query("select id from specimens where name='%s'" % spec_name)
-    if len(recs) == 0:
+    ids = specimen_ids_from_names([spec_name])
+    if spec_name not in ids:
         raise ValueError('No LIMS specimen named "%s"' % spec_name)
-    return recs[0]['id']
+    return ids[spec_name]
+
+
+def specimen_ids_from_names(spec_names):
+    """Return {name: id} for all specimens in *spec_names* that exist in LIMS.
+    """
+    recs = _batch_query('specimen_id', spec_names,
+        lambda names: "select id, name from specimens where name in (%s)" % names,
+        lambda rec: rec['name'])
+    return OrderedDict([(name, r[0]['id']) for name, r in recs.items() if len(r) > 0])
+
 
 def find_specimen_ids_matching_name(spec_name):
     """Return a list of LIMS IDs whose names include spec_name"""
@@ -341,15 +603,21 @@ def cell_cluster_ids(specimen):
     """
     if not isinstance(specimen, int):
         specimen = specimen_id_from_name(specimen)
-    q = """
-    select specimens.id from specimens 
-    join specimen_types_specimens on specimen_types_specimens.specimen_id=specimens.id
-    join specimen_types on specimen_types.id=specimen_types_specimens.specimen_type_id
-    where specimens.parent_id=%d
-    and specimen_types.name='CellCluster'
-    """ % specimen
-    recs = query(q)
-    return [rec['id'] for rec in recs]
+    return cell_cluster_ids_batch([specimen])[specimen]
+
+
+def cell_cluster_ids_batch(specimen_ids):
+    """Return {specimen_id: [cell_cluster_ids]} for many specimens using a single query.
+    """
+    recs = _batch_query('cell_cluster_ids', specimen_ids, lambda ids: """
+        select specimens.id, specimens.parent_id from specimens 
+        join specimen_types_specimens on specimen_types_specimens.specimen_id=specimens.id
+        join specimen_types on specimen_types.id=specimen_types_specimens.specimen_type_id
+        where specimens.parent_id in (%s)
+        and specimen_types.name='CellCluster'
+        order by specimens.id
+        """ % ids, lambda rec: rec['parent_id'])
+    return OrderedDict([(spec_id, [rec['id'] for rec in r]) for spec_id, r in recs.items()])
 
 
 def child_specimens(specimen):
@@ -387,16 +655,24 @@ def cell_cluster_data_paths(specimen):
 def specimen_metadata(specimen):
     if not isinstance(specimen, int):
         specimen = specimen_id_from_name(specimen)
-    recs = query("select data from specimen_metadata where specimen_id=%d" % specimen)
-    if len(recs) == 0:
-        return None
-    meta = recs[0]['data']
-    if meta == '':
-        return None
+    return specimen_metadata_batch([specimen])[specimen]
 
-    if isinstance(meta, six.string_types):
-        meta = json.loads(meta)  # unserialization corrects for a LIMS bug; we can remove this later.
-    return meta
+
+def specimen_metadata_batch(specimen_ids):
+    """Return {specimen_id: metadata} for many specimens using a single query.
+    """
+    result = OrderedDict()
+    recs = _batch_query('specimen_metadata', specimen_ids,
+        lambda ids: "select specimen_id, data from specimen_metadata where specimen_id in (%s)" % ids,
+        lambda rec: rec['specimen_id'])
+    for spec_id, r in recs.items():
+        meta = None if len(r) == 0 else r[0]['data']
+        if meta == '':
+            meta = None
+        if isinstance(meta, six.string_types):
+            meta = json.loads(meta)  # unserialization corrects for a LIMS bug; we can remove this later.
+        result[spec_id] = meta
+    return result
 
 def specimen_tags(specimen):
     if not isinstance(specimen, int):
@@ -554,8 +830,7 @@ def expt_cluster_ids(specimen, acq_timestamp):
         specimen = specimen_id_from_name(specimen)
     cluster_ids = cell_cluster_ids(specimen)
     cids = []
-    for cid in cluster_ids:
-        meta = specimen_metadata(cid)
+    for cid, meta in specimen_metadata_batch(cluster_ids).items():
         if meta is not None and meta['acq_timestamp'] == acq_timestamp:
             cids.append(cid)
     return cids
@@ -566,15 +841,20 @@ def cluster_cells(cluster):
     """
     if not isinstance(cluster, int):
         cluster = specimen_id_from_name(cluster)
-    
-    q = """select child.id, child.name, child.x_coord, child.y_coord, child.external_specimen_name, child.ephys_qc_result
-    from specimens parent 
-    inner join specimens child on child.parent_id=parent.id
-    where parent.id=%d
-    """ % cluster
+    return cluster_cells_batch([cluster])[cluster]
 
-    recs = query(q)
-    return recs
+
+def cluster_cells_batch(clusters):
+    """Return {cluster_id: [cell records]} for many CellCluster IDs using a single query.
+    """
+    return _batch_query('cluster_cells', clusters, lambda ids: """
+        select child.id, child.name, child.x_coord, child.y_coord, child.external_specimen_name, child.ephys_qc_result,
+            parent.id as cluster_id
+        from specimens parent 
+        inner join specimens child on child.parent_id=parent.id
+        where parent.id in (%s)
+        order by child.id
+        """ % ids, lambda rec: rec['cluster_id'])
 
 
 def cluster_ephys_roi_result(specimen):
@@ -582,17 +862,25 @@ def cluster_ephys_roi_result(specimen):
     """
     if not isinstance(specimen, int):
         specimen = specimen_id_from_name(specimen)
-    recs = query("""
-        select ephys_roi_results.id
-        from specimens 
-        join ephys_roi_results on ephys_roi_results.id=specimens.ephys_roi_result_id
-        where specimens.id=%d
-    """ % specimen)
-    if len(recs) == 0:
+    result_ids = cluster_ephys_roi_results_batch([specimen])[specimen]
+    if len(result_ids) == 0:
         return None
-    if len(recs) > 1:
+    if len(result_ids) > 1:
         raise Exception("Multiple ephys results for specimen %s" % specimen)
-    return recs[0]['id']
+    return result_ids[0]
+
+
+def cluster_ephys_roi_results_batch(clusters):
+    """Return {cluster_id: [ephys_roi_result_ids]} for many CellCluster IDs using a single query.
+    """
+    recs = _batch_query('cluster_ephys_roi_results', clusters, lambda ids: """
+        select specimens.id as specimen_id, ephys_roi_results.id
+        from specimens 
+        join ephys_roi_results on ephys_roi_results.id=specimens.ephys_roi_result_id
+        where specimens.id in (%s)
+        order by ephys_roi_results.id
+        """ % ids, lambda rec: rec['specimen_id'])
+    return OrderedDict([(cid, [rec['id'] for rec in r]) for cid, r in recs.items()])
 
 
 def cell_specimen_ids(cell_cluster):
@@ -625,19 +913,24 @@ def cell_layer(cell):
     """
     if not isinstance(cell, int):
         cell = specimen_id_from_name(cell)
+    return cell_layer_batch([cell])[cell]
 
-    q = """select structures.acronym
-    from structures
-    left join specimens on specimens.cortex_layer_id=structures.id
-    where specimens.id=%d
-    """ % cell
 
-    recs = query(q)
-    if len(recs) == 0:
-        return None
-    if len(recs) != 1:
-        raise Exception ('Incorrect number of layers for cell %d' % cell)
-    return recs[0][0]
+def cell_layer_batch(cells):
+    """Return {cell_specimen_id: layer} for many cell specimen IDs using a single query.
+    """
+    recs = _batch_query('cell_layer', cells, lambda ids: """
+        select structures.acronym, specimens.id
+        from structures
+        left join specimens on specimens.cortex_layer_id=structures.id
+        where specimens.id in (%s)
+        """ % ids, lambda rec: rec['id'])
+    layers = OrderedDict()
+    for cell, r in recs.items():
+        if len(r) > 1:
+            raise Exception ('Incorrect number of layers for cell %d' % cell)
+        layers[cell] = None if len(r) == 0 else r[0][0]
+    return layers
 
 def all_cell_layers():
     """ Return layer calls for all Cell specimens 
@@ -653,16 +946,21 @@ def all_cell_layers():
     recs = query(q)
     return recs
 
-def query_for_layer_polygons(
-    focal_plane_image_series_id):
+def query_for_layer_polygons(focal_plane_image_series_id):
     """ Get all layer polygons for this image series
     """
+    return layer_polygons_batch([focal_plane_image_series_id])[focal_plane_image_series_id]
 
-    q = f"""
+
+def layer_polygons_batch(focal_plane_image_series_ids):
+    """ Return {image_series_id: [layer polygons]} for many image series using a single query
+    """
+    return _batch_query('layer_polygons', focal_plane_image_series_ids, lambda ids: f"""
         select distinct
             st.acronym as name,
             polygon.path as path,
-            sc.resolution as resolution
+            sc.resolution as resolution,
+            imser.id as image_series_id
         from specimens sp
         join specimens spp on spp.id = sp.parent_id
         join image_series imser on imser.specimen_id = spp.id
@@ -676,11 +974,10 @@ def query_for_layer_polygons(
         join avg_graphic_objects polygon on polygon.parent_id = layer.id
         join structures st on st.id = polygon.cortex_layer_id
         where
-            imser.id = {focal_plane_image_series_id}
+            imser.id in ({ids})
             and label.name in ('Cortical Layers')
             and tm.name = 'Biocytin' -- the polys are duplicated between 'Biocytin' and 'DAPI' images. Need only one of these
-        """
-    return query(q)
+        """, lambda rec: rec['image_series_id'])
 
 if __name__ == '__main__':
     # testing specimen
@@ -18,6 +18,8 @@ from neuroanalysis.data import TSeries, TSeriesList
 from neuroanalysis.baseline import float_mode
 from neuroanalysis.filter import bessel_filter
 from aisynphys.connectivity import pair_was_probed, connection_probability_ci, pair_probed_gj
+from aisynphys.data import TSeriesStack
+from aisynphys.cell_class import cell_class_key
 
 
 thermal_colormap = pg.ColorMap(
@@ -27,6 +29,12 @@ thermal_colormap = pg.ColorMap(
 
 syn_typ_holding = {'ex': [-70], 'in': [-55]}
 
+
+def element_key(pre_class, post_class, pairs):
+    """Return a hashable key for one matrix element: its pre/post cell classes and the pairs it contains.
+    """
+    return (cell_class_key(pre_class), cell_class_key(post_class), tuple(pair.id for pair in pairs))
+
 class FormattableNumber(float):
 
     @property
@@ -101,6 +109,46 @@ class Analyzer(pg.QtCore.QObject):
 
     sigOutputChanged = pg.QtCore.Signal(object)
 
+    def __init__(self):
+        pg.QtCore.QObject.__init__(self)
+        # results memoized per matrix element (see element_key)
+        self.element_results = {}
+        self.element_group_results = {}
+
+    def measure(self, pair_groups):
+        """Given a dict that groups cell pairs by (pre_class, post_class), return a DataFrame with
+        one row per pair.
+
+        Rows are computed by measure_element() and memoized per matrix element, so after a change to
+        the cell classes only elements with new classes or pairs are measured again.
+        """
+        if self.results is not None:
+            return self.results
+
+        results = OrderedDict()
+        for (pre_class, post_class), class_pairs in pair_groups.items():
+            key = element_key(pre_class, post_class, class_pairs)
+            rows = self.element_results.get(key)
+            if rows is None:
+                rows = self.measure_element(pre_class, post_class, class_pairs)
+                self.element_results[key] = rows
+            results.update(rows)
+
+        self.results = pd.DataFrame.from_dict(results, orient='index')
+
+        return self.results
+
+    def measure_element(self, pre_class, post_class, class_pairs):
+        """Return an OrderedDict {pair: {field: value}} for all pairs in one matrix element.
+        """
+        raise NotImplementedError()
+
+    def clear_cache(self):
+        """Discard all memoized element results (eg. because the list of pairs changed).
+        """
+        self.element_results = {}
+        self.element_group_results = {}
+        self.invalidate_output()
 
     def group_result(self, pair_groups):
         if self.group_results is not None:
@@ -119,9 +167,13 @@ class Analyzer(pg.QtCore.QObject):
         for pair_class, pair_group in pair_groups.items():
             if len(pair_group) == 0:
                 continue
-            res = self.results.loc[pair_group]
-            res['extra'] = [0]*len(res.index) ## create an extra column to group by.
-            result = res.groupby(['extra']).agg(self.summary_stat) 
+            key = element_key(pair_class[0], pair_class[1], pair_group)
+            result = self.element_group_results.get(key)
+            if result is None:
+                res = self.results.loc[pair_group]
+                res['extra'] = [0]*len(res.index) ## create an extra column to group by.
+                result = res.groupby(['extra']).agg(self.summary_stat) 
+                self.element_group_results[key] = result
 
             if group_results is None:
                 group_results = pd.DataFrame(result, index=index)
@@ -262,49 +314,41 @@ class ConnectivityAnalyzer(Analyzer):
         self.results = None
         self.group_results = None
 
-    def measure(self, pair_groups):
-        """Given a list of cell pairs and a dict that groups cells together by class,
-        return a structure that describes connectivity of each cell pair.
-        """    
-        if self.results is not None:
-            return self.results
-
+    def measure_element(self, pre_class, post_class, class_pairs):
+        """Return a structure that describes connectivity of each cell pair in one matrix element
+        (see Analyzer.measure).
+        """
         results = OrderedDict()
+        for pair in class_pairs:
+            no_data = False
+            probed = pair_was_probed(pair, pre_class.output_synapse_type)
+            gj_probed = pair_probed_gj(pair)
+            if probed is False or gj_probed is False:
+                no_data = True
+
+            connected = pair.has_synapse if probed is True else False
+            gap = pair.has_electrical if gj_probed is True else False
+            distance = pair.distance if probed is True else float('nan')
+            
 
-        for key, class_pairs in pair_groups.items():
-            pre_class, post_class = key
-            for pair in class_pairs:
-                no_data = False
-                probed = pair_was_probed(pair, pre_class.output_synapse_type)
-                gj_probed = pair_probed_gj(pair)
-                if probed is False or gj_probed is False:
-                    no_data = True
-
-                connected = pair.has_synapse if probed is True else False
-                gap = pair.has_electrical if gj_probed is True else False
-                distance = pair.distance if probed is True else float('nan')
-                
-
-                results[pair] = {
-                'conn_no_data': no_data,
-                'pre_class': pre_class,
-                'post_class': post_class,
-                'Probed Connection': probed,
-                'Connected': connected,
-                'Gap Junction': gap,
-                'Distance': distance,
-                'Connection Probability': [int(connected) if connected is not None else 0, int(probed) if probed is not None else 0],
-                'Gap Junction Probability': [int(gap) if gap is not None else 0, int(gj_probed) if gj_probed is not None else 0],
-                'matrix_completeness': [int(connected) if connected is not None else 0, int(probed) if probed is not None else 0],
-                
-                }
-
-                if self.analyzer_mode == 'external':
-                    del(results[pair]['matrix_completeness'])
+            results[pair] = {
+            'conn_no_data': no_data,
+            'pre_class': pre_class,
+            'post_class': post_class,
+            'Probed Connection': probed,
+            'Connected': connected,
+            'Gap Junction': gap,
+            'Distance': distance,
+            'Connection Probability': [int(connected) if connected is not None else 0, int(probed) if probed is not None else 0],
+            'Gap Junction Probability': [int(gap) if gap is not None else 0, int(gj_probed) if gj_probed is not None else 0],
+            'matrix_completeness': [int(connected) if connected is not None else 0, int(probed) if probed is not None else 0],
+            
+            }
 
-        self.results = pd.DataFrame.from_dict(results, orient='index')
+            if self.analyzer_mode == 'external':
+                del(results[pair]['matrix_completeness'])
 
-        return self.results
+        return results
 
     def output_fields(self):
 
@@ -391,7 +435,7 @@ class ConnectivityAnalyzer(Analyzer):
             self.pair_items[pair.id] = [trace_itemA, trace_itemB]
 
         if len(tracesA) > 0:
-            grand_trace = TSeriesList(tracesA).mean()
+            grand_trace = TSeriesStack.from_tseries(tracesA).mean()
             name = ('%s->%s' % (pre_class, post_class))
             # trace_plt[0].addLegend()
             trace_plt[0].plot(grand_trace.time_values, grand_trace.data, pen={'color': color, 'width': 3}, name=name)
@@ -399,7 +443,7 @@ class ConnectivityAnalyzer(Analyzer):
             trace_plt[0].setLabels(left=('', 'A'), bottom=('Response Onset', 's'))
             trace_plt[0].setTitle('Voltage Clamp')
         if len(tracesB) > 0:
-            grand_trace = TSeriesList(tracesB).mean()
+            grand_trace = TSeriesStack.from_tseries(tracesB).mean()
             trace_plt[1].plot(grand_trace.time_values, grand_trace.data, pen={'color': color, 'width': 3})
             trace_plt[1].setLabels(right=('', 'V'), bottom=('Response Onset', 's'))
             trace_plt[1].setTitle('Current Clamp')
@@ -548,60 +592,51 @@ class StrengthAnalyzer(Analyzer):
         self.group_results = None
         self.pair_items = {}
 
-    def measure(self, pair_groups):
-        """Given a list of cell pairs and a dict that groups cells together by class,
-        return a structure that describes strength and kinetics of each cell pair.
-        """  
-        if self.results is not None:
-            return self.results
-
+    def measure_element(self, pre_class, post_class, class_pairs):
+        """Return a structure that describes strength and kinetics of each cell pair in one matrix element
+        (see Analyzer.measure).
+        """
         results = OrderedDict()
-        
-        for key, class_pairs in pair_groups.items():
-            pre_class, post_class = key
-
-            for pair in class_pairs:
-                no_data = False
-                synapse = None
-                gap = None
-                if pair.has_synapse is not True and pair.has_electrical is not True:
-                    no_data = True
-                if pair.has_synapse is True:
-                    synapse = pair.synapse   
-                if pair.has_electrical is True:
-                    gap = pair.gap_junction
-                if synapse is None and gap is None:   
-                    no_data = True
-                if synapse is not None:
-                    psp_amp = synapse.psp_amplitude
-                    psp_decay_tau = synapse.psp_decay_tau
-                    psp_rise_time = synapse.psp_rise_time 
-                    psc_amp = synapse.psc_amplitude
-                    psc_rise_time = synapse.psc_rise_time
-                    psc_decay_tau = synapse.psc_decay_tau
-                    latency = synapse.latency
-                if gap is not None:
-                    coupling_coeff = gap.coupling_coeff_pulse
-                    junctional_cond = gap.junctional_conductance           
-
-                results[pair] = {
-                'strength_no_data': no_data,
-                'pre_class': pre_class,
-                'post_class': post_class,
-                'PSP Amplitude': psp_amp if synapse is not None else float('nan'),
-                'PSP Rise Time': psp_rise_time if synapse is not None else float('nan'),
-                'PSP Decay Tau': psp_decay_tau if synapse is not None else float('nan'),
-                'PSC Amplitude': psc_amp if synapse is not None else float('nan'),
-                'PSC Rise Time': psc_rise_time if synapse is not None else float('nan'),
-                'PSC Decay Tau': psc_decay_tau if synapse is not None else float('nan'),
-                'Latency': latency if synapse is not None else float('nan'),
-                'Coupling Coefficient': coupling_coeff if gap is not None else float('nan'),
-                'Junctional Conductance': junctional_cond if gap is not None else float('nan'),
-                }
-
-        self.results = pd.DataFrame.from_dict(results, orient='index')
-
-        return self.results
+        for pair in class_pairs:
+            no_data = False
+            synapse = None
+            gap = None
+            if pair.has_synapse is not True and pair.has_electrical is not True:
+                no_data = True
+            if pair.has_synapse is True:
+                synapse = pair.synapse   
+            if pair.has_electrical is True:
+                gap = pair.gap_junction
+            if synapse is None and gap is None:   
+                no_data = True
+            if synapse is not None:
+                psp_amp = synapse.psp_amplitude
+                psp_decay_tau = synapse.psp_decay_tau
+                psp_rise_time = synapse.psp_rise_time 
+                psc_amp = synapse.psc_amplitude
+                psc_rise_time = synapse.psc_rise_time
+                psc_decay_tau = synapse.psc_decay_tau
+                latency = synapse.latency
+            if gap is not None:
+                coupling_coeff = gap.coupling_coeff_pulse
+                junctional_cond = gap.junctional_conductance           
+
+            results[pair] = {
+            'strength_no_data': no_data,
+            'pre_class': pre_class,
+            'post_class': post_class,
+            'PSP Amplitude': psp_amp if synapse is not None else float('nan'),
+            'PSP Rise Time': psp_rise_time if synapse is not None else float('nan'),
+            'PSP Decay Tau': psp_decay_tau if synapse is not None else float('nan'),
+            'PSC Amplitude': psc_amp if synapse is not None else float('nan'),
+            'PSC Rise Time': psc_rise_time if synapse is not None else float('nan'),
+            'PSC Decay Tau': psc_decay_tau if synapse is not None else float('nan'),
+            'Latency': latency if synapse is not None else float('nan'),
+            'Coupling Coefficient': coupling_coeff if gap is not None else float('nan'),
+            'Junctional Conductance': junctional_cond if gap is not None else float('nan'),
+            }
+
+        return results
 
     def output_fields(self):
 
@@ -713,7 +748,7 @@ class StrengthAnalyzer(Analyzer):
                 x_label = 'Time from presynaptic spike'
             else:
                 x_label = 'Response Onset'
-            grand_trace = TSeriesList(tracesA).mean()
+            grand_trace = TSeriesStack.from_tseries(tracesA).mean()
             name = ('%s->%s, n=%d' % (pre_class, post_class, len(tracesA)))
             trace_plt[1].plot(grand_trace.time_values, grand_trace.data, pen={'color': color, 'width': 3}, name=name)
             units = 'A' if field_name.startswith('PSC') else 'V'
@@ -726,7 +761,7 @@ class StrengthAnalyzer(Analyzer):
             trace_plt[1].hideAxis('left')
             spike_line = pg.InfiniteLine(0, pen={'color': 'w', 'width': 1, 'style': pg.QtCore.Qt.DotLine}, movable=False)
             trace_plt[0].addItem(spike_line)
-            grand_trace = TSeriesList(tracesB).mean()
+            grand_trace = TSeriesStack.from_tseries(tracesB).mean()
             trace_plt[0].plot(grand_trace.time_values, grand_trace.data, pen={'color': color, 'width': 3})
             trace_plt[0].setXRange(-5e-3, 20e-3)
             trace_plt[0].setLabels(left=('', 'A'), bottom=('Time from presynaptic spike', 's'))
@@ -909,49 +944,40 @@ class DynamicsAnalyzer(Analyzer):
         n = np.isfinite(x).sum()
         return np.clip(n / 10, 0, 1)
 
-    def measure(self, pair_groups):
-        """Given a list of cell pairs and a dict that groups cells together by class,
-        return a structure that describes dynamics of each cell pair.
-        """  
-        if self.results is not None:
-            return self.results
-
+    def measure_element(self, pre_class, post_class, class_pairs):
+        """Return a structure that describes dynamics of each cell pair in one matrix element
+        (see Analyzer.measure).
+        """
         results = OrderedDict()
-        for key, class_pairs in pair_groups.items():
-            pre_class, post_class = key
-            
-            for pair in class_pairs:
-                if pair.has_synapse is not True:
-                    no_data = True
-                    dynamics = None
-                elif pair.has_synapse is True:
-                    no_data = False
-                    dynamics = pair.dynamics
-
-                lcv_rest = (dynamics.variability_resting_state if dynamics is not None else np.nan) or np.nan
-                lcv_sec = (dynamics.variability_second_pulse_50hz if dynamics is not None else np.nan) or np.nan
-                lcv_train = (dynamics.variability_stp_induced_state_50hz if dynamics is not None else np.nan) or np.nan
-                results[pair] = {
-                    'dynamics_no_data': no_data,
-                    'pre_class': pre_class,
-                    'post_class': post_class,
-                    'Paired pulse STP': dynamics.stp_initial_50hz if dynamics is not None else np.nan,
-                    'Train-induced STP': dynamics.stp_induction_50hz if dynamics is not None else np.nan,
-                    'STP recovery': dynamics.stp_recovery_250ms if dynamics is not None else np.nan,
-                    'PSP 90th Percentile': dynamics.pulse_amp_90th_percentile if dynamics is not None else np.nan,
-                    'Variability - resting state': lcv_rest,
-                    'Variability - second pulse': lcv_sec,
-                    'Variability - train induced': lcv_train,
-                    'Initial variability change': lcv_sec - lcv_rest,
-                    'Train-induced variability change': lcv_train - lcv_rest,
-                    'Paired event correlation r': dynamics.paired_event_correlation_1_2_r if dynamics is not None else np.nan,
-                    'Paired event correlation p': dynamics.paired_event_correlation_1_2_p if dynamics is not None else np.nan,
-                }
+        for pair in class_pairs:
+            if pair.has_synapse is not True:
+                no_data = True
+                dynamics = None
+            elif pair.has_synapse is True:
+                no_data = False
+                dynamics = pair.dynamics
 
-        
-        self.results = pd.DataFrame.from_dict(results, orient='index')
-        
-        return self.results
+            lcv_rest = (dynamics.variability_resting_state if dynamics is not None else np.nan) or np.nan
+            lcv_sec = (dynamics.variability_second_pulse_50hz if dynamics is not None else np.nan) or np.nan
+            lcv_train = (dynamics.variability_stp_induced_state_50hz if dynamics is not None else np.nan) or np.nan
+            results[pair] = {
+                'dynamics_no_data': no_data,
+                'pre_class': pre_class,
+                'post_class': post_class,
+                'Paired pulse STP': dynamics.stp_initial_50hz if dynamics is not None else np.nan,
+                'Train-induced STP': dynamics.stp_induction_50hz if dynamics is not None else np.nan,
+                'STP recovery': dynamics.stp_recovery_250ms if dynamics is not None else np.nan,
+                'PSP 90th Percentile': dynamics.pulse_amp_90th_percentile if dynamics is not None else np.nan,
+                'Variability - resting state': lcv_rest,
+                'Variability - second pulse': lcv_sec,
+                'Variability - train induced': lcv_train,
+                'Initial variability change': lcv_sec - lcv_rest,
+                'Train-induced variability change': lcv_train - lcv_rest,
+                'Paired event correlation r': dynamics.paired_event_correlation_1_2_r if dynamics is not None else np.nan,
+                'Paired event correlation p': dynamics.paired_event_correlation_1_2_p if dynamics is not None else np.nan,
+            }
+
+        return results
 
     # def group_result(self):
     #     if self.group_results is not None:
@@ -1016,7 +1042,7 @@ class DynamicsAnalyzer(Analyzer):
             self.pair_items[pair_id] = [point, color]
         scatter.sigClicked.connect(self.scatter_plot_clicked)
         if len(traces) > 0:
-            grand_trace = TSeriesList(traces).mean()
+            grand_trace = TSeriesStack.from_tseries(traces).mean()
             trace_plt.plot(grand_trace.time_values, grand_trace.data, pen={'color': color, 'width': 3})
             units = 'V' if field_name.startswith('ic') else 'A'
             trace_plt.setXRange(0, 20e-3)
@@ -1056,6 +1082,7 @@ class CellAnalyzer(pg.QtCore.QObject):
 
         self.text = {}
         self.results = None
+        self.class_results = {}
 
         self.fields = [
             ('cell_class_nonsynaptic', {'mode': 'enum', 'values': ['ex', 'in'], 'defaults' : {
@@ -1134,56 +1161,70 @@ class CellAnalyzer(pg.QtCore.QObject):
         """Given a list of cells and a dict that groups cells together by class,
         return a structure that describes cell properties such as intrinsic ephys,
         morphology, transcriptomics.
+
+        Rows are memoized per cell class, so only new or changed classes are measured again.
         """  
 
         if self.results is not None:
             return self.results
 
-
         results = OrderedDict()
         for cell_class, class_cells in cell_groups.items(): 
-            for cell in class_cells:
-                
-                start = cell.electrode.start_time
-                stop = cell.electrode.stop_time
-
-                if start is not None and stop is not None:
-                    rec_length = (stop - start).total_seconds()/60.
-                else:
-                    rec_length = float('nan')
-
-                results[cell] = {
-                    'target_layer': cell.target_layer,
-                    'depth': cell.depth,
-                    'cre_type': cell.cre_type,
-                    'CellClass': cell_class,
-                    'cell_class_nonsynaptic': cell.cell_class_nonsynaptic,
-                    'time_stamp': cell.experiment.acq_timestamp,
-                    'recording_length': rec_length,
-                    # 'rig_operator': cell.experiment.operator_name,
-                }
-                
-                cell_attributes = {
-                    cell.intrinsic: self.intrinsic_fields,
-                    cell.morphology: self.morpho_fields,
-                    cell.patch_seq: self.patchseq_fields,
-                    cell.cortical_location: self.cell_location_fields,
-                }             
-
-
-                
-                for attribute, fields in cell_attributes.items():
-                    cols = [field[0] for field in fields]
-
-                    if attribute is not None: 
-                        results[cell].update({col: getattr(attribute, col) for col in cols})
-                    else:
-                        results[cell].update({col: float('nan') for col in cols})
+            key = (cell_class_key(cell_class), tuple(sorted(cell.id for cell in class_cells)))
+            rows = self.class_results.get(key)
+            if rows is None:
+                rows = self.measure_class(cell_class, class_cells)
+                self.class_results[key] = rows
+            results.update(rows)
 
         self.results = pd.DataFrame.from_dict(results, orient='index')
         
         return self.results
 
+    def measure_class(self, cell_class, class_cells):
+        """Return {cell: {field: value}} for all cells in one cell class.
+        """
+        results = OrderedDict()
+        for cell in class_cells:
+            
+            start = cell.electrode.start_time
+            stop = cell.electrode.stop_time
+
+            if start is not None and stop is not None:
+                rec_length = (stop - start).total_seconds()/60.
+            else:
+                rec_length = float('nan')
+
+            results[cell] = {
+                'target_layer': cell.target_layer,
+                'depth': cell.depth,
+                'cre_type': cell.cre_type,
+                'CellClass': cell_class,
+                'cell_class_nonsynaptic': cell.cell_class_nonsynaptic,
+                'time_stamp': cell.experiment.acq_timestamp,
+                'recording_length': rec_length,
+                # 'rig_operator': cell.experiment.operator_name,
+            }
+            
+            cell_attributes = {
+                cell.intrinsic: self.intrinsic_fields,
+                cell.morphology: self.morpho_fields,
+                cell.patch_seq: self.patchseq_fields,
+                cell.cortical_location: self.cell_location_fields,
+            }             
+
+
+            
+            for attribute, fields in cell_attributes.items():
+                cols = [field[0] for field in fields]
+
+                if attribute is not None: 
+                    results[cell].update({col: getattr(attribute, col) for col in cols})
+                else:
+                    results[cell].update({col: float('nan') for col in cols})
+
+        return results
+
     def output_fields(self):
 
         fields = [self.intrinsic_fields, self.morpho_fields, self.cell_location_fields, self.patchseq_fields]
@@ -1196,6 +1237,10 @@ class CellAnalyzer(pg.QtCore.QObject):
     def invalidate_output(self):
         self.results = None
 
+    def clear_cache(self):
+        self.class_results = {}
+        self.invalidate_output()
+
 
 def format_trace(trace, baseline_win, x_offset=1e-3):
     baseline = float_mode(trace.time_slice(baseline_win[0],baseline_win[1]).data)
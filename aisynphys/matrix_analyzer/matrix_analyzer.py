@@ -18,7 +18,7 @@ from pyqtgraph.widgets.DataFilterWidget import DataFilterParameter
 
 from aisynphys.database import default_db as db
 from aisynphys import constants
-from aisynphys.cell_class import CellClass, classify_cells, classify_pairs
+from aisynphys.cell_class import CellClass, ClassificationCache, cell_class_key
 from .analyzers import ConnectivityAnalyzer, StrengthAnalyzer, DynamicsAnalyzer, get_all_output_fields, CellAnalyzer
 from .matrix_display import MatrixDisplay, MatrixWidget
 from .scatter_plot_display import ScatterPlotTab
@@ -114,28 +114,39 @@ class ExperimentFilter(object):
         Internally uses aisynphys.db.pair_query.
         """
         if self.pairs is None:
-            selected_projects = [child.name() for child in self.params.child('Projects').children() if child.value() is True]
-            selected_acsf = [child.name() for child in self.params.child('ACSF [Ca2+]').children() if child.value() is True]
-            selected_internal = [child.name() for child in self.params.child('Internal [EGTA]').children() if child.value() is True]
-            project_names = selected_projects if len(selected_projects) > 0 else None 
-            internal_recipes = selected_internal if len(selected_internal) > 0 else None
-            acsf_recipes = selected_acsf if len(selected_acsf) > 0 else None
-            if self.analyzer_mode == 'external':
-                if project_names is not None:
-                    project_names = []
-                    [project_names.extend(self.project_keys[project]) for project in selected_projects]
-                if internal_recipes is not None:
-                    internal_recipes = []
-                    [internal_recipes.extend(self.internal_keys[internal]) for internal in selected_internal]
-                if acsf_recipes is not None:
-                    acsf_recipes = []
-                    [acsf_recipes.extend(self.acsf_keys[acsf]) for acsf in selected_acsf]
+            project_names, acsf_recipes, internal_recipes = self.selection()
             pair_records = db.pair_query(project_name=project_names, acsf=acsf_recipes, session=session, internal=internal_recipes, preload=['cell']).all()
             self.pairs = [rec.Pair for rec in pair_records]
+            self.pairs_selection = (project_names, acsf_recipes, internal_recipes)
             
         return self.pairs
 
+    def selection(self):
+        """Return the (project_names, acsf_recipes, internal_recipes) currently selected, with None
+        for any group that has nothing selected.
+        """
+        selected_projects = [child.name() for child in self.params.child('Projects').children() if child.value() is True]
+        selected_acsf = [child.name() for child in self.params.child('ACSF [Ca2+]').children() if child.value() is True]
+        selected_internal = [child.name() for child in self.params.child('Internal [EGTA]').children() if child.value() is True]
+        project_names = selected_projects if len(selected_projects) > 0 else None 
+        internal_recipes = selected_internal if len(selected_internal) > 0 else None
+        acsf_recipes = selected_acsf if len(selected_acsf) > 0 else None
+        if self.analyzer_mode == 'external':
+            if project_names is not None:
+                project_names = []
+                [project_names.extend(self.project_keys[project]) for project in selected_projects]
+            if internal_recipes is not None:
+                internal_recipes = []
+                [internal_recipes.extend(self.internal_keys[internal]) for internal in selected_internal]
+            if acsf_recipes is not None:
+                acsf_recipes = []
+                [acsf_recipes.extend(self.acsf_keys[acsf]) for acsf in selected_acsf]
+        return project_names, acsf_recipes, internal_recipes
+
     def invalidate_output(self):
+        if self.pairs is not None and self.selection() == self.pairs_selection:
+            # tree changes that do not affect the selection (eg. expanding a group)
+            return
         self.pairs = None
         self.sigOutputChanged.emit(self)
 
@@ -144,6 +155,9 @@ class CellClassFilter(object):
     def __init__(self, cell_class_groups, analyzer_mode):
         self.cell_groups = None
         self.cell_classes = None
+        self.cell_group_keys = None
+        # cell classification memoized for the current pair list
+        self.classifier = None
         self._signalHandler = SignalHandler()
         self.sigOutputChanged = self._signalHandler.sigOutputChanged
         self.analyzer_mode = analyzer_mode
@@ -165,19 +179,28 @@ class CellClassFilter(object):
     def get_cell_groups(self, pairs):
         """Given a list of cell pairs, return a dict indicating which cells
         are members of each user selected cell class.
-        This internally calls cell_class.classify_cells
+        This internally uses cell_class.ClassificationCache, so cells are only classified
+        for classes that were not already classified for the same list of pairs.
         """
-        ccg = copy.deepcopy(self.cell_class_groups)
         if self.cell_groups is None:
-            self.cell_classes = []
-            for group in self.params.children()[1:]:
-                if group.value() is True:
-                    self.cell_classes.extend(ccg[group.name()])
-            cell_classes = self.layer_call(self.cell_classes)
-            self.cell_classes = [self._make_cell_class(c) for c in cell_classes]
-            self.cell_groups = classify_cells(self.cell_classes, pairs=pairs, missing_attr='ignore')
+            self.cell_classes = self.selected_classes()
+            if self.classifier is None or self.classifier.pairs is not pairs:
+                self.classifier = ClassificationCache(pairs, missing_attr='ignore')
+            self.cell_groups = self.classifier.cell_groups(self.cell_classes)
+            self.cell_group_keys = [cell_class_key(c) for c in self.cell_classes]
         return self.cell_groups, self.cell_classes
 
+    def selected_classes(self):
+        """Return the list of CellClass instances currently selected.
+        """
+        ccg = copy.deepcopy(self.cell_class_groups)
+        cell_classes = []
+        for group in self.params.children()[1:]:
+            if group.value() is True:
+                cell_classes.extend(ccg[group.name()])
+        cell_classes = self.layer_call(cell_classes)
+        return [self._make_cell_class(c) for c in cell_classes]
+
     def _make_cell_class(self, spec):
         spec = spec.copy()
         dnames = spec.pop('display_names')
@@ -219,6 +242,17 @@ class CellClassFilter(object):
             list(param.items.keys())[0].setExpanded(value)
 
     def invalidate_output(self):
+        if self.cell_groups is not None and [cell_class_key(c) for c in self.selected_classes()] == self.cell_group_keys:
+            # tree changes that do not affect the selected classes (eg. pre/post display options)
+            return
+        self.cell_groups = None
+        self.cell_classes = None
+        self.sigOutputChanged.emit(self)
+
+    def pairs_changed(self):
+        """Called when the list of pairs changes; all memoized classifications are discarded.
+        """
+        self.classifier = None
         self.cell_groups = None
         self.cell_classes = None
         self.sigOutputChanged.emit(self)
@@ -272,6 +306,10 @@ class MatrixAnalyzer(object):
         self.session = session
         self.cell_groups = None
         self.cell_classes = None
+        # memoized (pre_class, post_class) pair groups and merged analyzer results; see update_results
+        self.pair_groups = None
+        self._pair_groups_source = (None, None)
+        self._merged_results = None
 
         self.presets = self.analyzer_presets()
         preset_list = sorted([p for p in self.presets.keys()])
@@ -295,7 +333,7 @@ class MatrixAnalyzer(object):
         self.main_window.update_button.clicked.connect(self.update_clicked)
         self.matrix_display.matrix_widget.sigClicked.connect(self.display_matrix_element_data)
         
-        self.experiment_filter.sigOutputChanged.connect(self.cell_class_filter.invalidate_output)
+        self.experiment_filter.sigOutputChanged.connect(self.cell_class_filter.pairs_changed)
         self.params.child('Presets', 'Analyzer Presets').sigValueChanged.connect(self.presetChanged)
 
         # connect up analyzers
@@ -303,6 +341,7 @@ class MatrixAnalyzer(object):
             for visualizer in self.visualizers:
                 analyzer.sigOutputChanged.connect(visualizer.invalidate_output)
             self.cell_class_filter.sigOutputChanged.connect(analyzer.invalidate_output)
+            self.experiment_filter.sigOutputChanged.connect(analyzer.clear_cache)
 
 
         # setup cell analzyer and display
@@ -312,6 +351,7 @@ class MatrixAnalyzer(object):
         self.cell_scatter.set_fields(cell_fields)
         self.cell_analyzer.sigOutputChanged.connect(self.cell_scatter.invalidate_output)
         self.cell_class_filter.sigOutputChanged.connect(self.cell_analyzer.invalidate_output)
+        self.experiment_filter.sigOutputChanged.connect(self.cell_analyzer.clear_cache)
 
     def save_preset(self):
         name = self.params['Presets', 'Save as Preset', 'Preset Name']
@@ -528,6 +568,13 @@ class MatrixAnalyzer(object):
             # p.print_stats(sort='cumulative')
 
     def update_results(self):
+        """Recompute any stage of the analysis whose inputs changed since the last update.
+
+        Stages are chained experiment filter -> pair list -> cell classification -> pair groups ->
+        analyzer results; each stage caches its output until it is invalidated by a parameter change
+        upstream (see the sigOutputChanged connections in __init__), and analyzers memoize results per
+        matrix element.
+        """
         # Select pairs 
         self.pairs = self.experiment_filter.get_pair_list(self.session)
 
@@ -536,10 +583,11 @@ class MatrixAnalyzer(object):
         self.cell_results = self.cell_analyzer.measure(self.cell_groups)
 
         # Group pairs into (pre_class, post_class) groups
-        self.pair_groups = classify_pairs(self.pairs, self.cell_groups)
+        self.pair_groups = self.classify_pairs(self.pairs, self.cell_groups)
 
         # analyze matrix elements
-        for a, analysis in enumerate(self.active_analyzers):
+        outputs = []
+        for analysis in self.active_analyzers:
             results = analysis.measure(self.pair_groups)
             try:
                 group_results = analysis.group_result(self.pair_groups)
@@ -548,6 +596,14 @@ class MatrixAnalyzer(object):
                         if so this filter set produced no results, try something else.\nYou may analyze cell features',
                         pg.QtGui.QMessageBox.Ok)
                     break
+            outputs.append((results, group_results))
+
+        if self._merged_results is not None and len(outputs) == len(self._merged_results[0]) and all(
+                a is b and ga is gb for (a, ga), (b, gb) in zip(outputs, self._merged_results[0])):
+            # no analyzer output changed; reuse merged tables
+            return
+
+        for a, (results, group_results) in enumerate(outputs):
             if a == 0:
                 self.results = results
                 self.group_results = group_results
@@ -556,4 +612,19 @@ class MatrixAnalyzer(object):
                 self.results = merge_results.loc[:, ~merge_results.columns.duplicated(keep='first')]
                 merge_group_results = pd.concat([self.group_results, group_results], axis=1)
                 self.group_results = merge_group_results.loc[:, ~merge_group_results.columns.duplicated(keep='first')]
+        self._merged_results = (outputs, self.results, self.group_results)
 
+    def classify_pairs(self, pairs, cell_groups):
+        """Return pairs grouped by (pre_class, post_class), as with cell_class.classify_pairs.
+
+        The pair list for each element is memoized by the cell class filter's ClassificationCache,
+        so changing one cell class only reclassifies the row and column of the matrix belonging to that class.
+        """
+        if self._pair_groups_source[0] is pairs and self._pair_groups_source[1] is cell_groups:
+            return self.pair_groups
+        classifier = self.cell_class_filter.classifier
+        if classifier is None or classifier.pairs is not pairs:
+            classifier = ClassificationCache(pairs, missing_attr='ignore')
+        pair_groups = classifier.pair_groups(cell_groups)
+        self._pair_groups_source = (pairs, cell_groups)
+        return pair_groups
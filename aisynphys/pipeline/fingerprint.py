@@ -0,0 +1,130 @@
+"""
+Content fingerprints used by the pipeline to decide when job results are stale.
+
+A fingerprint is an md5 hex digest computed over a stable encoding of arbitrary
+python / numpy values. Pipeline modules record the fingerprint of the inputs each
+job consumed and of the records each job wrote (see the input_hash and output_hash
+columns of the pipeline table), so that downstream jobs only need to be rerun when
+the content they depend on has actually changed.
+"""
+import hashlib
+import numpy as np
+import sqlalchemy
+import sqlalchemy.event
+import sqlalchemy.orm.attributes
+
+
+def content_hash(*values):
+    """Return an md5 hex digest of *values*.
+
+    Dicts are hashed independently of key order, floats are hashed by value
+    (so numpy scalars and python floats agree), and arrays are hashed by dtype,
+    shape, and raw content.
+    """
+    h = hashlib.md5()
+    _update_hash(h, values)
+    return h.hexdigest()
+
+
+def _update_hash(h, obj):
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind == 'O':
+            h.update(b'objarray%r' % (obj.shape,))
+            _update_hash(h, obj.ravel().tolist())
+        else:
+            h.update(('array:%s:%r:' % (obj.dtype.str, obj.shape)).encode())
+            h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        h.update(b'{')
+        for k in sorted(obj, key=repr):
+            _update_hash(h, k)
+            h.update(b':')
+            _update_hash(h, obj[k])
+        h.update(b'}')
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'[')
+        for v in obj:
+            _update_hash(h, v)
+            h.update(b',')
+        h.update(b']')
+    elif isinstance(obj, (bool, np.bool_)):
+        h.update(b'bool:%d' % bool(obj))
+    elif isinstance(obj, (float, np.floating)):
+        h.update(('float:%r' % float(obj)).encode())
+    elif isinstance(obj, (int, np.integer)):
+        h.update(b'int:%d' % int(obj))
+    elif isinstance(obj, bytes):
+        h.update(b'bytes:' + obj)
+    else:
+        h.update(('%s:%r' % (type(obj).__name__, obj)).encode())
+
+
+def record_hash(rec):
+    """Return a content hash for a single ORM record.
+
+    Primary and foreign key columns are excluded because their values change whenever
+    the record (or a record it references) is regenerated, even if the content is identical.
+    Deferred columns that have not been loaded are also excluded.
+    """
+    state = sqlalchemy.orm.attributes.instance_state(rec)
+    mapper = state.mapper
+    loaded = state.dict
+    values = [mapper.local_table.name]
+    for prop in mapper.column_attrs:
+        col = prop.columns[0]
+        if col.primary_key or len(col.foreign_keys) > 0:
+            continue
+        if prop.key not in loaded:
+            continue
+        values.append((prop.key, loaded[prop.key]))
+    return content_hash(values)
+
+
+class SessionFingerprint(object):
+    """Accumulates a content fingerprint for all records that are added or modified
+    through a database session.
+
+    Records are hashed after each flush, so this also captures records from jobs
+    that commit several times before finishing. Only the digest of each record is kept
+    (indexed by its identity key), so written records may be released while the job runs.
+    The final fingerprint does not depend on the order in which records were written.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.digests = {}
+        sqlalchemy.event.listen(session, 'after_flush', self._after_flush)
+
+    def _after_flush(self, session, flush_context=None):
+        for rec in list(session.new) + list(session.dirty):
+            key = _identity_key(rec)
+            if key is not None:
+                self.digests[key] = record_hash(rec)
+
+    def hexdigest(self):
+        """Return the fingerprint of all records written so far (including pending records).
+        """
+        digests = self.digests.copy()
+        unflushed = []
+        for rec in list(self.session.new) + list(self.session.dirty):
+            key = _identity_key(rec)
+            if key is None:
+                unflushed.append(record_hash(rec))
+            else:
+                digests[key] = record_hash(rec)
+        return content_hash(sorted(list(digests.values()) + unflushed))
+
+    def close(self):
+        sqlalchemy.event.remove(self.session, 'after_flush', self._after_flush)
+        self.digests.clear()
+
+
+def _identity_key(rec):
+    """Return the identity key of an ORM record, or None if it has not been assigned a primary key yet.
+    """
+    state = sqlalchemy.orm.attributes.instance_state(rec)
+    if state.key is not None:
+        return state.key
+    key = state.mapper.identity_key_from_instance(rec)
+    if any(v is None for v in key[1]):
+        return None
+    return key
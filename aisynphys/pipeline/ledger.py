@@ -0,0 +1,262 @@
+"""
+Persistent run ledger for pipeline updates.
+
+PipelineModule.update records every job it plans to run in the pipeline_run_ledger table,
+and DatabasePipelineModule.process_job records when each job starts and whether it finished
+or failed. This allows:
+
+* resuming an interrupted update from the jobs that were planned but never finished, without
+  recomputing ready_jobs() / updatable_jobs() for the module. Jobs that are still marked as
+  running are only resumed if the process that started them is gone or their lease has expired,
+  so that a resumed update does not repeat jobs another process is still working on.
+* retrying failed jobs with exponential backoff: a job that fails repeatedly with the same
+  inputs is retried less and less often, while a change to its inputs resets the backoff
+"""
+import os, re, socket, hashlib, logging
+from datetime import datetime, timedelta
+from collections import OrderedDict
+
+
+PLANNED = 'planned'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def error_fingerprint(error):
+    """Return a short hex digest identifying the class of an error message (or None if there is no error).
+
+    The fingerprint is computed from the last line of the error (usually the exception type and message
+    following a traceback) with numbers and memory addresses masked, so that the same failure
+    matches across jobs and runs.
+    """
+    lines = [line.strip() for line in (error or '').strip().split('\n') if line.strip() != '']
+    if len(lines) == 0:
+        return None
+    msg = re.sub(r'0x[0-9a-fA-F]+', '0x?', lines[-1])
+    msg = re.sub(r'\d+', '#', msg)
+    return hashlib.md5(msg.encode()).hexdigest()[:16]
+
+
+def pid_exists(pid):
+    """Return True if a process with ID *pid* exists on this host.
+
+    On windows, this always returns True (os.kill would terminate the process).
+    """
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # process exists but belongs to another user
+        return True
+    return True
+
+
+class RunLedger(object):
+    """Records the state of jobs for a single pipeline module in the pipeline_run_ledger table.
+
+    Parameters
+    ----------
+    database : Database
+        Database containing the pipeline_run_ledger table
+    module_name : str
+        Name of the pipeline module whose jobs are tracked
+    retry_delay : timedelta
+        Time to wait before retrying a job after its first failure. The delay doubles with each
+        consecutive failure that has the same error fingerprint.
+    max_retry_delay : timedelta
+        Maximum delay between retries
+    lease_timeout : timedelta
+        Jobs that started running longer ago than this are assumed to be abandoned, even if the
+        process that started them cannot be checked (for example, because it ran on another host)
+    """
+    def __init__(self, database, module_name, retry_delay=timedelta(hours=12), max_retry_delay=timedelta(days=28),
+                 lease_timeout=timedelta(hours=6)):
+        self.database = database
+        self.module_name = module_name
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lease_timeout = lease_timeout
+
+    def entries(self, job_ids=None, session=None):
+        """Return {job_id: PipelineRunLedger record} for all jobs in this module (or only *job_ids*).
+        """
+        db = self.database
+        own_session = session is None
+        if own_session:
+            session = db.session()
+        q = session.query(db.PipelineRunLedger).filter(db.PipelineRunLedger.module_name==self.module_name)
+        if job_ids is not None:
+            job_ids = set(job_ids)
+            if len(job_ids) <= 500:
+                q = q.filter(db.PipelineRunLedger.job_id.in_(list(job_ids)))
+        entries = {rec.job_id: rec for rec in q.all() if job_ids is None or rec.job_id in job_ids}
+        if own_session:
+            session.expunge_all()
+            session.rollback()
+        return entries
+
+    def plan(self, run_id, jobs):
+        """Record that the jobs in *jobs* ({job_id: ready_entry}) will be run by the update *run_id*.
+
+        The attempt count of a job is reset if its input_hash changed since it was last planned.
+        """
+        db = self.database
+        now = datetime.now()
+        session = db.session(readonly=False)
+        try:
+            entries = self.entries(job_ids=jobs.keys(), session=session)
+            for job_id, ready_entry in jobs.items():
+                input_hash = ready_entry.get('input_hash', None)
+                rec = entries.get(job_id)
+                if rec is None:
+                    rec = db.PipelineRunLedger(module_name=self.module_name, job_id=job_id, attempts=0, repeat_failures=0)
+                    session.add(rec)
+                elif input_hash is None or input_hash != rec.input_hash:
+                    rec.attempts = 0
+                    rec.repeat_failures = 0
+                    rec.next_attempt_time = None
+                rec.run_id = run_id
+                rec.state = PLANNED
+                rec.input_hash = input_hash
+                rec.meta = ready_entry.get('meta', None)
+                rec.plan_time = now
+            session.commit()
+        finally:
+            session.close()
+
+    def start(self, job_id, run_id=None):
+        """Record that a job has started running in this process.
+        """
+        def update(rec):
+            rec.state = RUNNING
+            rec.start_time = datetime.now()
+            rec.host = socket.gethostname()
+            rec.pid = os.getpid()
+            if run_id is not None:
+                rec.run_id = run_id
+        self._update(job_id, update)
+
+    def finish(self, job_id, success, error=None, interrupted=False):
+        """Record that a job has finished.
+
+        If *interrupted* is True (for example, the job was stopped by KeyboardInterrupt), then the job
+        is returned to the planned state so that it will be resumed, and does not count as an attempt.
+        """
+        now = datetime.now()
+        def update(rec):
+            if interrupted:
+                rec.state = PLANNED
+                return
+            rec.finish_time = now
+            rec.attempts = (rec.attempts or 0) + 1
+            if success:
+                rec.state = DONE
+                rec.repeat_failures = 0
+                rec.error_fingerprint = None
+                rec.next_attempt_time = None
+            else:
+                fingerprint = error_fingerprint(error)
+                if fingerprint is not None and fingerprint == rec.error_fingerprint:
+                    rec.repeat_failures = (rec.repeat_failures or 0) + 1
+                else:
+                    rec.repeat_failures = 1
+                rec.state = FAILED
+                rec.error_fingerprint = fingerprint
+                rec.next_attempt_time = now + self.backoff(rec.repeat_failures)
+        self._update(job_id, update)
+
+    def backoff(self, repeat_failures):
+        """Return the time to wait before retrying a job that failed *repeat_failures* consecutive times
+        with the same error.
+        """
+        n = max(repeat_failures - 1, 0)
+        # avoid overflow for very large failure counts
+        if n > 30:
+            return self.max_retry_delay
+        return min(self.retry_delay * 2**n, self.max_retry_delay)
+
+    def resumable(self, job_ids=None, now=None):
+        """Return {job_id: ready_entry} for jobs that were planned by an earlier update but never
+        finished, in the order they were planned.
+
+        Jobs in the "planned" state are always included. Jobs in the "running" state are included
+        only if they are abandoned (see abandoned()).
+        The ready entries contain the 'meta' and 'input_hash' values given when the jobs were planned.
+        """
+        entries = self.entries(job_ids=job_ids)
+        pending = [rec for rec in entries.values() if rec.state == PLANNED or (rec.state == RUNNING and self.abandoned(rec, now=now))]
+        pending.sort(key=lambda rec: (rec.plan_time or datetime.min, rec.id))
+        return OrderedDict([(rec.job_id, {'meta': rec.meta, 'input_hash': rec.input_hash}) for rec in pending])
+
+    def abandoned(self, rec, now=None):
+        """Return True if the running job recorded in ledger entry *rec* is no longer being run.
+
+        This is the case if the job was started on this host by a process that no longer exists,
+        or if it started longer ago than *lease_timeout*.
+        """
+        now = now or datetime.now()
+        if rec.start_time is None or now - rec.start_time > self.lease_timeout:
+            return True
+        if rec.host != socket.gethostname() or rec.pid is None:
+            # can't check processes on other hosts; wait for the lease to expire
+            return False
+        return not pid_exists(rec.pid)
+
+    def due_for_retry(self, error_jobs, now=None):
+        """Return the subset of *error_jobs* ({job_id: ready_entry}, as returned by updatable_jobs())
+        that should be retried now.
+
+        A failed job is retried if it has no ledger entry, if its input_hash differs from the one it
+        failed with, or if its backoff delay has expired.
+        """
+        now = now or datetime.now()
+        entries = self.entries(job_ids=error_jobs.keys())
+        due = OrderedDict()
+        for job_id, ready_entry in error_jobs.items():
+            rec = entries.get(job_id)
+            input_hash = ready_entry.get('input_hash', None)
+            if rec is None or rec.state != FAILED:
+                due[job_id] = ready_entry
+            elif input_hash is not None and input_hash != rec.input_hash:
+                due[job_id] = ready_entry
+            elif rec.next_attempt_time is None or rec.next_attempt_time <= now:
+                due[job_id] = ready_entry
+        return due
+
+    def clear(self, job_ids=None):
+        """Remove ledger entries for this module (or only for *job_ids*).
+        """
+        db = self.database
+        session = db.session(readonly=False)
+        try:
+            q = session.query(db.PipelineRunLedger).filter(db.PipelineRunLedger.module_name==self.module_name)
+            if job_ids is not None:
+                q = q.filter(db.PipelineRunLedger.job_id.in_(list(job_ids)))
+            q.delete(synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+
+    def _update(self, job_id, update):
+        """Apply *update(record)* to the ledger entry for *job_id* (creating it if needed) and commit.
+
+        Failure to update the ledger is logged but otherwise ignored.
+        """
+        db = self.database
+        try:
+            session = db.session(readonly=False)
+            try:
+                rec = self.entries(job_ids=[job_id], session=session).get(job_id)
+                if rec is None:
+                    rec = db.PipelineRunLedger(module_name=self.module_name, job_id=job_id, attempts=0, repeat_failures=0)
+                    session.add(rec)
+                update(rec)
+                session.commit()
+            finally:
+                session.close()
+        except Exception:
+            logging.getLogger(__name__).warning("Could not update run ledger for %s %s", self.module_name, job_id, exc_info=True)
@@ -0,0 +1,215 @@
+"""
+Resource usage instrumentation for pipeline jobs.
+
+DatabasePipelineModule.process_job wraps every job in a JobProfiler and stores the
+result in the pipeline_job_metrics table. metrics_report() summarizes these records
+to find the slowest modules and jobs, and the jobs that became slower between runs.
+"""
+import sys, time
+from collections import OrderedDict
+import sqlalchemy
+import sqlalchemy.event
+import sqlalchemy.engine
+import sqlalchemy.orm.attributes
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+
+def peak_rss():
+    """Return the peak resident memory of this process in bytes, or None if unknown.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kB, macos reports bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class JobProfiler(object):
+    """Measures wall time, CPU time, peak memory, database wait time, and rows written
+    while a single pipeline job runs.
+
+    Database time includes all statements executed by any engine in this process while
+    the profiler is running; rows are counted from records inserted or modified through *session*.
+    Only per-table counts and the primary keys of rows already counted are kept, so records
+    written by the job can be released as soon as the job is done with them.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.db_time = 0.0
+        self.written = {}
+        self._counted = set()
+        self._stmt_start = []
+        self.start_time = None
+        self.wall_time = None
+        self.cpu_time = None
+        self.peak_rss = None
+
+    def start(self):
+        self.start_time = time.time()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        sqlalchemy.event.listen(sqlalchemy.engine.Engine, 'before_cursor_execute', self._before_execute)
+        sqlalchemy.event.listen(sqlalchemy.engine.Engine, 'after_cursor_execute', self._after_execute)
+        sqlalchemy.event.listen(self.session, 'after_flush', self._after_flush)
+        return self
+
+    def stop(self):
+        self.wall_time = time.perf_counter() - self._wall_start
+        self.cpu_time = time.process_time() - self._cpu_start
+        self.peak_rss = peak_rss()
+        sqlalchemy.event.remove(sqlalchemy.engine.Engine, 'before_cursor_execute', self._before_execute)
+        sqlalchemy.event.remove(sqlalchemy.engine.Engine, 'after_cursor_execute', self._after_execute)
+        sqlalchemy.event.remove(self.session, 'after_flush', self._after_flush)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._stmt_start.append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if len(self._stmt_start) > 0:
+            self.db_time += time.perf_counter() - self._stmt_start.pop()
+
+    def _after_flush(self, session, flush_context):
+        # session.new / session.dirty still describe the records written by this flush
+        self._count(session, self.written, self._counted)
+
+    def _count(self, session, counts, counted):
+        """Add records in session.new / session.dirty to *counts*, skipping rows whose
+        identity key is already in *counted*.
+        """
+        for rec in list(session.new) + [r for r in session.dirty if session.is_modified(r)]:
+            state = sqlalchemy.orm.attributes.instance_state(rec)
+            key = state.key
+            if key is None and not state.mapper.primary_key_from_instance(rec).count(None):
+                key = state.mapper.identity_key_from_instance(rec)
+            if key is not None:
+                if key in counted:
+                    continue
+                counted.add(key)
+            table = state.mapper.local_table.name
+            counts[table] = counts.get(table, 0) + 1
+
+    def rows_written(self):
+        """Return {table_name: n_rows} for all records written so far, including records
+        that are pending in the session but not yet flushed.
+        """
+        counts = dict(self.written)
+        self._count(self.session, counts, set(self._counted))
+        return counts
+
+    def metrics(self):
+        """Return a dict of column values for the pipeline_job_metrics table.
+        """
+        return {
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'db_time': self.db_time,
+            'peak_rss': self.peak_rss,
+            'rows_written': self.rows_written(),
+        }
+
+
+def load_metrics(db, modules=None):
+    """Return a pandas DataFrame of all recorded job metrics, optionally limited to a list of module names.
+    """
+    q = db.query(db.PipelineJobMetrics)
+    if modules is not None:
+        q = q.filter(db.PipelineJobMetrics.module_name.in_(list(modules)))
+    df = q.dataframe()
+    df.columns = [c.split('.')[-1] for c in df.columns]
+    return df
+
+
+def metrics_report(db, modules=None, n_jobs=20, regression_ratio=1.5):
+    """Return a printable report of pipeline job metrics.
+
+    The report contains:
+
+    * per-module totals for the most recent run of each module, sorted by total wall time
+    * the *n_jobs* slowest jobs from those runs
+    * jobs whose wall time increased by more than *regression_ratio* between the last
+      two runs of each module
+
+    Parameters
+    ----------
+    db : Database
+        Database containing the pipeline_job_metrics table
+    modules : list | None
+        Names of modules to include (default is all modules)
+    """
+    df = load_metrics(db, modules)
+    if len(df) == 0:
+        return "No job metrics recorded."
+
+    # order runs within each module by the time they started
+    run_start = df.groupby(['module_name', 'run_id'])['start_time'].min().reset_index()
+    run_start = run_start.sort_values(['module_name', 'start_time'])
+    runs = OrderedDict()
+    for mod_name, grp in run_start.groupby('module_name', sort=False):
+        runs[mod_name] = list(grp['run_id'])
+
+    latest = df[[runs[m][-1] == r for m, r in zip(df['module_name'], df['run_id'])]]
+
+    report = []
+    report.append("\n=====  Slowest modules (most recent run)  =====\n")
+    mods = latest.groupby('module_name').agg(
+        run_id=('run_id', 'first'),
+        jobs=('job_id', 'count'),
+        failed=('success', lambda s: int((s == False).sum())),
+        wall=('wall_time', 'sum'),
+        mean_wall=('wall_time', 'mean'),
+        cpu=('cpu_time', 'sum'),
+        db=('db_time', 'sum'),
+        peak_rss=('peak_rss', 'max'),
+        rows=('rows_written', lambda rw: sum(sum(r.values()) for r in rw if r is not None)),
+    ).sort_values('wall', ascending=False)
+    fmt = "{:<24s} {:<20s} {:>6s} {:>6s} {:>10s} {:>9s} {:>10s} {:>10s} {:>9s} {:>9s}\n"
+    report.append(fmt.format('module', 'run', 'jobs', 'failed', 'wall (s)', 'mean (s)', 'cpu (s)', 'db (s)', 'rss (MB)', 'rows'))
+    for mod_name, m in mods.iterrows():
+        report.append(fmt.format(mod_name, str(m['run_id']), str(m['jobs']), str(m['failed']), '%0.1f' % m['wall'],
+            '%0.2f' % m['mean_wall'], '%0.1f' % m['cpu'], '%0.1f' % m['db'], _mb(m['peak_rss']), str(m['rows'])))
+
+    report.append("\n=====  Slowest jobs (most recent run)  =====\n")
+    fmt = "{:<24s} {:<24s} {:>10s} {:>10s} {:>10s} {:>9s}  {:s}\n"
+    report.append(fmt.format('module', 'job', 'wall (s)', 'cpu (s)', 'db (s)', 'rss (MB)', 'rows written'))
+    for _, j in latest.sort_values('wall_time', ascending=False).head(n_jobs).iterrows():
+        rows = j['rows_written'] or {}
+        rows_str = ', '.join('%s:%d' % (t, n) for t, n in sorted(rows.items(), key=lambda x: -x[1]))
+        report.append(fmt.format(j['module_name'], str(j['job_id']), '%0.2f' % j['wall_time'], '%0.2f' % j['cpu_time'],
+            '%0.2f' % j['db_time'], _mb(j['peak_rss']), rows_str))
+
+    report.append("\n=====  Regressions (previous run -> most recent run)  =====\n")
+    fmt = "{:<24s} {:<24s} {:>10s} {:>10s} {:>7s}\n"
+    regressions = []
+    for mod_name, mod_runs in runs.items():
+        if len(mod_runs) < 2:
+            continue
+        mdf = df[df['module_name'] == mod_name]
+        prev = mdf[mdf['run_id'] == mod_runs[-2]].groupby('job_id')['wall_time'].last()
+        last = mdf[mdf['run_id'] == mod_runs[-1]].groupby('job_id')['wall_time'].last()
+        common = prev.index.intersection(last.index)
+        if len(common) == 0:
+            continue
+        prev_total, last_total = prev[common].sum(), last[common].sum()
+        regressions.append((mod_name, '[%d common jobs]' % len(common), prev_total, last_total))
+        for job_id in common:
+            if prev[job_id] > 0 and last[job_id] / prev[job_id] > regression_ratio:
+                regressions.append((mod_name, str(job_id), prev[job_id], last[job_id]))
+    if len(regressions) == 0:
+        report.append("(no modules with more than one recorded run)\n")
+    else:
+        report.append(fmt.format('module', 'job', 'prev (s)', 'last (s)', 'ratio'))
+        for mod_name, job_id, prev_t, last_t in regressions:
+            ratio = '%0.2f' % (last_t / prev_t) if prev_t > 0 else '-'
+            report.append(fmt.format(mod_name, job_id, '%0.2f' % prev_t, '%0.2f' % last_t, ratio))
+
+    return ''.join(report)
+
+
+def _mb(nbytes):
+    if nbytes is None or nbytes != nbytes:
+        return '-'
+    return '%0.0f' % (nbytes / 1e6)
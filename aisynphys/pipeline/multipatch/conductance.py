@@ -2,12 +2,14 @@
 from __future__ import print_function, division
 
 import numpy as np
+import pandas as pd
+from sqlalchemy.orm import joinedload
 from .pipeline_module import MultipatchPipelineModule
 from .synapse import SynapsePipelineModule
 from .pulse_response import PulseResponsePipelineModule
 from .resting_state import RestingStatePipelineModule
-from sklearn.linear_model import LinearRegression
-from ...avg_response_fit import sort_responses
+from ...avg_response_fit import sort_response_frame
+from ...dynamics import experiment_pulse_response_frame
 
 class ConductancePipelineModule(MultipatchPipelineModule):
     """ Measure the effective conductance of a chemical synapse using reversal potential calculated from VC.
@@ -25,31 +27,29 @@ class ConductancePipelineModule(MultipatchPipelineModule):
         expt_id = job['job_id']
 
         expt = db.experiment_from_ext_id(expt_id, session=session)
-       
-        for pair in expt.pairs.values():
-            if pair.has_synapse is not True:
-                continue
+        pairs = (session.query(db.Pair)
+            .filter(db.Pair.experiment_id==expt.id)
+            .filter(db.Pair.has_synapse==True)
+            .options(joinedload(db.Pair.synapse).joinedload(db.Synapse.resting_state_fit))
+            .order_by(db.Pair.id)
+        ).all()
 
-            # get qc-pass responses in VC at both holding potentials (ie ex_qc_pass and in_qc_pass)
-            # require that both holding potentials be present to calculate reversal
-            vc_pulses = vc_pr_query(pair, db, session).all()
-            
-            sorted_vc_pulses = sort_responses(vc_pulses)
-            qc_pass_70 = sorted_vc_pulses[('vc', -70)]['qc_pass']
-            qc_pass_55 = sorted_vc_pulses[('vc', -55)]['qc_pass']
+        # get qc-pass responses in VC at both holding potentials (ie ex_qc_pass and in_qc_pass) for all pairs
+        vc_frame = experiment_pulse_response_frame(expt, db, session, clamp_mode='vc', pair_ids=[pair.id for pair in pairs])
+        reversals = reversal_potentials(vc_frame)
 
-            if len(qc_pass_70) < 1 or len(qc_pass_55) < 1:
-                continue
-            
-            pulse_responses = qc_pass_70 + qc_pass_55
-            adj_baseline = np.array([pr.recording.patch_clamp_recording.access_adj_baseline_potential for pr in pulse_responses if pr.pulse_response_fit is not None])
-            pr_amps = np.array([pr.pulse_response_fit.fit_amp for pr in pulse_responses if pr.pulse_response_fit is not None]) 
-            if len(adj_baseline) < 1 or len(pr_amps) < 1:
+        # load baseline potentials for the IC responses that contributed to each resting state PSP amp
+        ic_pr_ids = {}
+        for pair in pairs:
+            if pair.id in reversals and pair.synapse.psp_amplitude is not None:
+                ic_pr_ids[pair.id] = pair.synapse.resting_state_fit.ic_pulse_ids[0].tolist()
+        baseline_potentials = ic_baseline_potentials(db, session, [i for ids in ic_pr_ids.values() for i in ids])
+
+        for pair in pairs:
+            # require that both holding potentials be present to calculate reversal
+            if pair.id not in reversals:
                 continue
-            model = LinearRegression().fit(adj_baseline.reshape((-1,1)), pr_amps)
-            slope = model.coef_ 
-            intercept = model.intercept_
-            reversal = -intercept / slope
+            reversal = reversals[pair.id]
 
             rec = db.Conductance(
                 synapse_id=pair.synapse.id,
@@ -59,11 +59,8 @@ class ConductancePipelineModule(MultipatchPipelineModule):
             psp_amp = pair.synapse.psp_amplitude
             if psp_amp is None:
                 continue
-            # get pulse responses that contributed to resting state PSP amp and get average baseline potential
-            ic_pr_ids = pair.synapse.resting_state_fit.ic_pulse_ids[0].tolist()
-            ic_prs = session.query(db.PulseResponse).filter(db.PulseResponse.id.in_(ic_pr_ids)).all()
-            avg_baseline_potential = np.nanmean([pr.recording.patch_clamp_recording.baseline_potential for pr in ic_prs])
-            
+            # get average baseline potential of pulse responses that contributed to resting state PSP amp
+            avg_baseline_potential = np.nanmean([baseline_potentials.get(i, np.nan) for i in ic_pr_ids[pair.id]])
             
             if psp_amp is not None:
                 eff_cond = effective_conductance = (0 - psp_amp) / (reversal - avg_baseline_potential) # m = (y2 - y1) / (x2 - x1)
@@ -97,4 +94,47 @@ def vc_pr_query(pair, db, session):
     q = q.filter(db.PulseResponse.pair_id==pair.id)
     q = q.filter(db.PatchClampRecording.clamp_mode=='vc')
    
-    return q
\ No newline at end of file
+    return q
+
+
+def reversal_potentials(vc_frame):
+    """Return {pair_id: reversal_potential} estimated from a frame of VC pulse responses
+    (see aisynphys.dynamics.experiment_pulse_response_frame).
+
+    For each pair, a line is fit to the fit amplitudes of qc-passed responses versus the access-adjusted
+    baseline potential, and the reversal potential is taken as the x-intercept. Pairs are only
+    included if they have qc-passed responses at both -70 and -55 mV holding potentials.
+    """
+    holding, qc_pass = sort_response_frame(vc_frame)
+    passed = vc_frame[qc_pass & ~np.isnan(holding)]
+    passed_holding = holding[qc_pass & ~np.isnan(holding)]
+    n_70 = pd.Series(passed_holding == -70, index=passed.index).groupby(passed['pair_id']).sum()
+    n_55 = pd.Series(passed_holding == -55, index=passed.index).groupby(passed['pair_id']).sum()
+    both = n_70.index[(n_70 > 0) & (n_55 > 0)]
+
+    fits = passed[passed['pair_id'].isin(both) & passed['has_fit']]
+    x = fits['access_adj_baseline_potential']
+    y = fits['fit_amp']
+    grp = fits.groupby('pair_id')
+
+    # least-squares line fit for all pairs at once
+    x_mean = x.groupby(fits['pair_id']).transform('mean')
+    y_mean = y.groupby(fits['pair_id']).transform('mean')
+    sxy = ((x - x_mean) * (y - y_mean)).groupby(fits['pair_id']).sum()
+    sxx = ((x - x_mean) ** 2).groupby(fits['pair_id']).sum()
+    slope = (sxy / sxx).where(sxx > 0, 0.0)
+    intercept = grp['fit_amp'].mean() - slope * grp['access_adj_baseline_potential'].mean()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reversal = -intercept / slope
+    return {int(pair_id): float(rev) for pair_id, rev in reversal.items()}
+
+
+def ic_baseline_potentials(db, session, pulse_response_ids):
+    """Return {pulse_response_id: baseline_potential} for a list of pulse response IDs.
+    """
+    if len(pulse_response_ids) == 0:
+        return {}
+    q = session.query(db.PulseResponse.id, db.PatchClampRecording.baseline_potential)
+    q = q.join(db.PatchClampRecording, db.PulseResponse.recording_id==db.PatchClampRecording.recording_id)
+    q = q.filter(db.PulseResponse.id.in_(list(set(pulse_response_ids))))
+    return {pr_id: (np.nan if bp is None else bp) for pr_id, bp in q.all()}
@@ -7,6 +7,7 @@ from ..pipeline_module import DatabasePipelineModule
 from .experiment import ExperimentPipelineModule
 from aisynphys import lims
 import numpy as np
+from sqlalchemy.orm import joinedload
 from neuroanalysis.util.optional_import import optional_import
 get_depths_slice = optional_import('aisynphys.layer_depths', 'get_depths_slice')
 import logging
@@ -19,6 +20,11 @@ class CortexLocationPipelineModule(DatabasePipelineModule):
     name = 'cortical_location'
     dependencies = [ExperimentPipelineModule]
     table_group = ['cortical_cell_location']
+
+    def __init__(self, pipeline):
+        DatabasePipelineModule.__init__(self, pipeline)
+        # LIMS info collected by ready_jobs(), passed to workers in each job spec
+        self._lims_info = {}
     
     @classmethod
     def create_db_entries(cls, job, session):
@@ -27,7 +33,10 @@ class CortexLocationPipelineModule(DatabasePipelineModule):
         expt_id = job['job_id']
 
         expt = db.experiment_from_ext_id(expt_id, session=session)
-        image_series_id, soma_centers, image_series_resolution = get_lims_info(expt)
+        lims_info = job.get('lims_info', None)
+        if lims_info is None:
+            lims_info = get_lims_info(expt)
+        image_series_id, soma_centers, image_series_resolution = lims_info
         
         results, errors, cell_errors = get_depths_slice(image_series_id, soma_centers,
                                                 species=expt.slice.species,
@@ -105,28 +114,51 @@ class CortexLocationPipelineModule(DatabasePipelineModule):
         # All experiments and their creation times in the DB
         expts = self.pipeline.get_module('experiment').finished_jobs()
 
+        expt_ids = [expt_id for expt_id, (expt_mtime, success) in expts.items() if success is True]
+
         session = db.session()
-        ready = OrderedDict()
-            
-        for expt_id, (expt_mtime, success) in expts.items():
-            if success is not True:
-                continue
+        q = session.query(db.Experiment).filter(db.Experiment.ext_id.in_(expt_ids))
+        q = q.options(joinedload(db.Experiment.slice), joinedload(db.Experiment.cell_list))
+        expt_recs = {expt.ext_id: expt for expt in q.all()}
 
-            q = session.query(db.Experiment)
-            q = q.filter(db.Experiment.ext_id==expt_id)
-            expt = q.all()[0]
+        # prefetch LIMS data for all experiments in a few batched queries
+        spec_names = set(expt.slice.lims_specimen_name for expt in expt_recs.values() if expt.slice is not None)
+        lims.specimen_images_batch([name for name in spec_names if name is not None])
+        cluster_ids = set((expt.meta or {}).get('lims_cell_cluster_id') for expt in expt_recs.values())
+        lims.cluster_cells_batch([cid for cid in cluster_ids if isinstance(cid, int)])
 
+        lims_info = OrderedDict()
+        for expt_id in expt_ids:
+            if expt_id not in expt_recs:
+                continue
             try:
-                # just check for complete lims info, no need to compare values
-                image_series_id, _, _ = get_lims_info(expt)
-                polys = lims.query_for_layer_polygons(image_series_id)
-                assert len(polys) > 0
+                # check for complete lims info; the results are also handed to jobs (see make_job_spec)
+                lims_info[expt_id] = get_lims_info(expt_recs[expt_id])
             except (AssertionError, ValueError):
                 continue
-            ready[expt_id] = {'dep_time': expt_mtime}
+            if lims_info[expt_id][0] is None:
+                del lims_info[expt_id]
+
+        polys = lims.layer_polygons_batch(list(set(info[0] for info in lims_info.values())))
+        ready = OrderedDict()
+        self._lims_info = {}
+        for expt_id, info in lims_info.items():
+            if len(polys[info[0]]) == 0:
+                continue
+            ready[expt_id] = {'dep_time': expts[expt_id][0]}
+            self._lims_info[expt_id] = info
         
+        session.rollback()
         return ready
 
+    def make_job_spec(self, spec):
+        """Extends DatabasePipelineModule to include the LIMS info collected for each job by ready_jobs().
+        """
+        spec = DatabasePipelineModule.make_job_spec(self, spec)
+        if spec['job_id'] in self._lims_info:
+            spec['lims_info'] = self._lims_info[spec['job_id']]
+        return spec
+
 def get_pair_distances(pair, pia_direction):
     l1 = np.array(pair.pre_cell.cortical_location.position)
     l2 = np.array(pair.post_cell.cortical_location.position)
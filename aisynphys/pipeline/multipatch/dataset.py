@@ -39,6 +39,12 @@ class DatasetPipelineModule(MultipatchPipelineModule):
             pairs_by_device_id[(pre_dev_id, post_dev_id)] = pair
             pair.n_ex_test_spikes = 0
             pair.n_in_test_spikes = 0
+            for mode in ('ic', 'vc'):
+                setattr(pair, 'n_ex_test_spikes_' + mode, 0)
+                setattr(pair, 'n_in_test_spikes_' + mode, 0)
+        
+        # electrodes that recorded long-pulse stimuli used for gap junction detection
+        gj_probed_devs = set()
         
         # load NWB file
         path = os.path.join(config.synphys_data, expt_entry.storage_path)
@@ -58,6 +64,12 @@ class DatasetPipelineModule(MultipatchPipelineModule):
             
             rec_entries = {}
             all_pulse_entries = {}
+
+            # evaluate recording QC for all patch clamp recordings in this sweep at once
+            pc_recs = [rec for rec in srec.recordings if isinstance(rec, PatchClampRecording) and not rec.aborted]
+            rec_qc_batch = qc.RecordingQCBatch.from_recordings(pc_recs)
+            rec_qc = {rec.device_id: rec_qc_batch.result(i) for i, rec in enumerate(pc_recs)}
+
             for rec in srec.recordings:
                 if rec.aborted:
                     # skip incomplete recordings
@@ -75,11 +87,13 @@ class DatasetPipelineModule(MultipatchPipelineModule):
                 
                 session.add(rec_entry)
                 rec_entries[rec.device_id] = rec_entry
+                if rec_entry.stim_name is not None and 'TargetV' in rec_entry.stim_name:
+                    gj_probed_devs.add(rec.device_id)
                 
                 # import patch clamp recording information
                 if not isinstance(rec, PatchClampRecording):
                     continue
-                qc_pass, qc_failures = qc.recording_qc_pass(rec)
+                qc_pass, qc_failures = rec_qc[rec.device_id]
                 pcrec_entry = db.PatchClampRecording(
                     recording=rec_entry,
                     clamp_mode=rec.clamp_mode,
@@ -215,17 +229,22 @@ class DatasetPipelineModule(MultipatchPipelineModule):
                         continue
 
                     # get all responses, regardless of the presence of a spike
-                    responses = mpa.get_spike_responses(srec[pre_dev], srec[post_dev], align_to='pulse', require_spike=False)
+                    responses = mpa.get_spike_responses(srec[pre_dev], srec[post_dev], align_to='pulse', require_spike=False, recording_qc=rec_qc.get(post_dev))
 
                     pair_entry = pairs_by_device_id.get((pre_dev, post_dev), None)
                     if pair_entry is None:
                         continue  # no data for one or both channels
                     
+                    clamp_mode = getattr(srec[post_dev], 'clamp_mode', None)
                     for resp in responses:
                         if resp['ex_qc_pass']:
                             pair_entry.n_ex_test_spikes += 1
+                            if clamp_mode in ('ic', 'vc'):
+                                setattr(pair_entry, 'n_ex_test_spikes_' + clamp_mode, getattr(pair_entry, 'n_ex_test_spikes_' + clamp_mode) + 1)
                         if resp['in_qc_pass']:
                             pair_entry.n_in_test_spikes += 1
+                            if clamp_mode in ('ic', 'vc'):
+                                setattr(pair_entry, 'n_in_test_spikes_' + clamp_mode, getattr(pair_entry, 'n_in_test_spikes_' + clamp_mode) + 1)
                         
                         resampled = resp['response']['primary'].resample(sample_rate=db.default_sample_rate)
                         resp_entry = db.PulseResponse(
@@ -248,7 +267,8 @@ class DatasetPipelineModule(MultipatchPipelineModule):
                             # pull data and run qc if needed
                             if key not in baseline_qc_cache:
                                 data = srec[post_dev]['primary'].time_slice(start, stop).resample(sample_rate=db.default_sample_rate).data
-                                ex_qc_pass, in_qc_pass, qc_failures = qc.pulse_response_qc_pass(srec[post_dev], [start, stop], None, [])
+                                base_qc = qc.PulseResponseQCBatch(srec[post_dev], [[start, stop]], [None], [[]], recording_qc=rec_qc.get(post_dev))
+                                ex_qc_pass, in_qc_pass = bool(base_qc.ex_qc_pass[0]), bool(base_qc.in_qc_pass[0])
                                 baseline_qc_cache[key] = (data, ex_qc_pass, in_qc_pass)
                             else:
                                 (data, ex_qc_pass, in_qc_pass) = baseline_qc_cache[key]
@@ -285,6 +305,10 @@ class DatasetPipelineModule(MultipatchPipelineModule):
             
             if unmatched > 0:
                 print("%s %s: %d pulse responses without matched baselines" % (job_id, srec, unmatched))
+
+        # record whether each pair was probed for gap junctions (see connectivity.pair_probed_gj)
+        for (pre_dev, post_dev), pair in pairs_by_device_id.items():
+            pair.gap_junction_probed = pre_dev in gj_probed_devs and post_dev in gj_probed_devs
         
         # lowpass filter access resistance and then go back through each electrode to fill in for test_pulse
         for electrode, tps in tp_entries.items():
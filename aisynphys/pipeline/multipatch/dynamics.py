@@ -8,8 +8,9 @@ from __future__ import print_function, division
 import os, logging
 import numpy as np
 from collections import OrderedDict
+from sqlalchemy.orm import joinedload
 from ...util import timestamp_to_datetime
-from ...dynamics import generate_pair_dynamics
+from ...dynamics import generate_pair_dynamics, experiment_pulse_response_frame
 from .pipeline_module import MultipatchPipelineModule
 from .pulse_response import PulseResponsePipelineModule
 
@@ -28,13 +29,24 @@ class DynamicsPipelineModule(MultipatchPipelineModule):
         job_id = job['job_id']
         logger.debug("Processing job %s", job_id)
 
-        # Load experiment from DB
+        # Load experiment and synaptic pairs from DB
         expt = db.experiment_from_ext_id(job_id, session=session)
-        for pair in expt.pairs.values():
-            if pair.has_synapse is not True:
-                continue
-            
-            dynamics = generate_pair_dynamics(pair, db, session)
+        pairs = (session.query(db.Pair)
+            .filter(db.Pair.experiment_id==expt.id)
+            .filter(db.Pair.has_synapse==True)
+            .options(joinedload(db.Pair.synapse))
+            .order_by(db.Pair.id)
+        ).all()
+
+        # load IC responses for all pairs at once (only responses with a fit and a multipatch
+        # probe are used, as in pulse_response_query)
+        frame = experiment_pulse_response_frame(expt, db, session, clamp_mode='ic', pair_ids=[pair.id for pair in pairs])
+        frame = frame[frame['has_fit'] & frame['has_probe']]
+        pair_frames = dict(list(frame.groupby('pair_id', sort=False)))
+
+        for pair in pairs:
+            pr_frame = pair_frames.get(pair.id, frame.iloc[:0])
+            dynamics = generate_pair_dynamics(pair, db, session, pr_frame=pr_frame)
             session.add(dynamics)
             logger.debug("Finished dynamics for pair %s", pair)
         session.commit()
@@ -1,4 +1,4 @@
-import os, sys, glob, re
+import os, sys, glob, re, json
 from collections import OrderedDict
 from .pipeline_module import MultipatchPipelineModule
 from ... import config, lims
@@ -35,26 +35,13 @@ class ExperimentPipelineModule(MultipatchPipelineModule):
         slice_entry = db.slice_from_ext_id(expt.slice_id, session=session)
         
         expt_info = expt.expt_info
-        lims_cell_cluster_id = lims.expt_cluster_ids(slice_entry.lims_specimen_name, expt.timestamp)
-
-        # make sure we have only 1 cluster ID
-        if len(lims_cell_cluster_id) == 1:
-            lims_cell_cluster_id = lims_cell_cluster_id[0]
-        elif len(lims_cell_cluster_id) == 0:
-            lims_cell_cluster_id = None
-        else:
-            raise Exception ('Too many LIMS specimens %d' % len(lims_cell_cluster_id))
-
-        # look up LIMS ephys result ID (needed for data download from warehouse)
-        if lims_cell_cluster_id is None:
-            lims_ephys_result_id = None
-        else:
-            try:
-                lims_ephys_result_id = lims.cluster_ephys_roi_result(lims_cell_cluster_id)
-            except Exception:
-                lims_ephys_result_id = None
-                print("Error getting ephys result ID from LIMS (but continuing anyway):")
-                sys.excepthook(*sys.exc_info())
+
+        # LIMS cell clusters are normally collected for all jobs at once (see make_job_specs)
+        specimen_name = slice_entry.lims_specimen_name
+        clusters = job.get('lims_clusters', {})
+        if specimen_name not in clusters:
+            clusters = lims_cluster_info([specimen_name])
+        lims_cell_cluster_id, lims_ephys_result_id, lims_cell_ids = expt_lims_info(clusters, specimen_name, expt.timestamp)
 
         meta = {
             'lims_cell_cluster_id': lims_cell_cluster_id,
@@ -87,11 +74,6 @@ class ExperimentPipelineModule(MultipatchPipelineModule):
 
         # create pipette and cell entries
         cell_entries = {}
-        if lims_cell_cluster_id is not None:
-            lims_cell_ids = lims.cell_specimen_ids(lims_cell_cluster_id)
-        else:
-            lims_cell_ids = {}
-            
         for e_id, elec in expt.electrodes.items():
             elec_entry = db.Electrode(experiment=expt_entry, ext_id=elec.electrode_id, device_id=elec.device_id)
             for k in ['patch_status', 'start_time', 'stop_time',  
@@ -140,6 +122,10 @@ class ExperimentPipelineModule(MultipatchPipelineModule):
                 # has_electrical=pair.has_electrical,
                 n_ex_test_spikes=0,  # will be counted later
                 n_in_test_spikes=0,
+                n_ex_test_spikes_ic=0,
+                n_ex_test_spikes_vc=0,
+                n_in_test_spikes_ic=0,
+                n_in_test_spikes_vc=0,
                 distance=pair.distance,
             )
             pair_entries[pre_cell_entry, post_cell_entry] = pair_entry
@@ -149,6 +135,40 @@ class ExperimentPipelineModule(MultipatchPipelineModule):
         for (pre_cell, post_cell), pair_entry in pair_entries.items():
             pair_entry.reciprocal = pair_entries[post_cell, pre_cell]
 
+    def make_job_specs(self, specs):
+        """Extends MultipatchPipelineModule to look up the LIMS cell clusters of all jobs with a few
+        batched queries. Each job receives the clusters for its slice in job['lims_clusters'], so
+        that workers do not need to query LIMS.
+        """
+        specs = MultipatchPipelineModule.make_job_specs(self, specs)
+        slice_ids = sorted(set((spec['meta'] or {}).get('slice_id') for spec in specs) - {None})
+        if len(slice_ids) == 0:
+            return specs
+
+        db = self.database
+        session = db.session()
+        spec_names = {}
+        try:
+            for i in range(0, len(slice_ids), self.experiment_chunk_size):
+                chunk = slice_ids[i:i+self.experiment_chunk_size]
+                spec_names.update(session.query(db.Slice.ext_id, db.Slice.lims_specimen_name).filter(db.Slice.ext_id.in_(chunk)).all())
+        finally:
+            session.rollback()
+            session.close()
+
+        try:
+            clusters = lims_cluster_info(set(spec_names.values()))
+        except Exception:
+            print("Error getting cell clusters from LIMS (jobs will query LIMS individually):")
+            sys.excepthook(*sys.exc_info())
+            return specs
+
+        for spec in specs:
+            specimen_name = spec_names.get((spec['meta'] or {}).get('slice_id'), None)
+            if specimen_name in clusters:
+                spec['lims_clusters'] = {specimen_name: clusters[specimen_name]}
+        return specs
+
     def job_records(self, job_ids, session):
         """Return a list of records associated with a list of job IDs.
         
@@ -203,13 +223,64 @@ class ExperimentPipelineModule(MultipatchPipelineModule):
                 continue
             if slice_mtime is None or slice_success is False:
                 continue
-            ready[expt.uid] = {'dep_time': max(raw_data_mtime, slice_mtime), 'meta': {'source': site_path}}
+            ready[expt.uid] = {'dep_time': max(raw_data_mtime, slice_mtime), 'meta': {'source': site_path, 'slice_id': slice_ts}}
         
         print("Found %d experiments; %d are able to be processed, %d were skipped due to errors." % (len(ymls), len(ready), n_errors))
         return ready
 
 
 
+def lims_cluster_info(specimen_names):
+    """Return the LIMS cell clusters of many slice specimens, using a few batched queries.
+
+    Returns {specimen_name: [cluster, ...]} for each specimen found in LIMS, where each cluster is a
+    dict with keys 'id', 'acq_timestamp', 'ephys_roi_result_ids', and 'cell_specimen_ids'
+    ({cell_ext_id: lims_specimen_id}).
+    """
+    spec_ids = lims.specimen_ids_from_names([name for name in specimen_names if name is not None])
+    cluster_ids = lims.cell_cluster_ids_batch(list(spec_ids.values()))
+    all_cluster_ids = [cid for cids in cluster_ids.values() for cid in cids]
+    metadata = lims.specimen_metadata_batch(all_cluster_ids)
+    ephys_results = lims.cluster_ephys_roi_results_batch(all_cluster_ids)
+    cells = lims.cluster_cells_batch(all_cluster_ids)
+
+    clusters = OrderedDict()
+    for name, spec_id in spec_ids.items():
+        clusters[name] = [{
+            'id': cid,
+            'acq_timestamp': (metadata[cid] or {}).get('acq_timestamp'),
+            'ephys_roi_result_ids': ephys_results[cid],
+            'cell_specimen_ids': {cell['external_specimen_name']: cell['id'] for cell in cells[cid]},
+        } for cid in cluster_ids[spec_id]]
+    return clusters
+
+
+def expt_lims_info(clusters, specimen_name, acq_timestamp):
+    """Return (cell_cluster_id, ephys_roi_result_id, {cell_ext_id: lims_specimen_id}) for the experiment
+    acquired at *acq_timestamp*, given the *clusters* returned by lims_cluster_info().
+
+    The cluster ID and ephys result ID are None (and the cell dict is empty) if no cluster was found.
+    """
+    if specimen_name not in clusters:
+        raise ValueError('No LIMS specimen named "%s"' % specimen_name)
+    expt_clusters = [c for c in clusters[specimen_name] if c['acq_timestamp'] is not None and c['acq_timestamp'] == acq_timestamp]
+
+    # make sure we have only 1 cluster ID
+    if len(expt_clusters) == 0:
+        return None, None, {}
+    elif len(expt_clusters) > 1:
+        raise Exception('Too many LIMS specimens %d' % len(expt_clusters))
+    cluster = expt_clusters[0]
+
+    # LIMS ephys result ID (needed for data download from warehouse)
+    ephys_result_ids = cluster['ephys_roi_result_ids']
+    if len(ephys_result_ids) > 1:
+        print("Error getting ephys result ID from LIMS (but continuing anyway): multiple ephys results for specimen %s" % cluster['id'])
+    ephys_result_id = ephys_result_ids[0] if len(ephys_result_ids) == 1 else None
+
+    return cluster['id'], ephys_result_id, cluster['cell_specimen_ids']
+
+
 _cache = None
 def get_cache():
     global _cache
@@ -241,3 +312,74 @@ class DataRepo(object):
         if self._pip_yamls is None:
             self._pip_yamls = glob.glob(os.path.join(self.remote_path, '*', 'slice_*', 'site_*', 'pipettes.yml'))
         return self._pip_yamls
+
+
+_site_index = None
+def get_site_index():
+    global _site_index
+    if _site_index is None:
+        _site_index = SiteInfoIndex()
+    return _site_index
+
+
+class SiteInfoIndex(object):
+    """Cached index of acq4 site metadata, keyed by experiment storage path.
+
+    Reading site metadata with getDirHandle(path).info() parses the site's .index file, which is slow
+    when repeated for every experiment on network storage. This index keeps the parsed headstage
+    metadata in a local json file and only re-reads a site when the modification time of its
+    .index file has changed.
+    """
+    def __init__(self, cache_file=None, data_path=None):
+        if cache_file is None:
+            cache_file = os.path.join(config.cache_path, 'site_info_index.json')
+        self.cache_file = cache_file
+        self.data_path = config.synphys_data if data_path is None else data_path
+        self._index = None
+        self._changed = False
+
+    @property
+    def index(self):
+        if self._index is None:
+            if os.path.isfile(self.cache_file):
+                with open(self.cache_file, 'r') as fh:
+                    self._index = json.load(fh)
+            else:
+                self._index = {}
+        return self._index
+
+    def headstages(self, storage_path):
+        """Return the headstage metadata recorded for a site, or an empty dict if none was recorded.
+
+        Keys are headstage names as used for cell ext_ids (for example '1' rather than 'HS1').
+        Sites that have no .index file also return an empty dict.
+        """
+        path = os.path.join(self.data_path, storage_path)
+        try:
+            mtime = os.stat(os.path.join(path, '.index')).st_mtime
+        except FileNotFoundError:
+            return {}
+        entry = self.index.get(storage_path)
+        if entry is None or entry['mtime'] != mtime:
+            headstages = getDirHandle(path).info().get('headstages') or {}
+            entry = {
+                'mtime': mtime,
+                'headstages': {hs_name.split('HS')[1]: dict(hs) for hs_name, hs in headstages.items()},
+            }
+            self.index[storage_path] = entry
+            self._changed = True
+        return entry['headstages']
+
+    def save(self):
+        """Write any changes back to the cache file.
+        """
+        if not self._changed:
+            return
+        cache_dir = os.path.dirname(self.cache_file)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_file = self.cache_file + '.tmp'
+        with open(tmp_file, 'w') as fh:
+            json.dump(self.index, fh)
+        os.replace(tmp_file, self.cache_file)
+        self._changed = False
@@ -37,7 +37,12 @@ class GapJunctionPipelineModule(MultipatchPipelineModule):
         if sweeps is None:
             raise Exception('NWB has no content')
 
-        for pair in expt.pair_list:
+        # load all pairs with their pre/post cells in one query
+        cell_ids = [cell.ext_id for cell in expt.cell_list]
+        pair_ids = [(expt.ext_id, pre_id, post_id) for pre_id in cell_ids for post_id in cell_ids if pre_id != post_id]
+        pairs = db.pairs_from_ext_ids(pair_ids, session=session)
+
+        for pair in pairs.values():
             pre_dev = pair.pre_cell.electrode.device_id
             post_dev = pair.post_cell.electrode.device_id
             
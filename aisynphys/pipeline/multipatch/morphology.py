@@ -6,11 +6,11 @@ For generating a DB table describing cell morphology.
 from __future__ import print_function, division
 
 import os, datetime, hashlib, json
-from sqlalchemy.orm import joinedload
 from collections import OrderedDict
 from ...util import timestamp_to_datetime, optional_import
 from ...data.pipette_metadata import PipetteMetadata
 from ... import config, lims
+from ..fingerprint import content_hash
 from .pipeline_module import MultipatchPipelineModule
 from .experiment import ExperimentPipelineModule
 
@@ -113,55 +113,57 @@ class MorphologyPipelineModule(MultipatchPipelineModule):
     def ready_jobs(self):
         """Return an ordered dict of all jobs that are ready to be processed (all dependencies are present)
         and the dates that dependencies were created.
+
+        Each job is fingerprinted by the experiment record it was generated from and the morphology
+        database records of its cells, so jobs are only rerun when one of these actually changes.
         """
-        db = self.database
         # All experiments and their creation times in the DB
-        expts = self.pipeline.get_module('experiment').finished_jobs()
-
-        # Look up nwb file locations for all experiments
-        session = db.session()
-        # expts = session.query(db.Experiment).filter(db.Experiment.ext_id==1521667891.153).all()
-        session.rollback()
+        expt_module = self.pipeline.get_module('experiment')
+        expts = expt_module.finished_jobs()
+        expt_hashes = expt_module.job_fingerprints()
         
-        # Return the greater of NWB mod time and experiment DB record mtime
         ready = OrderedDict()
 
         try:
-            morpho_results = morpho_db()
+            morpho_hashes = morpho_record_hashes()
         except ImportError as exc:
             print("Skipping morphology: %s" % str(exc))
             return ready
-            
-        for expt_id, (expt_mtime, success) in expts.items():
-            if success is not True:
-                continue
 
-            q = session.query(db.Experiment)
-            # joinedload should speed up access to cell/morpho attributes by eager loading along with the experiment
-            q = q.options(joinedload(db.Experiment.cell_list).joinedload(db.Cell.morphology))
-            q = q.filter(db.Experiment.ext_id==expt_id)
-            expt = q.all()[0]
-
-            ready[expt_id] = {'dep_time': expt_mtime}
-            needs_update = False
-            for cell_ext_id, cell in expt.cells.items():
-                if cell.morphology is None:
-                    needs_update = True
-                    break
-                cell_specimen_id = cell.meta.get('lims_specimen_id')
-                morpho_rec = morpho_results.get(cell_specimen_id, None)
-                morpho_db_hash = hash_record([morpho_rec])
-                prev_hash = None if cell.morphology.meta is None else cell.morphology.meta['morpho_db_hash']
-                if morpho_db_hash != prev_hash:
-                    needs_update = True
-                    break
-
-            if needs_update:        
+        expt_ids = [expt_id for expt_id, (expt_mtime, success) in expts.items() if success is True]
+        expt_cells = self.experiment_cells(expt_ids)
+        missing_morpho = self.experiments_missing_morphology()
+
+        for expt_id in expt_ids:
+            if expt_id not in expt_cells:
+                continue
+            if expt_id in missing_morpho:
+                # some cells have no morphology record (for example, they were removed along with
+                # their experiment); always rerun these regardless of fingerprints
                 ready[expt_id] = {'dep_time': datetime.datetime.now()}
+                continue
+            cells = expt_cells[expt_id]['cells']
+            morpho_recs = [(cell_ext_id, morpho_hashes.get(cell_meta.get('lims_specimen_id'))) for cell_ext_id, cell_meta in cells.items()]
+            ready[expt_id] = {
+                'dep_time': expts[expt_id][0],
+                'input_hash': content_hash(expt_hashes.get(expt_id, (None, None))[1], morpho_recs),
+            }
         
         return ready
 
 
+    def experiments_missing_morphology(self):
+        """Return the set of experiment ext_ids that have at least one cell with no morphology record.
+        """
+        db = self.database
+        session = db.session()
+        q = session.query(db.Experiment.ext_id).join(db.Cell, db.Cell.experiment_id==db.Experiment.id)
+        q = q.outerjoin(db.Morphology, db.Morphology.cell_id==db.Cell.id).filter(db.Morphology.id==None)
+        expt_ids = set(rec[0] for rec in q.distinct().all())
+        session.rollback()
+        return expt_ids
+
+
 def hash_record(rec):
     return hashlib.md5(repr(rec).encode()).hexdigest()
 
@@ -191,6 +193,17 @@ def import_morpho_db():
 
     return morpho_results
 
+def morpho_record_hashes():
+    """Return a dict mapping {cell_specimen_id: hash} for all records in the morphology database.
+
+    Hashes are computed for all rows at once (see pandas.util.hash_pandas_object).
+    """
+    import pandas as pd
+    morpho_df = pd.DataFrame.from_dict(morpho_db(), orient='index')
+    row_hashes = pd.util.hash_pandas_object(morpho_df, index=True)
+    return {int(spec_id): int(h) for spec_id, h in row_hashes.items()}
+
+
 morpho_cache = None
 def morpho_db():
     global morpho_cache
@@ -9,8 +9,9 @@ import os, datetime, shutil, tempfile, hashlib
 import pandas as pd
 from collections import OrderedDict
 from ... import config
+from ..fingerprint import content_hash
 from .pipeline_module import MultipatchPipelineModule
-from .experiment import ExperimentPipelineModule
+from .experiment import ExperimentPipelineModule, get_site_index
 from ...util import optional_import
 getDirHandle = optional_import('acq4.util.DataManager', 'getDirHandle')
 pyodbc = optional_import('pyodbc')
@@ -150,63 +151,65 @@ class PatchSeqPipelineModule(MultipatchPipelineModule):
     def ready_jobs(self):
         """Return an ordered dict of all jobs that are ready to be processed (all dependencies are present)
         and the dates that dependencies were created.
+
+        Each job is fingerprinted by the experiment record it was generated from and the amplification /
+        mapping results for the tubes collected in that experiment, so jobs are only rerun when one of
+        these actually changes.
         """
-        db = self.database
         # All experiments and their creation times in the DB
-        expts = self.pipeline.get_module('experiment').finished_jobs()
-
-        # Look up nwb file locations for all experiments
-        session = db.session()
-        # expts = session.query(db.Experiment).filter(db.Experiment.ext_id==1521667891.153).all()
-        session.rollback()
+        expt_module = self.pipeline.get_module('experiment')
+        expts = expt_module.finished_jobs()
+        expt_hashes = expt_module.job_fingerprints()
         
-        # Return the greater of NWB mod time and experiment DB record mtime
         ready = OrderedDict()
 
         try:
-            amp_results = get_amp_results()
-            mapping_results = get_mapping_results()
+            amp_hashes, mapping_hashes = patchseq_record_hashes()
         except ImportError as exc:
             print("Skipping patchseq: %s" % str(exc))
             return ready
 
-        patchseq_results = amp_results.copy()
-        patchseq_results.update(mapping_results)
+        expt_ids = [expt_id for expt_id, (expt_mtime, success) in expts.items() if success is True]
+        expt_cells = self.experiment_cells(expt_ids)
+        site_index = get_site_index()
 
-        for expt_id, (expt_mtime, success) in expts.items():
-            if success is not True:
+        for expt_id in expt_ids:
+            if expt_id not in expt_cells:
                 continue
+            headstages = site_index.headstages(expt_cells[expt_id]['storage_path'])
+
+            # hash exactly the values that create_db_entries would read for each cell
+            tube_results = []
+            for cell_ext_id in expt_cells[expt_id]['cells']:
+                hs = headstages.get(cell_ext_id, {})
+                tube_id = hs.get('Tube ID', '').strip()
+                if tube_id == '':
+                    continue
+                tube_results.append((
+                    cell_ext_id, tube_id, hs.get('Nucleus'), hs.get('End Seal'),
+                    amp_hashes.get(tube_id), mapping_hashes.get(tube_id),
+                ))
+
+            ready[expt_id] = {
+                'dep_time': expts[expt_id][0],
+                'input_hash': content_hash(expt_hashes.get(expt_id, (None, None))[1], tube_results),
+            }
 
-            expt = session.query(db.Experiment).filter(db.Experiment.ext_id==expt_id).all()[0]
-            ready[expt_id] = {'dep_time': expt_mtime}
-
-            path = os.path.join(config.synphys_data, expt.storage_path)
-            site_info = getDirHandle(path).info()
-            headstages = site_info.get('headstages')
-            if headstages is None:
-                continue
+        site_index.save()
+        return ready
 
-            patchseq_tubes = {hs_name.split('HS')[1]: hs['Tube ID'] for hs_name, hs in headstages.items()}
-            if patchseq_tubes is None:
-                continue
 
-            patchseq_hash_compare = []
-            for cell_ext_id, cell in expt.cells.items():
-                tube_id = patchseq_tubes.get(cell_ext_id, '').strip()
-                if tube_id not in patchseq_results:
-                    continue
-                patchseq_data = patchseq_results[tube_id]
-                patchseq_data_hash = hashlib.md5(str(tuple(patchseq_data.values())).encode()).hexdigest()
-                patchseq_rec = session.query(db.PatchSeq).join(db.Cell).filter(db.Cell.id == cell.id).all()
-                if len(patchseq_rec) == 1:
-                    patchseq_rec_hash = patchseq_rec[0].patchseq_hash
-                    patchseq_hash_compare.append(patchseq_data_hash == patchseq_rec_hash)
-                else:
-                    patchseq_hash_compare.append(False)
-            if all(patchseq_hash_compare) is False:
-                ready[expt_id] = {'dep_time': datetime.datetime.now()}
+def patchseq_record_hashes():
+    """Return dicts mapping {tube_id: hash} for all amplification and mapping results.
 
-        return ready
+    Hashes are computed for all rows at once (see pandas.util.hash_pandas_object).
+    """
+    hashes = []
+    for results in (get_amp_results(), get_mapping_results()):
+        df = pd.DataFrame.from_dict(results, orient='index')
+        row_hashes = pd.util.hash_pandas_object(df, index=True)
+        hashes.append({tube_id: int(h) for tube_id, h in row_hashes.items()})
+    return hashes[0], hashes[1]
 
 amp_cache = None
 def get_amp_results(): 
@@ -1,30 +1,90 @@
 import os
+from collections import OrderedDict
 from ..pipeline_module import DatabasePipelineModule
 
 
 class MultipatchPipelineModule(DatabasePipelineModule):
+
+    # maximum number of experiment IDs per query in experiment_cells()
+    experiment_chunk_size = 500
     
     def job_status(self):
         """Extends DatabasePipelineModule to provide more information about the source of each job.
         """
-        db = self.database
         jobs = DatabasePipelineModule.job_status(self)
-        expts = {rec[0]:rec[1] for rec in db.query(db.Experiment.ext_id, db.Experiment).all()}
-        
-        for jid, (status, error, meta) in jobs.items():
-            if status is True:
-                continue
-            if meta is None:
-                if jid not in expts:
-                    continue
-                meta = {'source': expts[jid].original_path}
-            else:
+        failed = [(jid, meta) for jid, (status, error, meta) in jobs.items() if status is not True]
+        for (jid, meta), source in zip(failed, self.job_sources(failed)):
+            status, error, _ = jobs[jid]
+            if meta is not None and 'source' in meta:
                 # a path should already be present in meta; translate backward to original source
-                meta['storage_path'] = meta['source']
-                sync_file = os.path.join(meta['source'], 'sync_source')
-                if os.path.exists(sync_file):
-                    meta['source'] = open(sync_file).read()
-                    
+                meta = dict(meta, storage_path=meta['source'], source=source)
+            elif source != '':
+                meta = dict(meta or {}, source=source)
             jobs[jid] = (status, error, meta)
-        
         return jobs
+
+    def job_source(self, job_id, meta):
+        """Return the original path where the experiment for a job was acquired.
+        """
+        return self.job_sources([(job_id, meta)])[0]
+
+    def job_sources(self, jobs):
+        """Return the original acquisition path for each (job_id, meta) in *jobs*.
+
+        Jobs without a source path in their meta are looked up in the experiment table
+        with one query per chunk of job IDs.
+        """
+        lookup = sorted(set(job_id for job_id, meta in jobs if meta is None or 'source' not in meta))
+        original_paths = {}
+        if len(lookup) > 0:
+            db = self.database
+            session = db.session()
+            try:
+                for i in range(0, len(lookup), self.experiment_chunk_size):
+                    chunk = lookup[i:i+self.experiment_chunk_size]
+                    for expt in session.query(db.Experiment).filter(db.Experiment.ext_id.in_(chunk)):
+                        original_paths[expt.ext_id] = expt.original_path
+            finally:
+                session.rollback()
+                session.close()
+
+        sources = []
+        for job_id, meta in jobs:
+            if meta is not None and 'source' in meta:
+                sync_file = os.path.join(meta['source'], 'sync_source')
+                if os.path.exists(sync_file):
+                    with open(sync_file) as fh:
+                        sources.append(fh.read())
+                else:
+                    sources.append(meta['source'])
+            else:
+                sources.append(original_paths.get(job_id, None) or '')
+        return sources
+
+    def experiment_cells(self, expt_ids):
+        """Return cell information for many experiments using a single query.
+
+        Returns {expt_ext_id: {'storage_path': str, 'cells': OrderedDict([(cell_ext_id, cell_meta), ...])}}
+        for each of *expt_ids* found in the database, with cells sorted by ext_id.
+        """
+        db = self.database
+        session = db.session()
+        expt_ids = sorted(set(expt_ids))
+        recs = []
+        try:
+            for i in range(0, len(expt_ids), self.experiment_chunk_size):
+                chunk = expt_ids[i:i+self.experiment_chunk_size]
+                q = session.query(db.Experiment.ext_id, db.Experiment.storage_path, db.Cell.ext_id, db.Cell.meta)
+                q = q.outerjoin(db.Cell, db.Cell.experiment_id==db.Experiment.id)
+                q = q.filter(db.Experiment.ext_id.in_(chunk))
+                recs.extend(q.all())
+        finally:
+            session.rollback()
+            session.close()
+
+        expts = {}
+        for expt_id, storage_path, cell_ext_id, cell_meta in sorted(recs, key=lambda r: (r[0], r[2] or '')):
+            expt = expts.setdefault(expt_id, {'storage_path': storage_path, 'cells': OrderedDict()})
+            if cell_ext_id is not None:
+                expt['cells'][cell_ext_id] = cell_meta or {}
+        return expts
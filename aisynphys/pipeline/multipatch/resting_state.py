@@ -2,9 +2,10 @@
 from __future__ import print_function, division
 
 import numpy as np
+from sqlalchemy.orm import joinedload, selectinload
 from .pipeline_module import MultipatchPipelineModule
 from .synapse import SynapsePipelineModule
-from ...resting_state import resting_state_response_fits
+from ...resting_state import resting_state_response_fits_batch
 
 
 # Minimum duration (seconds) we need to wait between stimuli to consider
@@ -34,8 +35,15 @@ class RestingStatePipelineModule(MultipatchPipelineModule):
         expt_id = job['job_id']
 
         expt = db.experiment_from_ext_id(expt_id, session=session)
-       
-        for pair in expt.pairs.values():
+        pairs = (session.query(db.Pair)
+            .filter(db.Pair.experiment_id==expt.id)
+            .options(joinedload(db.Pair.synapse), selectinload(db.Pair.poly_synapse))
+            .order_by(db.Pair.id)
+        ).all()
+
+        synapses = []
+        fit_recs = []
+        for pair in pairs:
             if pair.has_synapse is not True and pair.has_polysynapse is not True:
                 continue
 
@@ -51,14 +59,18 @@ class RestingStatePipelineModule(MultipatchPipelineModule):
             elif pair.has_polysynapse and len(pair.poly_synapse) == 1:
                 synapse = pair.poly_synapse[0]
                 fit_rec = db.RestingStateFit(poly_synapse=synapse)
+            else:
+                continue
+            synapses.append(synapse)
+            fit_recs.append(fit_rec)
 
-            # get resting-state response fits for this synapse            
-            result = resting_state_response_fits(synapse, rest_duration=minimum_rest_duration)
-            
+        # get resting-state response fits for all synapses in the experiment
+        results = resting_state_response_fits_batch(synapses, rest_duration=minimum_rest_duration, session=session, database=db)
+
+        for synapse, fit_rec, result in zip(synapses, fit_recs, results):
             if result is None:
                 continue
             
-            
             for mode in ('ic', 'vc'):
                 fit = result[mode]['fit']
                 if fit is None:
@@ -70,8 +82,9 @@ class RestingStatePipelineModule(MultipatchPipelineModule):
                 setattr(fit_rec, mode + '_avg_data_start_time', result[mode]['average'].t0)
                 
                 # list IDs of pulses that went into this average
-                pr_ids = np.array([pr.id for pr in result[mode]['responses']]),
-                setattr(fit_rec, mode + '_pulse_ids', pr_ids)
+                # (stored as a (1, N) array, as in earlier releases)
+                pr_ids = result[mode]['pulse_response_ids']
+                setattr(fit_rec, mode + '_pulse_ids', pr_ids[np.newaxis])
                 
             session.add(fit_rec)
             
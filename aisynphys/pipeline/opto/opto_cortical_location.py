@@ -10,7 +10,6 @@ import datetime, os
 import json
 import numpy as np
 from aisynphys import config
-from pyqtgraph.debug import Profiler
 
 class OptoCortexLocationPipelineModule(DatabasePipelineModule):
     """Imports cell and site location data for each experiment
@@ -25,6 +24,7 @@ class OptoCortexLocationPipelineModule(DatabasePipelineModule):
         job_id = job['job_id'] ## an expt id
         errors = []
 
+        from pyqtgraph.debug import Profiler
         prof = Profiler('opto_cortical_location', disabled=True)
 
         expt = load_experiment(job_id)
@@ -60,6 +60,9 @@ class OptoDatasetPipelineModule(DatabasePipelineModule):
         for pair in pairs_by_cell_id.values():
             pair.n_ex_test_spikes = 0
             pair.n_in_test_spikes = 0
+            for mode in ('ic', 'vc'):
+                setattr(pair, 'n_ex_test_spikes_' + mode, 0)
+                setattr(pair, 'n_in_test_spikes_' + mode, 0)
 
         # load NWB file
         path = os.path.join(config.synphys_data, expt_entry.storage_path)
@@ -410,12 +413,17 @@ class OptoDatasetPipelineModule(DatabasePipelineModule):
                     responses = osra.get_responses(stim_rec, post_rec)
                     if len(responses) > 10:
                         raise Exception('Found more than 10 pulse responses for %s. Please investigate.'%srec)
+                    clamp_mode = getattr(post_rec, 'clamp_mode', None)
                     for resp in responses:
                         if pair_entry is not None: ### when recordings are crappy cells are not always included in connections files so won't exist as pairs in the db, also led stimulations don't have pairs
                             if resp['ex_qc_pass']:
                                 pair_entry.n_ex_test_spikes += 1
+                                if clamp_mode in ('ic', 'vc'):
+                                    setattr(pair_entry, 'n_ex_test_spikes_' + clamp_mode, getattr(pair_entry, 'n_ex_test_spikes_' + clamp_mode) + 1)
                             if resp['in_qc_pass']:
                                 pair_entry.n_in_test_spikes += 1
+                                if clamp_mode in ('ic', 'vc'):
+                                    setattr(pair_entry, 'n_in_test_spikes_' + clamp_mode, getattr(pair_entry, 'n_in_test_spikes_' + clamp_mode) + 1)
                             
                         sr = min(resp['response']['primary'].sample_rate, 20000)
                         resampled = resp['response']['primary'].resample(sample_rate=sr)
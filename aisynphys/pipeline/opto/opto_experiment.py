@@ -97,6 +97,10 @@ class OptoExperimentPipelineModule(DatabasePipelineModule):
                     # crosstalk_artifact,
                     n_ex_test_spikes=0,  # will be counted in opto_dataset pipeline module
                     n_in_test_spikes=0,  # will be counted in opto_dataset pipeline module
+                    n_ex_test_spikes_ic=0,
+                    n_ex_test_spikes_vc=0,
+                    n_in_test_spikes_ic=0,
+                    n_in_test_spikes_vc=0,
                     distance=pair.distance,
                     # lateral_distance,  # should these be filled in in the opto_cortical_location pipeline module?
                     # vertical_distance, 
@@ -1,7 +1,9 @@
-import re
 from collections import OrderedDict
 from ..util.toposort import toposort
 from .pipeline_module import PipelineModule, DatabasePipelineModule
+from .metrics import metrics_report
+from .state import PipelineState
+from .report import PipelineReport
 
 
 class Pipeline(object):
@@ -21,6 +23,7 @@ class Pipeline(object):
     
     def __init__(self, **kwds):
         self.kwds = kwds
+        self.state = None
         self.modules = [mcls(self) for mcls in self.module_classes]
 
         excluded = [PipelineModule, DatabasePipelineModule]
@@ -38,6 +41,24 @@ class Pipeline(object):
     
     def get_module(self, module_name):
         return self.sorted_modules()[module_name]
+
+    def load_state(self):
+        """Load a snapshot of the pipeline table that is shared by all modules in this pipeline.
+
+        While a snapshot is loaded, the finished_jobs(), job_fingerprints() and job_status() methods
+        of database modules are answered from memory rather than by querying the pipeline table.
+        The snapshot is refreshed (reloading only modules that were changed by any writer) at the
+        start of each module update.
+
+        Returns the PipelineState.
+        """
+        self.state = PipelineState(self.database).load()
+        return self.state
+
+    def clear_state(self):
+        """Discard the snapshot loaded by load_state().
+        """
+        self.state = None
         
     def update(self, modules=None, job_ids=None):
         if modules is None:
@@ -76,100 +97,28 @@ class Pipeline(object):
         
     def report(self, modules=None, job_ids=None):
         """Return a printable string report describing the state of the pipeline plus error messages
-        
+
         If job IDs are specified, then return information about the status of each job.
+
+        See status_report() and aisynphys.pipeline.report.PipelineReport.
+        """
+        return self.status_report(modules).format(job_ids=job_ids)
+
+    def status_report(self, modules=None):
+        """Return a PipelineReport that summarizes the status of *modules* (default is all modules).
+
+        The report can be printed with its format() method or saved with write_json().
         """
         if modules is None:
-            modules = self.sorted_modules()
-        job_ids = job_ids or []
-        mod_name_len = max([len(mod.name) for mod in modules])
-            
-        # only report the first error encountered for each job ID
-        report = []
-        failed_job_ids = set()
-        totals = {}
-        job_status = {}
-        for module in modules:
-            module_errors = []
-            totals[module.name] = [0, 0]
-            job_status[module.name] = module.job_status()
-            for job_id, (success, error, meta) in job_status[module.name].items():
-                if success is False and job_id not in failed_job_ids:
-                    module_errors.append((job_id, error, meta))
-                    failed_job_ids.add(job_id)
-                totals[module.name][0 if success else 1] += 1
-
-            report.append("\n=====  %s  =====\n" % module.name)
-            
-            # sort by error 
-            module_errors.sort(key=lambda e: e[1])
-
-            # decide exactly how to describe each error
-            err_strs = []
-            for job_id, job_error, meta in module_errors:
-                # Attempt to summarize the job error string into a single line
-                err_lines = job_error.strip().split('\n')
-                
-                # strip off all traceback lines
-                tb_lines = []
-                while len(err_lines) >= 2:
-                    if err_lines[0].startswith('Traceback '):
-                        err_lines = err_lines[1:]
-                    if re.match(r'  File \".*\", line \d+, .*', err_lines[0]) is not None:
-                        # found a traceback stack line; might be followed by a code line
-                        if err_lines[1].startswith('    '):
-                            tb_lines.append(err_lines[:2])
-                            err_lines = err_lines[2:]
-                        else:
-                            tb_lines.append(err_lines[:1])
-                            err_lines = err_lines[1:]
-                    else:
-                        break
-                if len(err_lines) == 0:
-                    err_msg = "[no error message]"
-                else:
-                    err_msg = err_lines[0]  # assume the first line after the traceback contains the most useful message
-                    
-                err_strs.append((
-                    str(job_id),
-                    "" if meta is None else meta.get('source', ''),
-                    err_msg,
-                ))
-                
-            # format into a nice table
-            if len(err_strs) > 0:
-                col_widths = [max([len(err[i]) for err in err_strs]) for i in range(3)]
-                fmt = "{:<%ds}  {:<%ds}  {:s}\n" % tuple(col_widths[:2])
-                for cols in err_strs:
-                    report.append(fmt.format(*cols))
-                
-        report.append("\n=====  Pipeline summary  =====\n")
-        fmt = "%%%ds   %%4d pass   %%4d fail\n" % mod_name_len
-        for module in modules:
-            tot_success, tot_error = totals[module.name]
-            report.append(fmt % (module.name, tot_success, tot_error))
-        
-        
-        for jid in job_ids:
-            report.append("\n----- job: %s -----\n" % jid)
-            for module in modules:
-                js = job_status[module.name].get(jid, None)
-                if js is None:
-                    status = '-'
-                    error = ''
-                else:
-                    success, error, meta = js
-                    status = 'ok' if success else 'fail'
-                    
-                report_entry = "  {:20s} :  {:15s} : {:5s} : ".format(module.name, jid, status)
-                
-                error = error or ''
-                indent = ' ' * len(report_entry)
-                for i,err_line in enumerate(error.split('\n')):
-                    if i > 0:
-                        err_line = indent + err_line
-                    report_entry = report_entry + err_line + '\n'
-                    
-                report.append(report_entry)
-        
-        return ''.join(report)
+            modules = self.sorted_modules().values()
+        return PipelineReport(self.database, modules)
+
+    def metrics_report(self, modules=None, n_jobs=20):
+        """Return a printable string report ranking the slowest modules and jobs, and listing
+        jobs that became slower between the last two runs of each module.
+
+        See aisynphys.pipeline.metrics.metrics_report.
+        """
+        if modules is None:
+            modules = self.sorted_modules().values()
+        return metrics_report(self.database, [mod.name for mod in modules], n_jobs=n_jobs)
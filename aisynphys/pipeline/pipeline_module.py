@@ -1,9 +1,12 @@
 from __future__ import division, print_function
-import sys, time, multiprocessing, traceback, logging
+import sys, time, uuid, multiprocessing, traceback, logging
 from datetime import datetime
 import numpy as np
 from collections import OrderedDict
 from .. import database
+from .fingerprint import content_hash, SessionFingerprint
+from .metrics import JobProfiler
+from .ledger import RunLedger
 
 
 class PipelineModule(object):
@@ -63,7 +66,7 @@ class PipelineModule(object):
         return [mod for mod in self.pipeline.modules if mod in deps]
     
     def update(self, job_ids=None, retry_errors=False, limit=None, parallel=False, 
-               workers=None, debug=False, force=False):
+               workers=None, debug=False, force=False, resume=False):
         """Update analysis results for this module.
         
         Parameters
@@ -71,7 +74,8 @@ class PipelineModule(object):
         job_ids : list | None
             List of job IDs to be updated, or None to update all jobs.
         retry_errors : bool
-            If True, jobs that previously failed will be attempted again.
+            If True, jobs that previously failed will be attempted again. Jobs that keep failing
+            with unchanged inputs are retried with exponential backoff (see RunLedger).
         parallel : bool
             If True, run jobs in parallel threads or subprocesses.
         workers : int or None
@@ -85,32 +89,55 @@ class PipelineModule(object):
             If False, then errors are logged and ignored.
         force: bool
             Update all available jobs, regardless of status.
+        resume : bool
+            If True and a previous update of this module was interrupted, then run only the jobs
+            that it planned but did not finish (skipping the search for updatable jobs).
         """
         logger = logging.getLogger(__name__)
         logger.info("Updating pipeline stage: %s", self.name)
+        state = getattr(self.pipeline, 'state', None)
+        if state is not None:
+            # pick up results written by upstream updates or other processes
+            state.refresh()
+        ledger = self.run_ledger()
         n_retry = 0
-        if force:
+        resumed = OrderedDict()
+        if resume and not force and ledger is not None:
+            resumed = ledger.resumable(job_ids=job_ids)
+            if len(resumed) > 0:
+                logger.info("Resuming %d unfinished job(s) from an interrupted update.", len(resumed))
+
+        if len(resumed) > 0:
+            run_jobs_ready = resumed
+            run_job_ids = list(resumed.keys())
+            drop_job_ids = []
+        elif force:
             if job_ids is not None:
                 run_job_ids = job_ids
-                run_jobs_meta = {}  # no extra metadata provided for these jobs
+                run_jobs_ready = {}  # no extra metadata provided for these jobs
                 # don't deal with orphaned records here
                 drop_job_ids = []
             else:
                 logger.info("Searching for jobs to update..")
-                run_jobs_meta = self.ready_jobs()
-                run_job_ids = list(run_jobs_meta.keys())
+                run_jobs_ready = self.ready_jobs()
+                run_job_ids = list(run_jobs_ready.keys())
                 # maybe want to drop orphaned records here?
                 drop_job_ids = []
                 
         else:
             logger.info("Searching for jobs to update..")
-            drop_job_ids, run_jobs_meta, error_jobs = self.updatable_jobs()
+            drop_job_ids, run_jobs_ready, error_jobs = self.updatable_jobs()
             
             if retry_errors:
-                run_jobs_meta.update(error_jobs)
+                if ledger is not None:
+                    retry_jobs = ledger.due_for_retry(error_jobs)
+                    if len(retry_jobs) < len(error_jobs):
+                        logger.info("Postponing retry of %d failed job(s) (backoff).", len(error_jobs) - len(retry_jobs))
+                    error_jobs = retry_jobs
+                run_jobs_ready.update(error_jobs)
                 n_retry = len(error_jobs)
 
-            run_job_ids = list(run_jobs_meta.keys())
+            run_job_ids = list(run_jobs_ready.keys())
             
             if job_ids is not None:
                 run_job_ids = set(run_job_ids).intersection(job_ids)
@@ -127,62 +154,82 @@ class PipelineModule(object):
             
         logger.info("Found %d job(s) to update.", len(run_job_ids))
 
+        # Make a list of specifications for jobs to be run.
+        # All jobs from this update share a run ID so that job metrics can be compared between runs.
+        # The random suffix keeps IDs unique for updates started at the same time.
+        run_id = '%s %s' % (datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'), uuid.uuid4().hex[:8])
+        if ledger is not None and len(run_job_ids) > 0:
+            ledger.plan(run_id, OrderedDict([(job_id, run_jobs_ready.get(job_id, {})) for job_id in run_job_ids]))
+
         # drop invalid records first
         if len(drop_job_ids) > 0:
             logger.info("Dropping %d invalid results (will not update)..", len(drop_job_ids))
             logger.debug("%s", drop_job_ids)
             self.drop_jobs(drop_job_ids)
+
+        # Results that have an output fingerprint keep their downstream results while they are
+        # rerun; downstream results are dropped afterward only if the output actually changed.
+        prev_outputs = self.output_fingerprints(run_job_ids)
         if len(run_job_ids) > 0:
             logger.info("Dropping %d invalid results (will update)..", len(run_job_ids))
             logger.debug("%s", run_job_ids)
-            self.drop_jobs(run_job_ids)
+            self.drop_jobs(run_job_ids, keep_downstream=prev_outputs.keys())
 
-        # Make a list of specifications for jobs to be run.
         run_jobs = []
         for i, job_id in enumerate(run_job_ids):
+            ready_entry = run_jobs_ready.get(job_id, {})
             job = {
                 'job_id': job_id, 
                 'job_number': i, 
                 'n_jobs': len(run_job_ids),
                 'module_class': self.__class__,
-                'meta': run_jobs_meta.get(job_id, None),
+                'meta': ready_entry.get('meta', None),
+                'input_hash': ready_entry.get('input_hash', None),
+                'run_id': run_id,
                 'debug': debug,
             }
-            
-            # Allow subclasses to modify spec (especially to add configuration on _where_ to store results)
-            job = self.make_job_spec(job)
-            
             run_jobs.append(job)
+
+        # Allow subclasses to modify specs (especially to add configuration on _where_ to store results)
+        run_jobs = self.make_job_specs(run_jobs)
             
-        if parallel and self.allow_parallel:
-            # kill DB connections before forking multiple processes
-            database.dispose_all_engines()
-            
-            logger.info("Processing %d jobs (parallel)..", len(run_jobs))
-            ctx = multiprocessing.get_context('spawn')  # Fork kills!
-            if workers is None:
-                workers = multiprocessing.cpu_count()
-            if self.max_workers is not None:
-                workers = min(workers, self.max_workers)
-
-            pool = ctx.Pool(processes=workers, maxtasksperchild=self.maxtasksperchild)
-            try:
-                # would like to just call self._run_job, but we can't pass a method to Pool.map()
-                # instead we wrap this with the run_job_parallel function defined below.
+        try:
+            if parallel and self.allow_parallel:
+                # kill DB connections before forking multiple processes
+                database.dispose_all_engines()
+                
+                logger.info("Processing %d jobs (parallel)..", len(run_jobs))
+                ctx = multiprocessing.get_context('spawn')  # Fork kills!
+                if workers is None:
+                    workers = multiprocessing.cpu_count()
+                if self.max_workers is not None:
+                    workers = min(workers, self.max_workers)
+
+                pool = ctx.Pool(processes=workers, maxtasksperchild=self.maxtasksperchild)
+                try:
+                    # would like to just call self._run_job, but we can't pass a method to Pool.map()
+                    # instead we wrap this with the run_job_parallel function defined below.
+                    job_results = {}
+                    chunksize = self.maxtasksperchild or 1
+                    for result in pool.imap(run_job_parallel, run_jobs, chunksize=chunksize):  # note: maxtasksperchild is broken unless we also force chunksize
+                        job_results[result['job_id']] = result['error']
+                        print("Finished %d/%d  (%0.1f%%)" % (len(job_results), len(run_jobs), 100*len(job_results)/len(run_jobs)))
+                finally:
+                    pool.close()
+                    
+            else:
+                logger.info("Processing %d jobs (serial)..", len(run_jobs))
                 job_results = {}
-                chunksize = self.maxtasksperchild or 1
-                for result in pool.imap(run_job_parallel, run_jobs, chunksize=chunksize):  # note: maxtasksperchild is broken unless we also force chunksize
+                for job in run_jobs:
+                    result = self._run_job(job)
                     job_results[result['job_id']] = result['error']
-                    print("Finished %d/%d  (%0.1f%%)" % (len(job_results), len(run_jobs), 100*len(job_results)/len(run_jobs)))
-            finally:
-                pool.close()
-                
-        else:
-            logger.info("Processing %d jobs (serial)..", len(run_jobs))
-            job_results = {}
-            for job in run_jobs:
-                result = self._run_job(job)
-                job_results[result['job_id']] = result['error']
+        finally:
+            # also runs if the update is interrupted, so that no downstream result outlives a changed input
+            if len(prev_outputs) > 0:
+                changed = self.changed_outputs(prev_outputs)
+                if len(changed) > 0:
+                    logger.info("Dropping downstream results for %d job(s) whose output changed..", len(changed))
+                    self.drop_downstream_jobs(changed)
                 
         errors = {job:result for job,result in job_results.items() if result is not None}
         return {'n_dropped': len(drop_job_ids), 'n_updated': len(run_job_ids), 'n_errors': len(errors), 'errors': errors, 'n_retry': n_retry}
@@ -196,6 +243,21 @@ class PipelineModule(object):
         """
         return spec
 
+    def make_job_specs(self, specs):
+        """Return a list of job specifications modified from *specs* (see make_job_spec).
+
+        The default implementation calls make_job_spec() for each job. Modules may extend this to
+        collect job parameters for many jobs at once (for example, with batched queries) before
+        the jobs are sent to workers.
+        """
+        return [self.make_job_spec(spec) for spec in specs]
+
+    def run_ledger(self):
+        """Return the RunLedger that records the state of this module's jobs, or None if
+        this module does not keep a ledger.
+        """
+        return None
+
     @classmethod
     def _run_job(cls, job):
         """Entry point for running a single analysis job; may be invoked in a subprocess.
@@ -239,11 +301,50 @@ class PipelineModule(object):
         """
         raise NotImplementedError()
         
-    def drop_jobs(self, job_ids):
+    def drop_jobs(self, job_ids, keep_downstream=None):
         """Remove all results previously stored for a list of job IDs.
+
+        Results of downstream modules that depend on these jobs are also removed, except for
+        those derived from job IDs in *keep_downstream* (see drop_downstream_jobs).
         """
         raise NotImplementedError()
 
+    def drop_downstream_jobs(self, job_ids):
+        """Remove the results of downstream modules that depend on a list of job IDs in this module.
+        """
+        raise NotImplementedError()
+
+    def output_fingerprints(self, job_ids):
+        """Return {job_id: output_hash} for jobs in *job_ids* that previously finished successfully
+        and recorded an output fingerprint.
+
+        While these jobs are rerun, their downstream results are kept; afterward, changed_outputs()
+        tells which of them produced different output (and therefore invalidate downstream results).
+        """
+        job_ids = set(job_ids)
+        if len(job_ids) == 0:
+            return {}
+        finished = self.finished_jobs()
+        return {
+            job_id: output_hash for job_id, (input_hash, output_hash) in self.job_fingerprints().items()
+            if job_id in job_ids and output_hash is not None and finished.get(job_id, (None, False))[1] is True
+        }
+
+    def changed_outputs(self, prev_outputs):
+        """Return the job IDs in *prev_outputs* ({job_id: output_hash}) whose current result is missing,
+        failed, or has a different output fingerprint.
+        """
+        state = getattr(self.pipeline, 'state', None)
+        if state is not None:
+            state.refresh()
+        finished = self.finished_jobs()
+        fingerprints = self.job_fingerprints()
+        changed = []
+        for job_id, prev_hash in prev_outputs.items():
+            if finished.get(job_id, (None, False))[1] is not True or fingerprints.get(job_id, (None, None))[1] != prev_hash:
+                changed.append(job_id)
+        return changed
+
     def drop_all(self):
         """Remove all results generated by this module.
         """
@@ -257,6 +358,14 @@ class PipelineModule(object):
         """
         raise NotImplementedError()
 
+    def job_fingerprints(self):
+        """Return a dict of content fingerprints recorded for each finished job:  {job_id: (input_hash, output_hash)}
+
+        *input_hash* identifies the inputs that were consumed when the job last ran, and *output_hash*
+        identifies the results it produced. Either value may be None if no fingerprint was recorded.
+        """
+        raise NotImplementedError()
+
     def ready_jobs(self):
         """Return an ordered dict of all jobs that are ready to be processed (all dependencies are present)
         and the dates that dependencies were created.
@@ -264,28 +373,39 @@ class PipelineModule(object):
         Returns
         -------
         ready : OrderedDict
-            Contains {job_id: {'dep_time': datetime, 'meta': object}, ...}
+            Contains {job_id: {'dep_time': datetime, 'meta': object, 'input_hash': str}, ...}
             where *job_id* is a string that uniquely identifies the job to be processed,
-            *dep_time* gives the date that its dependencies were last updated, and
+            *dep_time* gives the date that its dependencies were last updated,
             *meta* is an optional arbitrary object to be stored in the pipeline
-            table along with this job.
+            table along with this job, and *input_hash* is an optional content 
+            fingerprint of the job's inputs. If *input_hash* is given, then it is used
+            instead of *dep_time* to decide whether a previous result is stale.
         """
         # default implpementation collects IDs of finished jobs from upstream modules.
         job_times = OrderedDict()
+        job_hashes = {}
         deps = self.upstream_modules()
         for i,mod in enumerate(deps):
             jobs = mod.finished_jobs()
+            fingerprints = mod.job_fingerprints()
             for job_id,(ts,success) in jobs.items():
                 if success is False:
                     continue
                 job_times.setdefault(job_id, [None]*len(deps))
                 job_times[job_id][i] = ts
+                job_hashes.setdefault(job_id, [None]*len(deps))
+                job_hashes[job_id][i] = fingerprints.get(job_id, (None, None))[1]
             
         ready = OrderedDict()
         for job_id, times in job_times.items():
             if None in times:
                 continue
             ready[job_id] = {'dep_time': max(times)}
+
+            # inputs are fingerprinted only if all upstream outputs have fingerprints
+            hashes = job_hashes[job_id]
+            if None not in hashes:
+                ready[job_id]['input_hash'] = content_hash([(mod.name, h) for mod, h in zip(deps, hashes)])
             
         return ready
 
@@ -297,32 +417,33 @@ class PipelineModule(object):
         drop_jobs : list
             Job IDs that need to be dropped because their output is invalid and they are not ready to be updated again
         run_jobs : OrderedDict
-            {job_id: meta} for jobs that need to be updated AND are ready to be updated
+            {job_id: ready_entry} for jobs that need to be updated AND are ready to be updated
+            (where *ready_entry* is the value returned for each job by ready_jobs())
         error_jobs : OrderedDict
-            {job_id: meta} for jobs that previously failed to update due to an error
+            {job_id: ready_entry} for jobs that previously failed to update due to an error
         """
         drop_job_ids = []
         run_jobs = OrderedDict()
         error_jobs = OrderedDict()
         ready = self.ready_jobs()
         finished = self.finished_jobs()
-        for job_id in ready:
-            meta = ready[job_id].get('meta', None)
+        fingerprints = self.job_fingerprints()
+        for job_id, ready_entry in ready.items():
             if job_id in finished:
                 finish_date, success = finished[job_id]
-                dep_date = ready[job_id]['dep_time']
-                if dep_date > finish_date:
+                prev_input_hash = fingerprints.get(job_id, (None, None))[0]
+                if self.result_is_stale(ready_entry, finish_date, prev_input_hash):
                     # result is invalid
-                    run_jobs[job_id] = meta
+                    run_jobs[job_id] = ready_entry
                 else:
                     if success is False:
-                        error_jobs[job_id] = meta
+                        error_jobs[job_id] = ready_entry
                     else:
                         # result is valid
                         pass  
             else:
                 # no current result
-                run_jobs[job_id] = meta
+                run_jobs[job_id] = ready_entry
         
         # look for orphaned results
         for job in finished:
@@ -332,6 +453,37 @@ class PipelineModule(object):
         print("%d jobs ready for processing, %d finished, %d need drop, %d need update, %d previous errors" % (len(ready), len(finished), len(drop_job_ids), len(run_jobs), len(error_jobs)))
         return drop_job_ids, run_jobs, error_jobs
 
+    @staticmethod
+    def result_is_stale(ready_entry, finish_date, prev_input_hash):
+        """Return True if a job result is out of date.
+
+        *ready_entry* is the value returned for the job by ready_jobs(), *finish_date* is the time
+        the previous result was generated, and *prev_input_hash* is the input fingerprint recorded
+        with that result (or None).
+        """
+        input_hash = ready_entry.get('input_hash', None)
+        if input_hash is not None and prev_input_hash is not None:
+            # compare content fingerprints if we have them
+            return input_hash != prev_input_hash
+        # otherwise fall back to comparing timestamps
+        return ready_entry['dep_time'] > finish_date
+
+    def stale_jobs(self):
+        """Return an ordered dict of finished jobs whose results are out of date:  {job_id: finish_date}
+
+        Results are considered stale by the same rules used in updatable_jobs().
+        """
+        ready = self.ready_jobs()
+        fingerprints = self.job_fingerprints()
+        stale = OrderedDict()
+        for job_id, (finish_date, success) in self.finished_jobs().items():
+            if job_id not in ready:
+                continue
+            prev_input_hash = fingerprints.get(job_id, (None, None))[0]
+            if self.result_is_stale(ready[job_id], finish_date, prev_input_hash):
+                stale[job_id] = finish_date
+        return stale
+
     def job_status(self):
         """Return the status and error message for each job in this module.
             
@@ -343,6 +495,24 @@ class PipelineModule(object):
         """
         raise NotImplementedError()
 
+    def job_source(self, job_id, meta):
+        """Return a string describing the original data source of a job, used in error reports.
+
+        *meta* is the value stored with the job in the pipeline table. The default implementation
+        returns meta['source'] if present.
+        """
+        if meta is None:
+            return ''
+        return meta.get('source', '')
+
+    def job_sources(self, jobs):
+        """Return a list of job_source() values for a list of (job_id, meta) tuples.
+
+        Reports call this method with batches of jobs; subclasses that need to query for job sources
+        should override it to look up the whole batch at once.
+        """
+        return [self.job_source(job_id, meta) for job_id, meta in jobs]
+
 
 def run_job_parallel(job):
     # multiprocessing Pool.map doesn't work on methods; must be a plain function
@@ -362,6 +532,11 @@ class DatabasePipelineModule(PipelineModule):
     def database(self):
         return self.pipeline.database    
 
+    def run_ledger(self):
+        """Return the RunLedger that records the state of this module's jobs.
+        """
+        return RunLedger(self.database, self.name)
+
     @classmethod
     def create_db_entries(cls, job_id, session):
         """Generate DB entries for *job_id* and add them to *session*.
@@ -413,37 +588,74 @@ class DatabasePipelineModule(PipelineModule):
         
         # allow addition of extra metadata into pipeline table
         meta = job.get('meta', None)
+        input_hash = job.get('input_hash', None)
         
+        ledger = RunLedger(db, cls.name)
+        ledger.start(job_id, run_id=job.get('run_id', None))
         session = db.session(readonly=False)
+        profiler = JobProfiler(session).start()
+        success = False
+        error = None
+        interrupted = False
         
         try:
             # drop old pipeline job record
             session.query(db.Pipeline).filter(db.Pipeline.job_id==job_id).filter(db.Pipeline.module_name==cls.name).delete()
             session.commit()
 
+            # fingerprint everything this job writes so downstream modules can tell whether it changed
+            output_fingerprint = SessionFingerprint(session)
             errors = cls.create_db_entries(job, session)
             if errors is None:
                 errors = []
             error = '\n'.join(errors)
-            job_result = db.Pipeline(module_name=cls.name, job_id=job_id, success=True, error=error, finish_time=datetime.now(), meta=meta)
+            output_hash = output_fingerprint.hexdigest()
+            output_fingerprint.close()
+            job_result = db.Pipeline(module_name=cls.name, job_id=job_id, success=True, error=error, finish_time=datetime.now(), 
+                                     meta=meta, input_hash=input_hash, output_hash=output_hash)
             session.add(job_result)
 
             session.commit()
             got_exc = False
+            success = True
         except (Exception, KeyboardInterrupt):
             got_exc = True
+            interrupted = isinstance(sys.exc_info()[1], KeyboardInterrupt)
             session.rollback()
             
             err = ''.join(traceback.format_exception(*sys.exc_info()))
-            job_result = db.Pipeline(module_name=cls.name, job_id=job_id, success=False, error=err, finish_time=datetime.now(), meta=meta)
+            error = err
+            job_result = db.Pipeline(module_name=cls.name, job_id=job_id, success=False, error=err, finish_time=datetime.now(), meta=meta, input_hash=input_hash)
             session.add(job_result)
             session.commit()
             raise
         finally:
+            profiler.stop()
+            cls.store_job_metrics(job, profiler, success)
+            ledger.finish(job_id, success, error=error, interrupted=interrupted)
             if not (got_exc and debug):
                 # leave session open if there was an exception and debugging is requested
                 session.close()
 
+    @classmethod
+    def store_job_metrics(cls, job, profiler, success):
+        """Record resource usage for a job in the pipeline_job_metrics table.
+
+        Failure to store metrics is logged but does not affect the job.
+        """
+        db = job['database']
+        try:
+            session = db.session(readonly=False)
+            try:
+                session.add(db.PipelineJobMetrics(
+                    module_name=cls.name, job_id=job['job_id'], run_id=job.get('run_id', None), success=success,
+                    start_time=datetime.fromtimestamp(profiler.start_time), **profiler.metrics()))
+                session.commit()
+            finally:
+                session.close()
+        except Exception:
+            logging.getLogger(__name__).warning("Could not store job metrics for %s %s", cls.name, job['job_id'], exc_info=True)
+
     def initialize(self):
         """Create space (folders, tables, etc.) for this analyzer to store its results.
         """
@@ -460,11 +672,14 @@ class DatabasePipelineModule(PipelineModule):
         session = db.session(readonly=False)
         session.query(db.Pipeline).filter(db.Pipeline.module_name==self.name).delete()
         session.commit()
+        self.run_ledger().clear()
     
-    def drop_jobs(self, job_ids, session=None, skip=None):
+    def drop_jobs(self, job_ids, session=None, skip=None, keep_downstream=None):
         """Remove all results previously stored for a list of job IDs.
         
-        The associated results of dependent modules are also removed.
+        The associated results of dependent modules are also removed, except for results derived from
+        job IDs in *keep_downstream*. These are kept only if they do not reference the tables of this
+        module (otherwise the database removes them along with this module's records).
         """
         db = self.database
         if session is None:
@@ -473,11 +688,8 @@ class DatabasePipelineModule(PipelineModule):
         if skip is None:
             skip = []
         
-        for dep in reversed(self.downstream_modules()):
-            if dep in skip:
-                continue            
-            dep_jobs = dep.dependent_job_ids(self, job_ids)
-            dep.drop_jobs(dep_jobs, session=session, skip=skip)
+        keep = set(keep_downstream or [])
+        self._drop_downstream(self, job_ids, keep, session, skip)
         
         print("Dropping %d jobs from %s module.." % (len(job_ids), self.name))
         records = self.job_records(job_ids, session)
@@ -488,24 +700,96 @@ class DatabasePipelineModule(PipelineModule):
                 session.delete(rec)
                 print("   record %d/%d\r" % (i, len(records)), end='')
                 sys.stdout.flush()
-            session.query(db.Pipeline).filter(db.Pipeline.module_name==self.name).filter(db.Pipeline.job_id.in_(job_ids)).delete(synchronize_session=False)
             print("   dropped %d records; committing.." % len(records))
-            session.commit()
+        session.query(db.Pipeline).filter(db.Pipeline.module_name==self.name).filter(db.Pipeline.job_id.in_(job_ids)).delete(synchronize_session=False)
+        session.commit()
         
         skip.append(self)  # only process each module once
+
+    def drop_downstream_jobs(self, job_ids, session=None):
+        """Remove the results of downstream modules that depend on a list of job IDs in this module.
+        """
+        if session is None:
+            session = self.database.session(readonly=False)
+        self._drop_downstream(self, job_ids, set(), session, [])
+
+    def _drop_downstream(self, origin, job_ids, keep, session, skip):
+        """Drop results of modules downstream of this one that depend on *job_ids*.
+
+        Results derived from job IDs in *keep* are kept, unless the downstream module references the
+        tables of *origin* (the module whose records are being removed).
+        """
+        for dep in reversed(self.downstream_modules()):
+            if dep in skip:
+                continue
+            dep_jobs = dep.dependent_job_ids(self, job_ids)
+            if len(keep) == 0 or dep.references_module(origin):
+                if len(dep_jobs) > 0:
+                    dep.drop_jobs(dep_jobs, session=session, skip=skip)
+                continue
+
+            kept = set(dep.dependent_job_ids(self, [job_id for job_id in job_ids if job_id in keep]))
+            drop = [job_id for job_id in dep_jobs if job_id not in kept]
+            if len(drop) > 0:
+                dep.drop_jobs(drop, session=session, skip=skip)
+            if len(kept) > 0:
+                # results kept in dep may still have downstream results that reference origin
+                dep._drop_downstream(origin, list(kept), kept, session, list(skip))
+
+    def references_module(self, module):
+        """Return True if any table written by this module has a foreign key (directly or through
+        other tables) to a table written by *module*.
+        """
+        tables = self.database.metadata_tables()
+        targets = set(getattr(module, 'table_group', None) or [])
+        if len(targets) == 0:
+            return False
+        checked = set()
+        pending = [name for name in (self.table_group or []) if name in tables]
+        while len(pending) > 0:
+            name = pending.pop()
+            if name in checked:
+                continue
+            checked.add(name)
+            for fk in tables[name].foreign_keys:
+                ref = fk.column.table.name
+                if ref in targets:
+                    return True
+                pending.append(ref)
+        return False
     
     def finished_jobs(self):
         """Return an ordered dict of job IDs that have been successfully processed by this module,
         the dates when they were processed, and whether each job succeeded:  {job_id: (date, success)}
 
         Note that some results returned may be obsolete if dependencies have changed.
+
+        If a pipeline state snapshot is loaded (see Pipeline.load_state), then results are read from the snapshot.
         """
+        state = self.pipeline.state
+        if state is not None:
+            return state.finished_jobs(self.name)
         db = self.database
         session = db.session()
         jobs = session.query(db.Pipeline.job_id, db.Pipeline.finish_time, db.Pipeline.success).filter(db.Pipeline.module_name==self.name).all()
         session.rollback()
         return OrderedDict([(uid, (date, success)) for uid, date, success in jobs])
 
+    def job_fingerprints(self):
+        """Return a dict of content fingerprints recorded for each finished job:  {job_id: (input_hash, output_hash)}
+
+        *input_hash* identifies the inputs that were consumed when the job last ran, and *output_hash*
+        identifies the results it produced. Either value may be None if no fingerprint was recorded.
+        """
+        state = self.pipeline.state
+        if state is not None:
+            return state.job_fingerprints(self.name)
+        db = self.database
+        session = db.session()
+        jobs = session.query(db.Pipeline.job_id, db.Pipeline.input_hash, db.Pipeline.output_hash).filter(db.Pipeline.module_name==self.name).all()
+        session.rollback()
+        return {uid: (input_hash, output_hash) for uid, input_hash, output_hash in jobs}
+
     def job_status(self):
         """Return the status and error message for each job in this module.
             
@@ -515,6 +799,9 @@ class DatabasePipelineModule(PipelineModule):
         *meta* is the same value as returned by ready_jobs(), and may contain information about
         the source of this job so that errors can be traced back to their original data.
         """
+        state = self.pipeline.state
+        if state is not None:
+            return state.job_status(self.name)
         db = self.database
         session = db.session()
         jobs = session.query(db.Pipeline.job_id, db.Pipeline.error, db.Pipeline.success, db.Pipeline.meta).filter(db.Pipeline.module_name==self.name).all()
@@ -0,0 +1,365 @@
+"""
+Status reports for the pipeline table.
+
+PipelineReport computes module-level aggregates (job counts by status and run-ledger state,
+error classes) with GROUP BY queries rather than loading the status of every job. Stale jobs
+are found with the same rules the pipeline uses to decide which jobs to update.
+Job-level records are streamed from the database only when they are requested (failed jobs
+for the error tables, or specific job IDs for drill-down).
+
+Reports can be rendered for the console (format()) or written as JSON (write_json()) so that
+they can be collected by other tools.
+"""
+import re, json, itertools
+from datetime import datetime
+from collections import OrderedDict
+import sqlalchemy
+from .ledger import PLANNED, RUNNING, DONE, FAILED
+
+
+def summarize_error(error):
+    """Summarize an error message (possibly including a traceback) into a single line.
+
+    Traceback lines are stripped, and the first line following the traceback is returned.
+    """
+    err_lines = (error or '').strip().split('\n')
+    while len(err_lines) >= 2:
+        if err_lines[0].startswith('Traceback '):
+            err_lines = err_lines[1:]
+        if re.match(r'  File \".*\", line \d+, .*', err_lines[0]) is not None:
+            # found a traceback stack line; might be followed by a code line
+            if err_lines[1].startswith('    '):
+                err_lines = err_lines[2:]
+            else:
+                err_lines = err_lines[1:]
+        else:
+            break
+    if len(err_lines) == 0 or err_lines[0].strip() == '':
+        return "[no error message]"
+    # assume the first line after the traceback contains the most useful message
+    return err_lines[0]
+
+
+def error_class(error):
+    """Return a short string used to group similar errors.
+
+    This is the exception type name if the summarized error starts with one (for example
+    "ValueError: ..."), and otherwise the summarized message with numbers masked.
+    """
+    msg = summarize_error(error)
+    m = re.match(r'([A-Za-z_][\w\.]*)(:|$)', msg.strip())
+    if m is not None:
+        return m.groups()[0]
+    msg = re.sub(r'0x[0-9a-fA-F]+', '0x?', msg)
+    return re.sub(r'\d+', '#', msg)[:80]
+
+
+class PipelineReport(object):
+    """Aggregate status report for a set of pipeline modules.
+
+    Parameters
+    ----------
+    database : Database
+        Database containing the pipeline and pipeline_run_ledger tables
+    modules : list
+        Pipeline modules to report on, in the order they should be listed. Each module's
+        stale_jobs() is used to find out-of-date results, and each module's job_sources() is used to
+        describe where failed jobs came from.
+    """
+    def __init__(self, database, modules):
+        self.database = database
+        self.modules = list(modules)
+        self._summary = None
+
+    @property
+    def module_names(self):
+        return [mod.name for mod in self.modules]
+
+    def summary(self):
+        """Return an OrderedDict of aggregates for each module (computed once and cached).
+
+        Each entry contains:
+
+        * n_success, n_failed: number of jobs in the pipeline table by status
+        * first_finish, last_finish: oldest and newest job finish times
+        * n_stale: number of finished jobs whose results are out of date (see
+          PipelineModule.stale_jobs); only counted for modules with upstream dependencies
+        * oldest_stale: {'job_id', 'finish_time'} for the stale job that finished first, or None
+        * ledger: {state: n_jobs} from the run ledger, plus 'backoff' (failed jobs waiting
+          for their retry delay to expire)
+        * errors: OrderedDict of {error_class: n_jobs}, most frequent first
+        """
+        if self._summary is None:
+            summary = OrderedDict()
+            for name in self.module_names:
+                summary[name] = {
+                    'n_success': 0, 'n_failed': 0, 'first_finish': None, 'last_finish': None,
+                    'n_stale': 0, 'oldest_stale': None,
+                    'ledger': OrderedDict([(state, 0) for state in (PLANNED, RUNNING, DONE, FAILED, 'backoff')]),
+                    'errors': OrderedDict(),
+                }
+
+            session = self.database.session()
+            try:
+                self._query_counts(session, summary)
+                self._query_ledger(session, summary)
+            finally:
+                session.rollback()
+                session.close()
+            self._query_stale(summary)
+
+            for name, errors in self.error_histogram().items():
+                summary[name]['errors'] = errors
+            self._summary = summary
+        return self._summary
+
+    def _query_counts(self, session, summary):
+        P = self.database.Pipeline
+        q = session.query(P.module_name, P.success, sqlalchemy.func.count(P.id), sqlalchemy.func.min(P.finish_time), sqlalchemy.func.max(P.finish_time))
+        q = q.filter(P.module_name.in_(self.module_names)).group_by(P.module_name, P.success)
+        for name, success, count, first, last in q.all():
+            mod = summary[name]
+            mod['n_success' if success else 'n_failed'] += count
+            if first is not None and (mod['first_finish'] is None or first < mod['first_finish']):
+                mod['first_finish'] = first
+            if last is not None and (mod['last_finish'] is None or last > mod['last_finish']):
+                mod['last_finish'] = last
+
+    def _query_stale(self, summary):
+        # stale results are found using each module's ready_jobs(), as in updatable_jobs(); modules
+        # without upstream dependencies are skipped because their inputs are not in the database
+        for mod in self.modules:
+            if len(mod.upstream_modules()) == 0:
+                continue
+            stale = mod.stale_jobs()
+            if len(stale) == 0:
+                continue
+            job_id, finish_time = min(stale.items(), key=lambda x: (x[1], x[0]))
+            summary[mod.name]['n_stale'] = len(stale)
+            summary[mod.name]['oldest_stale'] = {'job_id': job_id, 'finish_time': finish_time}
+
+    def _query_ledger(self, session, summary):
+        L = self.database.PipelineRunLedger
+        backoff = sqlalchemy.case([(sqlalchemy.and_(L.state==FAILED, L.next_attempt_time > datetime.now()), 1)], else_=0)
+        q = session.query(L.module_name, L.state, sqlalchemy.func.count(L.id), sqlalchemy.func.sum(backoff))
+        q = q.filter(L.module_name.in_(self.module_names)).group_by(L.module_name, L.state)
+        for name, state, count, n_backoff in q.all():
+            ledger = summary[name]['ledger']
+            ledger[state] = ledger.get(state, 0) + count
+            ledger['backoff'] += int(n_backoff or 0)
+
+    def error_histogram(self):
+        """Return {module_name: OrderedDict([(error_class, n_jobs), ...])}, most frequent first.
+
+        Error messages are streamed from the failed records of each module without loading
+        the rest of the pipeline table.
+        """
+        hist = OrderedDict([(name, {}) for name in self.module_names])
+        for job in self.iter_jobs(success=False, describe=False):
+            counts = hist[job['module_name']]
+            counts[job['error_class']] = counts.get(job['error_class'], 0) + 1
+        return OrderedDict([
+            (name, OrderedDict(sorted(counts.items(), key=lambda x: (-x[1], x[0]))))
+            for name, counts in hist.items()
+        ])
+
+    def iter_jobs(self, module_names=None, success=None, job_ids=None, describe=True, batch_size=1000):
+        """Generate one dict per job record, streamed from the database in batches.
+
+        Parameters
+        ----------
+        module_names : list | None
+            Limit to these modules (default is all modules in the report)
+        success : bool | None
+            If given, limit to jobs that succeeded (True) or failed (False)
+        job_ids : list | None
+            Limit to these job IDs
+        describe : bool
+            If True, then failed jobs are described using their module's job_sources() method,
+            which is called once per module for each batch of records.
+        batch_size : int
+            Number of records to fetch from the database at a time
+
+        Each dict contains module_name, job_id, success, finish_time, error, error_summary,
+        error_class, meta, and source (empty for successful jobs or if *describe* is False).
+        """
+        modules = OrderedDict([(mod.name, mod) for mod in self.modules])
+        if module_names is None:
+            module_names = list(modules.keys())
+        P = self.database.Pipeline
+        session = self.database.session()
+        try:
+            q = session.query(P.module_name, P.job_id, P.success, P.finish_time, P.error, P.meta)
+            q = q.filter(P.module_name.in_(list(module_names)))
+            if success is not None:
+                q = q.filter(P.success==success)
+            if job_ids is not None:
+                q = q.filter(P.job_id.in_(list(job_ids)))
+            rows = iter(q.order_by(P.id).yield_per(batch_size))
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if len(batch) == 0:
+                    break
+                sources = self._job_sources(modules, batch) if describe else {}
+                for i, (module_name, job_id, job_success, finish_time, error, meta) in enumerate(batch):
+                    failed = job_success is not True
+                    yield {
+                        'module_name': module_name,
+                        'job_id': job_id,
+                        'success': job_success,
+                        'finish_time': finish_time,
+                        'error': error,
+                        'error_summary': summarize_error(error) if failed else None,
+                        'error_class': error_class(error) if failed else None,
+                        'meta': meta,
+                        'source': sources.get(i, None) or '',
+                    }
+        finally:
+            session.rollback()
+            session.close()
+
+    @staticmethod
+    def _job_sources(modules, batch):
+        """Return {index: source} for the failed jobs in a batch of pipeline rows, calling
+        job_sources() once per module.
+        """
+        by_module = OrderedDict()
+        for i, (module_name, job_id, job_success, _, _, meta) in enumerate(batch):
+            if job_success is not True:
+                by_module.setdefault(module_name, []).append((i, job_id, meta))
+        sources = {}
+        for module_name, jobs in by_module.items():
+            mod_sources = modules[module_name].job_sources([(job_id, meta) for _, job_id, meta in jobs])
+            for (i, _, _), source in zip(jobs, mod_sources):
+                sources[i] = source
+        return sources
+
+    def to_dict(self, include_failed_jobs=False):
+        """Return the report as a JSON-serializable dict.
+
+        If *include_failed_jobs* is True, then a summary of every failed job is included
+        (see write_json to stream these instead).
+        """
+        data = OrderedDict([
+            ('generated', datetime.now()),
+            ('modules', self.summary()),
+        ])
+        if include_failed_jobs:
+            data['failed_jobs'] = [self._job_json(job) for job in self.iter_jobs(success=False)]
+        return _json_values(data)
+
+    def write_json(self, fh, include_failed_jobs=True):
+        """Write the report as JSON to the open file *fh*.
+
+        Failed jobs are streamed from the database and written one at a time.
+        """
+        data = self.to_dict(include_failed_jobs=False)
+        fh.write('{')
+        for i, (key, value) in enumerate(data.items()):
+            fh.write((',\n ' if i > 0 else '\n ') + json.dumps(key) + ': ' + json.dumps(value, indent=1).replace('\n', '\n '))
+        if include_failed_jobs:
+            fh.write(',\n "failed_jobs": [')
+            for i, job in enumerate(self.iter_jobs(success=False)):
+                fh.write((',\n  ' if i > 0 else '\n  ') + json.dumps(_json_values(self._job_json(job))))
+            fh.write('\n ]')
+        fh.write('\n}\n')
+
+    @staticmethod
+    def _job_json(job):
+        keys = ['module_name', 'job_id', 'finish_time', 'error_class', 'error_summary', 'source']
+        return OrderedDict([(k, job[k]) for k in keys])
+
+    def format(self, job_ids=None):
+        """Return a printable string report describing the state of the pipeline plus error messages.
+
+        Only the first error encountered for each job ID is listed. If *job_ids* are given, then
+        the status of each of these jobs in every module is listed as well.
+        """
+        summary = self.summary()
+        mod_name_len = max([len(name) for name in self.module_names] + [6])
+
+        report = []
+        failed_job_ids = set()
+        for name in self.module_names:
+            report.append("\n=====  %s  =====\n" % name)
+
+            module_errors = []
+            for job in self.iter_jobs(module_names=[name], success=False):
+                if job['job_id'] not in failed_job_ids:
+                    module_errors.append(job)
+                    failed_job_ids.add(job['job_id'])
+
+            # sort by error
+            module_errors.sort(key=lambda e: e['error'] or '')
+            err_strs = [(str(e['job_id']), e['source'], e['error_summary']) for e in module_errors]
+
+            # format into a nice table
+            if len(err_strs) > 0:
+                col_widths = [max([len(err[i]) for err in err_strs]) for i in range(3)]
+                fmt = "{:<%ds}  {:<%ds}  {:s}\n" % tuple(col_widths[:2])
+                for cols in err_strs:
+                    report.append(fmt.format(*cols))
+
+        report.append("\n=====  Error classes  =====\n")
+        fmt = "%%%ds   %%6d   %%s\n" % mod_name_len
+        for name, mod in summary.items():
+            for cls, count in mod['errors'].items():
+                report.append(fmt % (name, count, cls))
+
+        report.append("\n=====  Pipeline summary  =====\n")
+        fmt = "%%%ds   %%6d pass   %%6d fail   %%6d stale   %%s" % mod_name_len
+        for name, mod in summary.items():
+            oldest = mod['oldest_stale']
+            oldest = '' if oldest is None else 'oldest stale: %s (%s)' % (oldest['job_id'], _format_time(oldest['finish_time']))
+            report.append((fmt % (name, mod['n_success'], mod['n_failed'], mod['n_stale'], oldest)).rstrip() + '\n')
+
+        ledger = [(name, mod['ledger']) for name, mod in summary.items() if any(mod['ledger'].values())]
+        if len(ledger) > 0:
+            report.append("\n=====  Run ledger  =====\n")
+            fmt = "%%%ds   %%6d planned   %%6d running   %%6d done   %%6d failed (%%d waiting to retry)\n" % mod_name_len
+            for name, counts in ledger:
+                report.append(fmt % (name, counts[PLANNED], counts[RUNNING], counts[DONE], counts[FAILED], counts['backoff']))
+
+        if job_ids:
+            status = {}
+            for job in self.iter_jobs(job_ids=job_ids, describe=False):
+                status[(job['module_name'], job['job_id'])] = job
+            for jid in job_ids:
+                report.append("\n----- job: %s -----\n" % jid)
+                for name in self.module_names:
+                    job = status.get((name, jid), None)
+                    if job is None:
+                        state = '-'
+                        error = ''
+                    else:
+                        state = 'ok' if job['success'] else 'fail'
+                        error = job['error']
+
+                    report_entry = "  {:20s} :  {:15s} : {:5s} : ".format(name, jid, state)
+
+                    error = error or ''
+                    indent = ' ' * len(report_entry)
+                    for i,err_line in enumerate(error.split('\n')):
+                        if i > 0:
+                            err_line = indent + err_line
+                        report_entry = report_entry + err_line + '\n'
+
+                    report.append(report_entry)
+
+        return ''.join(report)
+
+
+def _format_time(t):
+    return '-' if t is None else t.strftime('%Y-%m-%d %H:%M')
+
+
+def _json_values(obj):
+    """Recursively convert datetimes in *obj* to ISO format strings.
+    """
+    if isinstance(obj, dict):
+        return OrderedDict([(k, _json_values(v)) for k, v in obj.items()])
+    if isinstance(obj, (list, tuple)):
+        return [_json_values(v) for v in obj]
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return obj
@@ -0,0 +1,141 @@
+"""
+In-memory snapshot of the pipeline table.
+
+Many pipeline operations need the finished jobs of every module: each module's ready_jobs()
+reads the finished jobs and fingerprints of its upstream modules, updatable_jobs() reads its own,
+and reports read the status of every module. A PipelineState loads the pipeline table once and
+answers all of these from memory (see Pipeline.load_state).
+
+Each module's snapshot is stamped with the row count, maximum row id, and latest finish time of
+its records in the pipeline table. refresh() compares these stamps against the database (a single
+aggregate query) and reloads only the modules that were changed by other writers.
+"""
+from collections import OrderedDict
+import sqlalchemy
+
+
+class PipelineState(object):
+    """Snapshot of the pipeline table, indexed by module name and job ID.
+
+    Parameters
+    ----------
+    database : Database
+        Database containing the pipeline table
+    """
+    def __init__(self, database):
+        self.database = database
+        self.stamps = {}
+        # {module_name: OrderedDict([(job_id, (finish_time, success, input_hash, output_hash)), ...])}
+        self._jobs = {}
+        # {module_name: OrderedDict([(job_id, (success, error, meta)), ...])}; loaded on demand
+        self._status = {}
+
+    def load(self, modules=None):
+        """Load pipeline records for all modules (or only the module names in *modules*) in a single query.
+        """
+        db = self.database
+        session = db.session()
+        try:
+            stamps = self._query_stamps(session)
+            P = db.Pipeline
+            q = session.query(P.module_name, P.job_id, P.finish_time, P.success, P.input_hash, P.output_hash)
+            if modules is not None:
+                q = q.filter(P.module_name.in_(list(modules)))
+            recs = q.order_by(P.id).all()
+        finally:
+            session.rollback()
+            session.close()
+
+        if modules is None:
+            self._jobs = {}
+            self._status = {}
+            self.stamps = stamps
+        else:
+            for name in modules:
+                self._jobs.pop(name, None)
+                self._status.pop(name, None)
+                if name in stamps:
+                    self.stamps[name] = stamps[name]
+                else:
+                    self.stamps.pop(name, None)
+
+        for module_name, job_id, finish_time, success, input_hash, output_hash in recs:
+            jobs = self._jobs.setdefault(module_name, OrderedDict())
+            jobs[job_id] = (finish_time, success, input_hash, output_hash)
+        return self
+
+    def version_stamps(self):
+        """Return {module_name: (n_records, max_id, max_finish_time)} for the current contents of the pipeline table.
+        """
+        session = self.database.session()
+        try:
+            return self._query_stamps(session)
+        finally:
+            session.rollback()
+            session.close()
+
+    def _query_stamps(self, session):
+        P = self.database.Pipeline
+        q = session.query(P.module_name, sqlalchemy.func.count(P.id), sqlalchemy.func.max(P.id), sqlalchemy.func.max(P.finish_time))
+        q = q.group_by(P.module_name)
+        return {name: (count, max_id, max_time) for name, count, max_id, max_time in q.all()}
+
+    def changed_modules(self):
+        """Return a list of module names whose records were changed since they were loaded.
+        """
+        stamps = self.version_stamps()
+        names = set(stamps.keys()) | set(self.stamps.keys())
+        return sorted(name for name in names if stamps.get(name) != self.stamps.get(name))
+
+    def refresh(self):
+        """Reload records for any modules that were changed since they were loaded.
+
+        Returns the list of reloaded module names.
+        """
+        changed = self.changed_modules()
+        if len(changed) > 0:
+            self.load(modules=changed)
+        return changed
+
+    def finished_jobs(self, module_name):
+        """Return {job_id: (finish_time, success)} for all jobs recorded for *module_name*
+        (see PipelineModule.finished_jobs).
+        """
+        jobs = self._jobs.get(module_name, {})
+        return OrderedDict([(job_id, rec[:2]) for job_id, rec in jobs.items()])
+
+    def job_fingerprints(self, module_name):
+        """Return {job_id: (input_hash, output_hash)} for all jobs recorded for *module_name*
+        (see PipelineModule.job_fingerprints).
+        """
+        jobs = self._jobs.get(module_name, {})
+        return {job_id: rec[2:] for job_id, rec in jobs.items()}
+
+    def job_status(self, module_name):
+        """Return {job_id: (success, error, meta)} for all jobs recorded for *module_name*
+        (see PipelineModule.job_status).
+
+        Error messages and metadata are not part of the initial snapshot; they are loaded for all
+        modules at once the first time any module's status is requested.
+        """
+        if module_name not in self._status:
+            self._load_status()
+        return OrderedDict(self._status.get(module_name, {}))
+
+    def _load_status(self):
+        db = self.database
+        P = db.Pipeline
+        missing = [name for name in self._jobs if name not in self._status]
+        if len(missing) == 0:
+            return
+        session = db.session()
+        try:
+            recs = session.query(P.module_name, P.job_id, P.success, P.error, P.meta).filter(P.module_name.in_(missing)).order_by(P.id).all()
+        finally:
+            session.rollback()
+            session.close()
+        for name in missing:
+            self._status[name] = OrderedDict()
+        for module_name, job_id, success, error, meta in recs:
+            if job_id in self._jobs[module_name]:
+                self._status[module_name][job_id] = (success, error, meta)
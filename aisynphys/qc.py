@@ -166,6 +166,272 @@ def pulse_response_qc_pass(post_rec, window, n_spikes, adjacent_pulses):
     
     return ex_qc_pass, in_qc_pass, failures
 
+# Failure bits used by RecordingQCBatch (see recording_qc_pass)
+REC_QC_UNKNOWN_CURRENT = 1 << 0
+REC_QC_CURRENT = 1 << 1
+REC_QC_UNKNOWN_POTENTIAL = 1 << 2
+REC_QC_POTENTIAL = 1 << 3
+REC_QC_UNKNOWN_NOISE = 1 << 4
+REC_QC_NOISE = 1 << 5
+REC_QC_ZEROS = 1 << 6
+
+# Failure bits used by PulseResponseQCBatch (see pulse_response_qc_pass)
+PR_QC_RECORDING = 1 << 0
+PR_QC_NO_SPIKES = 1 << 1
+PR_QC_NOISE = 1 << 2
+PR_QC_MAX_POTENTIAL = 1 << 3
+PR_QC_MAX_AMP = 1 << 4
+PR_QC_ADJACENT = 1 << 5
+PR_QC_WINDOW_BASELINE = 1 << 6
+PR_QC_UNKNOWN_BASELINE = 1 << 7
+PR_QC_RECORDING_BASELINE = 1 << 8
+
+
+def _float_array(values):
+    """Return (float array, None mask) for a list of values that may contain None.
+    """
+    unknown = np.array([v is None for v in values], dtype=bool)
+    arr = np.array([np.nan if v is None else v for v in values], dtype=float)
+    return arr, unknown
+
+
+def count_zeros(arrays):
+    """Return (zero_count, n_samples) arrays for a list of 1D data arrays.
+
+    The arrays are stacked (NaN-padded) and zeros are counted in a single vectorized pass.
+    """
+    n_samples = np.array([len(a) for a in arrays], dtype=int)
+    if len(arrays) == 0:
+        return n_samples, n_samples
+    stack = np.full((len(arrays), n_samples.max()), np.nan)
+    for i, a in enumerate(arrays):
+        stack[i, :len(a)] = a
+    return (stack == 0).sum(axis=1), n_samples
+
+
+class RecordingQCBatch(object):
+    """Applies the criteria of recording_qc_pass() to many recordings at once.
+
+    Failures are stored as a bitmask per recording (see REC_QC_* flags); failure
+    messages are only generated when requested with failures().
+
+    Parameters
+    ----------
+    clamp_mode : list
+        'ic' or 'vc' for each recording
+    baseline_current, baseline_potential, baseline_noise_stdev : list
+        Baseline values for each recording (None if unknown)
+    zero_count, n_samples : array
+        Number of exact zeros and total number of samples in each recording's primary channel (see count_zeros)
+    """
+    def __init__(self, clamp_mode, baseline_current, baseline_potential, baseline_noise_stdev, zero_count, n_samples):
+        self.clamp_mode = np.array(clamp_mode, dtype=object)
+        self.baseline_current, unknown_current = _float_array(baseline_current)
+        self.baseline_potential, unknown_potential = _float_array(baseline_potential)
+        self.baseline_noise_stdev, unknown_noise = _float_array(baseline_noise_stdev)
+        zero_count = np.asarray(zero_count)
+        n_samples = np.asarray(n_samples)
+
+        ic = self.clamp_mode == 'ic'
+        vc = self.clamp_mode == 'vc'
+        cur = self.baseline_current
+        pot = self.baseline_potential
+        noise = self.baseline_noise_stdev
+        noise_limit = np.where(ic, 5e-3, 200e-12)
+
+        flags = [
+            (REC_QC_UNKNOWN_CURRENT, unknown_current),
+            (REC_QC_CURRENT, ~unknown_current & ((cur < -800e-12) | (cur > 800e-12))),
+            (REC_QC_UNKNOWN_POTENTIAL, ic & unknown_potential),
+            (REC_QC_POTENTIAL, ic & ~unknown_potential & ((pot < -85e-3) | (pot > -45e-3))),
+            (REC_QC_UNKNOWN_NOISE, (ic | vc) & unknown_noise),
+            (REC_QC_NOISE, (ic | vc) & ~unknown_noise & (noise > noise_limit)),
+            (REC_QC_ZEROS, zero_count > n_samples // 10),
+        ]
+        self.mask = np.zeros(len(self.clamp_mode), dtype=int)
+        for bit, fail in flags:
+            self.mask[fail] |= bit
+
+    @classmethod
+    def from_recordings(cls, recs):
+        """Evaluate QC for a list of PatchClampRecording instances.
+        """
+        zero_count, n_samples = count_zeros([rec['primary'].data for rec in recs])
+        return cls(
+            clamp_mode=[rec.clamp_mode for rec in recs],
+            baseline_current=[rec.baseline_current for rec in recs],
+            baseline_potential=[rec.baseline_potential for rec in recs],
+            baseline_noise_stdev=[rec.baseline_noise_stdev for rec in recs],
+            zero_count=zero_count,
+            n_samples=n_samples,
+        )
+
+    def __len__(self):
+        return len(self.mask)
+
+    @property
+    def qc_pass(self):
+        """Boolean array indicating which recordings passed QC.
+        """
+        return self.mask == 0
+
+    def failures(self, i):
+        """Return the list of failure messages for recording *i* (identical to those returned by recording_qc_pass).
+        """
+        mask = self.mask[i]
+        failures = []
+        if mask & REC_QC_UNKNOWN_CURRENT:
+            failures.append('unknown baseline current')
+        if mask & REC_QC_CURRENT:
+            failures.append('baseline current of %s is outside of bounds [-800pA, 800pA]' % si_format(self.baseline_current[i], suffix='A'))
+        if mask & REC_QC_UNKNOWN_POTENTIAL:
+            failures.append('baseline potential is None')
+        if mask & REC_QC_POTENTIAL:
+            failures.append('baseline potential of %s is outside of bounds [-85mV, -45mV]' % si_format(self.baseline_potential[i], suffix='V'))
+        if mask & REC_QC_UNKNOWN_NOISE:
+            failures.append('no baseline_noise_stdev for this recording')
+        if mask & REC_QC_NOISE:
+            if self.clamp_mode[i] == 'ic':
+                failures.append('baseline noise stdev of %s exceeds 5mV' % si_format(self.baseline_noise_stdev[i], suffix='V'))
+            else:
+                failures.append('baseline noise stdev of %s exceeds 200pA' % si_format(self.baseline_noise_stdev[i], suffix='A'))
+        if mask & REC_QC_ZEROS:
+            failures.append('data recording contains a significant chunk of zeros')
+        return failures
+
+    def result(self, i):
+        """Return (qc_pass, failures) for recording *i*, as returned by recording_qc_pass().
+        """
+        return bool(self.mask[i] == 0), self.failures(i)
+
+
+class PulseResponseQCBatch(object):
+    """Applies the criteria of pulse_response_qc_pass() to many response windows from the same
+    postsynaptic recording.
+
+    The recording-level QC is evaluated only once, and failures are stored as bitmasks
+    (see PR_QC_* flags) for excitatory and inhibitory QC; failure messages are only
+    generated when requested with failures().
+
+    Parameters
+    ----------
+    post_rec : Recording
+        The postsynaptic Recording instance
+    windows : list
+        [start, stop] times of each pulse response window
+    n_spikes : list
+        Number of presynaptic spikes for each window (or None to skip the spike check)
+    adjacent_pulses : list
+        List of adjacent presynaptic pulse times for each window
+    recording_qc : tuple | None
+        Optional (qc_pass, failures) for *post_rec* if it was already evaluated
+        (for example, by RecordingQCBatch.result())
+    """
+    ex_limits = (-85e-3, -50e-3)
+    in_limits = (-60e-3, -50e-3)
+
+    def __init__(self, post_rec, windows, n_spikes, adjacent_pulses, recording_qc=None):
+        if post_rec.clamp_mode not in ('ic', 'vc'):
+            raise TypeError('Unsupported clamp mode %s' % post_rec.clamp_mode)
+        self.clamp_mode = post_rec.clamp_mode
+        if recording_qc is None:
+            recording_qc = RecordingQCBatch.from_recordings([post_rec]).result(0)
+        self.recording_pass, self.recording_failures = recording_qc
+
+        n = len(windows)
+        self.n_spikes = list(n_spikes)
+        self.noise = np.empty(n)
+        self.max_value = np.empty(n)
+        self.max_amp = np.empty(n)
+        self.base_potential = np.empty(n)
+        primary = post_rec['primary']
+        for i, (start, stop) in enumerate(windows):
+            data = primary.time_slice(start, stop)
+            pre_pulse = data.time_slice(start, start + 5e-3)
+            base = pre_pulse.median()
+            self.noise[i] = pre_pulse.std()
+            self.max_value[i] = data.data.max()
+            self.max_amp[i] = np.abs(data.data - base).max()
+            if self.clamp_mode == 'ic':
+                self.base_potential[i] = base
+            else:
+                self.base_potential[i] = post_rec['command'].time_slice(start, stop).median()
+        self.recording_baseline = post_rec.baseline_potential
+
+        common = np.zeros(n, dtype=int)
+        if not self.recording_pass:
+            common |= PR_QC_RECORDING
+        common[[ns == 0 for ns in self.n_spikes]] |= PR_QC_NO_SPIKES
+        if self.clamp_mode == 'ic':
+            common[self.noise > 1.5e-3] |= PR_QC_NOISE
+            common[self.max_value > -40e-3] |= PR_QC_MAX_POTENTIAL
+            common[self.max_amp > 10e-3] |= PR_QC_MAX_AMP
+        else:
+            common[self.noise > 15e-12] |= PR_QC_NOISE
+            common[self.max_amp > 500e-12] |= PR_QC_MAX_AMP
+        common[[any([abs(t) < 8e-3 for t in adj]) for adj in adjacent_pulses]] |= PR_QC_ADJACENT
+
+        self.ex_mask = common.copy()
+        self.in_mask = common.copy()
+        for mask, (lo, hi) in [(self.ex_mask, self.ex_limits), (self.in_mask, self.in_limits)]:
+            mask[~((lo < self.base_potential) & (self.base_potential < hi))] |= PR_QC_WINDOW_BASELINE
+            base2 = self.recording_baseline
+            if base2 is None:
+                mask |= PR_QC_UNKNOWN_BASELINE
+            elif not (lo < base2 < hi):
+                mask |= PR_QC_RECORDING_BASELINE
+
+    def __len__(self):
+        return len(self.ex_mask)
+
+    @property
+    def ex_qc_pass(self):
+        return self.ex_mask == 0
+
+    @property
+    def in_qc_pass(self):
+        return self.in_mask == 0
+
+    def failures(self, i):
+        """Return {'ex': [...], 'in': [...]} failure messages for window *i* (identical to those returned by pulse_response_qc_pass).
+        """
+        return {
+            'ex': self._render(i, self.ex_mask[i], self.ex_limits),
+            'in': self._render(i, self.in_mask[i], self.in_limits),
+        }
+
+    def _render(self, i, mask, limits):
+        failures = []
+        units = 'V' if self.clamp_mode == 'ic' else 'A'
+        bounds = '[%dmV, %dmV]' % (round(limits[0] * 1e3), round(limits[1] * 1e3))
+        if mask & PR_QC_RECORDING:
+            failures.append('postsynaptic recording failed QC: %s' % ', and '.join(self.recording_failures))
+        if mask & PR_QC_NO_SPIKES:
+            failures.append('%d spikes detected in presynaptic recording' % self.n_spikes[i])
+        if mask & PR_QC_NOISE:
+            limit = '1.5mV' if self.clamp_mode == 'ic' else '15pA'
+            failures.append('STD of response window, %s, exceeds %s' % (si_format(self.noise[i], suffix=units), limit))
+        if mask & PR_QC_MAX_POTENTIAL:
+            failures.append('Max in response window, %s, exceeds -40mV' % si_format(self.max_value[i], suffix='V'))
+        if mask & PR_QC_MAX_AMP:
+            limit = '10mV' if self.clamp_mode == 'ic' else '500pA'
+            failures.append('Max response amplitude, %s, exceeds %s' % (si_format(self.max_amp[i], suffix=units), limit))
+        if mask & PR_QC_ADJACENT:
+            failures.append('Spikes detected within 8ms of the response window')
+        if mask & PR_QC_WINDOW_BASELINE:
+            failures.append('Response window baseline of %s is outside of bounds %s' % (si_format(self.base_potential[i], suffix='V'), bounds))
+        if mask & PR_QC_UNKNOWN_BASELINE:
+            failures.append('Unknown baseline potential for this recording')
+        if mask & PR_QC_RECORDING_BASELINE:
+            failures.append('Recording baseline of %s is outside of bounds %s' % (si_format(self.recording_baseline, suffix='V'), bounds))
+        return failures
+
+    def result(self, i):
+        """Return (ex_qc_pass, in_qc_pass, failures) for window *i*, as returned by pulse_response_qc_pass().
+        """
+        return bool(self.ex_mask[i] == 0), bool(self.in_mask[i] == 0), self.failures(i)
+
+
 def spike_qc(n_spikes, post_qc):
     """If there is not exactly 1 presynaptic spike, qc Fail spike and postsynaptic response
     """
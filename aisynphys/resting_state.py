@@ -1,17 +1,29 @@
 # coding: utf8
 from __future__ import print_function, division
 
-from .avg_response_fit import fit_avg_pulse_response
-from .data import PulseResponseList
+import numpy as np
+import sqlalchemy
+from .avg_response_fit import fit_avg_response_stack
+from .data import PulseResponseList, TSeriesStack
 from .database import default_db as db
-from .util import datetime_to_timestamp 
+from .database.database import decode_ndarray
+from .database.schema import default_sample_rate
+from .util import datetime_to_timestamp
 
 
-def resting_state_response_fits(synapse, rest_duration):
+fit_signs = {
+    ('ex', 'ic'): 1,
+    ('ex', 'vc'): -1,
+    ('in', 'ic'): -1,
+    ('in', 'vc'): 1,
+}
+
+
+def resting_state_response_fits(synapse, rest_duration, session=None, database=None):
     """Return curve fits to average pulse responses from *synapse* for pulses that are at "resting state",
     meaning that each stimulus included in the average is preceded by a certain minimum period
-    with no other presynaptic stimuli. 
-    
+    with no other presynaptic stimuli.
+
     Parameters
     ----------
     synapse : Synapse or PolySynapse instance
@@ -19,66 +31,189 @@ def resting_state_response_fits(synapse, rest_duration):
     rest_duration : float
         Duration (seconds) of the time window that must be quiescent in order to consider
         the synapse at "resting state".
-        
+
     Returns
     -------
     result : dict
         Dictionary containing averages and fit results for current clamp and voltage clamp
+        (see resting_state_response_fits_batch)
     """
+    return resting_state_response_fits_batch([synapse], rest_duration, session=session, database=database)[0]
+
+
+def resting_state_response_fits_batch(synapses, rest_duration, session=None, database=None, response_duration=10e-3):
+    """Return resting-state response fits for many synapses (usually all synapses in one experiment).
+
+    Candidate pulse responses for all synapses are loaded in a single query, their waveforms are
+    decoded in bulk and stacked per synapse and clamp mode, and then all averages are fit together.
+
+    Parameters
+    ----------
+    synapses : list
+        Synapse or PolySynapse instances
+    rest_duration : float
+        Duration (seconds) of the time window that must be quiescent in order to consider
+        the synapse at "resting state".
+    response_duration : float
+        Minimum duration (seconds) of pulse response data to include
+
+    Returns
+    -------
+    results : list
+        One item per synapse; None if the synapse has no latency, otherwise a dict
+        ``{'ic': {'fit': .., 'average': .., 'pulse_response_ids': ..}, 'vc': {..}}``.
+    """
+    database = database or db
+    session = session or database.default_session
+
+    fit_synapses = [syn for syn in synapses if syn.latency is not None]
+
+    # 1. Select qc-passed "resting state" PRs for all synapses at once
+    responses = get_resting_state_response_data(fit_synapses, rest_duration, response_duration, session=session, database=database)
+
+    # 2. Stack responses and collect fit parameters for every synapse / clamp mode
+    results = {}
+    tasks = []
+    for i, synapse in enumerate(fit_synapses):
+        latency = synapse.latency
+        latency_window = [latency - 100e-6, latency + 100e-6]
+        results[id(synapse)] = {}
+        for mode in ('ic', 'vc'):
+            sign = fit_signs[synapse.synapse_type, mode]
+            if mode == 'ic':
+                init_params = {'rise_time': synapse.psp_rise_time, 'decay_tau': synapse.psp_decay_tau}
+            else:
+                init_params = {'rise_time': synapse.psc_rise_time, 'decay_tau': synapse.psc_decay_tau}
+            init_params = {k:v for k,v in init_params.items() if v is not None}
+
+            rows = responses[i, mode]
+            results[id(synapse)][mode] = {
+                'fit': None,
+                'average': None,
+                'pulse_response_ids': rows['pulse_response_id'],
+            }
+            if len(rows['pulse_response_id']) > 0:
+                tasks.append((synapse, mode, response_stack(rows), latency_window, sign, init_params))
+
+    # 3. Average and fit
+    for synapse, mode, stack, latency_window, sign, init_params in tasks:
+        fit, avg = fit_avg_response_stack(stack, mode, latency_window, sign, init_params=init_params)
+        results[id(synapse)][mode].update({'fit': fit, 'average': avg})
+
+    return [results.get(id(synapse)) for synapse in synapses]
 
-    latency = synapse.latency
-    
-    if latency is None:
-        return None
-    latency_window = [latency - 100e-6, latency + 100e-6]
-    syn_typ = synapse.synapse_type
-        
-    fit_signs = {
-        ('ex', 'ic'): 1,
-        ('ex', 'vc'): -1,
-        ('in', 'ic'): -1,
-        ('in', 'vc'): 1,
-    }
-        
-    # 1. Select qc-passed "resting state" PRs
-    rest_prs = get_resting_state_responses(synapse, rest_duration, response_duration=10e-3)
-    
-    # 2. Average and fit
-    fits = {}
-    for mode, pr_list in rest_prs.items():
-        sign = fit_signs[syn_typ, mode]
-        if mode == 'ic':
-            init_params = {'rise_time': synapse.psp_rise_time, 'decay_tau': synapse.psp_decay_tau}
-        else:
-            init_params = {'rise_time': synapse.psc_rise_time, 'decay_tau': synapse.psc_decay_tau}
-        init_params = {k:v for k,v in init_params.items() if v is not None}
-
-        if len(pr_list) == 0:
-            fit, avg = None, None
-        else:
-            fit, avg = fit_avg_pulse_response(pr_list, latency_window=latency_window, sign=sign, init_params=init_params)
-
-        fits[mode] = {
-            'fit': fit,
-            'average': avg,
-            'responses': pr_list,
-        }
-    
-    return fits
+
+def get_resting_state_response_data(synapses, rest_duration, response_duration, session=None, database=None):
+    """Load all qc-passed, resting-state pulse responses for many synapses in a single query.
+
+    Response waveforms are selected as raw bytes and decoded in bulk rather than through the ORM.
+
+    Returns
+    -------
+    responses : dict
+        ``{(synapse_index, clamp_mode): rows}``, where *rows* is a dict of arrays with keys
+        pulse_response_id, data_start_time, onset_time, and first_spike_time (NaN where unknown),
+        plus 'data', a list of response waveforms. Rows are ordered by recording start time and pulse
+        onset time.
+    """
+    database = database or db
+    session = session or database.default_session
+    PR = database.PulseResponse
+
+    columns = ['pulse_response_id', 'data_start_time', 'onset_time', 'first_spike_time']
+    responses = {}
+    for i in range(len(synapses)):
+        for mode in ('ic', 'vc'):
+            responses[i, mode] = {k: [] for k in columns + ['data']}
+    if len(synapses) == 0:
+        return _response_arrays(responses)
+
+    # each synapse selects responses that pass QC for its own synapse type
+    syn_index = {}
+    qc_clauses = []
+    for i, synapse in enumerate(synapses):
+        syn_index.setdefault((synapse.pair_id, synapse.synapse_type), []).append(i)
+    for syn_typ in set(syn_typ for pair_id, syn_typ in syn_index):
+        pair_ids = [pair_id for pair_id, t in syn_index if t == syn_typ]
+        qc_field = getattr(PR, syn_typ + '_qc_pass')
+        qc_clauses.append(sqlalchemy.and_(PR.pair_id.in_(pair_ids), qc_field==True))
+
+    q = session.query(
+        PR.pair_id,
+        PR.ex_qc_pass,
+        PR.in_qc_pass,
+        database.PatchClampRecording.clamp_mode,
+        PR.id,
+        PR.data_start_time,
+        database.StimPulse.onset_time,
+        database.StimPulse.first_spike_time,
+        sqlalchemy.type_coerce(PR.data, sqlalchemy.LargeBinary),
+    )
+    q = q.join(database.StimPulse, PR.stim_pulse)
+    q = q.join(database.Recording, PR.recording)
+    q = q.join(database.PatchClampRecording, database.PatchClampRecording.recording_id==database.Recording.id)
+    q = q.filter(database.StimPulse.previous_pulse_dt > rest_duration)
+    q = q.filter(sqlalchemy.or_(*qc_clauses))
+    q = q.order_by(PR.pair_id, database.Recording.start_time, database.StimPulse.onset_time)
+
+    headers = {}
+    for pair_id, ex_qc_pass, in_qc_pass, clamp_mode, pr_id, data_start_time, onset_time, spike_time, blob in q:
+        if clamp_mode not in ('ic', 'vc'):
+            continue
+        data = decode_ndarray(blob, headers)
+        if data is None or len(data) / default_sample_rate < response_duration:
+            # not enough data; skip
+            continue
+        for syn_typ, qc_pass in (('ex', ex_qc_pass), ('in', in_qc_pass)):
+            if qc_pass is not True:
+                continue
+            for i in syn_index.get((pair_id, syn_typ), ()):
+                rows = responses[i, clamp_mode]
+                rows['pulse_response_id'].append(pr_id)
+                rows['data_start_time'].append(data_start_time)
+                rows['onset_time'].append(onset_time)
+                rows['first_spike_time'].append(spike_time)
+                rows['data'].append(data)
+
+    return _response_arrays(responses)
+
+
+def _response_arrays(responses):
+    for rows in responses.values():
+        rows['pulse_response_id'] = np.array(rows['pulse_response_id'], dtype=int)
+        for k in ('data_start_time', 'onset_time', 'first_spike_time'):
+            rows[k] = np.array([np.nan if v is None else v for v in rows[k]], dtype=float)
+    return responses
+
+
+def response_stack(rows, bsub_win=5e-3):
+    """Return a spike-aligned, baseline-subtracted TSeriesStack from response rows returned by
+    get_resting_state_response_data.
+
+    This matches ``PulseResponseList(prs).post_stack(align='spike', bsub=True)``; responses with no
+    known spike time are excluded.
+    """
+    keep = ~np.isnan(rows['first_spike_time'])
+    data = [d for d, k in zip(rows['data'], keep) if k]
+    stack = TSeriesStack.from_arrays(data, rows['data_start_time'][keep], default_sample_rate)
+    if len(stack) == 0:
+        return stack
+    stack = stack.baseline_subtract(rows['onset_time'][keep], bsub_win)
+    return stack.align(rows['first_spike_time'][keep])
 
 
 def get_resting_state_responses(synapse, rest_duration, response_duration):
     """Return {'ic': PulseResponseList(), 'vc': PulseResponseList()} containing
     all qc-passed, resting-state pulse responses for *pair*.
-    
+
     The *rest_duration* parameter is used to define the stimuli that count as "resting state":
     any pulse-response that is preceded by a window *rest_duration* seconds long in which there
-    are no presynaptic spikes. Typical values here might be a few seconds to tens of seconds to 
+    are no presynaptic spikes. Typical values here might be a few seconds to tens of seconds to
     allow the synapse to recover to its resting state.
     """
     syn_typ = synapse.synapse_type
     qc_field = getattr(db.PulseResponse, syn_typ + '_qc_pass')
-    
+
     q = db.query(db.PulseResponse, db.StimPulse, db.Recording, db.PatchClampRecording, db.PulseResponse.data)
     q = q.join(db.StimPulse, db.PulseResponse.stim_pulse)
     q = q.join(db.Recording, db.PulseResponse.recording)
@@ -88,7 +223,7 @@ def get_resting_state_responses(synapse, rest_duration, response_duration):
     q = q.filter(qc_field==True)
     q = q.order_by(db.Recording.start_time, db.StimPulse.onset_time)
     recs = q.all()
-        
+
     rest_prs = {'ic': [], 'vc': []}
     for rec in recs:
         pr = rec.PulseResponse
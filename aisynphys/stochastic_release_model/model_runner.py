@@ -115,8 +115,7 @@ class StochasticModelRunner:
         return self._synapse_events
 
     def get_pair(self, session=None):
-        expt = self.db.experiment_from_ext_id(self.experiment_id, session=session)
-        return expt.pairs[(self.pre_cell_id, self.post_cell_id)]
+        return self.db.pair_from_ext_id((self.experiment_id, self.pre_cell_id, self.post_cell_id), session=session)
 
     def _load_synapse_events(self, session):
         pair = self.get_pair(session)
@@ -13,6 +13,7 @@ from sqlalchemy.orm import aliased
 from neuroanalysis.data import TSeries, TSeriesList
 from neuroanalysis.baseline import float_mode
 from .avg_response_fit import fit_psp
+from .data import TSeriesStack
 from .database import default_db as db
 
 
@@ -237,21 +238,21 @@ def analyze_pair_connectivity(amps, sign=None):
         ### generate the average response and psp fit
         
         # collect all bg and fg traces
-        fg_traces = TSeriesList()
+        fg_data = []
+        fg_t0 = []
         for rec in fg:
             if not np.isfinite(rec['max_slope_time']) or rec['max_slope_time'] is None:
                 continue
-            t0 = rec['response_start_time'] - rec['max_slope_time']   # time-align to presynaptic spike
-            trace = TSeries(rec['data'], sample_rate=db.default_sample_rate, t0=t0)
-            fg_traces.append(trace)
+            fg_t0.append(rec['response_start_time'] - rec['max_slope_time'])   # time-align to presynaptic spike
+            fg_data.append(rec['data'])
         
         # get averages
         
-        if len(fg_traces) == 0:
+        if len(fg_data) == 0:
             continue
             
         # bg_avg = bg_traces.mean()
-        fg_avg = fg_traces.mean()
+        fg_avg = TSeriesStack.from_arrays(fg_data, fg_t0, db.default_sample_rate).mean()
         base_rgn = fg_avg.time_slice(-6e-3, 0)
         base = float_mode(base_rgn.data)
         fields[clamp_mode + '_average_response'] = fg_avg.data
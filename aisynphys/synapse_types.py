@@ -3,16 +3,20 @@ Analysis code used to load tables of synapse features and perform dimensionality
 with the intent to better understand what the major classes of synapses are, and how they relate
 to cell and synapse properties.
 """
-import os, pickle
+import os, pickle, hashlib
 import numpy as np
 import pandas
-import sklearn.preprocessing, sklearn.pipeline
+import sqlalchemy
 from sqlalchemy.orm import aliased
-import umap
 from .database import default_db
-from neuroanalysis.util.optional_import import optional_import
-plt = optional_import('matplotlib.pyplot')
-sns = optional_import('seaborn')
+from .database.database import decode_ndarray
+from . import config
+from .util.lazy_import import lazy_import
+umap = lazy_import('umap')
+sklearn_preprocessing = lazy_import('sklearn.preprocessing')
+sklearn_pipeline = lazy_import('sklearn.pipeline')
+plt = lazy_import('matplotlib.pyplot')
+sns = lazy_import('seaborn')
 
 
 # Complete list of fields to load along with synapses by default
@@ -203,44 +207,68 @@ def label_rows(data, subclasses, new_column):
 
 
 
-def load_model_vectors(db=default_db, max_vector_size=np.inf):
-    """Return a pandas dataframe containing sPCA vectors describing the posterior distribution of likelihood
-    values across model parameters.
+def load_model_vector_matrix(db=default_db, max_vector_size=np.inf, chunk_size=1000):
+    """Load sPCA vectors describing the posterior distribution of likelihood values across model parameters
+    into a single float32 matrix.
+
+    Vectors are read as raw bytes and copied directly into a preallocated matrix, rather than being
+    decoded into a separate array for each synapse.
+
+    Returns
+    -------
+    index : list
+        (experiment_ext_id, pre_ext_id, post_ext_id) for each row in *matrix*
+    matrix : array
+        (n_synapses, n_components) float32 array of sPCA vectors
     """
     pre_cell = aliased(db.Cell)
     post_cell = aliased(db.Cell)
+    raw_vector = sqlalchemy.type_coerce(db.SynapseModel.sparse_pca_vector, sqlalchemy.LargeBinary)
     query = (
-        db.query(db.SynapseModel.sparse_pca_vector, db.Experiment.ext_id, pre_cell.ext_id, post_cell.ext_id)
+        db.query(raw_vector, db.Experiment.ext_id, pre_cell.ext_id, post_cell.ext_id)
         .join(db.Pair, db.SynapseModel.pair)
         .join(db.Experiment, db.Pair.experiment)
         .join(pre_cell, db.Pair.pre_cell)
         .join(post_cell, db.Pair.post_cell)
     )
-    records = query.all()
-
-    n_cols = min(max_vector_size, len(records[0][0]))
+    n_rows = query.count()
+
+    index = []
+    matrix = None
+    headers = {}
+    for blob, expt_id, pre_cell_id, post_cell_id in query.yield_per(chunk_size):
+        if blob is None or len(blob) == 0:
+            continue
+        vector = decode_ndarray(blob, headers).ravel()
+        if matrix is None:
+            n_cols = int(min(max_vector_size, len(vector)))
+            matrix = np.empty((n_rows, n_cols), dtype='float32')
+        matrix[len(index)] = vector[:n_cols]
+        index.append((expt_id, pre_cell_id, post_cell_id))
+
+    if matrix is None:
+        matrix = np.empty((0, 0), dtype='float32')
+    return index, matrix[:len(index)]
 
-    results = []
-    for rec in records:
-        spca_vector, expt_id, pre_cell_id, post_cell_id = rec
-        row = {
-            'experiment_ext_id': expt_id,
-            'pre_ext_id': pre_cell_id,
-            'post_ext_id': post_cell_id,
-        }
-        for j in range(n_cols):
-            row['PC_%d'%j] = spca_vector[j]
-        results.append(row)
 
-    return pandas.DataFrame(results).set_index(['experiment_ext_id', 'pre_ext_id', 'post_ext_id'])
+def load_model_vectors(db=default_db, max_vector_size=np.inf):
+    """Return a pandas dataframe containing sPCA vectors describing the posterior distribution of likelihood
+    values across model parameters.
+    """
+    index, matrix = load_model_vector_matrix(db, max_vector_size=max_vector_size)
+    return pandas.DataFrame(
+        data=matrix,
+        index=pandas.MultiIndex.from_tuples(index, names=['experiment_ext_id', 'pre_ext_id', 'post_ext_id']),
+        columns=['PC_%d'%j for j in range(matrix.shape[1])],
+    )
 
 
 def umap_pipeline(n_components=2, n_neighbors=15, min_dist=0.8, random_state=0, **kwds):
     """Create an sklearn Pipeline containing a power transfomer (for normalization) and UMAP.
     All arguments are used to construct the UMAP instance.
     """
-    normalizer = sklearn.preprocessing.PowerTransformer(method='yeo-johnson', standardize=True)
-    mapper = sklearn.pipeline.Pipeline([
+    normalizer = sklearn_preprocessing.PowerTransformer(method='yeo-johnson', standardize=True)
+    mapper = sklearn_pipeline.Pipeline([
         ('normalize', normalizer),
         ('reduce', umap.UMAP(
             n_components=n_components,
@@ -253,10 +281,41 @@ def umap_pipeline(n_components=2, n_neighbors=15, min_dist=0.8, random_state=0,
     return mapper
 
 
-def run_umap_pipeline(data, mapper, features):
+def umap_cache_key(mapper, features):
+    """Return a hash identifying a umap pipeline (see umap_pipeline) by its parameters and input features.
+    """
+    h = hashlib.sha1(b'umap_pipeline_v1')
+    params = mapper.get_params(deep=True)
+    for k in sorted(params):
+        v = params[k]
+        # estimator objects are skipped; their parameters are listed separately
+        if v is None or isinstance(v, (str, int, float, bool, tuple, dict, np.number)):
+            h.update(('%s=%r|' % (k, v)).encode())
+    h.update(repr(list(features)).encode())
+    return h.hexdigest()
+
+
+def feature_data_hash(feature_data):
+    """Return a hash of the index and values of a feature dataframe.
+    """
+    h = hashlib.sha1()
+    h.update(repr(list(feature_data.index)).encode())
+    h.update(repr(list(feature_data.columns)).encode())
+    h.update(np.ascontiguousarray(feature_data.values, dtype=float).tobytes())
+    return h.hexdigest()
+
+
+def run_umap_pipeline(data, mapper, features, cache_path=None):
     """Filter *data* to include only rows that contain values for all *features*, 
     then train *mapping* on this filtered data and return a a dataframe containing
     the filtered data plus umap embedding columns.
+
+    The fitted mapper, the embedding, and the UMAP nearest-neighbor graph are cached on disk
+    in *cache_path* (default is config.synapse_type_cache_path), keyed by the pipeline parameters
+    and features. If the cached mapper was trained on the same data, it is reused without refitting. If the
+    data only adds new synapses to the cached training data, the new synapses are projected onto the
+    cached embedding with mapper.transform(). Otherwise the mapper is refit and the cache replaced.
+    Set cache_path=False to disable caching.
     """
 
     # only keep synapses with all feature fields
@@ -267,17 +326,68 @@ def run_umap_pipeline(data, mapper, features):
     print("Dropped to %d synapses" % len(clean_syn_data))
 
     feature_data = clean_syn_data[features]
-    mapper.fit(feature_data)
-
-    embedding = pandas.DataFrame(
-        data=mapper.transform(feature_data),
-        index=clean_syn_data.index,
-        columns=['umap-0', 'umap-1'],
-    )
+    data_hash = feature_data_hash(feature_data)
+
+    if cache_path is None:
+        cache_path = config.synapse_type_cache_path
+    cache_file = None
+    cached = None
+    if cache_path:
+        cache_file = os.path.join(cache_path, 'umap_%s.pkl' % umap_cache_key(mapper, features))
+        if os.path.isfile(cache_file):
+            try:
+                with open(cache_file, 'rb') as fh:
+                    cached = pickle.load(fh)
+            except Exception:
+                print("Could not read umap cache file %s; refitting" % cache_file)
+
+    if cached is not None and cached['data_hash'] == data_hash:
+        mapper.steps = cached['mapper'].steps
+        embedding = cached['embedding']
+    elif cached is not None and _is_extension(cached['training_data'], feature_data):
+        mapper.steps = cached['mapper'].steps
+        new_rows = ~feature_data.index.isin(cached['embedding'].index)
+        print("Projecting %d new synapses onto cached embedding" % new_rows.sum())
+        embedding = cached['embedding'].reindex(feature_data.index)
+        embedding.loc[new_rows] = mapper.transform(feature_data[new_rows])
+    else:
+        mapper.fit(feature_data)
+        coords = mapper.transform(feature_data)
+        embedding = pandas.DataFrame(
+            data=coords,
+            index=clean_syn_data.index,
+            columns=['umap-%d'%i for i in range(coords.shape[1])],
+        )
+        if cache_file is not None:
+            cached = {
+                'data_hash': data_hash,
+                'training_data': feature_data,
+                'mapper': mapper,
+                'embedding': embedding,
+                'graph': mapper.steps[-1][1].graph_,
+            }
+            # write to a temporary file first so that concurrent sessions never read a partial file
+            os.makedirs(cache_path, exist_ok=True)
+            tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+            with open(tmp_file, 'wb') as fh:
+                pickle.dump(cached, fh)
+            os.replace(tmp_file, cache_file)
 
     return clean_syn_data.join(embedding)
 
 
+def _is_extension(training_data, feature_data):
+    """Return True if *feature_data* contains every row of *training_data* unchanged, plus
+    zero or more new rows.
+    """
+    if not training_data.index.isin(feature_data.index).all():
+        return False
+    if not training_data.index.is_unique or not feature_data.index.is_unique:
+        return False
+    current = feature_data.loc[training_data.index, training_data.columns]
+    return np.array_equal(current.values.astype(float), training_data.values.astype(float))
+
+
 def show_umap(data, ax, title=None, legend_title=None, picking=True, **kwds):
     """Default styling and convenience features for generating umap scatter plots.
     """
@@ -0,0 +1,43 @@
+"""
+Fixtures shared by tests that use a local database.
+"""
+import pytest
+from aisynphys.database import SynphysDatabase
+
+
+@pytest.fixture
+def db(tmp_path):
+    """An empty sqlite DB (with all tables created) in a temporary directory.
+
+    Test modules that need a populated DB can override this fixture and request ``db`` to
+    get the empty database.
+    """
+    db = SynphysDatabase('sqlite:///', 'sqlite:///', str(tmp_path / 'test.sqlite'), check_schema=False)
+    db.create_tables()
+    yield db
+    db.dispose_engines()
+
+
+@pytest.fixture
+def synthetic_experiment(db):
+    """Return a function that adds one experiment with three cells to the *db* fixture.
+
+    The returned function is called as ``synthetic_experiment(session, pairs, **synapse_attrs)``
+    where *pairs* is a list of (pre_index, post_index, synapse_type) for the pairs to create.
+    Pairs with a synapse_type of None have no synapse; all others have a Synapse record with
+    *synapse_attrs*. Returns (experiment, sync_rec, pair_list).
+    """
+    def add_synthetic_experiment(session, pairs, **synapse_attrs):
+        expt = db.Experiment(ext_id='1500000000.000', storage_path='slice_000/site_000', acq_timestamp=1500000000.0)
+        srec = db.SyncRec(experiment=expt, ext_id=1)
+        cells = [db.Cell(experiment=expt, ext_id=str(i), electrode=db.Electrode(experiment=expt, ext_id=str(i))) for i in range(1, 4)]
+        pair_list = []
+        for pre, post, syn_type in pairs:
+            pair = db.Pair(experiment=expt, pre_cell=cells[pre], post_cell=cells[post], has_synapse=syn_type is not None)
+            if syn_type is not None:
+                session.add(db.Synapse(pair=pair, synapse_type=syn_type, **synapse_attrs))
+            session.add(pair)
+            pair_list.append(pair)
+        session.add(expt)
+        return expt, srec, pair_list
+    return add_synthetic_experiment
@@ -0,0 +1,54 @@
+import threading
+import numpy as np
+import pytest
+from aisynphys.ui.array_source import ArraySource
+
+
+@pytest.fixture
+def data(tmp_path):
+    arr = np.random.RandomState(0).normal(size=(6, 7, 8, 9)).astype('float32')
+    filename = str(tmp_path / 'data.npy')
+    np.save(filename, arr)
+    return arr, filename
+
+
+def test_array_source_slicing(data):
+    arr, filename = data
+    src = ArraySource.open(filename, chunk_size=100)
+    assert isinstance(src.data, np.memmap) and src.shape == arr.shape
+
+    assert np.array_equal(src.get({0: 2, 3: 5}), arr[2, :, :, 5])
+    # small slabs are projected directly without computing a full projection
+    assert np.array_equal(src.get({0: 1, 1: 2}, project={3}, block=False), arr[1, 2].max(axis=-1))
+    assert src._projections == {}
+    assert np.array_equal(src.get({1: 3}, project={0, 2}), arr[:, 3].max(axis=(0, 1)))
+
+    assert np.array_equal(src.get({3: 4}, project={0, 1}), arr.max(axis=(0, 1))[..., 4])
+    assert np.array_equal(src.projection({0, 1, 2}), arr.max(axis=(0, 1, 2)))
+    assert src.range() == (arr.min(), arr.max())
+
+    # projections are built on cached sub-projections
+    assert frozenset({1}) in src._projections or frozenset({0}) in src._projections
+    assert np.array_equal(src.projection({1}), arr.max(axis=1))
+
+    # 1D arrays
+    src1 = ArraySource(np.memmap(filename, mode='r', dtype='float32', offset=128, shape=(300,)), chunk_size=7)
+    assert src1.projection({0}) == arr.ravel()[:300].max()
+
+
+def test_array_source_background(data):
+    arr, filename = data
+    src = ArraySource.open(filename, chunk_size=20)
+    done = []
+    ready = threading.Event()
+    def callback(req):
+        done.append(req)
+        if len(done) == 2:
+            ready.set()
+    src.add_callback(callback)
+    assert src.range(block=False) is None
+    assert src.get({0: 1}, project={2, 3}, block=False) is None
+    assert ready.wait(10)
+    assert set(done) == {'range', frozenset({2, 3})}
+    assert src.range(block=False) == (arr.min(), arr.max())
+    assert np.array_equal(src.get({0: 1}, project={2, 3}, block=False), arr.max(axis=(2, 3))[1])
@@ -0,0 +1,101 @@
+import os, datetime, sqlite3
+import numpy as np
+import pytest
+from aisynphys.database import SynphysDatabase
+from aisynphys.database import database
+
+
+def make_fixture_db(db, n_experiments=3, n_cells=4, seed=0):
+    """Fill *db* with a few experiments and return the path of its sqlite file.
+    """
+    rng = np.random.RandomState(seed)
+    session = db.session(readonly=False)
+    for i in range(n_experiments):
+        expt = db.Experiment(ext_id='%0.3f' % (1.5e9 + i), acq_timestamp=1.5e9 + i, date=datetime.datetime(2020, 1, 1, 12, 0, i),
+                             meta={'index': i})
+        srec = db.SyncRec(experiment=expt, ext_id=1)
+        cells = [db.Cell(experiment=expt, ext_id=str(j), position=[j, 0.5, None], meta={'cre': 'sst'}) for j in range(n_cells)]
+        rec = db.Recording(sync_rec=srec, start_time=datetime.datetime(2020, 1, 1, 12, 0, i, 500))
+        for pre in cells:
+            for post in cells:
+                if pre is post:
+                    continue
+                pair = db.Pair(experiment=expt, pre_cell=pre, post_cell=post, distance=rng.uniform(0, 100e-6))
+                for k in range(3):
+                    sp = db.StimPulse(recording=rec, pulse_number=k, onset_time=k * 0.02, data=rng.normal(size=50))
+                    data = None if k == 2 else rng.normal(size=100).astype('float32')
+                    session.add(db.PulseResponse(recording=rec, stim_pulse=sp, pair=pair, data=data, data_start_time=0.0,
+                                                 ex_qc_pass=bool(k % 2), meta={'k': k}))
+    session.commit()
+    db.dispose_engines()
+    return db.sqlite_file
+
+
+def table_rows(sqlite_file, table):
+    conn = sqlite3.connect(sqlite_file)
+    try:
+        return conn.execute('SELECT * FROM %s ORDER BY id' % table).fetchall()
+    finally:
+        conn.close()
+
+
+def sqlite_master(sqlite_file, kind):
+    conn = sqlite3.connect(sqlite_file)
+    try:
+        return set(r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type=?", (kind,)))
+    finally:
+        conn.close()
+
+
+def test_bake_sqlite_multi_matches_single_bakes(db, tmp_path):
+    source = SynphysDatabase.load_sqlite(make_fixture_db(db))
+    variants = {
+        'full': {'skip_tables': [], 'skip_columns': {}},
+        'medium': {'skip_tables': [], 'skip_columns': {'pulse_response': ['data', 'meta'], 'stim_pulse': ['data', 'meta']}},
+        'small': {'skip_tables': ['pulse_response', 'stim_pulse', 'recording'], 'skip_columns': {'cell': ['meta']}},
+    }
+
+    # reference: one bake per variant
+    for name, opts in variants.items():
+        source.bake_sqlite(str(tmp_path / ('single_%s.sqlite' % name)), vacuum=False, **opts)
+
+    source.bake_sqlite_multi({str(tmp_path / ('multi_%s.sqlite' % name)): opts for name, opts in variants.items()}, chunksize=7)
+
+    for name, opts in variants.items():
+        single = str(tmp_path / ('single_%s.sqlite' % name))
+        multi = str(tmp_path / ('multi_%s.sqlite' % name))
+        assert sqlite_master(multi, 'table') >= sqlite_master(single, 'table')
+        assert sqlite_master(multi, 'index') == sqlite_master(single, 'index')
+        assert 'sqlite_stat1' in sqlite_master(multi, 'table')
+        for table in source.metadata_tables():
+            assert table_rows(multi, table) == table_rows(single, table), (name, table)
+
+    assert len(table_rows(str(tmp_path / 'multi_full.sqlite'), 'pulse_response')) == 3 * 12 * 3
+    assert len(table_rows(str(tmp_path / 'multi_small.sqlite'), 'pulse_response')) == 0
+
+    # baked files load as databases
+    small = SynphysDatabase.load_sqlite(str(tmp_path / 'multi_small.sqlite'))
+    assert small.query(small.Pair).count() == 3 * 12
+    assert small.query(small.Cell).first().meta is None
+    small.dispose_engines()
+
+    with pytest.raises(Exception):
+        source.bake_sqlite_multi({str(tmp_path / 'multi_full.sqlite'): {}})
+    source.dispose_engines()
+
+
+def test_bake_sqlite_multi_failure(db, tmp_path, monkeypatch):
+    source = SynphysDatabase.load_sqlite(make_fixture_db(db))
+    iter_chunks = database.TableReadThread.iter_chunks
+    def failing_iter_chunks(reader):
+        if reader.table.name == 'pulse_response':
+            raise RuntimeError("read failed")
+        return iter_chunks(reader)
+    monkeypatch.setattr(database.TableReadThread, 'iter_chunks', failing_iter_chunks)
+
+    # partially written files are deleted
+    dest_files = [str(tmp_path / ('multi_%d.sqlite' % i)) for i in range(2)]
+    with pytest.raises(RuntimeError):
+        source.bake_sqlite_multi({f: {} for f in dest_files})
+    assert not any(os.path.exists(f) for f in dest_files)
+    source.dispose_engines()
@@ -0,0 +1,136 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from aisynphys.cell_class import CellClass, ClassificationCache, classify_cells, classify_pairs
+
+
+class Record(SimpleNamespace):
+    """Stand-in for a database record (hashed by identity).
+    """
+    __hash__ = object.__hash__
+    __eq__ = object.__eq__
+
+
+def synthetic_pairs(n_cells, seed=0):
+    """Return a list of fake pairs between all cells of a few fake experiments.
+    """
+    rng = np.random.RandomState(seed)
+    cre_types = ['sst', 'pvalb', 'vip', 'unknown', None]
+    cells = [Record(id=i, cre_type=cre_types[rng.randint(len(cre_types))], target_layer=str(rng.choice([2, 5])))
+             for i in range(n_cells)]
+    pairs = []
+    for expt in range(0, n_cells, 6):
+        expt_cells = cells[expt:expt+6]
+        for pre in expt_cells:
+            for post in expt_cells:
+                if pre is not post:
+                    pairs.append(Record(id=len(pairs), pre_cell=pre, post_cell=post))
+    rng.shuffle(pairs)
+    return pairs
+
+
+CLASSES = [
+    CellClass(cre_type='sst', name='sst'),
+    CellClass(cre_type='pvalb', target_layer='5', name='L5 pv'),
+    CellClass(cre_type=('vip', 'unknown'), name='other'),
+    # same name as the first class, with different criteria
+    CellClass(cre_type='vip', name='sst'),
+    CellClass(name='all'),
+]
+
+
+def check_groups(cache, pairs, cell_classes):
+    """Check that memoized results match classify_cells / classify_pairs.
+    """
+    cell_groups = cache.cell_groups(cell_classes)
+    expected = classify_cells(cell_classes, pairs=pairs, missing_attr='ignore')
+    assert list(cell_groups.keys()) == list(expected.keys())
+    for cell_class, cells in cell_groups.items():
+        assert set(cells) == expected[cell_class]
+        # ordered by first appearance in the pair list
+        assert cells == [c for c in cache.cells if c in expected[cell_class]]
+
+    pair_groups = cache.pair_groups(cell_groups)
+    expected_pairs = classify_pairs(pairs, expected)
+    assert list(pair_groups.keys()) == list(expected_pairs.keys())
+    for key, class_pairs in pair_groups.items():
+        assert class_pairs == expected_pairs[key]
+    return cell_groups, pair_groups
+
+
+def test_classification_cache():
+    pairs = synthetic_pairs(60)
+    cache = ClassificationCache(pairs)
+    groups, pair_groups = check_groups(cache, pairs, CLASSES)
+    # same-named classes are combined, as with classify_cells
+    assert len(groups) == 4
+    sst_cells = groups[CLASSES[0]]
+    assert set(c.cre_type for c in sst_cells) == {'sst', 'vip'}
+
+    # toggling a class off and on reuses memoized cells and pair lists
+    assert len(cache._class_cells) == len(CLASSES)
+    n_elements = len(cache._element_pairs)
+
+    subset = [CLASSES[0], CLASSES[2], CLASSES[4]]
+    _, sub_pair_groups = check_groups(cache, pairs, subset)
+    assert sub_pair_groups[CLASSES[2], CLASSES[4]] is pair_groups[CLASSES[2], CLASSES[4]]
+    # the combined 'sst' group now contains only the first class
+    assert sub_pair_groups[CLASSES[0], CLASSES[4]] is not pair_groups[CLASSES[0], CLASSES[4]]
+
+    assert len(cache._class_cells) == len(CLASSES)
+    # only elements in the row / column of the changed 'sst' group are new
+    assert len(cache._element_pairs) == n_elements + 2 * len(subset) - 1
+
+    _, pair_groups2 = check_groups(cache, pairs, CLASSES)
+    assert len(cache._element_pairs) == n_elements + 2 * len(subset) - 1
+    for key, class_pairs in pair_groups.items():
+        assert pair_groups2[key] is class_pairs
+
+    # a new pair list (eg. after an experiment filter change) is classified from scratch
+    pairs2 = pairs[:len(pairs)//2]
+    check_groups(ClassificationCache(pairs2), pairs2, CLASSES)
+
+
+def test_analyzer_memoization():
+    try:
+        from aisynphys.matrix_analyzer.analyzers import Analyzer
+    except Exception as exc:
+        pytest.skip("matrix analyzer is not available: %s" % exc)
+
+    class PairIdAnalyzer(Analyzer):
+        summary_stat = {'pair_id': 'mean', 'pre_cell': 'mean'}
+        summary_dtypes = {'pair_id': float, 'pre_cell': float}
+
+        def __init__(self):
+            Analyzer.__init__(self)
+            self.results = None
+            self.group_results = None
+            self.measured = []
+
+        def invalidate_output(self):
+            self.results = None
+            self.group_results = None
+
+        def measure_element(self, pre_class, post_class, class_pairs):
+            self.measured.append((pre_class.name, post_class.name))
+            return {pair: {'pair_id': pair.id, 'pre_cell': pair.pre_cell.id} for pair in class_pairs}
+
+    pairs = synthetic_pairs(60)
+    cache = ClassificationCache(pairs)
+    analyzer = PairIdAnalyzer()
+    n_measured = []
+    for cell_classes in [CLASSES, CLASSES[:3], CLASSES]:
+        pair_groups = cache.pair_groups(cache.cell_groups(cell_classes))
+        analyzer.invalidate_output()
+        results = analyzer.measure(pair_groups)
+        group_results = analyzer.group_result(pair_groups)
+        n_measured.append(len(analyzer.measured))
+
+        # compare against a full measurement without memoized elements
+        expected_groups = classify_pairs(pairs, classify_cells(cell_classes, pairs=pairs, missing_attr='ignore'))
+        fresh = PairIdAnalyzer()
+        assert results.equals(fresh.measure(expected_groups))
+        assert group_results.equals(fresh.group_result(expected_groups))
+
+    # re-selecting the original classes measured nothing new
+    assert n_measured[2] == n_measured[1]
@@ -0,0 +1,23 @@
+import numpy as np
+from aisynphys.genotypes import Genotype
+
+
+def test_predict_driver_expression_batch():
+    gt = Genotype('Pvalb-IRES-Cre/wt;Rorb-T2A-tTA2/wt;Ai63(TIT-tdT)/Ai140(TIT2L-GFP-ICL-tTA2)')
+    observations = [(r, g) for r in [True, False, None] for g in [True, False, None]]
+    red = [r for r, g in observations] * 3
+    green = [np.nan if g is None else float(g) for r, g in observations] * 3
+    batch = gt.predict_driver_expression_batch({'red': red, 'green': green})
+    assert set(batch.keys()) == gt.all_drivers
+    for i, (r, g) in enumerate(observations * 3):
+        expected = gt.predict_driver_expression({'red': r, 'green': g})
+        assert {driver: batch[driver][i] for driver in batch} == expected
+
+
+def test_compiled_model_invalidation():
+    gt = Genotype('Sst-IRES-Cre/wt;Ai14(RCL-tdT)/wt')
+    assert gt.predict_driver_expression({'blue': True}, starting_factors=['Cascade Blue']) == {'sst': None}
+    # rules added after the model is compiled (for example, an internal dye) are used by later queries
+    gt.model.add_rule(['Cascade Blue'], ['blue'])
+    assert gt.test_driver_combinations({'blue': True}) == {(): False, ('sst',): False}
+    assert gt.test_driver_combinations({'blue': True}, starting_factors=['Cascade Blue']) == {(): True, ('sst',): True}
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from aisynphys.connectivity import (connectivity_profile, connection_probability_ci, connection_probability_ci_array,
+    binned_connection_counts, binned_connection_probability, bootstrap_connectivity_profile)
+
+
+def reference_profile(connected, distance, bin_edges):
+    # per-bin loop used by connectivity_profile before it was vectorized
+    mask = np.isfinite(connected) & np.isfinite(distance)
+    connected = connected[mask]
+    distance = distance[mask]
+    n_bins = len(bin_edges) - 1
+    prop, lower, upper = np.zeros(n_bins), np.zeros(n_bins), np.zeros(n_bins)
+    for i in range(n_bins):
+        pts = connected[(distance >= bin_edges[i]) & (distance < bin_edges[i+1])]
+        if len(pts) == 0:
+            prop[i], lower[i], upper[i] = np.nan, 0, 1
+        else:
+            prop[i] = pts.sum() / len(pts)
+            lower[i], upper[i] = connection_probability_ci(pts.sum(), len(pts))
+    return prop, lower, upper
+
+
+def random_probes(n, seed=0):
+    rng = np.random.RandomState(seed)
+    distance = rng.uniform(0, 300e-6, size=n)
+    connected = (rng.uniform(size=n) < 0.3 * np.exp(-distance / 100e-6)).astype(float)
+    connected[::17] = np.nan
+    distance[::23] = np.nan
+    return connected, distance
+
+
+def test_connectivity_profile_matches_reference():
+    connected, distance = random_probes(500)
+    bin_edges = np.array([0, 20e-6, 50e-6, 100e-6, 200e-6, 250e-6, 400e-6, 500e-6])
+    _, prop, lower, upper = connectivity_profile(connected, distance, bin_edges)
+    ref = reference_profile(connected, distance, bin_edges)
+    for a, b in zip((prop, lower, upper), ref):
+        assert np.allclose(a, b, equal_nan=True)
+
+    # scalar and array CIs agree, including the edge cases
+    n_probed = np.array([0, 1, 5, 5, 5, 100])
+    n_conn = np.array([0, 1, 0, 2, 5, 37])
+    lower, upper = connection_probability_ci_array(n_conn, n_probed, alpha=0.1)
+    for i in range(len(n_probed)):
+        assert (lower[i], upper[i]) == pytest.approx(connection_probability_ci(n_conn[i], n_probed[i], alpha=0.1))
+
+
+def test_binned_groups():
+    connected, distance = random_probes(600, seed=1)
+    groups = np.arange(600) % 5
+    bin_edges = np.arange(0, 350e-6, 50e-6)
+    n_probed, n_conn = binned_connection_counts(connected, distance, bin_edges, groups=groups, n_groups=6)
+    assert n_probed.shape == (6, 6)
+    assert n_probed[5].sum() == 0
+    prop, lower, upper = binned_connection_probability(n_conn, n_probed)
+    for g in range(5):
+        mask = groups == g
+        ref = reference_profile(connected[mask], distance[mask], bin_edges)
+        for a, b in zip((prop[g], lower[g], upper[g]), ref):
+            assert np.allclose(a, b, equal_nan=True)
+
+
+def test_bootstrap_connectivity_profile():
+    connected, distance = random_probes(400, seed=2)
+    groups = np.arange(400) % 3
+    bin_edges = np.arange(0, 350e-6, 50e-6)
+    samples = bootstrap_connectivity_profile(connected, distance, bin_edges, groups=groups, n_samples=250, seed=5, chunk_size=100)
+    assert samples.shape == (250, 3, 6)
+
+    # seeded results do not depend on threading
+    threaded = bootstrap_connectivity_profile(connected, distance, bin_edges, groups=groups, n_samples=250, seed=5, chunk_size=100, n_threads=3)
+    assert np.array_equal(samples, threaded, equal_nan=True)
+    other = bootstrap_connectivity_profile(connected, distance, bin_edges, groups=groups, n_samples=250, seed=6, chunk_size=100)
+    assert not np.array_equal(samples, other, equal_nan=True)
+
+    # bootstrap distribution is centered on the measured profile
+    n_probed, n_conn = binned_connection_counts(connected, distance, bin_edges, groups=groups)
+    prop, lower, upper = binned_connection_probability(n_conn, n_probed)
+    assert np.allclose(np.nanmean(samples, axis=0), prop, atol=0.03)
+
+    # constant data has no spread; one group without the group axis
+    single = bootstrap_connectivity_profile(np.ones(20), np.linspace(0, 90e-6, 20), [0, 50e-6, 100e-6], n_samples=10, seed=0)
+    assert single.shape == (10, 2)
+    assert np.all(single == 1)
@@ -0,0 +1,91 @@
+import multiprocessing
+import pytest
+import sqlalchemy
+from aisynphys.database import SynphysDatabase
+
+
+@pytest.fixture
+def sqlite_file(db):
+    session = db.session(readonly=False)
+    for i in range(3):
+        session.add(db.Experiment(ext_id='%d.000' % i, storage_path='slice_%03d' % i))
+    session.commit()
+    db.dispose_engines()
+    return db.sqlite_file
+
+
+def count_experiments(db):
+    return db.session().query(db.Experiment).count()
+
+
+def test_readonly_sqlite_engine(sqlite_file):
+    db = SynphysDatabase.load_sqlite(sqlite_file)
+    engine = db.ro_engine
+    assert isinstance(engine.pool, sqlalchemy.pool.QueuePool)
+
+    with engine.connect() as conn:
+        pragmas = {name: conn.execute('PRAGMA %s' % name).scalar() for name in db.sqlite_ro_pragmas}
+        assert pragmas == dict(db.sqlite_ro_pragmas)
+        with pytest.raises(sqlalchemy.exc.OperationalError):
+            conn.execute("insert into experiment (ext_id) values ('x')")
+
+    # sessions reuse pooled connections
+    for i in range(5):
+        session = db.session()
+        assert session.query(db.Experiment).count() == 3
+        session.close()
+    assert engine.pool.checkedin() == 1
+
+    # the number of simultaneously open sessions is not capped by the pool
+    sessions = [db.session() for i in range(15)]
+    assert [s.query(db.Experiment).count() for s in sessions] == [3] * 15
+    for session in sessions:
+        session.close()
+
+    # a pooled connection opened by another process is replaced rather than reused
+    raw = engine.raw_connection()
+    dbapi_conn = raw.connection
+    raw.info['pid'] = -1
+    raw.close()
+    raw = engine.raw_connection()
+    assert raw.connection is not dbapi_conn
+    raw.close()
+    db.dispose_engines()
+
+
+def test_writable_sqlite_engine(sqlite_file):
+    db = SynphysDatabase.load_sqlite(sqlite_file, readonly=False)
+    session = db.session(readonly=False)
+    session.add(db.Experiment(ext_id='3.000', storage_path='slice_003'))
+    session.commit()
+    # the read-only engine sees changes written by the read-write engine
+    assert count_experiments(db) == 4
+    db.dispose_engines()
+
+
+forked_db = None
+
+def count_in_forked_process(i):
+    # uses the database (and pooled engine) inherited from the parent process
+    return count_experiments(forked_db)
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason="requires fork")
+def test_engines_after_fork(sqlite_file):
+    global forked_db
+    db = SynphysDatabase.load_sqlite(sqlite_file)
+    assert count_experiments(db) == 3
+    parent_engine = db.ro_engine
+
+    forked_db = db
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(2) as pool:
+        assert pool.map(count_in_forked_process, range(4)) == [3] * 4
+    forked_db = None
+
+    # the parent's pooled connections are still usable
+    assert db.ro_engine is parent_engine
+    assert count_experiments(db) == 3
+    # engines inherited by children are not retained by the parent database
+    assert db._inherited_engines == []
+    db.dispose_engines()
@@ -0,0 +1,84 @@
+import datetime
+import numpy as np
+import pytest
+from aisynphys.dynamics import generate_pair_dynamics, pulse_response_query, experiment_pulse_response_frame
+from aisynphys.pipeline.multipatch.conductance import reversal_potentials
+
+
+def add_pulse_trains(db, session, synthetic_experiment, seed=0):
+    """Add one experiment with 3 synaptic pairs and random IC / VC pulse trains to the DB.
+    """
+    rng = np.random.RandomState(seed)
+    expt, srec, pairs = synthetic_experiment(session, [(0, 1, 'ex'), (1, 2, 'in'), (2, 0, 'ex')])
+
+    start = datetime.datetime(2020, 1, 1)
+    sweep = 0
+    for pair in pairs:
+        sign = 1 if pair.synapse.synapse_type == 'ex' else -1
+        for clamp_mode in ['ic', 'vc']:
+            for ind_freq, rec_delay in [(50., 0.25), (50., 0.502), (20., 0.25), (100., None)]:
+                for holding in [-70e-3, -55e-3]:
+                    for repeat in range(4):
+                        sweep += 1
+                        rec = db.Recording(sync_rec=srec, start_time=start + datetime.timedelta(seconds=sweep))
+                        pcr = db.PatchClampRecording(recording=rec, clamp_mode=clamp_mode,
+                            baseline_potential=holding + rng.normal(scale=2e-3),
+                            access_adj_baseline_potential=holding + rng.normal(scale=2e-3))
+                        db.MultiPatchProbe(patch_clamp_recording=pcr, induction_frequency=ind_freq, recovery_delay=rec_delay)
+                        n_pulses = 12 if rng.uniform() > 0.2 else rng.randint(1, 12)
+                        for pulse_n in range(1, n_pulses + 1):
+                            if rng.uniform() < 0.05:
+                                # occasional missing pulse
+                                continue
+                            sp = db.StimPulse(recording=rec, pulse_number=pulse_n, onset_time=pulse_n * 0.02,
+                                n_spikes=1 if rng.uniform() > 0.05 else 0, first_spike_time=pulse_n * 0.02 + 1e-3,
+                                previous_pulse_dt=10.0 if pulse_n == 1 else 0.02)
+                            pr = db.PulseResponse(recording=rec, stim_pulse=sp, pair=pair,
+                                ex_qc_pass=bool(rng.uniform() > 0.1), in_qc_pass=bool(rng.uniform() > 0.1))
+                            if rng.uniform() > 0.05:
+                                amp = sign * (0.5e-3 * (1 + 0.1 * pulse_n) + rng.normal(scale=0.2e-3))
+                                vc_amp = (holding - (-0.01 if sign > 0 else -0.08)) * 1e-9 + rng.normal(scale=1e-12)
+                                session.add(db.PulseResponseFit(pulse_response=pr,
+                                    fit_amp=vc_amp if clamp_mode == 'vc' else amp,
+                                    dec_fit_reconv_amp=amp, baseline_dec_fit_reconv_amp=rng.normal(scale=0.1e-3)))
+    session.commit()
+    return expt, pairs
+
+
+def test_experiment_frame_dynamics(db, synthetic_experiment):
+    session = db.session(readonly=False)
+    expt, pairs = add_pulse_trains(db, session, synthetic_experiment)
+
+    frame = experiment_pulse_response_frame(expt, db, session, clamp_mode='ic')
+    frame = frame[frame['has_fit'] & frame['has_probe']]
+    for pair in pairs:
+        pr_recs = pulse_response_query(pair, clamp_mode='ic', session=session, db=db).all()
+        pair_frame = frame[frame['pair_id'] == pair.id]
+        assert len(pair_frame) == len(pr_recs)
+
+        from_recs = generate_pair_dynamics(pair, db, session, pr_recs=pr_recs)
+        from_frame = generate_pair_dynamics(pair, db, session, pr_frame=pair_frame)
+        assert from_frame.n_source_events > 10
+        for col in db.Dynamics.__table__.columns.keys():
+            a, b = getattr(from_recs, col), getattr(from_frame, col)
+            if col == 'stp_all_stimuli':
+                assert repr(a) == repr(b)
+            elif isinstance(a, float):
+                assert a == pytest.approx(b, nan_ok=True)
+            else:
+                assert a == b
+
+        # stp metrics are computed per stimulus type, with recovery delays rounded to known values
+        stims = [meta for meta, metrics in from_frame.stp_all_stimuli]
+        assert ('ic', 50., 0.5) in stims and ('ic', 100., None) in stims
+
+
+def test_reversal_potentials(db, synthetic_experiment):
+    session = db.session(readonly=False)
+    expt, pairs = add_pulse_trains(db, session, synthetic_experiment)
+    frame = experiment_pulse_response_frame(expt, db, session, clamp_mode='vc')
+    reversals = reversal_potentials(frame)
+    assert set(reversals.keys()) == set(pair.id for pair in pairs)
+    for pair in pairs:
+        expected = -10e-3 if pair.synapse.synapse_type == 'ex' else -80e-3
+        assert reversals[pair.id] == pytest.approx(expected, abs=3e-3)
@@ -0,0 +1,61 @@
+import pytest
+
+
+@pytest.fixture
+def db(db):
+    """A local sqlite DB containing three experiments, each with three cells and all pairs between them.
+    """
+    session = db.session(readonly=False)
+    for i, ts in enumerate([1500000000.123, 1500000100.5, 1500000200.0]):
+        expt = db.Experiment(ext_id='%0.3f' % ts, storage_path='slice_%03d/site_000' % i, acq_timestamp=ts)
+        cells = [db.Cell(experiment=expt, ext_id=str(j)) for j in range(1, 4)]
+        session.add_all(cells)
+        for pre in cells:
+            for post in cells:
+                if pre is not post:
+                    session.add(db.Pair(experiment=expt, pre_cell=pre, post_cell=post))
+    session.commit()
+    return db
+
+
+def test_experiments_from_timestamps(db):
+    expts = db.experiments_from_timestamps([1500000000.123, 1500000100.5, 1500000000.12, 1500000200.004, 1500000300.0])
+    assert expts[1500000000.123].ext_id == '1500000000.123'
+    assert expts[1500000100.5].ext_id == '1500000100.500'
+    # truncated / nearby timestamps resolve to the closest experiment
+    assert expts[1500000000.12].ext_id == '1500000000.123'
+    assert expts[1500000200.004].ext_id == '1500000200.000'
+    assert 1500000300.0 not in expts
+
+    assert db.experiment_from_timestamp(1500000100.5).acq_timestamp_key == 150000010050
+    with pytest.raises(KeyError):
+        db.experiment_from_timestamp(1500000100.52)
+
+
+def test_experiment_from_str_timestamp(db):
+    # pipeline job IDs are experiment ext_ids (timestamp strings)
+    assert db.experiment_from_timestamp('1500000000.123').ext_id == '1500000000.123'
+    assert db.experiment_from_timestamp('1500000200.00').ext_id == '1500000200.000'
+    expts = db.experiments_from_timestamps(['1500000100.500', 1500000100.5])
+    assert list(expts.keys()) == ['1500000100.500', 1500000100.5]
+    with pytest.raises(KeyError):
+        db.experiment_from_timestamp('1500000300.000')
+
+    expt = db.Experiment(ext_id='1500000400.000', acq_timestamp='1500000400.0')
+    assert expt.acq_timestamp_key == 150000040000
+
+
+def test_pairs_and_cells_from_ext_ids(db):
+    ids = [('1500000000.123', '1', '2'), ('1500000200.000', '3', '1'), ('1500000100.500', 2, 3), ('1500000100.500', '1', '1')]
+    pairs = db.pairs_from_ext_ids(ids)
+    assert list(pairs.keys()) == ids[:3]
+    for (expt_id, pre, post), pair in pairs.items():
+        assert (pair.experiment.ext_id, pair.pre_cell.ext_id, pair.post_cell.ext_id) == (expt_id, str(pre), str(post))
+
+    cells = db.cells_from_ext_ids([('1500000200.000', '2'), ('1500000000.123', '4')])
+    assert list(cells.keys()) == [('1500000200.000', '2')]
+    assert cells[('1500000200.000', '2')].experiment.ext_id == '1500000200.000'
+
+    assert db.pair_from_ext_id(('1500000000.123', '2', '3')).post_cell.ext_id == '3'
+    with pytest.raises(KeyError):
+        db.cell_from_ext_id(('1500000000.123', '4'))
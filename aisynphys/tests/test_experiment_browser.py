@@ -0,0 +1,80 @@
+import os
+import pytest
+
+pg = pytest.importorskip('pyqtgraph')
+from aisynphys.ui.experiment_browser import ExperimentBrowser, experiment_summary_query, pair_summary_query, pair_display_columns
+
+
+@pytest.fixture
+def db(db):
+    session = db.session(readonly=False)
+    for i in range(3):
+        slice = db.Slice(ext_id='slice_%d' % i, species='mouse' if i < 2 else 'human', genotype='Sst-IRES-Cre' if i == 0 else None)
+        expt = db.Experiment(slice=slice, ext_id='%0.3f' % (1.5e9 + i), acq_timestamp=1.5e9 + i, rig_name='rig%d' % i)
+        cells = [db.Cell(experiment=expt, ext_id=str(j), cre_type='unknown' if j == 0 else 'sst', target_layer='2/3') for j in range(3)]
+        session.add(db.Morphology(cell=cells[0], dendrite_type='spiny'))
+        for pre in cells:
+            for post in cells:
+                if pre is post:
+                    continue
+                has_data = i != 1 or pre is cells[0]
+                session.add(db.Pair(experiment=expt, pre_cell=pre, post_cell=post, has_synapse=post is cells[0],
+                                    has_electrical=None, n_ex_test_spikes=10 if has_data else 0, n_in_test_spikes=0))
+    # an experiment with no pairs
+    session.add(db.Experiment(ext_id='1400000000.000', acq_timestamp=1.4e9))
+    session.commit()
+    return db
+
+
+def test_summary_queries(db):
+    session = db.session()
+    recs = experiment_summary_query(session, database=db).all()
+    assert [r.acq_timestamp for r in recs] == [1.5e9, 1.5e9 + 1, 1.5e9 + 2]
+    assert [r.n_pairs for r in recs] == [6, 2, 6]
+    assert recs[0].genotype == 'Sst-IRES-Cre'
+    assert [r.n_pairs for r in experiment_summary_query(session, all_pairs=True, synapses=True, database=db)] == [2, 2, 2]
+    assert [r.rig_name for r in experiment_summary_query(session, search='HUMAN', database=db)] == ['rig2']
+
+    expts = session.query(db.Experiment).order_by(db.Experiment.acq_timestamp).all()
+    assert [r.n_pairs for r in experiment_summary_query(session, experiments=expts[:2], database=db)] == [0, 6]
+
+    rows = pair_summary_query(session, expts[2].id, database=db).all()
+    pairs = [p for p in expts[2].pair_list if p.n_ex_test_spikes > 0]
+    assert len(pairs) == 2
+    assert [r.id for r in rows] == sorted(p.id for p in pairs)
+    for rec in rows:
+        pair = session.query(db.Pair).get(rec.id)
+        cells, conn, types = pair_display_columns(rec)
+        assert cells == '%s => %s' % (pair.pre_cell.ext_id, pair.post_cell.ext_id)
+        assert conn == ('syn' if pair.has_synapse else '-') + ' ; ?'
+        # unknown cre type falls back to morphology
+        assert types == 'L2/3 spiny => L2/3 sst'
+    assert pair_display_columns(pair_summary_query(session, expts[1].id, synapses=True, database=db).first())[2] == 'L2/3 sst => L2/3 spiny'
+    session.close()
+
+
+def test_browser_loads_pairs_on_expand(db):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = pg.mkQApp()
+    browser = ExperimentBrowser(database=db)
+    browser.populate(all_pairs=True, synapses=True)
+    assert browser.topLevelItemCount() == 3
+    assert browser.items_by_pair_id == {}
+    expt_item = browser.topLevelItem(2)
+    assert expt_item.childCount() == 0 and not hasattr(expt_item, 'pair')
+    assert expt_item.expt.acq_timestamp == 1.5e9 + 2
+
+    expt_item.setExpanded(True)
+    assert expt_item.childCount() == 2
+    assert all(item.pair.has_synapse for item in browser.items_by_pair_id.values())
+
+    # selecting a pair from an experiment that was not yet expanded loads its children
+    pair = browser.session.query(db.Pair).filter(db.Pair.experiment_id==browser.topLevelItem(0).expt_id, db.Pair.has_synapse==True).first()
+    browser.select_pair(pair.id)
+    assert browser.selectedItems()[0].pair is pair
+    browser.select_pair((1.5e9 + 1, '2', '0'))
+    assert browser.selectedItems()[0].pair.post_cell.ext_id == '0'
+
+    browser.set_search('rig0')
+    assert browser.topLevelItemCount() == 1
+    browser.session.close()
@@ -0,0 +1,41 @@
+import os, sys, json, subprocess
+import pytest
+
+# Maximum time (seconds) allowed for `import aisynphys.database` in a fresh interpreter.
+# Short CLI tools and every spawned pipeline worker pay this cost before doing any work.
+# Wall-clock timing depends on the machine, so this check only runs when the budget is
+# set explicitly (e.g. AISYNPHYS_IMPORT_BUDGET=1.5).
+DATABASE_IMPORT_BUDGET = os.environ.get('AISYNPHYS_IMPORT_BUDGET', None)
+
+# dependencies that must only be imported when they are actually used
+HEAVY_MODULES = ['scipy.stats', 'scipy.interpolate', 'numba', 'neuroanalysis.data', 'umap', 'sklearn',
+                 'shapely', 'neuron_morphology', 'pyqtgraph', 'matplotlib', 'seaborn']
+
+
+def import_profile(module):
+    """Import *module* in a new interpreter; return the import time and list of all loaded modules.
+    """
+    code = (
+        "import sys, time, json; t = time.perf_counter(); import {mod}; dt = time.perf_counter() - t; "
+        "print(json.dumps([dt, sorted(sys.modules)]))"
+    ).format(mod=module)
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=root, env=env)
+    dt, modules = json.loads(output.decode().strip().split('\n')[-1])
+    return dt, set(modules)
+
+
+@pytest.mark.parametrize('module', ['aisynphys', 'aisynphys.database', 'aisynphys.layer_depths', 'aisynphys.synapse_types'])
+def test_lazy_imports(module):
+    _, modules = import_profile(module)
+    loaded = [m for m in HEAVY_MODULES if m in modules]
+    assert loaded == [], "importing %s loaded %s" % (module, ", ".join(loaded))
+
+
+@pytest.mark.skipif(DATABASE_IMPORT_BUDGET is None, reason="set AISYNPHYS_IMPORT_BUDGET to check import time")
+def test_database_import_time():
+    budget = float(DATABASE_IMPORT_BUDGET)
+    # take the best of a few runs; the first may include writing .pyc files
+    dt = min(import_profile('aisynphys.database')[0] for i in range(3))
+    assert dt < budget, "import aisynphys.database took %0.2f s (budget is %0.2f s)" % (dt, budget)
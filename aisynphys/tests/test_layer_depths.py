@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+from shapely.geometry import LineString, Point, Polygon
+from scipy.interpolate import CloughTocher2DInterpolator
+from aisynphys.streamlines import streamline_distances, first_intersections, surface_edges
+
+
+def arc(radius, start=np.pi/4, stop=3*np.pi/4, n=40):
+    theta = np.linspace(start, stop, n)
+    return np.stack([radius * np.cos(theta), radius * np.sin(theta)], axis=1)
+
+
+def synthetic_layers():
+    """Curved layers bounded by concentric arcs (pia at r=1000, wm at r=200), as processed layer polygons.
+    """
+    radii = {'Layer1': (1000, 900), 'Layer2/3': (900, 650), 'Layer4': (650, 500), 'Layer5': (500, 200)}
+    layers = {}
+    for name, (outer, inner) in radii.items():
+        pia_side = arc(outer)
+        wm_side = arc(inner)
+        layers[name] = {
+            'bounds': Polygon(np.concatenate([pia_side, wm_side[::-1]])),
+            'pia_surface': LineString(pia_side),
+            'wm_surface': LineString(wm_side),
+        }
+    # one layer without explicit surfaces; its polygon boundary is used instead
+    del layers['Layer4']['pia_surface']
+    return layers, arc(1000).tolist(), arc(200).tolist()
+
+
+def radial_field_interpolators():
+    """Interpolators for a radial gradient field (pointing toward the pia), sampled on a mesh.
+    """
+    r, theta = np.meshgrid(np.linspace(150, 1050, 40), np.linspace(np.pi/4 - 0.2, 3*np.pi/4 + 0.2, 40))
+    mesh = np.stack([(r * np.cos(theta)).ravel(), (r * np.sin(theta)).ravel()], axis=1)
+    dx = mesh[:, 0] / np.linalg.norm(mesh, axis=1)
+    dy = mesh[:, 1] / np.linalg.norm(mesh, axis=1)
+    depth = np.linalg.norm(mesh, axis=1)
+    return CloughTocher2DInterpolator(mesh, depth), CloughTocher2DInterpolator(mesh, dx), CloughTocher2DInterpolator(mesh, dy)
+
+
+def step_to_surface(pos, dx_interp, dy_interp, surface, step_size, max_iter):
+    """Reference implementation: walk one point at a time until the surface is crossed.
+    """
+    cur_pos = np.array(pos, dtype=float)
+    dist = 0
+    for _ in range(max_iter):
+        base_step = np.squeeze([dx_interp(cur_pos), dy_interp(cur_pos)])
+        if np.any(np.isnan(base_step)):
+            return np.nan
+        step = step_size * base_step / np.linalg.norm(base_step)
+        next_pos = cur_pos + step
+        intersection = LineString([cur_pos, next_pos]).intersection(surface)
+        if not intersection.is_empty:
+            points = getattr(intersection, 'geoms', [intersection])
+            return dist + min(Point(cur_pos).distance(pt) for pt in points)
+        dist += np.linalg.norm(step)
+        cur_pos = next_pos
+    return np.nan
+
+
+def random_somata(layers, n, seed=0):
+    rng = np.random.RandomState(seed)
+    r = rng.uniform(210, 990, n)
+    theta = rng.uniform(np.pi/4 + 0.05, 3*np.pi/4 - 0.05, n)
+    return {i: np.array([r[i] * np.cos(theta[i]), r[i] * np.sin(theta[i])]) for i in range(n)}
+
+
+def test_first_intersections():
+    edges = surface_edges([(0, 0), (10, 0), (10, 10)])
+    p0 = np.array([[5, -1], [5, 1], [9, 5], [0, 5]], dtype=float)
+    p1 = np.array([[5, 1], [5, 2], [11, 5], [20, 5]], dtype=float)
+    t = first_intersections(p0, p1, edges)
+    assert np.allclose(t, [0.5, np.nan, 0.5, 0.5], equal_nan=True)
+
+
+def test_streamline_distances_match_stepping():
+    layers, pia_path, wm_path = synthetic_layers()
+    _, dx_interp, dy_interp = radial_field_interpolators()
+    somata = random_somata(layers, 25)
+    pia = LineString(pia_path)
+    wm = LineString(wm_path)
+    l4_bounds = layers['Layer4']['bounds'].boundary
+
+    starts, surfaces, directions = [], [], []
+    for pos in somata.values():
+        for surface, direction in [(pia, 1), (wm, -1), (l4_bounds, 1)]:
+            starts.append(pos)
+            surfaces.append(surface)
+            directions.append(direction)
+
+    dists = streamline_distances(np.array(starts), surfaces, directions, dx_interp, dy_interp, step_size=2.0, max_iter=1000)
+    expected = [step_to_surface(p, dx_interp, dy_interp, s, d * 2.0, 1000) for p, s, d in zip(starts, surfaces, directions)]
+    assert np.allclose(dists, expected, equal_nan=True, atol=1e-6)
+
+    # radial field: distances to pia / wm are close to the radial distance
+    r = np.linalg.norm(np.array(starts), axis=1)
+    assert np.allclose(dists[0::3], 1000 - r[0::3], atol=1.0)
+    assert np.allclose(dists[1::3], r[1::3] - 200, atol=1.0)
+
+    # streamlines that cannot reach their surface within max_iter fail
+    short = streamline_distances(np.array(starts[:3]), surfaces[:3], directions[:3], dx_interp, dy_interp, step_size=2.0, max_iter=2)
+    assert np.isnan(short).all()
+
+
+def test_layer_depths_batch_matches_scalar():
+    pytest.importorskip('neuron_morphology', exc_type=ImportError)
+    from aisynphys import layer_depths
+    layers, pia_path, wm_path = synthetic_layers()
+    depth_interp, dx_interp, dy_interp = radial_field_interpolators()
+    somata = random_somata(layers, 20, seed=1)
+    somata['outside'] = np.array([0.0, 0.0])
+
+    outputs, errors = layer_depths.get_layer_depths_batch(somata, layers, pia_path, wm_path, dx_interp, dy_interp, step_size=2.0)
+    assert list(errors.keys()) == ['outside']
+    for name, point in somata.items():
+        if name == 'outside':
+            continue
+        expected = layer_depths.get_layer_depths(point, layers, pia_path, wm_path, depth_interp, dx_interp, dy_interp, step_size=2.0)
+        result = outputs[name]
+        assert result['layer'] == expected['layer']
+        for key in ['layer_depth', 'layer_thickness', 'normalized_layer_depth', 'normalized_depth', 'absolute_depth', 'wm_distance']:
+            assert result[key] == pytest.approx(expected[key], abs=1e-6, nan_ok=True)
+        assert np.allclose(result['pia_direction'], expected['pia_direction'])
+
+
+def test_laplace_interpolator_cache(tmp_path, monkeypatch):
+    from aisynphys import layer_depths
+    _, pia_path, wm_path = synthetic_layers()
+
+    # Laplace field interpolators are cached on disk, keyed by the boundary paths
+    calls = []
+    def fake_laplace_field(top_path, bottom_path):
+        calls.append(1)
+        mesh = np.array(list(top_path) + list(bottom_path), dtype=float)
+        return None, None, None, mesh, mesh[:, 1], mesh
+    monkeypatch.setattr(layer_depths, 'generate_laplace_field', fake_laplace_field)
+    interps = [layer_depths.get_laplace_interpolators(pia_path, wm_path, cache_path=str(tmp_path)) for i in range(2)]
+    assert len(calls) == 1
+    # interpolators read from the cache give the same results
+    values = [np.concatenate([f([0.0, 600.0]) for f in fns]) for fns in interps]
+    assert np.isfinite(values[0]).all()
+    assert np.array_equal(values[0], values[1])
+    layer_depths.get_laplace_interpolators(pia_path, wm_path[:-1], cache_path=str(tmp_path))
+    assert len(calls) == 2
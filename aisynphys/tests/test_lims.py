@@ -0,0 +1,141 @@
+import pickle
+import pytest
+from aisynphys import lims
+
+
+@pytest.fixture
+def fake_lims(monkeypatch):
+    """Replace LIMS query execution with a fake that records each query string.
+    """
+    cells = {1: [(10, 'cell_a'), (11, 'cell_b')], 2: [(20, 'cell_c')]}
+    queries = []
+
+    def execute(query_str):
+        queries.append(query_str)
+        cluster_ids = [int(cid) for cid in query_str.split('in (')[1].split(')')[0].split(',')]
+        keys = ('id', 'external_specimen_name', 'cluster_id')
+        return [lims.LimsRecord(keys, (cell_id, name, cid)) for cid in cluster_ids for cell_id, name in cells.get(cid, [])]
+
+    monkeypatch.setattr(lims, '_execute', execute)
+    monkeypatch.setattr(lims, '_cache', lims.LimsResultCache(ttl=600))
+    return queries
+
+
+def test_lims_record():
+    rec = lims.LimsRecord(('id', 'name'), (5, 'x'))
+    assert rec['id'] == rec.id == rec[0] == 5
+    assert dict(rec) == {'id': 5, 'name': 'x'}
+    assert pickle.loads(pickle.dumps(rec)).name == 'x'
+    with pytest.raises(KeyError):
+        rec['missing']
+
+
+def test_batch_query_cache(fake_lims):
+    cells = lims.cluster_cells_batch([1, 2, 3])
+    assert len(fake_lims) == 1
+    assert [c.id for c in cells[1]] == [10, 11]
+    assert cells[3] == []
+
+    # single lookups are served from the cache, including empty results
+    assert [c.id for c in lims.cluster_cells(2)] == [20]
+    assert lims.cluster_cells(3) == []
+    assert len(fake_lims) == 1
+
+    # callers get their own copy of cached results
+    lims.cluster_cells(1).append('junk')
+    cells[2].clear()
+    assert [c.id for c in lims.cluster_cells(1)] == [10, 11]
+    assert [c.id for c in lims.cluster_cells_batch([2])[2]] == [20]
+    assert len(fake_lims) == 1
+
+    # plain queries are not cached
+    lims.query('select * from cells where cluster_id in (1)')
+    lims.query('select * from cells where cluster_id in (1)')
+    assert len(fake_lims) == 3
+
+    # expired results are fetched again
+    lims.result_cache().ttl = 0
+    lims.cluster_cells(2)
+    assert len(fake_lims) == 4
+
+
+def test_record_replay(fake_lims, tmp_path, monkeypatch):
+    replay_file = str(tmp_path / 'lims_replay.sqlite')
+    lims.set_replay_store(replay_file, mode='record')
+    cell_ids = lims.cell_specimen_ids(1)
+
+    def no_lims(query_str):
+        raise Exception("LIMS should not be contacted in replay mode")
+    monkeypatch.setattr(lims, '_execute', no_lims)
+
+    lims.set_replay_store(replay_file, mode='replay')
+    assert lims.cell_specimen_ids(1) == cell_ids == {'cell_a': 10, 'cell_b': 11}
+    with pytest.raises(lims.LimsReplayError):
+        lims.cluster_cells(2)
+
+
+@pytest.fixture
+def fake_lims_tables(monkeypatch):
+    """Replace LIMS query execution with a fake that answers the queries used to look up
+    the cell clusters of slice specimens.
+    """
+    specimens = {'slice_a': 100, 'slice_b': 200}
+    clusters = {100: [1, 2], 200: [3]}
+    metadata = {1: {'acq_timestamp': 1.5e9}, 2: {'acq_timestamp': 1.6e9}}
+    ephys_results = {1: [50], 3: [51, 52]}
+    cells = {1: [(10, '1'), (11, '2')], 2: [(20, '1')]}
+    queries = []
+
+    def execute(query_str):
+        queries.append(query_str)
+        keys = [k.strip().strip("'") for k in query_str.split('in (')[1].split(')')[0].split(',')]
+        if 'where name in' in query_str:
+            return [lims.LimsRecord(('id', 'name'), (specimens[k], k)) for k in keys if k in specimens]
+        keys = [int(k) for k in keys]
+        if 'CellCluster' in query_str:
+            return [lims.LimsRecord(('id', 'parent_id'), (cid, k)) for k in keys for cid in clusters.get(k, [])]
+        if 'specimen_metadata' in query_str:
+            return [lims.LimsRecord(('specimen_id', 'data'), (k, metadata[k])) for k in keys if k in metadata]
+        if 'ephys_roi_results' in query_str:
+            return [lims.LimsRecord(('specimen_id', 'id'), (k, rid)) for k in keys for rid in ephys_results.get(k, [])]
+        return [lims.LimsRecord(('id', 'external_specimen_name', 'cluster_id'), (cell_id, name, k)) for k in keys for cell_id, name in cells.get(k, [])]
+
+    monkeypatch.setattr(lims, '_execute', execute)
+    monkeypatch.setattr(lims, '_cache', lims.LimsResultCache(ttl=600))
+    return queries
+
+
+def test_experiment_lims_prefetch(fake_lims_tables, db):
+    from aisynphys import config
+    from aisynphys.pipeline.multipatch import MultipatchPipeline, experiment
+
+    clusters = experiment.lims_cluster_info(['slice_a', 'slice_b', 'missing', None])
+    assert len(fake_lims_tables) == 5
+    assert [c['id'] for c in clusters['slice_a']] == [1, 2]
+    assert 'missing' not in clusters
+    assert experiment.expt_lims_info(clusters, 'slice_a', 1.5e9) == (1, 50, {'1': 10, '2': 11})
+    assert experiment.expt_lims_info(clusters, 'slice_a', 1.6e9) == (2, None, {'1': 20})
+    assert experiment.expt_lims_info(clusters, 'slice_a', 1.7e9) == (None, None, {})
+    # clusters without metadata are never matched
+    assert experiment.expt_lims_info(clusters, 'slice_b', None) == (None, None, {})
+    with pytest.raises(ValueError):
+        experiment.expt_lims_info(clusters, 'missing', 1.5e9)
+
+    session = db.session(readonly=False)
+    for i, name in enumerate(['slice_a', 'slice_b', 'slice_c']):
+        session.add(db.Slice(ext_id='slice%d' % i, lims_specimen_name=name, storage_path='slice_%03d' % i))
+    session.commit()
+    session.close()
+
+    # job specs for all experiments are filled in with a single round of LIMS queries
+    module = MultipatchPipeline(database=db, config=config).get_module('experiment')
+    lims.clear_cache()
+    del fake_lims_tables[:]
+    specs = [{'job_id': str(i), 'meta': {'source': '/data/%d' % i, 'slice_id': 'slice%d' % (i % 4)}} for i in range(8)]
+    specs = module.make_job_specs(specs)
+    assert len(fake_lims_tables) == 5
+    assert all(spec['database'] is db for spec in specs)
+    assert specs[0]['lims_clusters'] == {'slice_a': clusters['slice_a']}
+    assert specs[5]['lims_clusters'] == {'slice_b': clusters['slice_b']}
+    # specimens that are not in LIMS (or slices not in the DB) are left for the job to look up
+    assert 'lims_clusters' not in specs[2] and 'lims_clusters' not in specs[3]
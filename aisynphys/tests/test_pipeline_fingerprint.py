@@ -0,0 +1,197 @@
+import gc, weakref
+from datetime import datetime, timedelta
+from collections import OrderedDict
+import numpy as np
+import pytest
+from aisynphys.pipeline.fingerprint import content_hash, SessionFingerprint
+from aisynphys.pipeline.pipeline import Pipeline
+from aisynphys.pipeline.pipeline_module import PipelineModule, DatabasePipelineModule
+
+
+def test_content_hash():
+    assert content_hash({'a': 1, 'b': 2.0}) == content_hash({'b': 2.0, 'a': 1})
+    assert content_hash(1.5) == content_hash(np.float64(1.5))
+    assert content_hash(float('nan')) == content_hash(np.nan)
+    assert content_hash(np.arange(4)) == content_hash(np.arange(4))
+    assert content_hash(np.arange(4)) != content_hash(np.arange(4).reshape(2, 2))
+    assert content_hash(np.arange(4)) != content_hash(np.arange(4, dtype=float))
+    assert content_hash([1, 2]) != content_hash([[1, 2]])
+    assert content_hash(1) != content_hash('1')
+    assert content_hash(None) != content_hash('None')
+
+
+class MockModule(PipelineModule):
+    name = 'mock'
+
+    def __init__(self, ready, finished, fingerprints):
+        self._ready = ready
+        self._finished = finished
+        self._fingerprints = fingerprints
+
+    def ready_jobs(self):
+        return self._ready
+
+    def finished_jobs(self):
+        return self._finished
+
+    def job_fingerprints(self):
+        return self._fingerprints
+
+
+def test_updatable_jobs_fingerprints():
+    t0 = datetime(2020, 1, 1)
+    t1 = t0 + timedelta(days=1)
+    ready = OrderedDict([
+        ('same_hash', {'dep_time': t1, 'input_hash': 'aaa'}),       # rerun upstream, identical content
+        ('new_hash', {'dep_time': t0, 'input_hash': 'bbb'}),        # content changed without timestamp change
+        ('no_hash_new', {'dep_time': t1}),                          # no fingerprint; falls back to timestamps
+        ('no_hash_old', {'dep_time': t0}),
+        ('not_run', {'dep_time': t0, 'input_hash': 'ccc'}),
+    ])
+    finished = OrderedDict([
+        ('same_hash', (t0, True)),
+        ('new_hash', (t1, True)),
+        ('no_hash_new', (t0, True)),
+        ('no_hash_old', (t1, True)),
+        ('orphan', (t1, True)),
+    ])
+    fingerprints = {
+        'same_hash': ('aaa', 'out1'),
+        'new_hash': ('xxx', 'out2'),
+        'no_hash_new': (None, None),
+        'no_hash_old': (None, None),
+    }
+    mod = MockModule(ready, finished, fingerprints)
+    drop, run, errors = mod.updatable_jobs()
+
+    assert drop == ['orphan']
+    assert list(run.keys()) == ['new_hash', 'no_hash_new', 'not_run']
+    assert run['new_hash'] is ready['new_hash']
+    assert len(errors) == 0
+
+
+class SynapseTestModule(DatabasePipelineModule):
+    name = 'fp_synapse'
+    table_group = ['synapse']
+    inputs = {}
+    outputs = {}
+
+    def ready_jobs(self):
+        return OrderedDict([(job_id, {'dep_time': datetime(2020, 1, 1), 'input_hash': h}) for job_id, h in self.inputs.items()])
+
+    @classmethod
+    def create_db_entries(cls, job, session):
+        db = job['database']
+        pair = session.query(db.Pair).join(db.Experiment).filter(db.Experiment.ext_id==job['job_id']).one()
+        session.add(db.Synapse(pair_id=pair.id, synapse_type=cls.outputs[job['job_id']]))
+
+    def job_records(self, job_ids, session):
+        db = self.database
+        return session.query(db.Synapse).join(db.Pair).join(db.Experiment).filter(db.Experiment.ext_id.in_(job_ids)).all()
+
+
+class DynamicsTestModule(DatabasePipelineModule):
+    # dynamics records reference pairs, not synapses
+    name = 'fp_dynamics'
+    table_group = ['dynamics']
+    dependencies = [SynapseTestModule]
+
+    @classmethod
+    def create_db_entries(cls, job, session):
+        db = job['database']
+        pair = session.query(db.Pair).join(db.Experiment).filter(db.Experiment.ext_id==job['job_id']).one()
+        session.add(db.Dynamics(pair_id=pair.id))
+
+    def job_records(self, job_ids, session):
+        db = self.database
+        return session.query(db.Dynamics).join(db.Pair).join(db.Experiment).filter(db.Experiment.ext_id.in_(job_ids)).all()
+
+
+class FitTestModule(DatabasePipelineModule):
+    # avg_response_fit records reference synapses, so they are removed along with them
+    name = 'fp_fit'
+    table_group = ['avg_response_fit']
+    dependencies = [SynapseTestModule]
+
+    @classmethod
+    def create_db_entries(cls, job, session):
+        db = job['database']
+        syn = session.query(db.Synapse).join(db.Pair).join(db.Experiment).filter(db.Experiment.ext_id==job['job_id']).one()
+        session.add(db.AvgResponseFit(synapse_id=syn.id))
+
+    def job_records(self, job_ids, session):
+        db = self.database
+        return session.query(db.AvgResponseFit).join(db.Synapse).join(db.Pair).join(db.Experiment).filter(db.Experiment.ext_id.in_(job_ids)).all()
+
+
+class FingerprintTestPipeline(Pipeline):
+    module_classes = [SynapseTestModule, DynamicsTestModule, FitTestModule]
+
+    def __init__(self, database):
+        self.database = database
+        Pipeline.__init__(self, database=database)
+
+
+@pytest.fixture
+def fp_pipeline(db, monkeypatch):
+    session = db.session(readonly=False)
+    for job_id in ('j1', 'j2'):
+        expt = db.Experiment(ext_id=job_id, slice=db.Slice(ext_id=job_id, storage_path=job_id))
+        session.add(db.Pair(experiment=expt))
+    session.commit()
+    session.close()
+    monkeypatch.setattr(SynapseTestModule, 'inputs', {'j1': 'a', 'j2': 'b'})
+    monkeypatch.setattr(SynapseTestModule, 'outputs', {'j1': 'ex', 'j2': 'ex'})
+    return FingerprintTestPipeline(db)
+
+
+def update_all(pipeline):
+    return {name: mod.update()['n_updated'] for name, mod in pipeline.sorted_modules().items()}
+
+
+def test_downstream_kept_when_output_unchanged(fp_pipeline):
+    syn, dyn, fit = [fp_pipeline.get_module(name) for name in ('fp_synapse', 'fp_dynamics', 'fp_fit')]
+    assert not syn.references_module(dyn) and not dyn.references_module(syn)
+    assert fit.references_module(syn)
+    assert update_all(fp_pipeline) == {'fp_synapse': 2, 'fp_dynamics': 2, 'fp_fit': 2}
+    dyn_finished = dyn.finished_jobs()
+
+    # j1 inputs change but it produces the same output: dynamics results are kept, while fit
+    # results are dropped because their records referenced the replaced synapse
+    SynapseTestModule.inputs['j1'] = 'a2'
+    assert syn.update()['n_updated'] == 1
+    assert dyn.finished_jobs() == dyn_finished
+    assert len(dyn.job_records(['j1'], fp_pipeline.database.session())) == 1
+    assert list(fit.finished_jobs().keys()) == ['j2']
+    assert update_all(fp_pipeline) == {'fp_synapse': 0, 'fp_dynamics': 0, 'fp_fit': 1}
+
+    # j2 output changes: dynamics results are dropped after the rerun
+    SynapseTestModule.inputs['j2'] = 'b2'
+    SynapseTestModule.outputs['j2'] = 'in'
+    assert syn.update()['n_updated'] == 1
+    assert list(dyn.finished_jobs().keys()) == ['j1']
+    assert update_all(fp_pipeline) == {'fp_synapse': 0, 'fp_dynamics': 1, 'fp_fit': 1}
+
+
+def test_session_fingerprint_releases_records(fp_pipeline):
+    db = fp_pipeline.database
+    session = db.session(readonly=False)
+    fingerprint = SessionFingerprint(session)
+    pair = session.query(db.Pair).first()
+    syn = db.Synapse(pair_id=pair.id, synapse_type='ex')
+    session.add(syn)
+    pending_hash = fingerprint.hexdigest()
+    session.flush()
+    assert fingerprint.hexdigest() == pending_hash
+    assert all(isinstance(key, tuple) for key in fingerprint.digests)
+
+    # records are not kept alive by the fingerprint
+    ref = weakref.ref(syn)
+    session.expunge(syn)
+    del syn
+    gc.collect()
+    assert ref() is None
+    assert fingerprint.hexdigest() == pending_hash
+    fingerprint.close()
+    session.rollback()
+    session.close()
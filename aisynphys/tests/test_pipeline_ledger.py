@@ -0,0 +1,156 @@
+import os, sys, socket, subprocess
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import pytest
+from aisynphys.pipeline.pipeline import Pipeline
+from aisynphys.pipeline.pipeline_module import DatabasePipelineModule
+from aisynphys.pipeline.ledger import error_fingerprint
+
+
+class LedgerTestModule(DatabasePipelineModule):
+    name = 'test_ledger'
+    table_group = []
+    inputs = {}
+    interrupt = set()
+
+    def ready_jobs(self):
+        return OrderedDict([(job_id, {'dep_time': datetime(2020, 1, 1), 'input_hash': h}) for job_id, h in self.inputs.items()])
+
+    @classmethod
+    def create_db_entries(cls, job, session):
+        job_id = job['job_id']
+        if job_id in cls.interrupt:
+            cls.interrupt.remove(job_id)
+            raise KeyboardInterrupt()
+        if job_id.startswith('bad'):
+            raise Exception("Bad job %s at 0x7f3a2b" % job_id)
+        db = job['database']
+        session.add(db.Slice(ext_id=job_id, storage_path=job_id))
+        return []
+
+    def job_records(self, job_ids, session):
+        db = self.database
+        return session.query(db.Slice).filter(db.Slice.ext_id.in_(job_ids)).all()
+
+
+class LedgerTestPipeline(Pipeline):
+    module_classes = [LedgerTestModule]
+
+    def __init__(self, database):
+        self.database = database
+        Pipeline.__init__(self, database=database)
+
+
+@pytest.fixture
+def module(db, monkeypatch):
+    monkeypatch.setattr(LedgerTestModule, 'inputs', {'a': 'a1', 'b': 'b1', 'bad1': 'x1'})
+    monkeypatch.setattr(LedgerTestModule, 'interrupt', set())
+    return LedgerTestPipeline(db).get_module('test_ledger')
+
+
+def test_error_fingerprint():
+    assert error_fingerprint(None) is None
+    tb1 = 'Traceback (most recent call last):\n  File "x.py", line 3, in f\nException: Bad job bad1 at 0x7f3a2b\n'
+    tb2 = 'Traceback (most recent call last):\n  File "y.py", line 9, in g\nException: Bad job bad2 at 0x11\n'
+    assert error_fingerprint(tb1) == error_fingerprint(tb2)
+    assert error_fingerprint(tb1) != error_fingerprint('ValueError: something else')
+
+
+def test_retry_backoff(module):
+    ledger = module.run_ledger()
+    result = module.update(retry_errors=True)
+    assert result['n_updated'] == 3 and result['n_errors'] == 1
+    entries = ledger.entries()
+    assert {k: e.state for k, e in entries.items()} == {'a': 'done', 'b': 'done', 'bad1': 'failed'}
+    bad = entries['bad1']
+    assert (bad.attempts, bad.repeat_failures) == (1, 1)
+    assert bad.next_attempt_time > datetime.now() + timedelta(hours=11)
+
+    # failed job with unchanged inputs is not retried until its backoff expires
+    result = module.update(retry_errors=True)
+    assert (result['n_updated'], result['n_retry']) == (0, 0)
+
+    db = module.database
+    session = db.session(readonly=False)
+    session.query(db.PipelineRunLedger).filter(db.PipelineRunLedger.job_id=='bad1').update({'next_attempt_time': datetime.now() - timedelta(seconds=1)})
+    session.commit()
+    session.close()
+    result = module.update(retry_errors=True)
+    assert (result['n_updated'], result['n_retry'], result['n_errors']) == (1, 1, 1)
+    bad = ledger.entries()['bad1']
+    assert (bad.attempts, bad.repeat_failures) == (2, 2)
+    assert bad.next_attempt_time > datetime.now() + timedelta(hours=23)
+
+    # changed inputs reset the backoff
+    LedgerTestModule.inputs['bad1'] = 'x2'
+    result = module.update(retry_errors=True)
+    assert result['n_updated'] == 1
+    bad = ledger.entries()['bad1']
+    assert (bad.attempts, bad.repeat_failures, bad.input_hash) == (1, 1, 'x2')
+
+    # rebuilding the module clears its ledger
+    module.drop_all()
+    assert ledger.entries() == {}
+
+
+def test_resume_interrupted_update(module):
+    LedgerTestModule.inputs.update({'c': 'c1', 'd': 'd1'})
+    LedgerTestModule.interrupt.add('c')
+    with pytest.raises(KeyboardInterrupt):
+        module.update()
+
+    ledger = module.run_ledger()
+    states = {k: e.state for k, e in ledger.entries().items()}
+    assert states == {'a': 'done', 'b': 'done', 'bad1': 'failed', 'c': 'planned', 'd': 'planned'}
+    assert list(ledger.resumable().keys()) == ['c', 'd']
+    assert ledger.resumable()['d']['input_hash'] == 'd1'
+
+    # resuming does not search for updatable jobs
+    def no_ready_jobs():
+        raise AssertionError("ready_jobs should not be called when resuming")
+    module.ready_jobs = no_ready_jobs
+    result = module.update(resume=True)
+    assert (result['n_updated'], result['n_errors']) == (2, 0)
+    assert ledger.resumable() == OrderedDict()
+    finished = module.finished_jobs()
+    assert all(finished[j][1] for j in 'abcd')
+    assert finished['d'][0] is not None
+    del module.ready_jobs
+
+    # nothing left to resume; normal update finds no stale jobs
+    result = module.update(resume=True)
+    assert (result['n_updated'], result['n_dropped']) == (0, 0)
+
+
+def test_resume_running_jobs(module):
+    # a process that has already exited
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    host = socket.gethostname()
+    now = datetime.now()
+    running = {
+        'dead_pid': (host, proc.pid, now),
+        'live_pid': (host, os.getpid(), now),
+        'other_host': ('other-host', 1234, now),
+        'expired_lease': ('other-host', 1234, now - timedelta(days=1)),
+        'expired_live_pid': (host, os.getpid(), now - timedelta(days=1)),
+        'no_owner': (None, None, None),
+    }
+    db = module.database
+    session = db.session(readonly=False)
+    for i, (job_id, (job_host, pid, start)) in enumerate(running.items()):
+        session.add(db.PipelineRunLedger(module_name=module.name, job_id=job_id, state='running', host=job_host, pid=pid,
+                                         start_time=start, plan_time=now + timedelta(seconds=i)))
+    session.commit()
+    session.close()
+
+    # jobs still running in another live process are not resumed
+    ledger = module.run_ledger()
+    assert list(ledger.resumable().keys()) == ['dead_pid', 'expired_lease', 'expired_live_pid', 'no_owner']
+    assert 'other_host' in ledger.resumable(now=now + ledger.lease_timeout + timedelta(seconds=1))
+
+    # starting a job records its owner
+    ledger.start('a')
+    rec = ledger.entries()['a']
+    assert (rec.state, rec.host, rec.pid) == ('running', host, os.getpid())
+    assert 'a' not in ledger.resumable()
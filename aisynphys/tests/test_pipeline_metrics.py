@@ -0,0 +1,65 @@
+import gc, weakref
+from aisynphys.pipeline.pipeline_module import DatabasePipelineModule
+from aisynphys.pipeline.metrics import JobProfiler, load_metrics, metrics_report
+
+
+class SliceModule(DatabasePipelineModule):
+    name = 'test_slice'
+
+    @classmethod
+    def create_db_entries(cls, job, session):
+        db = job['database']
+        session.add(db.Slice(ext_id=job['job_id'], storage_path=job['job_id']))
+        if job['job_id'] == 'bad':
+            raise Exception("failed job")
+        return []
+
+
+def test_job_metrics(db):
+    for run_id in ['run1', 'run2']:
+        for job_id in ['a', 'b', 'bad']:
+            job = {'job_id': job_id, 'database': db, 'run_id': run_id}
+            try:
+                SliceModule.process_job(job)
+            except Exception:
+                assert job_id == 'bad'
+            if job_id != 'bad':
+                # clear out results so the next run writes the same records again
+                session = db.session(readonly=False)
+                session.query(db.Slice).delete()
+                session.commit()
+
+    df = load_metrics(db)
+    assert len(df) == 6
+    assert set(df['run_id']) == {'run1', 'run2'}
+    assert (df['wall_time'] >= df['db_time']).all()
+    good = df[df['success'] == True]
+    assert len(good) == 4
+    assert all(rows['slice'] == 1 and rows['pipeline'] == 1 for rows in good['rows_written'])
+
+    report = metrics_report(db)
+    assert 'Slowest modules' in report
+    assert '[3 common jobs]' in report
+
+
+def test_profiler_row_counts(db):
+    session = db.session(readonly=False)
+    profiler = JobProfiler(session).start()
+
+    slices = [db.Slice(ext_id=str(i), storage_path=str(i)) for i in range(3)]
+    session.add_all(slices)
+    session.flush()
+    # modifying a row that was already counted does not count it again
+    slices[0].storage_path = 'x'
+    session.flush()
+    session.add(db.Slice(ext_id='pending', storage_path='pending'))
+    profiler.stop()
+    assert profiler.rows_written() == {'slice': 4}
+
+    # no references to written records are kept
+    refs = [weakref.ref(s) for s in slices]
+    session.commit()
+    session.close()
+    del slices
+    gc.collect()
+    assert all(ref() is None for ref in refs)
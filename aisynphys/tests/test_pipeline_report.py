@@ -0,0 +1,159 @@
+import io, os, json
+from datetime import datetime, timedelta
+import pytest
+import sqlalchemy
+from aisynphys import config
+from aisynphys.pipeline.pipeline import Pipeline
+from aisynphys.pipeline.pipeline_module import DatabasePipelineModule
+from aisynphys.pipeline.multipatch.pipeline_module import MultipatchPipelineModule
+from aisynphys.pipeline.fingerprint import content_hash
+from aisynphys.pipeline.report import PipelineReport, summarize_error, error_class
+
+
+class ReportImportModule(DatabasePipelineModule):
+    name = 'report_import'
+
+
+class ReportAnalysisModule(DatabasePipelineModule):
+    name = 'report_analysis'
+    dependencies = [ReportImportModule]
+
+
+class ReportTestPipeline(Pipeline):
+    module_classes = [ReportImportModule, ReportAnalysisModule]
+
+    def __init__(self, database):
+        self.database = database
+        Pipeline.__init__(self, database=database)
+
+
+T0 = datetime(2020, 1, 1)
+TB = 'Traceback (most recent call last):\n  File "x.py", line %d, in f\n    f()\n%s\n'
+
+
+@pytest.fixture
+def pipeline(db):
+    session = db.session(readonly=False)
+    for i in range(50):
+        job_id = 'job%02d' % i
+        # import jobs finished on day i; every 10th job failed
+        failed = i % 10 == 9
+        error = TB % (i, 'ValueError: bad value %d' % i) if failed else None
+        # jobs 5 and 30 have content fingerprints
+        output_hash = 'out%d' % i if i in (5, 30) else None
+        session.add(db.Pipeline(module_name='report_import', job_id=job_id, success=not failed, finish_time=T0 + timedelta(days=i),
+                                error=error, meta={'source': '/data/%s' % job_id}, output_hash=output_hash))
+        # analysis jobs finished on day 20; jobs imported later than that are stale, unless
+        # fingerprints show that their inputs are unchanged
+        if not failed:
+            failed = i % 7 == 0
+            error = (TB % (i, 'KeyError: %d' % i) if i % 2 == 0 else 'Timed out after %d s' % i) if failed else None
+            input_hash = {5: 'changed', 30: content_hash([('report_import', 'out30')])}.get(i, None)
+            session.add(db.Pipeline(module_name='report_analysis', job_id=job_id, success=not failed, finish_time=T0 + timedelta(days=20, hours=i),
+                                    error=error, input_hash=input_hash))
+    session.add(db.PipelineRunLedger(module_name='report_analysis', job_id='job07', state='failed', next_attempt_time=datetime.now() + timedelta(days=1)))
+    session.add(db.PipelineRunLedger(module_name='report_analysis', job_id='job14', state='failed', next_attempt_time=datetime.now() - timedelta(days=1)))
+    session.add(db.PipelineRunLedger(module_name='report_analysis', job_id='job15', state='planned'))
+    session.commit()
+    session.close()
+    return ReportTestPipeline(db)
+
+
+def test_error_class():
+    assert summarize_error(TB % (1, 'ValueError: bad value 1')) == 'ValueError: bad value 1'
+    assert summarize_error(None) == '[no error message]'
+    assert error_class(TB % (1, 'KeyError')) == 'KeyError'
+    assert error_class('Timed out after 12 s\nmore info') == error_class('Timed out after 30 s') == 'Timed out after # s'
+
+
+def test_report_summary(pipeline):
+    report = pipeline.status_report()
+    summary = report.summary()
+    imp, ana = summary['report_import'], summary['report_analysis']
+    assert (imp['n_success'], imp['n_failed'], imp['n_stale']) == (45, 5, 0)
+    assert (imp['first_finish'], imp['last_finish']) == (T0, T0 + timedelta(days=49))
+    assert imp['errors'] == {'ValueError': 5}
+
+    # analysis jobs 0, 7, 14, ... failed; job IDs 21-48 were re-imported after analysis, but the
+    # inputs of job 30 did not change, and job 5 is stale because its inputs did
+    assert (ana['n_success'], ana['n_failed']) == (38, 7)
+    stale = [5] + [i for i in range(21, 50) if i % 10 != 9 and i != 30]
+    assert ana['n_stale'] == len(stale)
+    assert ana['oldest_stale'] == {'job_id': 'job05', 'finish_time': T0 + timedelta(days=20, hours=5)}
+    assert list(pipeline.get_module('report_analysis').stale_jobs().keys()) == ['job%02d' % i for i in stale]
+    assert list(ana['errors'].items()) == [('KeyError', 4), ('Timed out after # s', 3)]
+    assert (ana['ledger']['failed'], ana['ledger']['backoff'], ana['ledger']['planned']) == (2, 1, 1)
+
+    data = json.loads(json.dumps(report.to_dict()))
+    assert data['modules']['report_analysis']['oldest_stale']['finish_time'] == '2020-01-21T05:00:00'
+
+    # streamed JSON includes every failed job
+    fh = io.StringIO()
+    report.write_json(fh)
+    data = json.loads(fh.getvalue())
+    assert data['modules']['report_import']['n_failed'] == 5
+    assert len(data['failed_jobs']) == 12
+    failed = {(j['module_name'], j['job_id']): j for j in data['failed_jobs']}
+    assert failed['report_import', 'job09'] == {'module_name': 'report_import', 'job_id': 'job09', 'finish_time': '2020-01-10T00:00:00',
+                                                'error_class': 'ValueError', 'error_summary': 'ValueError: bad value 9', 'source': '/data/job09'}
+
+
+def test_report_format(pipeline):
+    report = pipeline.report(job_ids=['job14'])
+    assert 'job09  /data/job09  ValueError: bad value 9' in report
+    assert 'report_analysis       38 pass        7 fail       26 stale   oldest stale: job05 (2020-01-21 05:00)' in report
+    assert 'KeyError: 14' in report.split('----- job: job14 -----')[1]
+
+    # drill-down streams only the requested jobs
+    jobs = list(pipeline.status_report().iter_jobs(job_ids=['job03', 'job09']))
+    assert [(j['module_name'], j['job_id'], j['success']) for j in jobs] == [
+        ('report_import', 'job03', True), ('report_analysis', 'job03', True), ('report_import', 'job09', False)]
+
+
+class ReportExperimentModule(MultipatchPipelineModule):
+    name = 'report_experiment'
+
+
+class ReportExperimentPipeline(ReportTestPipeline):
+    module_classes = [ReportExperimentModule]
+
+
+def test_report_job_sources(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'synphys_data', str(tmp_path))
+    session = db.session(readonly=False)
+    for i in range(10):
+        expt_id = '%0.3f' % (1.5e9 + i)
+        session.add(db.Experiment(ext_id=expt_id, acq_timestamp=1.5e9 + i, storage_path='expt%d' % i))
+        # failed jobs without a source in their meta are looked up in the experiment table
+        meta = {'source': '/data/%d' % i} if i % 3 == 0 else None
+        session.add(db.Pipeline(module_name='report_experiment', job_id=expt_id, success=False, finish_time=T0, error='ValueError', meta=meta))
+    session.add(db.Pipeline(module_name='report_experiment', job_id='missing', success=False, finish_time=T0, error='ValueError'))
+    session.commit()
+    session.close()
+
+    module = ReportExperimentPipeline(db).get_module('report_experiment')
+    queries = []
+    def count_queries(conn, cursor, statement, *args):
+        if 'FROM experiment' in statement:
+            queries.append(statement)
+    sqlalchemy.event.listen(sqlalchemy.engine.Engine, 'before_cursor_execute', count_queries)
+    try:
+        jobs = list(PipelineReport(db, [module]).iter_jobs(batch_size=4))
+    finally:
+        sqlalchemy.event.remove(sqlalchemy.engine.Engine, 'before_cursor_execute', count_queries)
+
+    sources = [job['source'] for job in jobs]
+    assert sources == ['/data/0'] + [os.path.join(config.synphys_data, 'expt%d' % i) if i % 3 else '/data/%d' % i for i in range(1, 10)] + ['']
+    # one experiment query per batch of 4 jobs
+    assert len(queries) == 3
+
+    # job_status() looks up all sources with a single experiment query
+    queries.clear()
+    sqlalchemy.event.listen(sqlalchemy.engine.Engine, 'before_cursor_execute', count_queries)
+    try:
+        status = module.job_status()
+    finally:
+        sqlalchemy.event.remove(sqlalchemy.engine.Engine, 'before_cursor_execute', count_queries)
+    assert len(queries) == 1
+    assert [meta and meta['source'] for success, error, meta in status.values()] == sources[:-1] + [None]
+    assert status['1500000000.000'][2] == {'source': '/data/0', 'storage_path': '/data/0'}
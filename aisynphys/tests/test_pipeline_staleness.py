@@ -0,0 +1,133 @@
+import os, json, datetime
+import pytest
+import pandas as pd
+from aisynphys import config
+from aisynphys.pipeline.multipatch import MultipatchPipeline, morphology, patch_seq, experiment
+
+
+@pytest.fixture
+def pipeline(db, tmp_path, monkeypatch):
+    """A multipatch pipeline backed by a local sqlite DB containing one experiment with two cells.
+    """
+    session = db.session(readonly=False)
+    expt = db.Experiment(ext_id='1500000000.000', storage_path='slice_000/site_000')
+    session.add(expt)
+    for cell_ext_id, spec_id in [('1', 101), ('2', 102)]:
+        session.add(db.Cell(experiment=expt, ext_id=cell_ext_id, meta={'lims_specimen_id': spec_id}))
+    session.add(db.Pipeline(module_name='experiment', job_id='1500000000.000', success=True,
+                            finish_time=datetime.datetime.now(), output_hash='expt_hash'))
+    session.commit()
+
+    monkeypatch.setattr(config, 'synphys_data', str(tmp_path / 'data'), raising=False)
+    return MultipatchPipeline(database=db, config=config)
+
+
+def finish_job(module, job_id, input_hash):
+    db = module.database
+    session = db.session(readonly=False)
+    session.query(db.Pipeline).filter(db.Pipeline.module_name==module.name).delete()
+    session.add(db.Pipeline(module_name=module.name, job_id=job_id, success=True,
+                            finish_time=datetime.datetime.now(), input_hash=input_hash))
+    session.commit()
+
+
+def test_morphology_staleness(pipeline, tmp_path, monkeypatch):
+    morpho_dir = tmp_path / 'morphology'
+    morpho_dir.mkdir()
+    morpho_file = morpho_dir / 'morpho.csv'
+    morpho = pd.DataFrame({'cell_specimen_id': [101, 102], 'dendrite_type': ['spiny', 'aspiny']})
+    morpho.to_csv(morpho_file, index=False)
+    monkeypatch.setattr(config, 'morpho_address', str(morpho_dir), raising=False)
+    monkeypatch.setattr(morphology, 'morpho_cache', None)
+
+    module = pipeline.get_module('morphology')
+
+    # cells without morphology records are always updated
+    ready = module.ready_jobs()
+    assert list(ready.keys()) == ['1500000000.000']
+    assert 'input_hash' not in ready['1500000000.000']
+    db = module.database
+    session = db.session(readonly=False)
+    for cell in session.query(db.Cell).all():
+        session.add(db.Morphology(cell_id=cell.id))
+    session.commit()
+
+    ready = module.ready_jobs()
+    finish_job(module, '1500000000.000', ready['1500000000.000']['input_hash'])
+
+    # inputs unchanged; nothing to do
+    drop, run, errors = module.updatable_jobs()
+    assert len(run) == 0
+
+    # changing a cell's morphology record invalidates the job
+    morpho.loc[1, 'dendrite_type'] = 'sparsely spiny'
+    morpho.to_csv(morpho_file, index=False)
+    monkeypatch.setattr(morphology, 'morpho_cache', None)
+    drop, run, errors = module.updatable_jobs()
+    assert list(run.keys()) == ['1500000000.000']
+
+
+def test_patchseq_staleness(pipeline, tmp_path, monkeypatch):
+    pytest.importorskip('openpyxl')
+
+    # site metadata is read from the cached index as long as the .index file is unchanged
+    site_dir = tmp_path / 'data' / 'slice_000' / 'site_000'
+    site_dir.mkdir(parents=True)
+    (site_dir / '.index').write_text('')
+    index_file = tmp_path / 'site_info_index.json'
+    headstages = {'1': {'Tube ID': 'T1', 'Nucleus': '+', 'End Seal': True}, '2': {'Tube ID': '', 'Nucleus': '', 'End Seal': False}}
+    json.dump({'slice_000/site_000': {'mtime': os.stat(site_dir / '.index').st_mtime, 'headstages': headstages}}, open(index_file, 'w'))
+    monkeypatch.setattr(experiment, '_site_index', experiment.SiteInfoIndex(cache_file=str(index_file)))
+
+    amp_dir = tmp_path / 'amp'
+    amp_dir.mkdir()
+    amp = pd.DataFrame({'Sample ID': ['T1'], 'Comment': [''], 'Result pass/fail BA': ['Pass'],
+                        '% area 400-10000bp BA': [50.0], 'Picogreen pg/ul': [100.0]})
+    with pd.ExcelWriter(amp_dir / 'amp.xlsx') as writer:
+        amp.to_excel(writer, startrow=2, index=False)
+    mapping_dir = tmp_path / 'mapping'
+    mouse_file = mapping_dir / 'mouse_patchseq_VISp_current' / 'mapping.df.with.bp.40.lastmap.csv'
+    human_file = mapping_dir / 'human' / 'human_patchseq_MTG_current' / 'mapping.df.lastmap.csv'
+    mapping = pd.DataFrame([{'sample_id': 'T1', **{col: 'x' for col in patch_seq.mapping_cols}}])
+    for path in (mouse_file, human_file):
+        path.parent.mkdir(parents=True)
+    mapping.to_csv(mouse_file, index=False)
+    mapping.iloc[:0].to_csv(human_file, index=False)
+
+    monkeypatch.setattr(config, 'amplification_report_address', str(amp_dir), raising=False)
+    monkeypatch.setattr(config, 'mapping_report_address', str(mapping_dir), raising=False)
+    monkeypatch.setattr(patch_seq, 'amp_cache', None)
+    monkeypatch.setattr(patch_seq, 'mapping_cache', None)
+
+    module = pipeline.get_module('patch_seq')
+    ready = module.ready_jobs()
+    assert list(ready.keys()) == ['1500000000.000']
+    finish_job(module, '1500000000.000', ready['1500000000.000']['input_hash'])
+    drop, run, errors = module.updatable_jobs()
+    assert len(run) == 0
+
+    # new mapping results for the tube invalidate the job
+    mapping['cluster_label'] = 'y'
+    mapping.to_csv(mouse_file, index=False)
+    monkeypatch.setattr(patch_seq, 'mapping_cache', None)
+    drop, run, errors = module.updatable_jobs()
+    assert list(run.keys()) == ['1500000000.000']
+
+
+def test_experiment_cells_and_site_index(pipeline, tmp_path, monkeypatch):
+    db = pipeline.database
+    session = db.session(readonly=False)
+    for i in range(1, 4):
+        session.add(db.Experiment(ext_id='150000000%d.000' % i, storage_path='slice_00%d/site_000' % i))
+    session.commit()
+
+    module = pipeline.get_module('morphology')
+    monkeypatch.setattr(module, 'experiment_chunk_size', 2)
+    expts = module.experiment_cells(['1500000000.000', '1500000002.000', '1500000003.000', 'missing'])
+    assert sorted(expts.keys()) == ['1500000000.000', '1500000002.000', '1500000003.000']
+    assert list(expts['1500000000.000']['cells'].keys()) == ['1', '2']
+    assert len(expts['1500000003.000']['cells']) == 0
+
+    # sites without an .index file have no headstage metadata
+    index = experiment.SiteInfoIndex(cache_file=str(tmp_path / 'index.json'), data_path=str(tmp_path / 'data'))
+    assert index.headstages('slice_001/site_000') == {}
@@ -0,0 +1,105 @@
+import datetime
+from collections import OrderedDict
+import pytest
+import sqlalchemy.event
+import sqlalchemy.engine
+from aisynphys.pipeline.pipeline import Pipeline
+from aisynphys.pipeline.pipeline_module import DatabasePipelineModule
+
+
+class UpstreamModule(DatabasePipelineModule):
+    name = 'test_upstream'
+
+    def ready_jobs(self):
+        return OrderedDict([('job%d' % i, {'dep_time': datetime.datetime(2020, 1, 1)}) for i in range(6)])
+
+
+class DownstreamModule(DatabasePipelineModule):
+    name = 'test_downstream'
+    dependencies = [UpstreamModule]
+
+
+class FinalModule(DatabasePipelineModule):
+    name = 'test_final'
+    dependencies = [UpstreamModule, DownstreamModule]
+
+
+class StateTestPipeline(Pipeline):
+    module_classes = [UpstreamModule, DownstreamModule, FinalModule]
+
+    def __init__(self, database):
+        self.database = database
+        Pipeline.__init__(self, database=database)
+
+
+def add_job(db, module_name, job_id, success=True, **kwds):
+    session = db.session(readonly=False)
+    session.add(db.Pipeline(module_name=module_name, job_id=job_id, success=success, finish_time=datetime.datetime.now(),
+                            error=None if success else 'Exception: failed', meta={'job': job_id}, **kwds))
+    session.commit()
+    session.close()
+
+
+@pytest.fixture
+def pipeline(db):
+    for i in range(5):
+        add_job(db, 'test_upstream', 'job%d' % i, success=i != 3, output_hash='up%d' % i)
+    for i in range(3):
+        add_job(db, 'test_downstream', 'job%d' % i, success=i != 1, input_hash='in%d' % i, output_hash='down%d' % i)
+    return StateTestPipeline(db)
+
+
+def pipeline_results(pipeline):
+    results = {}
+    for name, mod in pipeline.sorted_modules().items():
+        results[name] = (mod.finished_jobs(), mod.job_fingerprints(), mod.job_status(), mod.ready_jobs(), mod.updatable_jobs())
+    return results
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.count = 0
+    def __call__(self, *args):
+        self.count += 1
+    def __enter__(self):
+        sqlalchemy.event.listen(sqlalchemy.engine.Engine, 'before_cursor_execute', self)
+        return self
+    def __exit__(self, *args):
+        sqlalchemy.event.remove(sqlalchemy.engine.Engine, 'before_cursor_execute', self)
+
+
+def test_pipeline_state_snapshot(pipeline):
+    with QueryCounter() as uncached_queries:
+        expected = pipeline_results(pipeline)
+
+    state = pipeline.load_state()
+    with QueryCounter() as cached_queries:
+        results = pipeline_results(pipeline)
+    assert results == expected
+    # only error messages / meta are loaded after the initial snapshot
+    assert cached_queries.count == 1
+    assert uncached_queries.count > 10
+    assert list(results['test_downstream'][3].keys()) == ['job0', 'job1', 'job2', 'job4']
+    assert results['test_upstream'][2]['job3'] == (False, 'Exception: failed', {'job': 'job3'})
+
+    # a concurrent writer is detected by version stamps, and only its module is reloaded
+    assert state.changed_modules() == []
+    add_job(pipeline.database, 'test_downstream', 'job4', output_hash='down4')
+    assert state.changed_modules() == ['test_downstream']
+    assert 'job4' not in pipeline.get_module('test_downstream').finished_jobs()
+    assert state.refresh() == ['test_downstream']
+    assert 'job4' in pipeline.get_module('test_downstream').finished_jobs()
+    assert pipeline.get_module('test_downstream').job_status()['job4'][0] is True
+
+    # deleting records also changes the stamp
+    session = pipeline.database.session(readonly=False)
+    session.query(pipeline.database.Pipeline).filter_by(module_name='test_upstream', job_id='job0').delete()
+    session.commit()
+    session.close()
+    assert state.refresh() == ['test_upstream']
+    assert 'job0' not in pipeline.get_module('test_downstream').ready_jobs()
+
+    # refreshed snapshot still matches direct queries
+    refreshed = pipeline_results(pipeline)
+    pipeline.clear_state()
+    assert pipeline_results(pipeline) == refreshed
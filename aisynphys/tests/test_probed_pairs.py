@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from aisynphys.connectivity import pair_was_probed, pair_probed_gj, probed_pair_clause, connectivity_count_query, get_cp_results
+
+
+@pytest.fixture
+def db(db):
+    rng = np.random.RandomState(0)
+    session = db.session(readonly=False)
+    for i in range(3):
+        expt = db.Experiment(ext_id='%0.3f' % (1.5e9 + i), acq_timestamp=1.5e9 + i)
+        cells = [db.Cell(experiment=expt, ext_id=str(j), cell_class_nonsynaptic=[None, 'ex', 'in', 'mixed'][j % 4],
+                         cell_class=[None, 'ex', 'in', 'mixed'][j % 4]) for j in range(5)]
+        for pre in cells:
+            for post in cells:
+                if pre is post:
+                    continue
+                counts = {'n_%s_test_spikes_%s' % (syn, mode): int(rng.randint(0, 12)) for syn in ('ex', 'in') for mode in ('ic', 'vc')}
+                session.add(db.Pair(
+                    experiment=expt, pre_cell=pre, post_cell=post,
+                    n_ex_test_spikes=counts['n_ex_test_spikes_ic'] + counts['n_ex_test_spikes_vc'],
+                    n_in_test_spikes=counts['n_in_test_spikes_ic'] + counts['n_in_test_spikes_vc'],
+                    has_synapse=bool(rng.randint(2)), has_electrical=bool(rng.randint(2)),
+                    gap_junction_probed=bool(rng.randint(2)), **counts))
+    session.commit()
+    return db
+
+
+def test_probed_pair_clause(db):
+    pairs = db.query(db.Pair).all()
+    for syn_type in ('ex', 'in', 'mixed', None):
+        for mode in (None, 'ic', 'vc'):
+            expected = set(p.id for p in pairs if pair_was_probed(p, syn_type, clamp_mode=mode))
+            q = db.query(db.Pair.id).filter(probed_pair_clause(db.Pair, syn_type, clamp_mode=mode))
+            assert set(r.id for r in q) == expected
+
+    # per-row synapse type, as used by pair_query(synapse_probed=True)
+    expected = set(p.id for p in pairs if pair_was_probed(p, p.pre_cell.cell_class))
+    assert 0 < len(expected) < len(pairs)
+    assert set(p.id for p in db.pair_query(synapse_probed=True).all()) == expected
+    assert set(p.id for p in db.pair_query(electrical_probed=True).all()) == set(p.id for p in pairs if pair_probed_gj(p))
+
+
+def test_connectivity_count_query(db):
+    all_pairs = db.query(db.Pair).all()
+    groups = {}
+    for p in all_pairs:
+        groups.setdefault((p.pre_cell.cell_class_nonsynaptic, p.post_cell.cell_class_nonsynaptic), []).append(p)
+
+    rows = connectivity_count_query(database=db).all()
+    assert len(rows) == len(groups) == 13
+    for row in rows:
+        pairs = groups[row.pre_cell_class_nonsynaptic, row.post_cell_class_nonsynaptic]
+        expected = get_cp_results(pairs)
+        assert (row.n_probed, row.n_connected, row.n_gaps_probed, row.n_gaps) == (
+            expected['n_probed'], expected['n_connected'], expected['n_gaps_probed'], expected['n_gaps'])
+
+    total = connectivity_count_query(group_by=(), database=db).all()
+    assert len(total) == 1
+    assert total[0].n_probed == sum(row.n_probed for row in rows) > 0
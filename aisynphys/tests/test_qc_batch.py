@@ -0,0 +1,67 @@
+import itertools
+import numpy as np
+from neuroanalysis.data import TSeries
+from aisynphys import qc
+
+
+class SyntheticRecording(dict):
+    """Minimal stand-in for a PatchClampRecording: channels are accessed by name, baseline
+    values are attributes.
+    """
+    def __init__(self, clamp_mode, baseline_current, baseline_potential, baseline_noise_stdev, primary, command):
+        dict.__init__(self, primary=primary, command=command)
+        self.clamp_mode = clamp_mode
+        self.baseline_current = baseline_current
+        self.baseline_potential = baseline_potential
+        self.baseline_noise_stdev = baseline_noise_stdev
+
+
+def synthetic_recordings():
+    """Generate recordings covering every combination of passing / failing / missing QC values.
+    """
+    rng = np.random.RandomState(0)
+    recs = []
+    combos = itertools.product(
+        ['ic', 'vc'],
+        [None, 0.0, 900e-12, -900e-12],   # baseline current
+        [None, -65e-3, -40e-3, -90e-3],   # baseline potential
+        [None, 0.5, 1e-12, 1e-3, 10e-3],  # baseline noise (scaled below)
+        [0.0, 0.05, 0.5],                 # fraction of zeros
+    )
+    for clamp_mode, cur, pot, noise, zero_frac in combos:
+        n = 4000
+        if clamp_mode == 'ic':
+            data = rng.normal(loc=-65e-3 if pot is None else pot, scale=0.5e-3, size=n)
+            data[2000:2100] += rng.uniform(0, 30e-3)
+            command = np.zeros(n)
+        else:
+            data = rng.normal(scale=rng.choice([5e-12, 30e-12]), size=n)
+            data[2000:2100] += rng.uniform(-800e-12, 0)
+            command = np.full(n, -70e-3 if pot is None else pot)
+        data[:int(n * zero_frac)] = 0
+        recs.append(SyntheticRecording(clamp_mode, cur, pot, noise,
+            TSeries(data, sample_rate=20000, t0=0), TSeries(command, sample_rate=20000, t0=0)))
+    return recs
+
+
+def test_recording_qc_parity():
+    recs = synthetic_recordings()
+    batch = qc.RecordingQCBatch.from_recordings(recs)
+    for i, rec in enumerate(recs):
+        assert batch.result(i) == qc.recording_qc_pass(rec)
+    assert batch.qc_pass.sum() > 0 and (~batch.qc_pass).sum() > 0
+
+
+def test_pulse_response_qc_parity():
+    recs = synthetic_recordings()
+    windows = [[0.08, 0.13], [0.095, 0.12], [0.05, 0.1], [0.15, 0.16]]
+    n_spikes = [1, 0, None, 1]
+    adjacent = [[], [5e-3], [-20e-3, 20e-3], [-7e-3]]
+    n_ex_pass = 0
+    for rec in recs:
+        batch = qc.PulseResponseQCBatch(rec, windows, n_spikes, adjacent)
+        for i in range(len(windows)):
+            expected = qc.pulse_response_qc_pass(rec, windows[i], n_spikes[i], adjacent[i])
+            assert batch.result(i) == expected
+            n_ex_pass += expected[0]
+    assert n_ex_pass > 0
@@ -0,0 +1,113 @@
+import datetime
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from aisynphys import avg_response_fit
+from aisynphys.avg_response_fit import fit_avg_pulse_response
+from aisynphys.resting_state import resting_state_response_fits_batch, resting_state_response_fits
+from aisynphys.pipeline.multipatch.resting_state import RestingStatePipelineModule, minimum_rest_duration
+
+
+def add_psp_responses(db, session, synthetic_experiment, seed=0):
+    """Add one experiment with an excitatory and an inhibitory synapse whose pulse responses
+    contain noisy PSPs / PSCs.
+    """
+    rng = np.random.RandomState(seed)
+    # an unconnected pair has no synapse and is skipped
+    expt, srec, pairs = synthetic_experiment(session, [(0, 1, 'ex'), (1, 2, 'in'), (2, 0, None)],
+                                             latency=1.5e-3, psp_rise_time=2e-3, psp_decay_tau=15e-3)
+    synapses = [pair.synapse for pair in pairs[:2]]
+
+    t = np.arange(600) / 20000.
+    start = datetime.datetime(2020, 1, 1)
+    for i, synapse in enumerate(synapses):
+        sign = 1 if synapse.synapse_type == 'ex' else -1
+        for clamp_mode in ('ic', 'vc'):
+            for j in range(40):
+                rec = db.Recording(sync_rec=srec, start_time=start + datetime.timedelta(seconds=100 * i + 2 * j + (clamp_mode == 'vc')))
+                db.PatchClampRecording(recording=rec, clamp_mode=clamp_mode, baseline_potential=-70e-3)
+                spike_t = 10e-3 + rng.uniform(0.5e-3, 1e-3)
+                sp = db.StimPulse(recording=rec, pulse_number=1, onset_time=10e-3, n_spikes=1,
+                    first_spike_time=None if j == 3 else spike_t, previous_pulse_dt=10.0 if j % 4 != 1 else 0.02)
+                x = np.clip(t - spike_t - synapse.latency, 0, None)
+                psp = sign * (1 if clamp_mode == 'ic' else -50e-12 / 1e-3) * 1e-3 * (1 - np.exp(-x / 2e-3)) * np.exp(-x / 15e-3)
+                data = -70e-3 + psp + rng.normal(scale=50e-6 if clamp_mode == 'ic' else 2e-12, size=len(t))
+                if j == 6:
+                    data = data[:100]
+                session.add(db.PulseResponse(recording=rec, stim_pulse=sp, pair=synapse.pair, data=data, data_start_time=0.0,
+                    ex_qc_pass=j != 7, in_qc_pass=j != 10))
+    session.commit()
+    return expt, synapses
+
+
+@pytest.fixture
+def fake_fit_psp(monkeypatch):
+    """Replace neuroanalysis' fit_psp with a deterministic stand-in that records its inputs.
+    """
+    calls = []
+    def fit_psp(average, search_window, clamp_mode, sign, init_params=None, fit_kws=None, **kwds):
+        calls.append((average, tuple(search_window), clamp_mode, sign, init_params, fit_kws['weights']))
+        amp = sign * np.abs(average.data).max()
+        values = {'amp': amp, 'latency': np.mean(search_window), 'rise_time': 2e-3, 'decay_tau': 15e-3, 'exp_amp': 0.0, 'exp_tau': 1.0}
+        return SimpleNamespace(best_values=values, nrmse=lambda: 0.1)
+    monkeypatch.setattr(avg_response_fit, 'fit_psp', fit_psp)
+    return calls
+
+
+def test_resting_state_batch_matches_per_synapse(db, synthetic_experiment, fake_fit_psp):
+    session = db.session(readonly=False)
+    expt, synapses = add_psp_responses(db, session, synthetic_experiment)
+
+    results = resting_state_response_fits_batch(synapses, rest_duration=minimum_rest_duration, session=session, database=db)
+    batch_calls = fake_fit_psp[:]
+    assert len(batch_calls) == 4
+    for synapse, result in zip(synapses, results):
+        qc_field = getattr(db.PulseResponse, synapse.synapse_type + '_qc_pass')
+        for mode in ('ic', 'vc'):
+            # reference: per-synapse ORM query and PulseResponseList averaging
+            prs = (session.query(db.PulseResponse)
+                .join(db.StimPulse).join(db.Recording).join(db.PatchClampRecording)
+                .filter(db.PulseResponse.pair_id==synapse.pair_id)
+                .filter(db.PatchClampRecording.clamp_mode==mode)
+                .filter(db.StimPulse.previous_pulse_dt > minimum_rest_duration)
+                .filter(qc_field==True)
+                .order_by(db.Recording.start_time, db.StimPulse.onset_time)
+            ).all()
+            prs = [pr for pr in prs if pr.post_tseries.duration >= 10e-3]
+            assert list(result[mode]['pulse_response_ids']) == [pr.id for pr in prs]
+            assert len(prs) == 40 - 10 - 2
+
+            sign = {('ex', 'ic'): 1, ('ex', 'vc'): -1, ('in', 'ic'): -1, ('in', 'vc'): 1}[synapse.synapse_type, mode]
+            init_params = {'rise_time': 2e-3, 'decay_tau': 15e-3} if mode == 'ic' else {}
+            del fake_fit_psp[:]
+            fit, avg = fit_avg_pulse_response(prs, [1.4e-3, 1.6e-3], sign, init_params=init_params)
+            assert np.allclose(result[mode]['average'].data, avg.data)
+            assert result[mode]['average'].t0 == pytest.approx(avg.t0)
+            assert result[mode]['fit'].best_values == pytest.approx(fit.best_values)
+
+            # the fit received the same inputs
+            ref_call = fake_fit_psp[0]
+            call = [c for c in batch_calls if c[0] is result[mode]['average']][0]
+            assert call[1] == pytest.approx(ref_call[1])
+            assert call[2:5] == ref_call[2:5]
+            assert np.array_equal(call[5], ref_call[5])
+
+    # single-synapse wrapper; synapses without a latency are not fit
+    single = resting_state_response_fits(synapses[0], rest_duration=minimum_rest_duration, session=session, database=db)
+    assert list(single['ic']['pulse_response_ids']) == list(results[0]['ic']['pulse_response_ids'])
+    synapses[1].latency = None
+    assert resting_state_response_fits_batch(synapses, minimum_rest_duration, session=session, database=db)[1] is None
+
+
+def test_resting_state_pipeline_module(db, synthetic_experiment, fake_fit_psp):
+    session = db.session(readonly=False)
+    expt, synapses = add_psp_responses(db, session, synthetic_experiment)
+    RestingStatePipelineModule.create_db_entries({'database': db, 'job_id': expt.ext_id}, session)
+    session.commit()
+
+    fits = session.query(db.RestingStateFit).order_by(db.RestingStateFit.synapse_id).all()
+    assert [f.synapse_id for f in fits] == [s.id for s in synapses]
+    for fit_rec, synapse in zip(fits, synapses):
+        assert fit_rec.ic_pulse_ids.shape == (1, 28)
+        assert synapse.psp_amplitude == fit_rec.ic_amp
+        assert np.sign(fit_rec.ic_amp) == (1 if synapse.synapse_type == 'ex' else -1)
@@ -0,0 +1,76 @@
+import datetime
+import numpy as np
+import pytest
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def db(db):
+    session = db.session(readonly=False)
+    for i in range(4):
+        slice = db.Slice(ext_id='slice_%d' % i, species='mouse' if i % 2 == 0 else 'human', age=30 + i)
+        expt = db.Experiment(slice=slice, ext_id='%0.3f' % (1.5e9 + i), acq_timestamp=1.5e9 + i,
+                             date=datetime.datetime(2020, 1, 1 + i), project_name='test')
+        cells = [db.Cell(experiment=expt, ext_id=str(j), cell_class='ex' if j < 2 else 'in',
+                         position=[j * 1e-6, 0, 0], depth=j * 10e-6) for j in range(3)]
+        for pre in cells:
+            for post in cells:
+                if pre is post:
+                    continue
+                pair = db.Pair(experiment=expt, pre_cell=pre, post_cell=post, has_synapse=pre.ext_id == '0', distance=50e-6)
+                if pair.has_synapse:
+                    synapse = db.Synapse(pair=pair, synapse_type='ex', latency=1e-3)
+                    session.add(synapse)
+                    session.add(db.AvgResponseFit(synapse=synapse, clamp_mode='ic', holding=-70, avg_data=np.arange(5) * i))
+                    session.add(db.Dynamics(pair=pair, paired_pulse_ratio_50hz=0.5, stp_all_stimuli=[['ic', 50, None], {'x': i}]))
+                session.add(pair)
+    session.commit()
+    return db
+
+
+def test_snapshot_roundtrip(db):
+    snap = db.export_snapshot(chunk_size=10, blob_chunk_size=2)
+    assert snap.path == str(db.db_name)[:-len('.sqlite')] + '.snapshot'
+    assert db.load_snapshot().schema_version == db.schema_version
+
+    # scalar tables match the ORM
+    cells = snap.load('cell')
+    assert len(cells) == db.query(db.Cell).count()
+    for cell in db.query(db.Cell):
+        row = cells[cells['id'] == cell.id].iloc[0]
+        assert row['cell_class'] == cell.cell_class
+        assert row['position'] == cell.position
+    assert cells['depth'].dtype == float
+
+    # projection and predicate pushdown
+    pairs = snap.load('pair', columns=['id', 'has_synapse'], filters=[('has_synapse', '==', True)])
+    assert list(pairs.columns) == ['id', 'has_synapse']
+    assert sorted(pairs['id']) == sorted(p.id for p in db.query(db.Pair).filter(db.Pair.has_synapse == True))
+
+    # array and deferred columns are stored separately
+    assert 'avg_data' not in snap.columns('avg_response_fit')
+    assert 'stp_all_stimuli' not in snap.columns('dynamics')
+    assert set(snap.blob_columns('avg_response_fit')) == {'avg_data'}
+    fits = db.query(db.AvgResponseFit).all()
+    arrays = snap.load_blobs('avg_response_fit', 'avg_data', ids=[fits[-1].id])
+    assert list(arrays.keys()) == [fits[-1].id]
+    assert np.array_equal(arrays[fits[-1].id], fits[-1].avg_data)
+    stims = snap.load_blobs('dynamics', 'stp_all_stimuli')
+    assert {k: v for k, v in stims.items()} == {d.id: d.stp_all_stimuli for d in db.query(db.Dynamics)}
+
+    # pre-joined summaries
+    summary = snap.load('pair_summary', filters=[('slice_species', '==', 'human')])
+    assert len(summary) == 2 * 6
+    assert set(summary['pre_cell_class']) == {'ex', 'in'}
+    syn = summary[summary['has_synapse']]
+    assert (syn['synapse_synapse_type'] == 'ex').all()
+    assert (summary[~summary['has_synapse']]['synapse_latency'].isnull()).all()
+    assert len(snap.load('synapse_summary')) == db.query(db.Synapse).count()
+    assert set(snap.load('cell_summary', columns=['experiment_ext_id'])['experiment_ext_id']) == {'%0.3f' % (1.5e9 + i) for i in range(4)}
+
+    # existing snapshots are not overwritten by accident
+    with pytest.raises(Exception):
+        db.export_snapshot()
+    db.export_snapshot(overwrite=True, tables=['slice'])
+    assert db.load_snapshot().tables == ['slice']
@@ -0,0 +1,35 @@
+import numpy as np
+from aisynphys.database.database import rows_to_structured_array
+
+
+def test_rows_to_structured_array():
+    dtype = [('id', int), ('x', float), ('ok', bool), ('name', object), ('pos', object)]
+    rows = [(1, 0.5, True, 'a', [1, 2, 3]), (2, None, None, None, [4, 5, 6]), (3, 2.0, False, 'c', None)]
+    arr = rows_to_structured_array(rows, dtype)
+    assert arr.dtype == np.dtype(dtype)
+    assert list(arr['id']) == [1, 2, 3]
+    assert np.isnan(arr['x'][1]) and arr['x'][2] == 2.0
+    assert list(arr['ok']) == [True, False, False]
+    assert list(arr['name']) == ['a', None, 'c']
+    assert arr['pos'][1] == [4, 5, 6]
+
+    # fields matched by name
+    arr2 = rows_to_structured_array([(r[1], r[0]) for r in rows], [('id', int), ('x', float)], keys=['x', 'id'])
+    assert list(arr2['id']) == [1, 2, 3]
+    assert len(rows_to_structured_array([], dtype)) == 0
+
+
+def test_query_structured_array(db):
+    session = db.session(readonly=False)
+    expt = db.Experiment(ext_id='1', acq_timestamp=1.0)
+    for i in range(5):
+        session.add(db.Cell(experiment=expt, ext_id=str(i), depth=None if i == 2 else i * 1e-6, cell_class='ex' if i < 3 else None))
+    session.commit()
+
+    q = session.query(db.Cell.depth.label('depth'), db.Cell.id.label('cell_id'), db.Cell.cell_class.label('cell_class')).order_by(db.Cell.id)
+    arr = q.structured_array([('cell_id', int), ('cell_class', object), ('depth', float)])
+    ref = q.recarray()
+    assert list(arr['cell_id']) == list(ref['cell_id'])
+    assert list(arr['cell_class']) == list(ref['cell_class'])
+    assert np.array_equal(arr['depth'], ref['depth'], equal_nan=True)
+    session.close()
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas
+import pytest
+
+synapse_types = pytest.importorskip('aisynphys.synapse_types', exc_type=ImportError)
+
+
+def test_load_model_vectors(db):
+    rng = np.random.RandomState(0)
+    session = db.session(readonly=False)
+    expt = db.Experiment(ext_id='1500000000.000', storage_path='slice_000/site_000', acq_timestamp=1500000000.0)
+    cells = [db.Cell(experiment=expt, ext_id=str(i)) for i in range(1, 5)]
+    vectors = {}
+    for pre in cells:
+        for post in cells:
+            if pre is post:
+                continue
+            pair = db.Pair(experiment=expt, pre_cell=pre, post_cell=post)
+            vector = None if post.ext_id == '4' else rng.normal(size=20)
+            session.add(db.SynapseModel(pair=pair, sparse_pca_vector=vector))
+            if vector is not None:
+                vectors[(expt.ext_id, pre.ext_id, post.ext_id)] = vector
+    session.commit()
+
+    vecs = synapse_types.load_model_vectors(db, max_vector_size=8)
+    assert vecs.index.names == ['experiment_ext_id', 'pre_ext_id', 'post_ext_id']
+    assert list(vecs.columns) == ['PC_%d' % i for i in range(8)]
+    assert set(vecs.index) == set(vectors.keys())
+    for key, row in vecs.iterrows():
+        assert np.allclose(row.values, vectors[key][:8].astype('float32'))
+    assert vecs.values.dtype == np.float32
+
+
+def test_umap_embedding_cache(tmp_path, monkeypatch):
+    rng = np.random.RandomState(0)
+    features = ['a', 'b', 'c']
+    index = pandas.MultiIndex.from_tuples([('expt', str(i), str(i+1)) for i in range(150)])
+    data = pandas.DataFrame(rng.normal(size=(150, 3)), index=index, columns=features)
+    data.iloc[3, 1] = np.nan
+
+    fit_calls = []
+    orig_fit = synapse_types.umap.UMAP.fit
+    def fit(self, *args, **kwds):
+        fit_calls.append(1)
+        return orig_fit(self, *args, **kwds)
+    monkeypatch.setattr(synapse_types.umap.UMAP, 'fit', fit)
+
+    mapper = synapse_types.umap_pipeline(n_neighbors=10)
+    result = synapse_types.run_umap_pipeline(data[:100], mapper, features, cache_path=str(tmp_path))
+    assert len(result) == 99 and len(fit_calls) == 1
+
+    # same data and parameters: the fitted mapper and embedding are loaded from the cache
+    mapper2 = synapse_types.umap_pipeline(n_neighbors=10)
+    result2 = synapse_types.run_umap_pipeline(data[:100], mapper2, features, cache_path=str(tmp_path))
+    assert len(fit_calls) == 1
+    assert np.allclose(result2[['umap-0', 'umap-1']], result[['umap-0', 'umap-1']])
+    assert mapper2.steps[-1][1].graph_.shape == (99, 99)
+
+    # new synapses are projected onto the cached embedding
+    result3 = synapse_types.run_umap_pipeline(data, synapse_types.umap_pipeline(n_neighbors=10), features, cache_path=str(tmp_path))
+    assert len(fit_calls) == 1 and len(result3) == 149
+    assert np.allclose(result3.loc[result.index, ['umap-0', 'umap-1']], result[['umap-0', 'umap-1']])
+    assert not result3[['umap-0', 'umap-1']].isna().any().any()
+
+    # changed training data or parameters require a refit
+    synapse_types.run_umap_pipeline(data[1:100], synapse_types.umap_pipeline(n_neighbors=10), features, cache_path=str(tmp_path))
+    assert len(fit_calls) == 2
+    synapse_types.run_umap_pipeline(data[1:100], synapse_types.umap_pipeline(n_neighbors=12), features, cache_path=str(tmp_path))
+    assert len(fit_calls) == 3
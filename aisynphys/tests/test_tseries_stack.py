@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from neuroanalysis.data import TSeries, TSeriesList
+from neuroanalysis.baseline import float_mode
+from aisynphys.data import PulseResponseList, TSeriesStack
+from aisynphys.data.data import float_mode_rows
+
+
+def synthetic_responses(n, seed=0):
+    """Return a list of fake pulse responses with jittered start times and spike times.
+    """
+    rng = np.random.RandomState(seed)
+    prs = []
+    for i in range(n):
+        t0 = rng.uniform(-12e-3, -8e-3)
+        data = rng.normal(size=rng.randint(900, 1000)) * 1e-4 + rng.normal() * 1e-3
+        spike_t = None if i % 17 == 0 else rng.uniform(1e-3, 2e-3)
+        stim = SimpleNamespace(onset_time=0.0, first_spike_time=spike_t, n_spikes=1)
+        prs.append(SimpleNamespace(post_tseries=TSeries(data, sample_rate=20000, t0=t0), stim_pulse=stim))
+    return prs
+
+
+def legacy_average(prs, bsub_win=5e-3):
+    """Per-trace averaging as previously done by PulseResponseList.post_tseries(align='spike', bsub=True).mean()
+    """
+    tsl = []
+    for pr in prs:
+        ts = pr.post_tseries
+        stim_time = pr.stim_pulse.onset_time
+        baseline_data = ts.time_slice(max(ts.t0, stim_time - bsub_win), stim_time).data
+        ts = ts - (ts.data[0] if len(baseline_data) == 0 else float_mode(baseline_data))
+        align_t = pr.stim_pulse.first_spike_time
+        if align_t is None:
+            continue
+        tsl.append(ts.copy(t0=ts.t0 - align_t))
+    return TSeriesList(tsl).mean()
+
+
+def test_float_mode_rows():
+    rng = np.random.RandomState(0)
+    data = rng.normal(size=(200, 120))
+    lengths = rng.randint(1, 120, size=200)
+    expected = [float_mode(data[i, :n]) for i, n in enumerate(lengths)]
+    assert np.allclose(float_mode_rows(data, lengths), expected)
+
+
+def test_stack_average_matches_tseries_list():
+    prs = synthetic_responses(200)
+    prl = PulseResponseList(prs)
+
+    stack = prl.post_stack(align='spike', bsub=True)
+    assert len(stack) == len([pr for pr in prs if pr.stim_pulse.first_spike_time is not None])
+
+    avg = stack.mean()
+    expected = legacy_average(prs)
+    assert avg.sample_rate == expected.sample_rate
+    assert avg.t0 == expected.t0
+    assert len(avg) == len(expected)
+    assert np.allclose(avg.data, expected.data, atol=1e-6)
+
+    # TSeriesList output is unchanged
+    tsl = prl.post_tseries(align='spike', bsub=True)
+    assert isinstance(tsl, TSeriesList)
+    assert len(tsl) == len(stack)
+
+
+def test_stack_resample():
+    rng = np.random.RandomState(0)
+    tseries = [
+        TSeries(rng.normal(size=400), sample_rate=20000, t0=1e-3),
+        TSeries(rng.normal(size=400), sample_rate=20000, t0=0.7e-3),
+        TSeries(rng.normal(size=331), sample_rate=50000, t0=0),
+        TSeries(rng.normal(size=200), sample_rate=10000, t0=0.2e-3),
+    ]
+    stack = TSeriesStack.from_tseries(tseries).resample(10000)
+    for i, ts in enumerate(tseries):
+        # bessel-filtered resampling matches TSeries.resample
+        expected = ts.resample(10000)
+        assert len(stack.tseries(i)) == len(expected)
+        assert np.allclose(stack.tseries(i).data, expected.data)
+
+    avg = TSeriesStack.from_tseries(tseries).mean()
+    expected = TSeriesList(tseries).mean()
+    assert avg.sample_rate == expected.sample_rate == 10000
+    assert avg.t0 == expected.t0
+    assert len(avg) == len(expected)
+    assert np.allclose(avg.data, expected.data)
+    assert avg.meta['mean_of_n'] == expected.meta['mean_of_n'] == 4
+
+
+def test_stack_mean_ignores_nan():
+    data = np.arange(20, dtype=float)
+    nan_data = data.copy()
+    nan_data[3] = np.nan
+    avg = TSeriesStack.from_arrays([data, nan_data], t0=[0, 0], sample_rate=10000).mean()
+    assert np.allclose(avg.data, data)
+    assert avg.meta['mean_of_n'] == 2
+    assert TSeriesStack.from_arrays([data], t0=[0], sample_rate=10000).mean().meta['mean_of_n'] == 1
@@ -0,0 +1,213 @@
+"""Array data sources for NDSlicer that may be much larger than memory.
+"""
+from __future__ import print_function, division
+import sys, queue, threading
+import numpy as np
+
+
+class ArraySource(object):
+    """Read-only ND array data displayed by NDSlicer.
+
+    *data* may be any array-like object that supports numpy basic indexing (ndarray, np.memmap, h5py dataset, ...).
+    Reads from *data* are done in chunks of at most *chunk_size* elements, so the complete array is never loaded
+    at once.
+
+    Max projections are cached as a pyramid keyed by the set of projected axes: each projection is computed from
+    the smallest cached projection over a subset of its axes, so the source array is scanned at most once per axis
+    and projections over several axes are computed from much smaller arrays. Projections and the data range can be
+    computed in a background thread (see request_projection); callbacks registered with add_callback are invoked
+    from that thread when results become available.
+
+    Parameters
+    ----------
+    data : array-like
+        The array to display
+    chunk_size : int
+        Maximum number of elements to read from *data* at once. Slices smaller than this are always
+        computed immediately.
+    """
+    def __init__(self, data, chunk_size=2**22):
+        self.data = data
+        self.shape = tuple(data.shape)
+        self.ndim = len(self.shape)
+        self.size = int(np.prod(self.shape))
+        self.dtype = np.dtype(data.dtype)
+        self.chunk_size = chunk_size
+
+        self._projections = {}
+        self._range = None
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._requests = queue.Queue()
+        self._thread = None
+
+    @classmethod
+    def open(cls, filename, dtype=None, shape=None, **kwds):
+        """Return an ArraySource backed by a read-only memmap of *filename*.
+
+        If *dtype* is None, then *filename* must be a .npy file; otherwise it is read as raw data with the given
+        *dtype* and *shape*.
+        """
+        if dtype is None:
+            data = np.load(filename, mmap_mode='r')
+        else:
+            data = np.memmap(filename, mode='r', dtype=dtype, shape=shape)
+        return cls(data, **kwds)
+
+    def get(self, index, project=(), block=True):
+        """Return a slice of the data.
+
+        Parameters
+        ----------
+        index : dict
+            {axis: index} for axes to slice at a single index
+        project : set
+            Axes to max-project (must not overlap *index*)
+        block : bool
+            If False and a projection is needed that has not been computed yet, request the projection
+            in the background and return None.
+
+        Returns
+        -------
+        data : ndarray | None
+            Array containing all remaining axes, in their original order.
+        """
+        project = frozenset(project)
+        if len(project) > 0:
+            proj = self.projection(project, block=False)
+            if proj is None:
+                remaining = [i for i in range(self.ndim) if i not in index]
+                if int(np.prod([self.shape[i] for i in remaining])) <= self.chunk_size:
+                    # slicing first leaves a small slab; project it directly
+                    slab = self._read(self.data, tuple(index.get(i, slice(None)) for i in range(self.ndim)))
+                    return slab.max(axis=tuple(remaining.index(i) for i in sorted(project)))
+                if not block:
+                    self.request_projection(project)
+                    return None
+                proj = self.projection(project)
+            remaining = [i for i in range(self.ndim) if i not in project]
+            return self._read(proj, tuple(index.get(i, slice(None)) for i in remaining))
+        return self._read(self.data, tuple(index.get(i, slice(None)) for i in range(self.ndim)))
+
+    def projection(self, axes, block=True):
+        """Return the max projection of the data across *axes* (the projected axes are removed).
+
+        If *block* is False, return None unless the projection has already been computed.
+        """
+        axes = frozenset(axes)
+        if len(axes) == 0:
+            return self.data
+        with self._lock:
+            proj = self._projections.get(axes)
+            parents = [(k, v) for k, v in self._projections.items() if k < axes]
+        if proj is not None or not block:
+            return proj
+
+        # start from the smallest cached projection over a subset of the requested axes
+        if len(parents) > 0:
+            base_axes, base = min(parents, key=lambda kv: kv[1].size)
+        else:
+            base_axes, base = frozenset(), self.data
+
+        # project remaining axes, longest first so that intermediate arrays shrink quickly
+        for ax in sorted(axes - base_axes, key=lambda a: -self.shape[a]):
+            local_axis = ax - len([a for a in base_axes if a < ax])
+            base = self._max(base, local_axis)
+            base_axes = base_axes | {ax}
+            with self._lock:
+                base = self._projections.setdefault(base_axes, base)
+        return base
+
+    def range(self, block=True):
+        """Return the (min, max) of the data.
+
+        If *block* is False and the data is large, then the range is requested in the background and
+        None is returned until it is available.
+        """
+        if self._range is None:
+            if not block and self.size > self.chunk_size:
+                self._request('range')
+                return None
+            lo, hi = np.inf, -np.inf
+            for sl in self._chunks(self.data.shape):
+                chunk = self._read(self.data, sl)
+                lo = min(lo, chunk.min())
+                hi = max(hi, chunk.max())
+            self._range = (lo, hi)
+        return self._range
+
+    def request_projection(self, axes):
+        """Request the max projection across *axes* to be computed in a background thread.
+        """
+        self._request(frozenset(axes))
+
+    def add_callback(self, fn):
+        """Register *fn(request)* to be called from the background thread after each requested
+        projection (request is a frozenset of axes) or range (request is 'range') is available.
+        """
+        self._callbacks.append(fn)
+
+    def _request(self, req):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._requests.put(req)
+
+    def _run(self):
+        while True:
+            req = self._requests.get()
+            try:
+                if req == 'range':
+                    self.range()
+                else:
+                    self.projection(req)
+            except Exception:
+                sys.excepthook(*sys.exc_info())
+                continue
+            for fn in self._callbacks:
+                fn(req)
+
+    def _max(self, data, axis):
+        """Max across *axis*, reading *data* in chunks unless it is already in memory.
+        """
+        if data is not self.data or type(data) is np.ndarray:
+            return data.max(axis=axis)
+        out_shape = data.shape[:axis] + data.shape[axis+1:]
+        out = None
+        for sl in self._chunks(data.shape, skip_axis=axis):
+            chunk_max = self._read(data, sl).max(axis=axis)
+            if len(out_shape) == 0:
+                out = chunk_max if out is None else np.maximum(out, chunk_max)
+                continue
+            if out is None:
+                out = np.empty(out_shape, dtype=chunk_max.dtype)
+            out[sl[:axis] + sl[axis+1:]] = chunk_max
+        return np.asarray(out)
+
+    def _chunks(self, shape, skip_axis=None):
+        """Yield slice tuples that divide an array of *shape* into chunks of at most chunk_size elements
+        (or single planes along the chunked axis if those are larger). Chunks span the full length of *skip_axis*.
+        """
+        axes = [i for i in range(len(shape)) if i != skip_axis]
+        if len(axes) == 0:
+            # 1D array projected across its only axis
+            axes, skip_axis = [0], None
+        ax = axes[0]
+        plane = int(np.prod(shape)) // max(shape[ax], 1)
+        step = max(1, self.chunk_size // max(plane, 1))
+        for start in range(0, shape[ax], step):
+            sl = [slice(None)] * len(shape)
+            sl[ax] = slice(start, start + step)
+            yield tuple(sl)
+
+    def _read(self, data, index):
+        return np.asarray(data[index])
+
+
+def as_array_source(data):
+    """Return *data* wrapped in an ArraySource, unless it is already an ArraySource.
+    """
+    if data is None or isinstance(data, ArraySource):
+        return data
+    return ArraySource(data)
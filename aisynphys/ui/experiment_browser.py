@@ -1,16 +1,190 @@
 from __future__ import print_function, division
 from datetime import datetime
+import sqlalchemy
+from sqlalchemy.orm import aliased
 import pyqtgraph as pg
 
 from aisynphys.database import default_db as db
 
 
+morphology_types = ['spiny', 'aspiny', 'sparsely spiny']
+
+
+def experiment_summary_query(session, experiments=None, all_pairs=False, synapses=False, search=None, database=None):
+    """Return a query yielding one row of display columns per experiment.
+
+    Only experiment- and slice-level columns are selected; pairs are counted in a grouped subquery
+    so that no pair or cell records are loaded. Rows have the columns id, acq_timestamp, rig_name,
+    species, project_name, target_region, genotype, acsf, and n_pairs (the number of pairs that
+    pass the *all_pairs* / *synapses* filters).
+
+    Parameters
+    ----------
+    experiments : list | None
+        Experiment instances or IDs to include. If None, then all experiments having at least one
+        matching pair are included.
+    all_pairs : bool
+        If False, then pairs with no qc-passed pulse responses are not counted
+    synapses : bool
+        If True, then only synaptically connected pairs are counted
+    search : str | None
+        Case-insensitive substring that must match at least one of the experiment ext_id, rig, species,
+        project, target region, genotype, or acsf columns
+    """
+    database = database or db
+    pairs = session.query(database.Pair.experiment_id, sqlalchemy.func.count(database.Pair.id).label('n_pairs'))
+    pairs = _pair_filter(pairs, database, all_pairs, synapses)
+    pairs = pairs.group_by(database.Pair.experiment_id).subquery()
+    n_pairs = sqlalchemy.func.coalesce(pairs.c.n_pairs, 0)
+
+    q = session.query(
+        database.Experiment.id,
+        database.Experiment.acq_timestamp,
+        database.Experiment.rig_name,
+        database.Slice.species,
+        database.Experiment.project_name,
+        database.Experiment.target_region,
+        database.Slice.genotype,
+        database.Experiment.acsf,
+        n_pairs.label('n_pairs'),
+    )
+    q = q.outerjoin(database.Slice, database.Experiment.slice_id==database.Slice.id)
+    q = q.outerjoin(pairs, pairs.c.experiment_id==database.Experiment.id)
+
+    if experiments is None:
+        q = q.filter(n_pairs > 0)
+    else:
+        expt_ids = [getattr(e, 'id', e) for e in experiments]
+        q = q.filter(database.Experiment.id.in_(expt_ids))
+
+    if search:
+        pattern = '%' + search + '%'
+        cols = [
+            database.Experiment.ext_id, database.Experiment.rig_name, database.Slice.species, database.Experiment.project_name,
+            database.Experiment.target_region, database.Slice.genotype, database.Experiment.acsf,
+        ]
+        q = q.filter(sqlalchemy.or_(*[col.ilike(pattern) for col in cols]))
+
+    return q.order_by(database.Experiment.acq_timestamp)
+
+
+def pair_summary_query(session, expt_id, all_pairs=False, synapses=False, database=None):
+    """Return a query yielding one row of display columns per pair in the experiment *expt_id*.
+
+    Cell types, layers, and morphology are pre-joined so that no relationships need to be loaded
+    while building the tree. Rows have the columns id, pre_ext_id, post_ext_id, has_synapse,
+    has_electrical, pre_cre_type, pre_target_layer, pre_dendrite_type, and the same three columns
+    for the postsynaptic cell.
+    """
+    database = database or db
+    pre_cell = aliased(database.Cell)
+    post_cell = aliased(database.Cell)
+    pre_morph = aliased(database.Morphology)
+    post_morph = aliased(database.Morphology)
+    q = session.query(
+        database.Pair.id,
+        pre_cell.ext_id.label('pre_ext_id'),
+        post_cell.ext_id.label('post_ext_id'),
+        database.Pair.has_synapse,
+        database.Pair.has_electrical,
+        pre_cell.cre_type.label('pre_cre_type'),
+        pre_cell.target_layer.label('pre_target_layer'),
+        pre_morph.dendrite_type.label('pre_dendrite_type'),
+        post_cell.cre_type.label('post_cre_type'),
+        post_cell.target_layer.label('post_target_layer'),
+        post_morph.dendrite_type.label('post_dendrite_type'),
+    )
+    q = q.join(pre_cell, pre_cell.id==database.Pair.pre_cell_id)
+    q = q.join(post_cell, post_cell.id==database.Pair.post_cell_id)
+    q = q.outerjoin(pre_morph, pre_morph.cell_id==pre_cell.id)
+    q = q.outerjoin(post_morph, post_morph.cell_id==post_cell.id)
+    q = q.filter(database.Pair.experiment_id==expt_id)
+    q = _pair_filter(q, database, all_pairs, synapses)
+    return q.order_by(database.Pair.id)
+
+
+def _pair_filter(q, database, all_pairs, synapses):
+    if all_pairs is False:
+        # pairs with a NULL spike count were never excluded
+        no_spikes = sqlalchemy.and_(database.Pair.n_ex_test_spikes==0, database.Pair.n_in_test_spikes==0)
+        q = q.filter(sqlalchemy.not_(no_spikes) | database.Pair.n_ex_test_spikes.is_(None) | database.Pair.n_in_test_spikes.is_(None))
+    if synapses:
+        q = q.filter(database.Pair.has_synapse==True)
+    return q
+
+
+def pair_display_columns(rec):
+    """Return the [cells, connectivity, types] strings displayed for a row from pair_summary_query.
+    """
+    cells = '%s => %s' % (rec.pre_ext_id, rec.post_ext_id)
+    conn = {True:"syn", False:"-", None:"?"}[rec.has_synapse]
+    gap = {True:"gap", False:"-", None:"?"}[rec.has_electrical]
+    types = []
+    for cre_type, dendrite_type, layer in [
+            (rec.pre_cre_type, rec.pre_dendrite_type, rec.pre_target_layer),
+            (rec.post_cre_type, rec.post_dendrite_type, rec.post_target_layer)]:
+        if cre_type == 'unknown' and dendrite_type in morphology_types:
+            cre_type = dendrite_type
+        types.append('L%s %s' % (layer or "?", cre_type))
+    return [cells, conn+' ; '+gap, ' => '.join(types)]
+
+
+class ExperimentItem(pg.TreeWidgetItem):
+    """Tree item for one experiment. Pair children are loaded when the item is first expanded,
+    and the Experiment record is only loaded when accessed.
+    """
+    def __init__(self, browser, rec):
+        self.browser = browser
+        self.expt_id = rec.id
+        self.acq_timestamp = rec.acq_timestamp
+        self.n_pairs = rec.n_pairs
+        self.children_loaded = False
+        date_str = datetime.fromtimestamp(rec.acq_timestamp).strftime('%Y-%m-%d')
+        cols = [date_str, '%0.3f'%rec.acq_timestamp, rec.rig_name, rec.species, rec.project_name, rec.target_region, rec.genotype, rec.acsf]
+        pg.TreeWidgetItem.__init__(self, list(map(str, cols)))
+        if rec.n_pairs > 0:
+            self.setChildIndicatorPolicy(self.ShowIndicator)
+
+    @property
+    def expt(self):
+        return self.browser.session.query(self.browser.db.Experiment).get(self.expt_id)
+
+    def load_children(self):
+        if self.children_loaded:
+            return
+        self.children_loaded = True
+        self.setChildIndicatorPolicy(self.DontShowIndicatorWhenChildless)
+        self.browser._load_pairs(self)
+
+
+class PairItem(pg.TreeWidgetItem):
+    """Tree item for one pair; the Pair record is only loaded when accessed.
+    """
+    def __init__(self, browser, expt_item, rec):
+        self.browser = browser
+        self.expt_item = expt_item
+        self.pair_id = rec.id
+        pg.TreeWidgetItem.__init__(self, pair_display_columns(rec))
+
+    @property
+    def pair(self):
+        return self.browser.session.query(self.browser.db.Pair).get(self.pair_id)
+
+    @property
+    def expt(self):
+        return self.expt_item.expt
+
+
 class ExperimentBrowser(pg.TreeWidget):
     """TreeWidget showing a list of experiments with cells and pairs.
+
+    Only experiment summary columns are queried when the browser is populated; the pairs for each
+    experiment are queried when the experiment is expanded (or a pair is selected with select_pair).
     """
-    # TODO: add filtering options, cell info, context menu of actions, etc.
+    # TODO: add cell info, context menu of actions, etc.
     
-    def __init__(self):
+    def __init__(self, database=None):
+        self.db = database or db
         self.all_columns = ['date', 'timestamp', 'rig', 'organism', 'project', 'region', 'genotype', 'acsf']
         self.visible_columns = self.all_columns[:]
         
@@ -20,8 +194,12 @@ class ExperimentBrowser(pg.TreeWidget):
         self.setHeaderLabels(self.all_columns)
         self.setDragDropMode(self.NoDragDrop)
         self._last_expanded = None
+        self.items_by_pair_id = {}
+        self.items_by_expt_id = {}
+        self._populate_args = {}
+        self.itemExpanded.connect(self._item_expanded)
         
-    def populate(self, experiments=None, all_pairs=False, synapses=False):
+    def populate(self, experiments=None, all_pairs=False, synapses=False, search=None):
         """Populate the browser with a list of experiments.
         
         Parameters
@@ -32,66 +210,69 @@ class ExperimentBrowser(pg.TreeWidget):
             If False, then pairs with no qc-passed pulse responses are excluded
         synapses : bool
             If True, then only synaptically connected pairs are shown
+        search : str | None
+            If given, only experiments with a matching ext_id, rig, organism, project, region, genotype,
+            or acsf are shown (see experiment_summary_query)
         """
         with pg.BusyCursor():
             # if all_pairs is set to True, all pairs from an experiment will be included regardless of whether they have data
             self.items_by_pair_id = {}
+            self.items_by_expt_id = {}
+            self._populate_args = dict(experiments=experiments, all_pairs=all_pairs, synapses=synapses)
             
-            self.session = db.session()
+            self.session = self.db.session()
             
-            if experiments is None:
-                # preload all cells,pairs so they are not queried individually later on
-                q = self.session.query(db.Pair, db.Experiment, db.Cell, db.Slice)
-                q = q.join(db.Experiment, db.Pair.experiment_id==db.Experiment.id)
-                q = q.join(db.Cell, db.Cell.id==db.Pair.pre_cell_id)
-                q = q.join(db.Slice)
-                if synapses:
-                    q = q.filter(db.Pair.has_synapse==True)
-                    
-                recs = q.all()
-                experiments = list(set([rec.Experiment for rec in recs]))
-            
-            experiments.sort(key=lambda e: e.acq_timestamp)
-            for expt in experiments:
-                date = expt.acq_timestamp
-                date_str = datetime.fromtimestamp(date).strftime('%Y-%m-%d')
-                slice = expt.slice
-                expt_item = pg.TreeWidgetItem(map(str, [date_str, '%0.3f'%expt.acq_timestamp, expt.rig_name, slice.species, expt.project_name, expt.target_region, slice.genotype, expt.acsf]))
-                expt_item.expt = expt
-                self.addTopLevelItem(expt_item)
-
-                for pair in expt.pair_list:
-                    if all_pairs is False and pair.n_ex_test_spikes == 0 and pair.n_in_test_spikes == 0:
-                        continue
-                    if synapses and not pair.has_synapse:
-                        continue
-                    cells = '%s => %s' % (pair.pre_cell.ext_id, pair.post_cell.ext_id)
-                    conn = {True:"syn", False:"-", None:"?"}[pair.has_synapse]
-                    gap = {True:"gap", False:"-", None:"?"}[pair.has_electrical]
-                    pre_type = pair.pre_cell.cre_type
-                    if pre_type == 'unknown':
-                        dendrite_type = pair.pre_cell.morphology.dendrite_type if pair.pre_cell.morphology is not None else None
-                        pre_type = dendrite_type if dendrite_type in ['spiny', 'aspiny', 'sparsely spiny'] else pre_type
-                    post_type = pair.post_cell.cre_type
-                    if post_type == 'unknown':
-                        dendrite_type = pair.post_cell.morphology.dendrite_type if pair.pre_cell.morphology is not None else None
-                        post_type = dendrite_type if dendrite_type in ['spiny', 'aspiny', 'sparsely spiny'] else post_type
-                    types = 'L%s %s => L%s %s' % (pair.pre_cell.target_layer or "?", pre_type, pair.post_cell.target_layer or "?", post_type)
-                    pair_item = pg.TreeWidgetItem([cells, conn+' ; '+gap, types])
-                    expt_item.addChild(pair_item)
-                    pair_item.pair = pair
-                    pair_item.expt = expt
-                    self.items_by_pair_id[pair.id] = pair_item
-                    # also allow select by ext id
-                    self.items_by_pair_id[(expt.acq_timestamp, pair.pre_cell.ext_id, pair.post_cell.ext_id)] = pair_item
+            q = experiment_summary_query(self.session, experiments, all_pairs=all_pairs, synapses=synapses, search=search, database=self.db)
+            items = []
+            for rec in q.all():
+                expt_item = ExperimentItem(self, rec)
+                self.items_by_expt_id[rec.id] = expt_item
+                items.append(expt_item)
+            self.addTopLevelItems(items)
                     
             self.verticalScrollBar().setValue(self.verticalScrollBar().maximum())
+
+    def set_search(self, search):
+        """Re-populate the browser, showing only experiments that match *search*.
+        """
+        self.clear()
+        self.populate(search=search, **self._populate_args)
+
+    def _item_expanded(self, item):
+        if isinstance(item, ExperimentItem):
+            item.load_children()
+
+    def _load_pairs(self, expt_item):
+        args = self._populate_args
+        q = pair_summary_query(self.session, expt_item.expt_id, all_pairs=args['all_pairs'], synapses=args['synapses'], database=self.db)
+        items = []
+        for rec in q.all():
+            pair_item = PairItem(self, expt_item, rec)
+            items.append(pair_item)
+            self.items_by_pair_id[rec.id] = pair_item
+            # also allow select by ext id
+            self.items_by_pair_id[(expt_item.acq_timestamp, rec.pre_ext_id, rec.post_ext_id)] = pair_item
+        expt_item.addChildren(items)
+
+    def _expt_id_for_pair(self, pair_id):
+        if isinstance(pair_id, tuple):
+            acq_timestamp, pre_ext_id, post_ext_id = pair_id
+            for expt_item in self.items_by_expt_id.values():
+                if expt_item.acq_timestamp == acq_timestamp:
+                    return expt_item.expt_id
+            return None
+        rec = self.session.query(self.db.Pair.experiment_id).filter(self.db.Pair.id==pair_id).first()
+        return None if rec is None else rec.experiment_id
                 
     def select_pair(self, pair_id):
         """Select a specific pair from the list
         """
         if self._last_expanded is not None:
             self._last_expanded.setExpanded(False)
+        if pair_id not in self.items_by_pair_id:
+            expt_item = self.items_by_expt_id.get(self._expt_id_for_pair(pair_id))
+            if expt_item is not None:
+                expt_item.load_children()
         item = self.items_by_pair_id[pair_id]
         self.clearSelection()
         item.setSelected(True)
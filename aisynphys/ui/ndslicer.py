@@ -3,6 +3,7 @@ import numpy as np
 from pyqtgraph.Qt import QtGui, QtCore
 import pyqtgraph as pg
 import pyqtgraph.dockarea
+from .array_source import ArraySource, as_array_source
 
 
 class NDSlicer(QtGui.QWidget):
@@ -18,6 +19,7 @@ class NDSlicer(QtGui.QWidget):
     
     selection_changing = QtCore.Signal(object)
     selection_changed = QtCore.Signal(object)
+    source_updated = QtCore.Signal(object)  # request completed by the ArraySource background thread
     
     def __init__(self, axes):
         QtGui.QWidget.__init__(self)
@@ -30,6 +32,7 @@ class NDSlicer(QtGui.QWidget):
 
         self.viewers = []
         self.data = None
+        self.source = None
         self.axes = OrderedDict([(ax, AxisData(name=ax, **ax_info)) for ax, ax_info in axes.items()])
         
         self.params = pg.parametertree.Parameter(name='params', type='group', children=[
@@ -68,26 +71,53 @@ class NDSlicer(QtGui.QWidget):
         self.ctrl_dock.addWidget(self.ctrl_split)
         self.dockarea.addDock(self.ctrl_dock, 'left')
 
+        self.source_updated.connect(self._source_updated)
+
     def set_data(self, data, axes=None):
         """Set the data to be displayed.
         
         Parameters
         ----------
-        data : array
-            Data array of any dimensionality to be displayed
+        data : array | ArraySource
+            Data array of any dimensionality to be displayed. Large on-disk arrays (eg. np.memmap) may be
+            given as an ArraySource, in which case max projections are computed in the background and
+            the array is only read in chunks.
         axes : dict
             Optional description of axes in *data*.
         """
         self.data = data
+        self.source = as_array_source(data)
+        if self.source_updated.emit not in self.source._callbacks:
+            self.source.add_callback(self.source_updated.emit)
         axes = axes or {}
         for ax,info in axes.items():
             for k,v in info.items():
                 setattr(self.axes[ax], k, v)
+
+        # precompute single-axis projections; projections across several axes are built from these
+        for i in range(self.source.ndim):
+            if self.source.size > self.source.chunk_size:
+                self.source.request_projection([i])
+
         for viewer in self.viewers:
-            viewer.set_data(self.data, self.axes)
-        data_lim = (self.data.min(), self.data.max())
+            viewer.set_data(self.source, self.axes)
+        self._update_levels()
+
+    def _update_levels(self):
+        data_lim = self.source.range(block=False)
+        if data_lim is None:
+            return
         self.histlut.setLevels(*data_lim)
         self.histlut.setHistogramRange(*data_lim)
+
+    def _source_updated(self, request):
+        if request == 'range':
+            self._update_levels()
+            for viewer in self.viewers:
+                viewer.set_data(self.source, self.axes)
+        else:
+            for viewer in self.viewers:
+                viewer.update_selection()
         
     def add_view(self, axes, position=None):
         """Add a new 1D or 2D view.
@@ -112,7 +142,7 @@ class NDSlicer(QtGui.QWidget):
         viewer.selection_changed.connect(self.viewer_selection_changed)
         viewer.selection_changing.connect(self.viewer_selection_changing)
         self.viewers.append(viewer)
-        viewer.set_data(self.data, self.axes)
+        viewer.set_data(self.source, self.axes)
         self.histlut_changed()
         return viewer, dock
 
@@ -137,11 +167,9 @@ class NDSlicer(QtGui.QWidget):
         if len(optimize_axes) > 0:
             # find best index for optimized axes
             index = self.index()
-            opt_data = self.data
-            for i,k in list(enumerate(self.axes.keys()))[::-1]:
-                if k not in optimize_axes:
-                    # take single index for axes that are not being optimized
-                    opt_data = np.take(opt_data, index[k], axis=i)
+            # take single index for axes that are not being optimized
+            take = {i:index[k] for i,k in enumerate(self.axes.keys()) if k not in optimize_axes}
+            opt_data = self.source.get(take)
             max_ind = np.unravel_index(opt_data.argmax(), opt_data.shape)
             for i,k in enumerate(optimize_axes):
                 ax = self.axes[k]
@@ -337,15 +365,15 @@ class Viewer(object):
         raise NotImplementedError()
         
     def get_data(self):
-        data = self.data
-        
+        """Return (data, colormap) for the selected axes, or (None, None) if the data is
+        still being computed in the background.
+        """
         # slice or flatten non-visible axes
         axis_names = list(self.data_axes.keys())
         colormap_axis = None
-        removed = 0
-        for i in range(len(axis_names)):
-            j = i - removed
-            ax_name = axis_names[j]
+        index = {}
+        project = set()
+        for i, ax_name in enumerate(axis_names):
             ax = self.data_axes[ax_name]
             if ax_name in self.selected_axes:
                 continue
@@ -354,12 +382,14 @@ class Viewer(object):
                 continue
             if ax.max_project:
                 # max projection across this axis
-                data = data.max(axis=j)
+                project.add(i)
             else:
                 # slice this axis
-                data = data.take(ax.index, j)
-            axis_names.pop(j)
-            removed += 1
+                index[i] = ax.index
+        data = self.data.get(index, project, block=False)
+        if data is None:
+            return None, None
+        axis_names = [ax for i, ax in enumerate(axis_names) if i not in index and i not in project]
             
         # re-order visible axes
         order = [axis_names.index(ax) for ax in self.selected_axes]
@@ -411,6 +441,9 @@ class OneDViewer(Viewer, pg.PlotWidget):
         axis = self.selected_axes[0]
         self.setLabels(bottom=axis)
         data, colors = self.get_data()
+        if data is None:
+            # redrawn when the projection is ready
+            return
             
         if colors is None:
             data = data[..., np.newaxis]
@@ -464,7 +497,7 @@ class TwoDViewer(Viewer, pg.GraphicsLayoutWidget):
 
     def set_data(self, data, axes):
         if data is not None:
-            self.data_bounds = (data.min(), data.max())
+            self.data_bounds = data.range(block=False) or self.data_bounds
         Viewer.set_data(self, data, axes)
         
     def set_image_params(self, levels, lut):
@@ -499,6 +532,9 @@ class TwoDViewer(Viewer, pg.GraphicsLayoutWidget):
         axes = self.selected_axes
         self.plot.setLabels(left=axes[1], bottom=axes[0])
         data, colors = self.get_data()
+        if data is None:
+            # redrawn when the projection is ready
+            return
         
         levels = self.levels or self.data_bounds
         
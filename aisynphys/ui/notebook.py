@@ -519,10 +519,18 @@ def cell_class_matrix(pre_classes, post_classes, metric, class_labels, ax, db, p
 
 
 def get_pair(expt_id, pre_cell, post_cell, db):
-    expt = db.query(db.Experiment).filter(db.Experiment.ext_id==expt_id).all()[0]
-    pairs = expt.pairs
-    pair = pairs[(pre_cell, post_cell)]
-    return pair
+    return db.pair_from_ext_id((expt_id, pre_cell, post_cell))
+
+
+def get_pairs(pair_list, db):
+    """Return the pairs for a list of (expt_id, pre_cell, post_cell) tuples, using a single query.
+    """
+    pair_list = [tuple(p) for p in pair_list]
+    pairs = db.pairs_from_ext_ids(pair_list)
+    missing = [p for p in pair_list if p not in pairs]
+    if len(missing) > 0:
+        raise KeyError("No pairs found for ext_ids %r" % missing)
+    return [pairs[p] for p in pair_list]
 
 
 def map_color_by_metric(pair, metric, cmap, norm, scale):
@@ -538,7 +546,7 @@ def map_color_by_metric(pair, metric, cmap, norm, scale):
 
 
 def plot_metric_pairs(pair_list, metric, db, ax, align='pulse', norm_amp=None, perc=False, labels=None, max_ind_freq=50):
-    pairs = [get_pair(eid, pre, post, db) for eid, pre, post in pair_list]
+    pairs = get_pairs(pair_list, db)
     _, metric_name, units, scale, _, cmap, cmap_log, clim, _ = get_metric_data(metric, db)
     cmap = matplotlib.cm.get_cmap(cmap)
     if cmap_log:
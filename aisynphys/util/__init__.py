@@ -1,3 +1,4 @@
 from neuroanalysis.util.optional_import import optional_import
 from .timestamp import timestamp_to_datetime, datetime_to_timestamp
 from .logging import logger
+from .lazy_import import lazy_import
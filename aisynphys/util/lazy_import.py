@@ -0,0 +1,49 @@
+import importlib
+
+
+def lazy_import(module, package=None):
+    """Return a proxy for *module* that imports the module the first time one of its attributes is accessed.
+
+    This is used to defer heavy (and often optional) dependencies so that importing aisynphys
+    modules remains fast for command-line tools and pipeline worker processes. If the import fails,
+    the ImportError is raised on first access rather than at import time.
+
+    Examples::
+
+        # import umap
+        umap = lazy_import('umap')
+
+        # from ..mypackage import mymodule
+        mymodule = lazy_import('..mypackage.mymodule', package=__name__)
+    """
+    return LazyModule(module, package)
+
+
+class LazyModule(object):
+    """Proxy object returned by lazy_import().
+    """
+    def __init__(self, name, package=None):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_package'] = package
+        self.__dict__['_lazy_module'] = None
+
+    def _lazy_load(self):
+        mod = self.__dict__['_lazy_module']
+        if mod is None:
+            mod = importlib.import_module(self._lazy_name, package=self._lazy_package)
+            self.__dict__['_lazy_module'] = mod
+        return mod
+
+    def __getattr__(self, attr):
+        return getattr(self._lazy_load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._lazy_load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._lazy_load())
+
+    def __repr__(self):
+        if self.__dict__['_lazy_module'] is None:
+            return "<lazy module %r (not yet imported)>" % self._lazy_name
+        return repr(self._lazy_module)
@@ -85,28 +85,28 @@ def run_expt(Wab, n_cells=4, n_expts=100, n_trials=1000):
     n_cell_types = Wab.shape[0]
     results = np.empty((n_trials, n_expts), dtype=[('conn', int), ('recip', int), ('probed', int)])
     
-    # Run many trials so we can analyze the trial-to-trial variability in results
-    for i in range(n_trials):
-        # Run many experiments to recover the connection probability
-        # (this is like running many multipatch experiments on a single class of neuron)
-        for j in range(n_expts):
-            # Randomly choose N cells from available cell types
-            types = np.random.randint(n_cell_types, size=n_cells)
-            
-            # i,j connection probability matrix for this experiment
-            cpm = Wab[types][:, types]
-            
-            # i,j boolean connection matrix for this experiment
-            conn = cpm > np.random.random(size=(n_cells, n_cells))
-            
-            # clear diagonal
-            diag = np.eye(n_cells, dtype='bool')
-            conn[diag] = False
-            
-            # count total connections and reciprocal connections
-            results[i, j]['conn'] = conn.sum()
-            results[i, j]['recip'] = (conn & conn.T).sum()
-            results[i, j]['probed'] = n_cells * (n_cells-1)
+    # Run many trials so we can analyze the trial-to-trial variability in results.
+    # Each trial runs many experiments to recover the connection probability
+    # (this is like running many multipatch experiments on a single class of neuron);
+    # all experiments in all trials are simulated at once.
+
+    # Randomly choose N cells from available cell types for each experiment
+    types = np.random.randint(n_cell_types, size=(n_trials, n_expts, n_cells))
+
+    # i,j connection probability matrix for each experiment
+    cpm = Wab[types[..., :, None], types[..., None, :]]
+
+    # i,j boolean connection matrix for each experiment
+    conn = cpm > np.random.random(size=cpm.shape)
+
+    # clear diagonal
+    diag = np.eye(n_cells, dtype='bool')
+    conn[..., diag] = False
+
+    # count total connections and reciprocal connections
+    results['conn'] = conn.sum(axis=(2, 3))
+    results['recip'] = (conn & conn.swapaxes(2, 3)).sum(axis=(2, 3))
+    results['probed'] = n_cells * (n_cells-1)
 
     cprobs = results['conn'].sum(axis=1) / results['probed'].sum(axis=1)
     rprobs = results['recip'].sum(axis=1) / results['probed'].sum(axis=1)
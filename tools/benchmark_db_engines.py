@@ -0,0 +1,81 @@
+"""
+Benchmark many small read-only queries against a sqlite database.
+
+Compares the legacy engine configuration (a new connection for every session, no PRAGMAs)
+with the pooled, read-tuned engine used by Database for read-only sqlite files.
+Each iteration opens a new session, runs a pair_query for one experiment, and
+loads a small DBQuery.dataframe.
+
+    python tools/benchmark_db_engines.py --db synphys_r2.1_small.sqlite
+    python tools/benchmark_db_engines.py   # uses a synthetic database
+"""
+import os, argparse, tempfile, time
+import sqlalchemy, sqlalchemy.pool
+from aisynphys.database import SynphysDatabase
+from aisynphys.synphys_cache import get_db_path
+
+
+def synthetic_db_file(path, n_experiments=200, n_cells=8):
+    db = SynphysDatabase('sqlite:///', 'sqlite:///', path, check_schema=False)
+    db.create_tables()
+    session = db.session(readonly=False)
+    for i in range(n_experiments):
+        expt = db.Experiment(ext_id='%0.3f' % (1.5e9 + i), storage_path='slice_%03d/site_000' % i, acq_timestamp=1.5e9 + i)
+        cells = [db.Cell(experiment=expt, ext_id=str(j)) for j in range(n_cells)]
+        session.add_all(cells)
+        for pre in cells:
+            for post in cells:
+                if pre is not post:
+                    session.add(db.Pair(experiment=expt, pre_cell=pre, post_cell=post))
+    session.commit()
+    db.dispose_engines()
+    return path
+
+
+def open_db(db_file, legacy):
+    db = SynphysDatabase.load_sqlite(db_file, readonly=True)
+    if legacy:
+        db.dispose_engines()
+        db.sqlite_immutable = False
+        db.sqlite_ro_pragmas = {}
+        db._engine_opts = {'sqlite': {'ro': {'poolclass': sqlalchemy.pool.NullPool}}}
+    return db
+
+
+def run(db, expt_ids):
+    # queries are built once so that only session / connection setup and execution are timed
+    pair_query = db.pair_query().filter(db.Experiment.id == sqlalchemy.bindparam('expt_id'))
+    cell_query = db.query(db.Cell.id, db.Cell.ext_id).filter(db.Cell.experiment_id == sqlalchemy.bindparam('expt_id'))
+    for expt_id in expt_ids:
+        session = db.session()
+        pair_query.with_session(session).params(expt_id=expt_id).all()
+        cell_query.with_session(session).params(expt_id=expt_id).dataframe()
+        session.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', type=str, default=None, help="sqlite file or published database version name")
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.db is None:
+        db_file = synthetic_db_file(os.path.join(tempfile.mkdtemp(), 'synthetic.sqlite'))
+    elif os.path.isfile(args.db):
+        db_file = args.db
+    else:
+        db_file = get_db_path(args.db)
+
+    for name, legacy in [('legacy', True), ('pooled', False)]:
+        db = open_db(db_file, legacy)
+        expt_ids = [rec.id for rec in db.query(db.Experiment.id).limit(args.queries)]
+        expt_ids = (expt_ids * (args.queries // max(len(expt_ids), 1) + 1))[:args.queries]
+        times = []
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            run(db, expt_ids)
+            times.append(time.perf_counter() - start)
+        db.dispose_engines()
+        best = min(times)
+        print("%-8s  best %0.3f s  (%0.2f ms / iteration, %d iterations)" % (name, best, 1000 * best / len(expt_ids), len(expt_ids)))
@@ -0,0 +1,57 @@
+"""
+Benchmark spike-aligned, baseline-subtracted averaging of pulse responses.
+
+Compares the per-trace TSeriesList approach to the vectorized TSeriesStack used
+by PulseResponseList, using a synthetic pair with many responses.
+
+    python tools/benchmark_pulse_response_average.py --responses 5000
+"""
+import argparse, time
+from types import SimpleNamespace
+import numpy as np
+from neuroanalysis.data import TSeries, TSeriesList
+from neuroanalysis.baseline import float_mode
+from aisynphys.data import PulseResponseList
+
+
+def synthetic_pair(n_responses, seed=0):
+    rng = np.random.RandomState(seed)
+    prs = []
+    for i in range(n_responses):
+        t0 = rng.uniform(-12e-3, -8e-3)
+        data = rng.normal(size=1000) * 1e-4 - 65e-3
+        spike_t = rng.uniform(1e-3, 2e-3)
+        stim = SimpleNamespace(onset_time=0.0, first_spike_time=spike_t, n_spikes=1)
+        prs.append(SimpleNamespace(post_tseries=TSeries(data, sample_rate=20000, t0=t0), stim_pulse=stim))
+    return prs
+
+
+def per_trace_average(prs, bsub_win=5e-3):
+    tsl = []
+    for pr in prs:
+        ts = pr.post_tseries
+        stim_time = pr.stim_pulse.onset_time
+        baseline_data = ts.time_slice(max(ts.t0, stim_time - bsub_win), stim_time).data
+        ts = ts - (ts.data[0] if len(baseline_data) == 0 else float_mode(baseline_data))
+        tsl.append(ts.copy(t0=ts.t0 - pr.stim_pulse.first_spike_time))
+    return TSeriesList(tsl).mean()
+
+
+def stacked_average(prs):
+    return PulseResponseList(prs).post_stack(align='spike', bsub=True).mean()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--responses', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    prs = synthetic_pair(args.responses)
+    for name, fn in [('per-trace', per_trace_average), ('stacked', stacked_average)]:
+        times = []
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            avg = fn(prs)
+            times.append(time.perf_counter() - start)
+        print("%-10s  best %0.3f s  (%d samples, t0=%0.6f)" % (name, min(times), len(avg), avg.t0))
@@ -91,13 +91,14 @@ for cell in expt.cell_list:
 
 print_heading(f"Pairs")
 
-pair_ids = sorted(list(expt.pairs.keys()))
+expt_pairs = expt.pairs
+pair_ids = sorted(list(expt_pairs.keys()))
 for pair_id in pair_ids:
     if len(cell_ids) == 1 and (cell_ids[0] not in pair_id):
         continue
     if len(cell_ids) == 2 and tuple(cell_ids) != pair_id:
         continue
-    pair = expt.pairs[pair_id]
+    pair = expt_pairs[pair_id]
     print_heading(f"Pair {expt.ext_id} {pair_id[0]} {pair_id[1]}", level=1)
 
     print_attrs(pair, [
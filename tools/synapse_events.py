@@ -1,3 +1,5 @@
+import sys, queue, threading
+from collections import OrderedDict
 import numpy as np
 import pyqtgraph as pg
 from sqlalchemy.sql import sqltypes
@@ -11,6 +13,79 @@ from aisynphys.pulse_response_strength import deconv_filter
 from aisynphys import config
 
 
+class ScatterDataLoader(pg.QtCore.QThread):
+    """Loads per-pulse-response scatter plot data for pairs in a background thread.
+
+    Recently loaded pairs are kept in an LRU cache so that reselecting a pair is immediate.
+    """
+    sigLoaded = pg.QtCore.Signal(object, object)  # pair_id, data
+
+    def __init__(self, fields, dtype, cache_size=20):
+        pg.QtCore.QThread.__init__(self)
+        self.fields = fields
+        self.dtype = dtype
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.requests = queue.Queue()
+
+    def get(self, pair_id):
+        """Return cached data for *pair_id*, or None if it has not been loaded recently.
+        """
+        with self.cache_lock:
+            if pair_id not in self.cache:
+                return None
+            self.cache.move_to_end(pair_id)
+            return self.cache[pair_id]
+
+    def request(self, pair_id):
+        """Request data for *pair_id* to be loaded; sigLoaded is emitted when it is ready.
+        """
+        self.requests.put(pair_id)
+
+    def stop(self):
+        self.requests.put(None)
+        self.wait()
+
+    def run(self):
+        session = db.session()
+        try:
+            while True:
+                pair_id = self.requests.get()
+                # skip requests that were superseded while we were busy
+                while pair_id is not None and not self.requests.empty():
+                    pair_id = self.requests.get()
+                if pair_id is None:
+                    return
+                data = self.get(pair_id)
+                if data is None:
+                    try:
+                        data = self.load(session, pair_id)
+                    except Exception:
+                        session.rollback()
+                        sys.excepthook(*sys.exc_info())
+                        continue
+                    with self.cache_lock:
+                        self.cache[pair_id] = data
+                        while len(self.cache) > self.cache_size:
+                            self.cache.popitem(last=False)
+                self.sigLoaded.emit(pair_id, data)
+        finally:
+            session.close()
+
+    def load(self, session, pair_id):
+        cols = [spec['column'].label(name) for name, spec in self.fields.items()]
+        q = session.query(*cols)
+        q = q.outerjoin(db.PulseResponseFit, db.PulseResponseFit.pulse_response_id==db.PulseResponse.id)
+        q = q.outerjoin(db.PulseResponseStrength, db.PulseResponseStrength.pulse_response_id==db.PulseResponse.id)
+        q = q.join(db.StimPulse, db.PulseResponse.stim_pulse)
+        q = q.join(db.Recording, db.PulseResponse.recording_id==db.Recording.id)
+        q = q.join(db.PatchClampRecording, db.PatchClampRecording.recording_id==db.Recording.id)
+        q = q.join(db.MultiPatchProbe)
+        q = q.filter(db.PulseResponse.pair_id==pair_id)
+        return q.structured_array(self.dtype)
+
+
 class SynapseEventWindow(pg.QtGui.QSplitter):
     def __init__(self):
         self.loaded_pair = None
@@ -98,6 +173,10 @@ class SynapseEventWindow(pg.QtGui.QSplitter):
         
         self.resize(1600, 1000)
         
+        self.loader = ScatterDataLoader(self.fields, self.dtype)
+        self.loader.sigLoaded.connect(self._pair_data_loaded)
+        self.loader.start()
+
         self.browser.itemSelectionChanged.connect(self.browser_item_selected)
         self.scatter_plot.sigScatterPlotClicked.connect(self.scatter_plot_clicked)
 
@@ -115,30 +194,29 @@ class SynapseEventWindow(pg.QtGui.QSplitter):
         
     def load_pair(self, pair):
         if pair is not self.loaded_pair:
-            print("Loading:", pair)
             self.loaded_pair = pair
+            data = self.loader.get(pair.id)
+            if data is None:
+                # load data for scatter plot in the background
+                print("Loading:", pair)
+                self.loader.request(pair.id)
+            else:
+                self._set_scatter_data(data)
 
-            # Load data for scatter plot
-            cols = [spec['column'].label(name) for name, spec in self.fields.items()]
-            q = db.query(*cols)
-            q = q.outerjoin(db.PulseResponseFit, db.PulseResponseFit.pulse_response_id==db.PulseResponse.id)
-            q = q.outerjoin(db.PulseResponseStrength, db.PulseResponseStrength.pulse_response_id==db.PulseResponse.id)
-            q = q.join(db.StimPulse, db.PulseResponse.stim_pulse)
-            q = q.join(db.Recording, db.PulseResponse.recording_id==db.Recording.id)
-            q = q.join(db.PatchClampRecording, db.PatchClampRecording.recording_id==db.Recording.id)
-            q = q.join(db.MultiPatchProbe)
-            q = q.filter(db.PulseResponse.pair_id==pair.id)
-            recs = q.all()
-            print("loaded %d/%s pulse responses" % (len(recs), len(pair.pulse_responses)))
-            self.loaded_recs = recs
-            
-            data = np.empty(len(recs), dtype=self.dtype)
-            for i,rec in enumerate(recs):
-                for name, spec in self.dtype:
-                    data[i][name] = getattr(rec, name)
-            self.loaded_data = data
-            
-            self.scatter_plot.setData(data)
+    def _pair_data_loaded(self, pair_id, data):
+        if self.loaded_pair is None or self.loaded_pair.id != pair_id:
+            # selection changed while loading
+            return
+        print("loaded %d pulse responses" % len(data))
+        self._set_scatter_data(data)
+
+    def _set_scatter_data(self, data):
+        self.loaded_data = data
+        self.scatter_plot.setData(data)
+
+    def closeEvent(self, ev):
+        self.loader.stop()
+        pg.QtGui.QSplitter.closeEvent(self, ev)
             
     def scatter_plot_clicked(self, plt, points):
         for plt in self.data_plots + self.dec_plots + self.spike_plots:
@@ -16,8 +16,12 @@ if __name__ == '__main__':
     parser.add_argument('modules', type=str, nargs='*', help="The name of the analysis module(s) to run")
     parser.add_argument('--update', action='store_true', default=False, help="Process any jobs that are ready to be updated")
     parser.add_argument('--retry', action='store_true', default=False, help="During update, retry processing jobs that previously failed (implies --update)")
+    parser.add_argument('--resume', action='store_true', default=False, help="During update, first finish any jobs left over from an interrupted update (recorded in the run ledger) instead of searching for new jobs; jobs still running in another process are skipped")
     parser.add_argument('--force-update', action='store_true', default=False, help="During update, reprocess all available jobs regardless of status (allowed only with --limit or --uids)")
     parser.add_argument('--report', action='store_true', default=False, help="Print a report of pipeline status and errors", )
+    parser.add_argument('--report-json', type=str, default=None, dest='report_json', help="Write pipeline status aggregates and failed jobs to a JSON file")
+    parser.add_argument('--profile-report', action='store_true', default=False, dest='profile_report', help="Print the slowest modules and jobs and any slowdowns between the last two runs of each module")
+    parser.add_argument('--profile-jobs', type=int, default=20, dest='profile_jobs', help="Number of slowest jobs to list in the profile report")
     parser.add_argument('--rebuild', action='store_true', default=False, help="Remove and rebuild tables for selected modules")
     parser.add_argument('--workers', type=int, default=None, help="Set the number of concurrent processes during update")
     parser.add_argument('--local', action='store_true', default=False, help="Disable concurrent processing to make debugging easier")
@@ -43,6 +47,9 @@ if __name__ == '__main__':
     except KeyError:
         raise Exception("Could not find pipeline named %s. Options are: %s"%(args.pipeline, str(all_pipelines.keys())))
 
+    # read the pipeline table once; all modules share this snapshot
+    pipeline.load_state()
+
     all_modules = pipeline.sorted_modules()
     
     enabled_modules = all_modules.copy()
@@ -71,11 +78,23 @@ if __name__ == '__main__':
     # sort topologically
     modules = [m for m in list(all_modules.values()) if m in modules]
 
-    if args.report:
+    if args.report or args.report_json is not None:
+        status_report = pipeline.status_report(modules)
+        if args.report:
+            print("----------------------------------------------")
+            print("Pipeline: %s   DB: %s" % (args.pipeline, str(db)))
+            print("----------------------------------------------")
+            print(status_report.format(job_ids=args.uids))
+        if args.report_json is not None:
+            with open(args.report_json, 'w') as fh:
+                status_report.write_json(fh)
+            print("Wrote pipeline report to %s" % args.report_json)
+
+    if args.profile_report:
         print("----------------------------------------------")
-        print("Pipeline: %s   DB: %s" % (args.pipeline, str(db)))
+        print("Pipeline job metrics: %s   DB: %s" % (args.pipeline, str(db)))
         print("----------------------------------------------")
-        print(pipeline.report(modules, job_ids=args.uids))
+        print(pipeline.metrics_report(modules, n_jobs=args.profile_jobs))
     
     if args.rebuild:
         mod_names = ', '.join([module.name for module in modules])
@@ -108,7 +127,7 @@ if __name__ == '__main__':
             try:
                 result = module.update(job_ids=args.uids, retry_errors=args.retry, limit=args.limit, 
                                     parallel=not args.local, workers=args.workers, debug=args.debug,
-                                    force=args.force_update)
+                                    force=args.force_update, resume=args.resume)
                 report.append((module, result))
             except Exception as exc:
                 report.append((module, {'exc_info': sys.exc_info()}))
@@ -146,8 +165,7 @@ if __name__ == '__main__':
         print("Pipeline:", args.pipeline)
         print("  {:20s}  :  ok  : err  :  dependencies".format('module'))
         print("  -----------------------------------------------------------")
+        summary = pipeline.status_report().summary()
         for module in all_modules.values():
-            status = module.job_status()
-            success = len([j for j in status.values() if j[0] is True])
-            err = len(status) - success
-            print("  {:20s}  : {:<5d}: {:<5d}:  {}".format(module.name, success, err, ', '.join([m.name for m in module.dependencies])))
+            counts = summary[module.name]
+            print("  {:20s}  : {:<5d}: {:<5d}:  {}".format(module.name, counts['n_success'], counts['n_failed'], ', '.join([m.name for m in module.dependencies])))
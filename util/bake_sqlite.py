@@ -1,5 +1,5 @@
-import os, sys, datetime
-from aisynphys.database import default_db as db
+import os, sys, datetime, importlib.util
+from aisynphys.database import default_db as db, SynphysDatabase
 
 date = datetime.datetime.today().strftime("%Y-%m-%d")
 
@@ -12,7 +12,11 @@ db_files = {
 }
 
 skip_tables = {}
-skip_tables['full'] = []
+# pipeline bookkeeping tables are only meaningful to the source DB
+skip_tables['full'] = [
+    'pipeline_job_metrics',
+    'pipeline_run_ledger',
+]
 skip_tables['medium'] = skip_tables['full'] + []
 skip_tables['small'] = skip_tables['medium'] + [
     'synapse_prediction',
@@ -42,15 +46,31 @@ skip_columns['medium'].update({
 skip_columns['small'] = skip_columns['medium'].copy()
 
 
-versions = sys.argv[1:]
+# the Parquet snapshot is optional; skip it with --no-snapshot or when pyarrow is unavailable
+export_snapshot = '--no-snapshot' not in sys.argv[1:]
+versions = [arg for arg in sys.argv[1:] if arg != '--no-snapshot']
 
 if len(versions) == 0:
     versions = list(db_files.keys())
 
 
+# all requested files are baked in a single pass over the source tables
+destinations = {}
 for version in versions:
     filename = db_files[version]
-    print("========== Cloning %s DB %s =============" % (version, filename))
+    print("========== Baking %s DB %s =============" % (version, filename))
     if os.path.exists(filename):
         os.remove(filename)
-    db.bake_sqlite(filename, skip_tables=skip_tables[version], skip_columns=skip_columns[version])
+    destinations[filename] = {'skip_tables': skip_tables[version], 'skip_columns': skip_columns[version]}
+db.bake_sqlite_multi(destinations)
+
+if export_snapshot and importlib.util.find_spec('pyarrow') is None:
+    print("WARNING: pyarrow is not installed; skipping Parquet snapshot export.")
+    export_snapshot = False
+
+if export_snapshot:
+    for filename in destinations:
+        # columnar snapshot distributed alongside the sqlite file
+        sqlite_db = SynphysDatabase.load_sqlite(filename)
+        sqlite_db.export_snapshot(overwrite=True)
+        sqlite_db.dispose_engines()
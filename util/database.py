@@ -15,6 +15,7 @@ parser = argparse.ArgumentParser(parents=[config.parser])
 parser.add_argument('--reset-db', action='store_true', default=False, help="Drop all tables in the database.", dest='reset_db')
 parser.add_argument('--vacuum', action='store_true', default=False, help="Ask the database to clean/optimize itself.")
 parser.add_argument('--bake', type=str, default=None, help="Bake current database into an sqlite file.")
+parser.add_argument('--snapshot', type=str, default=None, help="Export current database into a columnar (Parquet) snapshot directory.")
 parser.add_argument('--clone', type=str, default=None, help="Clone current database into a new database with the given name.")
 parser.add_argument('--tables', type=str, default=None, help="Comma-separated list of tables to include while baking.")
 parser.add_argument('--skip-tables', type=str, default="", help="Comma-separated list of tables to skip while baking.", dest="skip_tables")
@@ -63,6 +64,14 @@ if args.bake is not None:
     db.bake_sqlite(args.bake, tables=tables, skip_tables=args.skip_tables.split(','), skip_columns=skip_cols)
 
 
+if args.snapshot is not None:
+    skip_cols = {}
+    for colname in filter(None, args.skip_columns.split(',')):
+        table, col = colname.split('.')
+        skip_cols.setdefault(table, []).append(col)
+    db.export_snapshot(args.snapshot, tables=tables, skip_tables=args.skip_tables.split(','), skip_columns=skip_cols, overwrite=args.overwrite)
+
+
 if args.clone is not None:
     db.clone_database(args.clone, tables=tables, skip_tables=args.skip_tables.split(','))
 
@@ -25,16 +25,17 @@ def delay(hour=2):
 
 if __name__ == '__main__':
     stages = OrderedDict([
-        ('pre_update_report',   ('daily',  'python util/analysis_pipeline.py multipatch all --report', 'pre-update pipeline report')),
+        ('pre_update_report',   ('daily',  'python util/analysis_pipeline.py multipatch all --report --report-json update_logs/pipeline_report_{date}_pre.json', 'pre-update pipeline report')),
         ('backup_notes',        ('daily',  'docker exec `docker ps -aq -f name=synphys-postgres` pg_dump -U postgres data_notes  > data_notes_backups/data_notes_{date}.pgsql', 'backup data notes DB')),
         ('backup_morphology',   ('daily',  f'rsync {aisynphys.config.morpho_address}/* morphology_backups/', 'backup morphology DB')),
         ('sync',                ('daily',  'python util/sync_rigs_to_server.py', 'sync raw data to server')),
         ('patchseq_report',     ('daily',  'python util/patchseq_reports.py --daily', 'patchseq report')),
-        ('pipeline',            ('daily',  'python util/analysis_pipeline.py multipatch all --update --retry', 'run analysis pipeline')),
+        ('pipeline',            ('daily',  'python util/analysis_pipeline.py multipatch all --update --retry --resume', 'run analysis pipeline')),
         ('vacuum',              ('daily',  'python util/database.py --vacuum', 'vacuum database')),
-        ('post_update_report',  ('daily',  'python util/analysis_pipeline.py multipatch all --report', 'post-update pipeline report')),
-        ('bake_sqlite',         ('daily',  'python util/bake_sqlite.py small medium', 'bake sqlite')),
-        ('bake_sqlite_full',    ('weekly', 'python util/bake_sqlite.py full', 'bake sqlite full')),
+        ('post_update_report',  ('daily',  'python util/analysis_pipeline.py multipatch all --report --report-json update_logs/pipeline_report_{date}_post.json', 'post-update pipeline report')),
+        # on weekly update days, all sizes are baked together in a single pass over the DB
+        ('bake_sqlite',         ('not_weekly', 'python util/bake_sqlite.py small medium', 'bake sqlite')),
+        ('bake_sqlite_full',    ('weekly', 'python util/bake_sqlite.py small medium full', 'bake sqlite full')),
     ])
 
     parser = argparse.ArgumentParser(description="Run all analysis pipeline stages to import / analyze new data on a schedule.")
@@ -55,7 +56,8 @@ if __name__ == '__main__':
     while True:
         logfile = 'update_logs/' + time.strftime('%Y-%m-%d_%H-%M-%S') + '.log'
         for name, (when, cmd, msg) in stages.items():
-            if when == 'weekly' and datetime.today().weekday() != 5:
+            weekly_day = datetime.today().weekday() == 5
+            if (when == 'weekly' and not weekly_day) or (when == 'not_weekly' and weekly_day):
                 continue
                 
             time_str = time.strftime('%Y-%m-%d %H:%M')